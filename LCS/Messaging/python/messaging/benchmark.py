@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# benchmark.py: benchmarks for the lofar.messaging module.
+#
+# Copyright (C) 2015
+# ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for the performance critical parts of the lofar.messaging module, run against a real broker
+on a TemporaryExchange. Run it as: python3 -m lofar.messaging.benchmark --help
+"""
+
+import logging
+import uuid
+import random
+from time import time
+from datetime import datetime, timedelta
+from threading import Thread
+from optparse import OptionParser, OptionGroup
+
+from lofar.messaging.config import DEFAULT_BROKER
+from lofar.messaging.messagebus import TemporaryExchange, TemporaryQueue, BusListenerJanitor, can_connect_to_broker
+from lofar.messaging.rpc import RPCClient, RPCService, ServiceMessageHandler, RequestMessage, RPCException, RPCTimeoutException
+from lofar.messaging.rpc import DEFAULT_RPC_MAX_CONCURRENCY
+from lofar.messaging.serialization import supported_codecs, encode, decode, DEFAULT_COMPRESSION_THRESHOLD
+from lofar.common.util import program_name
+
+logger = logging.getLogger(__name__)
+
+class BenchmarkServiceMessageHandler(ServiceMessageHandler):
+    def echo(self, payload=None):
+        return payload
+
+def execute_with_temporary_reply_queue(rpc_client: RPCClient, method_name, *args, **kwargs):
+    '''the original RPCClient.execute implementation which creates, binds and deletes a TemporaryQueue for each call,
+    kept here as the reference implementation to benchmark against.'''
+    exchange = rpc_client._request_sender.exchange
+    broker = rpc_client._request_sender.broker
+
+    with TemporaryQueue(name_prefix="rpc-reply-for-%s-%s" % (program_name(include_extension=False), rpc_client._service_name),
+                        exchange=exchange, broker=broker, addressed_to_me_only=True) as tmp_reply_queue:
+        with tmp_reply_queue.create_frombus() as reply_receiver:
+            request_msg = RequestMessage(subject="%s.%s" % (rpc_client._service_name, method_name),
+                                         reply_to=tmp_reply_queue.address,
+                                         ttl=rpc_client._timeout).with_args_kwargs(*args, **kwargs)
+            rpc_client._request_sender.send(request_msg)
+            answer = reply_receiver.receive(rpc_client._timeout)
+
+            if answer is None:
+                raise RPCTimeoutException("rpc call timed out")
+            if not answer.handled_successfully:
+                raise RPCException(answer.error_message)
+            return answer.content
+
+def _percentile(sorted_values, percentile):
+    return sorted_values[min(len(sorted_values)-1, int(round(percentile/100.0*(len(sorted_values)-1))))]
+
+def _log_latencies(name, latencies, duration):
+    latencies = sorted(latencies)
+    logger.info('%-24s : #calls=%5d mean=%7.2fms p50=%7.2fms p95=%7.2fms max=%7.2fms throughput=%7.1f calls/s',
+                name, len(latencies),
+                1000.0*sum(latencies)/len(latencies),
+                1000.0*_percentile(latencies, 50),
+                1000.0*_percentile(latencies, 95),
+                1000.0*latencies[-1],
+                len(latencies)/max(1e-9, duration))
+
+def _run_calls(execute, num_calls, num_threads):
+    '''run num_calls calls of the execute function on each of num_threads threads.
+    :return: tuple of the list of per-call latencies, and the total duration'''
+    latencies = []
+
+    def run():
+        for i in range(num_calls):
+            start = time()
+            execute()
+            latencies.append(time() - start)
+
+    start = time()
+    threads = [Thread(target=run) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time() - start
+
+def benchmark_rpc(num_calls=100, num_threads=1, num_service_threads=1, payload_size=16, max_concurrency=DEFAULT_RPC_MAX_CONCURRENCY, broker=DEFAULT_BROKER):
+    '''
+    benchmark the per-call latency of the RPCClient, with its shared reply queue,
+    against the original implementation with a temporary reply queue per call,
+    and the throughput of the pipelined execute_many.
+    :return dict: mapping of benchmark name to the list of per-call latencies
+    '''
+    payload = 'x' * payload_size
+    service_name = 'benchmark-%s' % (uuid.uuid4().hex[:8],)
+    results = {}
+
+    logger.info('benchmarking rpc calls: #calls=%s per thread, #threads=%s, #service_threads=%s, payload_size=%s',
+                num_calls, num_threads, num_service_threads, payload_size)
+
+    with TemporaryExchange("benchmark", broker=broker) as tmp_exchange:
+        with BusListenerJanitor(RPCService(service_name, BenchmarkServiceMessageHandler, exchange=tmp_exchange.address,
+                                           num_threads=num_service_threads, broker=broker)):
+            with RPCClient(service_name, exchange=tmp_exchange.address, broker=broker) as rpc_client:
+                # warm up
+                rpc_client.execute('echo', payload)
+
+                for name, execute in [('per_call_reply_queue', lambda: execute_with_temporary_reply_queue(rpc_client, 'echo', payload)),
+                                      ('shared_reply_queue', lambda: rpc_client.execute('echo', payload))]:
+                    latencies, duration = _run_calls(execute, num_calls, num_threads)
+                    _log_latencies(name, latencies, duration)
+                    results[name] = latencies
+
+                # pipelined calls from a single thread, with at most max_concurrency requests in flight.
+                # There are no per-call latencies here, so report the mean time per call as latency.
+                start = time()
+                rpc_client.execute_many([('echo', (payload,), None)] * (num_calls*num_threads), max_concurrency=max_concurrency)
+                duration = time() - start
+                name = 'execute_many(%d)' % (max_concurrency,)
+                _log_latencies(name, [duration/(num_calls*num_threads)] * (num_calls*num_threads), duration)
+                results[name] = [duration/(num_calls*num_threads)] * (num_calls*num_threads)
+
+    logger.info('%-24s : %.1fx', 'speedup (mean latency)', (sum(results['per_call_reply_queue'])/max(1e-9, sum(results['shared_reply_queue']))))
+    return results
+
+def create_typical_replies(num_items=1000):
+    '''create reply contents which look like the typical big rpc replies on the bus
+    :return dict: mapping of reply name to reply content'''
+    now = datetime.utcnow()
+    radb_tasks = [{'id': i, 'mom_id': 2000000+i, 'otdb_id': 1000000+i, 'specification_id': i,
+                   'status': random.choice(['approved', 'prescheduled', 'scheduled', 'queued', 'active', 'finished']),
+                   'status_id': random.randint(200, 1150), 'type': random.choice(['observation', 'pipeline', 'reservation']),
+                   'type_id': random.randint(0, 2), 'cluster': 'CEP4', 'project_name': 'LC%d_%03d' % (random.randint(0, 12), i % 100),
+                   'starttime': now + timedelta(minutes=i), 'endtime': now + timedelta(minutes=i+60),
+                   'duration': 3600.0, 'predecessor_ids': [i-1] if i else [], 'successor_ids': [i+1],
+                   'blocked_by_ids': [], 'mom2object_id': 3000000+i} for i in range(num_items)]
+
+    otdb_tree = {'tree_id': 1000000, 'state': 'approved', 'parset': {'ObsSW.Observation.Dataslots.DataslotInfo.%d.DataslotList' % i:
+                                                                     '[%s]' % ','.join(str(x) for x in range(i, i+10))
+                                                                     for i in range(num_items)}}
+
+    disk_usage = {'found': True, 'path': '/data/projects', 'disk_usage': 1234567890123,
+                  'sub_directories': {'/data/projects/LC%d_%03d/L%d' % (i % 12, i % 100, 1000000+i):
+                                          {'found': True, 'disk_usage': random.randint(0, 1e12), 'nr_of_files': random.randint(0, 1000),
+                                           'cache_timestamp': now - timedelta(seconds=i)}
+                                      for i in range(num_items)}}
+
+    return {'radb_tasks': radb_tasks, 'otdb_parset': otdb_tree, 'disk_usage': disk_usage}
+
+def benchmark_codecs(num_items=1000, repeat=5, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    '''
+    benchmark the encode and decode time, and the payload size of the supported codecs on typical reply contents.
+    No broker is needed for this benchmark.
+    :return dict: mapping of (reply name, codec) to the tuple of (encode time, decode time, payload size)
+    '''
+    results = {}
+    logger.info('benchmarking codecs on typical replies with #items=%s, compression_threshold=%s', num_items, compression_threshold)
+    logger.info('%-12s %-14s %12s %12s %12s', 'reply', 'codec', 'encode[ms]', 'decode[ms]', 'size[kB]')
+
+    for reply_name, content in create_typical_replies(num_items).items():
+        for codec in supported_codecs():
+            encode_durations, decode_durations = [], []
+            for i in range(repeat):
+                start = time()
+                content_type, content_encoding, body, compression = encode(content, codec, compression_threshold)
+                encode_durations.append(time() - start)
+
+                start = time()
+                decode(body, content_type, content_encoding, compression)
+                decode_durations.append(time() - start)
+
+            results[(reply_name, codec)] = (min(encode_durations), min(decode_durations), len(body))
+            logger.info('%-12s %-14s %12.2f %12.2f %12.1f', reply_name, codec,
+                        1000.0*min(encode_durations), 1000.0*min(decode_durations), len(body)/1024.0)
+
+    return results
+
+def main():
+    parser = OptionParser(usage='%prog [options]',
+                          description='benchmarks the performance critical parts of lofar.messaging against a real broker.')
+    group = OptionGroup(parser, 'RPC')
+    group.add_option('-n', '--num_calls', dest='num_calls', type='int', default=100, help='number of rpc calls per client thread, default: %default')
+    group.add_option('-t', '--threads', dest='threads', type='int', default=1, help='number of client threads doing calls concurrently on one RPCClient, default: %default')
+    group.add_option('-s', '--service_threads', dest='service_threads', type='int', default=1, help='number of threads in the RPCService, default: %default')
+    group.add_option('-p', '--payload_size', dest='payload_size', type='int', default=16, help='number of characters in the echoed payload, default: %default')
+    group.add_option('-c', '--max_concurrency', dest='max_concurrency', type='int', default=DEFAULT_RPC_MAX_CONCURRENCY, help='maximum number of requests in flight for the pipelined execute_many, default: %default')
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Codecs')
+    group.add_option('-C', '--codecs', dest='codecs', action='store_true', help='benchmark the message content codecs on typical replies (no broker needed), instead of the rpc calls')
+    group.add_option('-i', '--items', dest='items', type='int', default=1000, help='number of items (tasks, keys, directories) in the typical replies, default: %default')
+    group.add_option('-z', '--compression_threshold', dest='compression_threshold', type='int', default=DEFAULT_COMPRESSION_THRESHOLD, help='compress payloads larger than this number of bytes, use -1 to disable compression, default: %default')
+    parser.add_option_group(group)
+
+    group = OptionGroup(parser, 'Messaging options')
+    group.add_option('-b', '--broker', dest='broker', type='string', default=DEFAULT_BROKER, help='Address of the messaging broker, default: %default')
+    group.add_option('-V', '--verbose', dest='verbose', action='store_true', help='Verbose logging')
+    parser.add_option_group(group)
+
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        level=logging.DEBUG if options.verbose else logging.INFO)
+    if not options.verbose:
+        logging.getLogger('lofar.messaging.messagebus').setLevel(logging.WARNING)
+
+    if options.codecs:
+        benchmark_codecs(options.items, compression_threshold=options.compression_threshold if options.compression_threshold >= 0 else None)
+        return
+
+    if not can_connect_to_broker(options.broker):
+        logger.error("Cannot connect to broker %s", options.broker)
+        exit(1)
+
+    benchmark_rpc(options.num_calls, options.threads, options.service_threads, options.payload_size, options.max_concurrency, options.broker)
+
+if __name__ == '__main__':
+    main()
@@ -59,6 +59,13 @@ class MessageFactoryError(MessagingError):
     pass
 
 
+class MessageEncodingError(MessagingError, TypeError):
+    """
+    Exception raised when the content of a message cannot be encoded with the requested codec.
+    """
+    pass
+
+
 class MessagingTimeoutError(MessagingError, TimeoutError):
     """
     raise upon timeouts
@@ -191,12 +191,14 @@ import inspect
 import re
 import uuid
 import threading
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime, timedelta
 from queue import Empty as EmptyQueueError
 from socket import gaierror
 import json
+import os
 import requests
+from time import time
 
 import logging
 logger = logging.getLogger(__name__)
@@ -205,6 +207,8 @@ from lofar.messaging.exceptions import *
 from lofar.messaging import adaptNameToEnvironment
 from lofar.messaging.messages import *
 from lofar.messaging.config import DEFAULT_BROKER, DEFAULT_BUSNAME, DEFAULT_PORT, DEFAULT_USER, DEFAULT_PASSWORD
+from lofar.messaging import serialization
+from lofar.messaging.metrics import metrics, QUEUE_DEPTH_SAMPLE_INTERVAL
 from lofar.common.threading_utils import TimeoutLock
 from lofar.common.util import program_name
 from lofar.common.util import is_empty_function
@@ -218,6 +222,9 @@ kombu.enable_insecure_serializers(['pickle'])
 # default receive timeout in seconds
 DEFAULT_BUS_TIMEOUT = 5
 
+# default timeout in seconds for requests to the broker's http management api
+DEFAULT_MANAGEMENT_API_TIMEOUT = 5
+
 def can_connect_to_broker(broker: str=DEFAULT_BROKER, port: int=DEFAULT_PORT) -> bool:
     try:
         logger.debug("trying to connect to broker: hostname=%s port=%s userid=%s password=***",
@@ -365,15 +372,20 @@ def queue_exists(name: str, broker: str=DEFAULT_BROKER) -> bool:
     except Exception as e:
         raise MessagingError("Could not test if queue %s exists on broker %s error=%s" % (name, broker, e))
 
-def nr_of_messages_in_queue(queue_name: str, broker: str = DEFAULT_BROKER) -> int:
-    """get the number of messages in the queue"""
+def _get_nr_of_messages_in_queue(queue_name: str, broker: str = DEFAULT_BROKER, timeout: float = DEFAULT_MANAGEMENT_API_TIMEOUT) -> int:
+    """get the number of messages in the queue. Raises if the broker's management api cannot tell."""
+    # the kombu way of getting the number of messages via a passice queue_declare is not reliable...
+    # so, let's use the http REST API using request
+    url = "http://%s:15672/api/queues/%%2F/%s" % (broker, queue_name)
+    response = requests.get(url, auth=(DEFAULT_USER, DEFAULT_PASSWORD), timeout=timeout)
+    response.raise_for_status()
+    queue_info = json.loads(response.text)
+    return queue_info.get('messages', 0)
+
+def nr_of_messages_in_queue(queue_name: str, broker: str = DEFAULT_BROKER, timeout: float = DEFAULT_MANAGEMENT_API_TIMEOUT) -> int:
+    """get the number of messages in the queue (0 if it cannot be determined within the timeout)"""
     try:
-        # the kombu way of getting the number of messages via a passice queue_declare is not reliable...
-        # so, let's use the http REST API using request
-        url = "http://%s:15672/api/queues/%%2F/%s" % (broker, queue_name)
-        response = requests.get(url, auth=(DEFAULT_USER, DEFAULT_PASSWORD))
-        queue_info = json.loads(response.text)
-        return queue_info.get('messages', 0)
+        return _get_nr_of_messages_in_queue(queue_name, broker, timeout)
     except Exception as e:
         return 0
 
@@ -425,9 +437,108 @@ def create_bound_queue(exchange: str, queue: str, routing_key: str='#', durable:
 
 
 
+# the maximum number of idle connections per broker which are kept open in the connection_pool for reuse. 0 disables the pooling.
+DEFAULT_CONNECTION_POOL_SIZE = int(os.environ.get('LOFAR_MESSAGING_CONNECTION_POOL_SIZE', 8))
+
+class ConnectionPool:
+    """
+    A process-wide, thread-safe pool of idle kombu connections per broker, so that short-lived ToBus/FromBus instances
+    (like those of an RPCClient which is created per request) do not pay a full tcp connect and amqp handshake on each open.
+
+    A connection is leased exclusively by one bus at a time, because kombu/amqp connections are not thread-safe.
+    Upon close, the bus releases the connection back into the pool, unless it had connection problems.
+    Connections which were idle for more than health_check_interval seconds are checked with a (cheap) roundtrip
+    to the broker before they are leased out again, and are replaced by a new connection when the check fails.
+    """
+    def __init__(self, max_idle_connections_per_broker: int=DEFAULT_CONNECTION_POOL_SIZE, health_check_interval: float=5):
+        self.max_idle_connections_per_broker = max_idle_connections_per_broker
+        self.health_check_interval = health_check_interval
+        self._idle_connections = {} # mapping of broker to list of (connection, released_timestamp) tuples
+        self._lock = threading.Lock()
+
+    def lease(self, broker: str) -> kombu.Connection:
+        """get a healthy connection to the given broker, either an idle one from the pool, or a new one."""
+        while True:
+            with self._lock:
+                idle_connections = self._idle_connections.get(broker)
+                if not idle_connections:
+                    break
+                # take the most recently used one, which is the most likely to be healthy
+                connection, released_timestamp = idle_connections.pop()
+
+            if self._is_healthy(connection, time() - released_timestamp):
+                metrics.increment('connection_pool_reuses', broker=broker)
+                return connection
+
+            logger.debug("discarding unhealthy pooled connection to broker %s", broker)
+            self._close_connection(connection)
+
+        metrics.increment('connection_pool_connects', broker=broker)
+        connection = kombu.Connection(hostname=broker, port=DEFAULT_PORT, userid=DEFAULT_USER, password=DEFAULT_PASSWORD)
+        try:
+            connection.connect()
+        except Exception:
+            self._close_connection(connection)
+            raise
+        return connection
+
+    def release(self, connection: kombu.Connection, broker: str, reusable: bool=True):
+        """
+        give the leased connection back to the pool for reuse, or close it if it's not reusable or if the pool is full.
+        :raises: any exception from closing the connection
+        """
+        if reusable and self.max_idle_connections_per_broker > 0 and self._is_healthy(connection, 0):
+            with self._lock:
+                idle_connections = self._idle_connections.setdefault(broker, [])
+                if len(idle_connections) < self.max_idle_connections_per_broker:
+                    idle_connections.append((connection, time()))
+                    return
+
+        connection.close()
+
+    def clear(self):
+        """close all idle connections in the pool"""
+        with self._lock:
+            idle_connections = [connection for connections in self._idle_connections.values() for connection, _ in connections]
+            self._idle_connections = {}
+
+        for connection in idle_connections:
+            self._close_connection(connection)
+
+    def _is_healthy(self, connection: kombu.Connection, idle_seconds: float) -> bool:
+        try:
+            if not connection.connected:
+                return False
+
+            channel = getattr(connection, '_default_channel', None)
+            if channel is not None and not getattr(channel, 'is_open', True):
+                # the default channel (used by the ToBus' producer) was closed by the broker, for example due to a publish to a non-existing exchange.
+                return False
+
+            if idle_seconds > self.health_check_interval:
+                # do a synchronous roundtrip to the broker, which fails if the broker dropped the connection in the mean time.
+                connection.default_channel.basic_qos(prefetch_size=0, prefetch_count=0, a_global=False)
+
+            return True
+        except Exception as e:
+            logger.debug("pooled connection is not healthy: %s", e)
+            return False
+
+    @staticmethod
+    def _close_connection(connection: kombu.Connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug("error while closing connection: %s", e)
+
+# the process-wide connection pool, used by all ToBus and FromBus instances
+connection_pool = ConnectionPool()
+
+
 class _AbstractBus:
     """
     Common class for ToBus and FromBus, providing an common way to connect to the amqp message bus.
+    The connections are leased from the process-wide connection_pool.
     """
 
     def __init__(self, broker: str=DEFAULT_BROKER, connection_log_level: int=logging.INFO):
@@ -439,6 +550,7 @@ class _AbstractBus:
         self.broker = broker
         self._connection_log_level = connection_log_level
         self._connection = None
+        self._connection_failed = False
         self._lock = TimeoutLock()
 
     @property
@@ -483,8 +595,8 @@ class _AbstractBus:
                     return
 
                 logger.debug("[%s] Connecting to broker: %s", self.__class__.__name__, self.broker)
-                self._connection = kombu.Connection(hostname=self.broker, port=DEFAULT_PORT, userid=DEFAULT_USER, password=DEFAULT_PASSWORD)
-                self._connection.connect()
+                self._connection = connection_pool.lease(self.broker)
+                self._connection_failed = False
                 logger.debug("[%s] Connected to broker: %s (%s)", self.__class__.__name__, self.broker, self.connection_name)
 
                 # let the subclass (FromBus or ToBus) create a receiver of sender
@@ -521,10 +633,12 @@ class _AbstractBus:
                 self._disconnect_from_endpoint()
             except MessagingError as e:
                 logger.error(e)
+                self._connection_failed = True
 
             try:
                 logger.debug("[%s] Disconnecting from broker: %s", self.__class__.__name__, self.broker)
-                self._connection.close()
+                # give the connection back to the pool, unless it had problems.
+                connection_pool.release(self._connection, self.broker, reusable=not self._connection_failed)
                 logger.debug("[%s] Disconnected from broker: %s", self.__class__.__name__, self.broker)
             except Exception as ex:
                 if isinstance(ex, AttributeError) and 'drain_events' in str(ex):
@@ -545,6 +659,9 @@ class _AbstractBus:
         """
         with self._lock:
             logger.info("[%s] Reconnecting to broker: %s", self.__class__.__name__, self.broker)
+            metrics.increment('reconnects', bus=self.__class__.__name__, broker=self.broker)
+            # do not give the current (probably broken) connection back to the pool
+            self._connection_failed = True
             try:
                 # close and catch any exceptions...
                 self.close()
@@ -606,16 +723,25 @@ class FromBus(_AbstractBus):
     connected = False
     """
 
-    def __init__(self, queue: str, broker: str=DEFAULT_BROKER, connection_log_level=logging.DEBUG):
+    def __init__(self, queue: str, broker: str=DEFAULT_BROKER, connection_log_level=logging.DEBUG, prefetch_count: int=0,
+                 accept_codecs: List[str]=None):
         """
         Constructor, specifying the address of the queue to connect to on the given broker.
         :param queue: the 'name' of the queue to connect to.
         :param broker: a valid broker url, like 'localhost'
         :param connection_log_level: optional logging level for opening/closing the connection (to add/reduce spamming)
+        :param prefetch_count: the maximum number of unacknowledged messages the broker delivers to this receiver in advance.
+                               0 means no limit (the amqp default). Use a limit to spread the load over multiple receivers on the same queue.
+        :param accept_codecs: the names of the codecs (see lofar.messaging.serialization) of the messages to accept.
+                              Messages with another codec cannot be decoded, and are rejected. None means: accept all codecs.
+                              Use for example serialization.supported_codecs()[:-1] to accept all codecs except pickle.
         """
         self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.accept_codecs = accept_codecs
         self._unacked_messages = {}
         self._receiver = None
+        self._channel = None
         super(FromBus, self).__init__(broker=broker, connection_log_level=connection_log_level)
 
     def _connect_to_endpoint(self):
@@ -628,11 +754,15 @@ class FromBus(_AbstractBus):
 
             kombu_queue = kombu.Queue(self.queue, no_declare=True)
 
+            # use our own channel on the (pooled) connection, which we close on disconnect,
+            # so the broker redelivers any of our unacked (prefetched) messages to other receivers.
+            self._channel = self._connection.channel()
+
             # try to passivly declare the queue on the broker, raises if non existent
-            kombu_queue.queue_declare(passive=True, channel=self._connection.default_channel)
+            kombu_queue.queue_declare(passive=True, channel=self._channel)
 
-            self._receiver = self._connection.SimpleQueue(kombu_queue)
-            self._receiver.consumer.qos(prefetch_count=0) # do not prefetch any messages
+            self._receiver = self._connection.SimpleQueue(kombu_queue, channel=self._channel, accept=self.accept_codecs)
+            self._receiver.consumer.qos(prefetch_count=self.prefetch_count) # 0 means: no limit
 
             logger.log(self._connection_log_level, "[FromBus] Connected receiver to: %s on broker: %s", self.queue, self.broker)
         except Exception as ex:
@@ -661,10 +791,16 @@ class FromBus(_AbstractBus):
 
                 logger.log(self._connection_log_level, "[FromBus] Disconnected receiver from bus: %s on broker: %s",
                              self.queue, self.broker)
+
+            if self._channel is not None:
+                self._channel.close()
         except Exception as ex:
             error_msg = "[FromBus] Disconnecting from queue %s at broker %s failed: %s" % (self.queue, self.broker, ex)
             logger.exception(error_msg)
             raise MessagingError(error_msg)
+        finally:
+            self._receiver = None
+            self._channel = None
 
     def _is_connection_error(self, error: Exception) -> bool:
         if isinstance(error, TypeError):
@@ -708,6 +844,8 @@ class FromBus(_AbstractBus):
                     # also keep track of thread id, because ack'ing/rejecting messages across threads is a bad idea!
                     self._unacked_messages[lofar_msg.id] = (kombu_msg, threading.current_thread().ident)
 
+                    metrics.increment('messages_received', queue=self.queue, subject=lofar_msg.metrics_subject)
+
                     if acknowledge:
                         self.ack(lofar_msg)
 
@@ -730,6 +868,84 @@ class FromBus(_AbstractBus):
                             kombu_msg.reject()
                         raise MessagingError("[FromBus] unknown exception while receiving message on %s: %s" % (self.queue, e))
 
+    def receive_batch(self, max_count: int, timeout: float=DEFAULT_BUS_TIMEOUT, batch_timeout: float=0.1,
+                      acknowledge: bool = True) -> List[LofarMessage]:
+        """
+        Receive a batch of up to max_count messages from the queue we're listening on.
+        Waits at most timeout seconds for the first message, and then at most batch_timeout seconds for the rest of the batch.
+        The messages which the broker prefetched for us (see prefetch_count) are taken from the local buffer without a round-trip.
+        :param max_count: the maximum number of messages in the batch.
+        :param timeout: maximum time in seconds to wait for the first message.
+        :param batch_timeout: maximum time in seconds to wait for the other messages, after the first message was received.
+        :param acknowledge: if True, then automatically acknowledge the received messages (cumulatively)
+        :return: list of received messages, which is empty if a timeout occurred.
+        """
+        lofar_msg = self.receive(timeout, acknowledge=False)
+        if lofar_msg is None:
+            return []
+
+        lofar_msgs = [lofar_msg]
+        batch_deadline = datetime.utcnow() + timedelta(seconds=batch_timeout)
+
+        while len(lofar_msgs) < max_count:
+            remaining_sec = (batch_deadline - datetime.utcnow()).total_seconds()
+            if remaining_sec <= 0:
+                break
+
+            lofar_msg = self.receive(remaining_sec, acknowledge=False)
+            if lofar_msg is None:
+                break
+            lofar_msgs.append(lofar_msg)
+
+        if acknowledge:
+            self.ack_batch(lofar_msgs)
+
+        return lofar_msgs
+
+    def ack_batch(self, lofar_msgs: List[LofarMessage]):
+        """
+        Acknowledge the given messages to the broker, cumulatively with one ack for the message with the highest delivery tag, when possible.
+        That is only possible if all unacked messages received before that message are in the given list.
+        Otherwise, each message is acknowledged individually.
+        :param lofar_msgs: the messages to be ack'ed
+        """
+        if not lofar_msgs:
+            return
+
+        with self._lock:
+            kombu_msgs = {}
+            for lofar_msg in lofar_msgs:
+                kombu_msg, thread_id = self._unacked_messages.get(lofar_msg.id, (None, None))
+
+                if kombu_msg is None:
+                    raise KeyError("Cannot find kombu message to ack for lofar message_id %s. unacked_msg_ids=%s" % (lofar_msg.id,
+                                                                                                                     list(self._unacked_messages.keys())))
+
+                if threading.current_thread().ident != thread_id:
+                    raise MessagingRuntimeError("Cannot acknowledge messages across threads")
+
+                kombu_msgs[lofar_msg.id] = kombu_msg
+
+            last_id, last_kombu_msg = max(kombu_msgs.items(), key=lambda item: item[1].delivery_tag)
+            other_unacked_ids = [id for id, (kombu_msg, thread_id) in self._unacked_messages.items()
+                                 if id not in kombu_msgs and kombu_msg.delivery_tag <= last_kombu_msg.delivery_tag]
+
+            if other_unacked_ids:
+                # a cumulative ack would also ack these other unacked messages, so ack the given messages one by one.
+                for lofar_msg in lofar_msgs:
+                    self.ack(lofar_msg)
+                return
+
+            try:
+                last_kombu_msg.ack(multiple=True)
+            except Exception as e:
+                logger.exception(e)
+                raise MessageBusError("Cannot ack %d msgs up to id=%s error:%s" % (len(kombu_msgs), last_id, str(e)))
+            else:
+                logger.debug("%s acknowledged %d messages up to %s", self, len(kombu_msgs), last_id)
+                for id in kombu_msgs.keys():
+                    del self._unacked_messages[id]
+
     def ack(self, lofar_msg: LofarMessage):
         """
         Acknowledge the message to the broker.
@@ -807,15 +1023,21 @@ class ToBus(_AbstractBus):
     connected = False
     """
 
-    def __init__(self, exchange: str=DEFAULT_BUSNAME, broker: str=DEFAULT_BROKER, connection_log_level=logging.DEBUG):
+    def __init__(self, exchange: str=DEFAULT_BUSNAME, broker: str=DEFAULT_BROKER, connection_log_level=logging.DEBUG,
+                 codec: str=None, compression_threshold: Optional[int]=serialization.DEFAULT_COMPRESSION_THRESHOLD):
         """
         Constructor, specifying the address of the exchange to connect to on the given broker.
         :param exchange: the name of the exchange to connect to.
         :param broker: the valid broker url, like 'localhost'
         :param connection_log_level: optional logging level for opening/closing the connection (to add/reduce spamming)
+        :param codec: the name of the codec (see lofar.messaging.serialization) to encode the message content with,
+                      unless the message specifies its own codec. Default: serialization.DEFAULT_CODEC
+        :param compression_threshold: compress the encoded message content if it is larger than this number of bytes. None means never.
         """
         self._sender = None
         self.exchange = exchange
+        self.codec = codec or serialization.DEFAULT_CODEC
+        self.compression_threshold = compression_threshold
         super(ToBus, self).__init__(broker=broker, connection_log_level=connection_log_level)
 
     def _connect_to_endpoint(self):
@@ -865,20 +1087,33 @@ class ToBus(_AbstractBus):
         :param message: message to be sent
         """
         start = datetime.utcnow()
+        kwargs_dict = message.as_kombu_publish_kwargs()
+
+        # encode the content once (outside of the lock), and not upon each retry.
+        # the receiver knows how to decode it from the content_type and the compression header.
+        content_type, content_encoding, body, compression = serialization.encode(kwargs_dict['body'],
+                                                                                 message.codec or self.codec,
+                                                                                 self.compression_threshold)
+        kwargs_dict['body'] = body
+        kwargs_dict['content_type'] = content_type
+        kwargs_dict['content_encoding'] = content_encoding
+        if compression:
+            kwargs_dict['headers']['compression'] = compression
+
+        # every message is sent the connected exchange, and then routed to zero or more queues using the subject.
+        kwargs_dict['exchange'] = self.exchange
+        kwargs_dict['routing_key'] = message.subject
+
         while True:
             try:
                 logger.debug("[ToBus] Sending message to: %s (%s)", self.exchange, message)
 
-                kwargs_dict = message.as_kombu_publish_kwargs()
-
-                # every message is sent the connected exchange, and then routed to zero or more queues using the subject.
-                kwargs_dict['exchange'] = self.exchange
-                kwargs_dict['routing_key'] = message.subject
-
                 with self._lock:
-                    self._sender.publish(serializer='pickle', **kwargs_dict)
+                    self._sender.publish(**kwargs_dict)
 
                 logger.debug("[ToBus] Sent message to: %s", self.exchange)
+                metrics.increment('messages_sent', exchange=self.exchange, subject=message.metrics_subject)
+                metrics.increment('bytes_sent', len(body), exchange=self.exchange)
                 return
             except Exception as e:
                 if self._is_connection_error(e):
@@ -1146,6 +1381,11 @@ class AbstractMessageHandler:
     The other four methods have empty bodies, so their default behaviour is no-op.
 
     Typical usage is to derive from this class and implement the handle_message method with concrete logic.
+
+    When the BusListener runs in batch mode (batch_size > 1), then the handle_messages method is called
+    with a batch of messages instead (between one before_receive_message and after_receive_message call).
+    By default, it calls handle_message for each message in the batch. Override it if your handler can do better
+    with a whole batch at once, for example by doing one database query for all messages in the batch.
     """
 
     def before_receive_message(self):
@@ -1159,6 +1399,21 @@ class AbstractMessageHandler:
         """
         raise NotImplementedError("Please implement the handle_message method in your subclass to handle the received message")
 
+    def handle_messages(self, msgs: List[LofarMessage]) -> Optional[List[LofarMessage]]:
+        """Called in batch mode to handle a batch of received messages. By default, calls handle_message for each message.
+        Raise an exception if you want to reject all messages of the batch on the broker.
+        :param msgs: the list of received messages to be handled
+        :return: the list of messages which could not be handled, and are thus rejected on the broker (or None if all were handled).
+        """
+        failed_msgs = []
+        for msg in msgs:
+            try:
+                self.handle_message(msg)
+            except Exception as e:
+                logger.exception("Handling of %s failed. Rejecting message. Error: %s", msg, e)
+                failed_msgs.append(msg)
+        return failed_msgs
+
     def after_receive_message(self):
         """Called in the main loop after the messages was handled.
         """
@@ -1353,7 +1608,10 @@ class BusListener:
                  handler_kwargs: dict = None,
                  exchange: str = None, routing_key: str = "#",
                  num_threads: int = 1,
-                 broker: str = DEFAULT_BROKER):
+                 broker: str = DEFAULT_BROKER,
+                 prefetch_count: int = 0,
+                 batch_size: int = 1,
+                 batch_timeout: float = 0.1):
         """
         Create a buslistener instance.
 
@@ -1381,6 +1639,13 @@ class BusListener:
                             default=1, use higher number only if it makes sense, for example when you are
                             waiting for a slow database while handling the message.
         :param broker: a message broker address
+        :param prefetch_count: the maximum number of unacknowledged messages the broker delivers in advance to each listener thread.
+                               default=0, meaning no limit. In batch mode, use at least the batch_size.
+        :param batch_size: the maximum number of messages handled in one go by the handler's handle_messages method.
+                           default=1, meaning that each message is handled on its own by the handler's handle_message method.
+                           A higher number lets each listener thread keep up with message storms, because the messages
+                           in a batch are received from the prefetched messages, and are acknowledged at once.
+        :param batch_timeout: in batch mode, the maximum time in seconds to wait for more messages once the first message of a batch was received.
         :raises: MessagingError if the exchange could not be created
         """
 
@@ -1395,6 +1660,11 @@ class BusListener:
         self.exchange         = exchange
         self.broker           = broker
         self._num_threads     = num_threads
+        self._prefetch_count  = prefetch_count
+        self._batch_size      = max(1, batch_size)
+        self._batch_timeout   = batch_timeout
+        self._last_queue_depth_sample_timestamp = datetime.min
+        self._queue_depth_sampler = None
         self._threads         = {}
         self._lock            = threading.Lock()
         self._running         = threading.Event()
@@ -1534,7 +1804,7 @@ class BusListener:
         # create an instance of the given handler for this background thread
         # (to keep the internals of the handler thread agnostic)
         with self._create_handler() as thread_handler:
-            with FromBus(self.address, broker=self.broker) as receiver:
+            with FromBus(self.address, broker=self.broker, prefetch_count=self._prefetch_count) as receiver:
                 logger.info("STARTED %s on thread '%s' ", self, current_thread.name)
 
                 with self._lock:
@@ -1546,6 +1816,8 @@ class BusListener:
 
                 # keep running and handling ....
                 while self.is_running():
+                    self._sample_queue_depth()
+
                     try:
                         thread_handler.before_receive_message()
                     except Exception as e:
@@ -1553,6 +1825,10 @@ class BusListener:
                         pass
 
                     try:
+                        if self._batch_size > 1:
+                            self._receive_and_handle_batch(receiver, thread_handler)
+                            continue
+
                         # get the next message
                         lofar_msg = receiver.receive(1, acknowledge=False)
                         # retry loop if timed-out
@@ -1561,9 +1837,11 @@ class BusListener:
 
                         # Execute the handler function
                         try:
-                            thread_handler.handle_message(lofar_msg)
+                            with metrics.timed('handle_time', queue=self.address, subject=lofar_msg.metrics_subject):
+                                thread_handler.handle_message(lofar_msg)
                         except Exception as e:
                             logger.exception("Handling of %s failed. Rejecting message. Error: %s", lofar_msg, e)
+                            metrics.increment('messages_rejected', queue=self.address, subject=lofar_msg.metrics_subject)
                             receiver.reject(lofar_msg)
                         else:
                             # handle_message was successful, so ack the msg.
@@ -1585,6 +1863,65 @@ class BusListener:
                         # Unknown problem in the library. Report this and continue.
                         logger.exception("[%s:] ERROR during processing of incoming message: %s", self.__class__.__name__, e)
 
+    def _sample_queue_depth(self):
+        """
+        Internal use only. Sample the number of messages waiting in our queue into the queue_depth metric,
+        at most once per QUEUE_DEPTH_SAMPLE_INTERVAL for all listener threads, because it's a call to the broker's management api.
+        The call is done on a separate thread, so a slow or unreachable management api does not delay the handling of messages.
+        """
+        with self._lock:
+            if (datetime.utcnow() - self._last_queue_depth_sample_timestamp).total_seconds() < QUEUE_DEPTH_SAMPLE_INTERVAL:
+                return
+            if self._queue_depth_sampler is not None and self._queue_depth_sampler.is_alive():
+                return
+            self._last_queue_depth_sample_timestamp = datetime.utcnow()
+            self._queue_depth_sampler = threading.Thread(target=self._sample_queue_depth_now,
+                                                         name="queue_depth_sampler_%s" % (self.address,),
+                                                         daemon=True)
+            self._queue_depth_sampler.start()
+
+    def _sample_queue_depth_now(self):
+        """Internal use only. Sample the number of messages in our queue, or record it as unknown (None) if the broker cannot tell."""
+        try:
+            queue_depth = _get_nr_of_messages_in_queue(self.address, self.broker)
+        except Exception as e:
+            logger.warning("could not sample the number of messages in queue %s: %s", self.address, e)
+            queue_depth = None
+        metrics.set_gauge('queue_depth', queue_depth, queue=self.address)
+
+    def _receive_and_handle_batch(self, receiver: FromBus, thread_handler: AbstractMessageHandler):
+        """
+        Internal use only. Receive a batch of messages, let the handler handle them,
+        reject the failed messages, and acknowledge the others cumulatively.
+        """
+        lofar_msgs = receiver.receive_batch(self._batch_size, timeout=1, batch_timeout=self._batch_timeout, acknowledge=False)
+        # retry loop if timed-out
+        if not lofar_msgs:
+            return
+
+        # Execute the handler function
+        try:
+            with metrics.timed('handle_batch_time', queue=self.address):
+                failed_msgs = thread_handler.handle_messages(lofar_msgs) or []
+        except Exception as e:
+            logger.exception("Handling of batch of %d messages failed. Rejecting messages. Error: %s", len(lofar_msgs), e)
+            failed_msgs = lofar_msgs
+
+        metrics.observe('batch_size', len(lofar_msgs), queue=self.address)
+        metrics.increment('messages_rejected', len(failed_msgs), queue=self.address)
+        failed_msg_ids = set(msg.id for msg in failed_msgs)
+        for lofar_msg in lofar_msgs:
+            if lofar_msg.id in failed_msg_ids:
+                receiver.reject(lofar_msg)
+
+        # handle_messages was successful for the others, so ack them at once.
+        receiver.ack_batch([lofar_msg for lofar_msg in lofar_msgs if lofar_msg.id not in failed_msg_ids])
+
+        try:
+            thread_handler.after_receive_message()
+        except Exception as e:
+            logger.exception("after_receive_message() failed: %s", e)
+
 
 class BusListenerJanitor:
     """The BusListenerJanitor cleans up auto-generated consumer queues.
@@ -1651,7 +1988,7 @@ class BusListenerJanitor:
 
 
 # do not expose create/delete_queue/exchange etc methods in all, it's not part of the public API
-__all__ = ['DEFAULT_BUS_TIMEOUT', 'FromBus', 'ToBus', 'BusListener', 'BusListenerJanitor',
+__all__ = ['DEFAULT_BUS_TIMEOUT', 'ConnectionPool', 'connection_pool', 'FromBus', 'ToBus', 'BusListener', 'BusListenerJanitor',
            'TemporaryQueue', 'TemporaryExchange', 'AbstractMessageHandler', 'UsingToBusMixin',
            'nr_of_messages_in_queue', 'can_connect_to_broker']
 
@@ -61,6 +61,13 @@ class LofarMessage:
         self.priority = priority
         self.ttl = ttl
         self.id = uuid.uuid4() if id is None else uuid.UUID(id)
+        # the codec (see lofar.messaging.serialization) to encode the content with when sending. None means: the ToBus' codec.
+        self.codec = None
+
+    @property
+    def metrics_subject(self) -> str:
+        """the subject to label the messaging metrics (see lofar.messaging.metrics) of this message with"""
+        return self.subject
 
     def as_kombu_publish_kwargs(self):
         """Convert this message into a kwargs-dict, ready for use with kombu.Producer.publish"""
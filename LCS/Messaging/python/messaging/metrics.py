@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# metrics.py: instrumentation of the lofar.messaging module.
+#
+# Copyright (C) 2015
+# ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process-wide counters, gauges and histograms for the lofar.messaging module.
+
+The FromBus, ToBus, BusListener, RPCClient and ServiceMessageHandler record (among others):
+ - messages_received/messages_sent per queue/exchange and subject (and bytes_sent),
+ - handle_time per listener queue and subject, and messages_rejected,
+ - service_method_time per rpc service method, and rpc_roundtrip_time and rpc_timeouts per called service method,
+ - reconnects per bus type and broker,
+ - queue_depth samples of the nr_of_messages_in_queue of each BusListener's queue.
+
+The number of distinct label sets per metric is capped (see MAX_LABEL_SETS_PER_METRIC),
+so labels with many distinct values, like the addresses of temporary queues, cannot make the metrics grow without bound.
+
+The metrics can be inspected:
+ - in the process, with metrics.snapshot() or metrics.format_summary(),
+ - periodically in the log and/or on the bus, with a MetricsReporter,
+ - remotely, for each RPCService, via its built-in 'get_bus_metrics' rpc method:
+
+>>> with RPCClient("MyService") as rpc:                                     # doctest: +SKIP
+...     print(rpc.execute("get_bus_metrics")['histograms'].keys())
+"""
+
+import os
+import logging
+import threading
+from time import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# the number of most recent samples per histogram used to compute the percentiles
+HISTOGRAM_RESERVOIR_SIZE = 1024
+
+# the interval in seconds at which a BusListener samples the depth of its queue
+QUEUE_DEPTH_SAMPLE_INTERVAL = 60
+
+# the maximum number of distinct label sets per metric name. Any further label sets are all counted as '<other>'.
+MAX_LABEL_SETS_PER_METRIC = 1000
+
+
+def _percentile(sorted_values, percentile):
+    return sorted_values[min(len(sorted_values)-1, int(round(percentile/100.0*(len(sorted_values)-1))))]
+
+def _format_key(name: str, labels: tuple) -> str:
+    """format the metric name and its labels like: name{label1=value1,label2=value2}"""
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ','.join("%s=%s" % (k, v) for k, v in labels))
+
+
+class Histogram:
+    """
+    Keeps the count, sum, min and max of all observed values, and the most recent values to compute the percentiles.
+    Not thread-safe on itself, the Metrics registry serializes the access.
+    """
+    def __init__(self, reservoir_size: int=HISTOGRAM_RESERVOIR_SIZE):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self._recent_values = deque(maxlen=reservoir_size)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self._recent_values.append(value)
+
+    def as_dict(self) -> dict:
+        recent_values = sorted(self._recent_values)
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum/self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': _percentile(recent_values, 50) if recent_values else None,
+                'p95': _percentile(recent_values, 95) if recent_values else None,
+                'p99': _percentile(recent_values, 99) if recent_values else None}
+
+
+class Metrics:
+    """
+    A thread-safe registry of counters, gauges and histograms, each identified by a name and a set of labels.
+    Use the process-wide 'metrics' instance of this module.
+    """
+    def __init__(self, max_label_sets_per_metric: int=MAX_LABEL_SETS_PER_METRIC):
+        self.enabled = os.environ.get('LOFAR_MESSAGING_METRICS', 'true').lower() not in ('0', 'false', 'no', 'off')
+        self.max_label_sets_per_metric = max_label_sets_per_metric
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """clear all metrics"""
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._nr_of_label_sets = {}
+            self._start_timestamp = time()
+
+    def _get_key(self, table: dict, name: str, labels: dict) -> tuple:
+        """the key for the metric with the given name and labels in the given table. Call with the lock held."""
+        key = (name, tuple(sorted(labels.items())))
+        if key not in table:
+            nr_of_label_sets = self._nr_of_label_sets.get(name, 0)
+            if nr_of_label_sets >= self.max_label_sets_per_metric:
+                # prevent unbounded growth for labels with many distinct values (like temporary queue names)
+                return (name, tuple((k, '<other>') for k, v in key[1]))
+            self._nr_of_label_sets[name] = nr_of_label_sets + 1
+        return key
+
+    def increment(self, name: str, amount: float=1, **labels):
+        """increment the counter with the given name and labels by the given amount"""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = self._get_key(self._counters, name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """set the gauge with the given name and labels to the given value (None means: unknown)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = self._get_key(self._gauges, name, labels)
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """add the given value (typically a duration in seconds) to the histogram with the given name and labels"""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = self._get_key(self._histograms, name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        """context manager which observes the duration of its body in the histogram with the given name and labels"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        :return dict: a json/pickle-able copy of all metrics, with keys like 'name{label1=value1,label2=value2}'
+        """
+        with self._lock:
+            return {'timestamp': time(),
+                    'uptime': time() - self._start_timestamp,
+                    'counters': {_format_key(*key): value for key, value in self._counters.items()},
+                    'gauges': {_format_key(*key): value for key, value in self._gauges.items()},
+                    'histograms': {_format_key(*key): histogram.as_dict() for key, histogram in self._histograms.items()}}
+
+    def format_summary(self, previous_snapshot: dict=None, snapshot: dict=None) -> str:
+        """
+        format a human readable multi-line summary of the metrics, with the counter rates since the previous_snapshot
+        (or since the start if None), and the histograms sorted by their total time, so the 'hot' ones come first.
+        """
+        snapshot = snapshot or self.snapshot()
+        previous_counters = previous_snapshot['counters'] if previous_snapshot else {}
+        elapsed = snapshot['timestamp'] - previous_snapshot['timestamp'] if previous_snapshot else snapshot['uptime']
+        elapsed = max(elapsed, 1e-9)
+
+        lines = ['messaging metrics over the last %.1f seconds:' % (elapsed,)]
+        for key, value in sorted(snapshot['counters'].items()):
+            delta = value - previous_counters.get(key, 0)
+            lines.append('  %s: %s (%.2f/s)' % (key, value, delta/elapsed))
+        for key, value in sorted(snapshot['gauges'].items()):
+            lines.append('  %s: %s' % (key, 'unknown' if value is None else value))
+        for key, h in sorted(snapshot['histograms'].items(), key=lambda item: -item[1]['sum']):
+            if key.partition('{')[0].endswith('_time'):
+                # durations in seconds, show them in ms
+                lines.append('  %s: count=%d mean=%.2fms p50=%.2fms p95=%.2fms max=%.2fms total=%.1fs' % (
+                             key, h['count'], 1000.0*h['mean'], 1000.0*h['p50'], 1000.0*h['p95'], 1000.0*h['max'], h['sum']))
+            else:
+                lines.append('  %s: count=%d mean=%.1f p50=%s p95=%s max=%s' % (key, h['count'], h['mean'], h['p50'], h['p95'], h['max']))
+        return '\n'.join(lines)
+
+
+# the process-wide metrics registry
+metrics = Metrics()
+
+
+class MetricsReporter:
+    """
+    Periodically logs a summary of the metrics, and/or sends a snapshot of the metrics as EventMessage on the bus,
+    with subject 'lofar.messaging.metrics.<program_name>', for central monitoring.
+
+    >>> with MetricsReporter(interval=300):                                  # doctest: +SKIP
+    ...     run_my_service()
+    """
+    def __init__(self, interval: float=300, log_level: int=logging.INFO, exchange: str=None, broker: str=None):
+        """
+        :param interval: the number of seconds between two reports
+        :param log_level: log the summary at this level, or not at all if None
+        :param exchange: if given, then also send the snapshot as an EventMessage to this exchange
+        :param broker: the broker for the exchange, default: DEFAULT_BROKER
+        """
+        self.interval = interval
+        self.log_level = log_level
+        self.exchange = exchange
+        self.broker = broker
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._previous_snapshot = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._report_loop, name='MetricsReporter', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def report(self):
+        """report the metrics now"""
+        snapshot = metrics.snapshot()
+
+        if self.log_level is not None:
+            logger.log(self.log_level, metrics.format_summary(self._previous_snapshot, snapshot))
+
+        if self.exchange:
+            # import here to prevent a circular import
+            from lofar.messaging.messagebus import ToBus
+            from lofar.messaging.messages import EventMessage
+            from lofar.messaging.config import DEFAULT_BROKER
+            from lofar.common.util import program_name
+
+            with ToBus(self.exchange, broker=self.broker or DEFAULT_BROKER) as tobus:
+                tobus.send(EventMessage(content=snapshot,
+                                        subject='lofar.messaging.metrics.%s' % (program_name(include_extension=False),)))
+
+        self._previous_snapshot = snapshot
+
+    def _report_loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                logger.error("could not report the messaging metrics: %s", e)
+
+
+__all__ = ['metrics', 'Metrics', 'MetricsReporter']
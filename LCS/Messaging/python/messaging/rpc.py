@@ -63,15 +63,24 @@ bar was called.
 from lofar.messaging.config import DEFAULT_BROKER, DEFAULT_BUSNAME
 from lofar.messaging.messagebus import ToBus, BusListener, AbstractMessageHandler, UsingToBusMixin, TemporaryQueue
 from lofar.messaging.messages import LofarMessage, MessageFactory
-from lofar.messaging.exceptions import MessagingError
+from lofar.messaging.exceptions import MessagingError, MessageEncodingError
+from lofar.messaging.serialization import supported_codecs, negotiate_codec, PICKLE_CODEC
+from lofar.messaging.metrics import metrics
 from lofar.common.util import program_name
 from typing import Optional
 from datetime import datetime, timedelta
+from threading import Thread, Event, Lock, BoundedSemaphore
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, wait as wait_for_futures
+from time import sleep, time
+import asyncio
 import logging
 import inspect
 
 DEFAULT_RPC_TIMEOUT = 60
 
+# the default maximum number of requests which RPCClient.execute_many has in flight at the same time
+DEFAULT_RPC_MAX_CONCURRENCY = 16
+
 logger = logging.getLogger(__name__)
 
 class RequestMessage(LofarMessage):
@@ -81,9 +90,13 @@ class RequestMessage(LofarMessage):
     subsystem. A service message must contain a valid ``ReplyTo`` property.
     """
 
-    def __init__(self, subject:str, reply_to:str, priority:int=4, ttl:float=None, id=None):
-        """create a new RequestMessage. Use method with_args_kwargs to specify request args and kwargs"""
+    def __init__(self, subject:str, reply_to:str, priority:int=4, ttl:float=None, id=None, accept_codecs: Optional[list]=None):
+        """create a new RequestMessage. Use method with_args_kwargs to specify request args and kwargs
+        :param accept_codecs: the codecs (see lofar.messaging.serialization) in which the requester accepts the reply, in order of preference.
+                              None means: only the default codec (pickle).
+        """
         self.reply_to = reply_to
+        self.accept_codecs = list(accept_codecs) if accept_codecs else None
         content = { 'args': (), 'kwargs': {} }
         super(RequestMessage, self).__init__(content=content, subject=subject, priority=priority, ttl=ttl, id=id)
 
@@ -95,6 +108,8 @@ class RequestMessage(LofarMessage):
     def as_kombu_publish_kwargs(self):
         publish_kwargs = super(RequestMessage, self).as_kombu_publish_kwargs()
         publish_kwargs['reply_to'] = self.reply_to
+        if self.accept_codecs:
+            publish_kwargs['headers']['AcceptCodecs'] = ','.join(self.accept_codecs)
         return publish_kwargs
 
     def __str__(self):
@@ -106,7 +121,8 @@ MessageFactory.register(RequestMessage,
                         lambda kombu_msg : RequestMessage(reply_to=kombu_msg.properties.get('reply_to'),
                                                           subject=kombu_msg.headers.get('Subject'),
                                                           id=kombu_msg.headers.get('MessageId'),
-                                                          priority=kombu_msg.properties.get('priority',4)).with_args_kwargs(
+                                                          priority=kombu_msg.properties.get('priority',4),
+                                                          accept_codecs=[c for c in kombu_msg.headers.get('AcceptCodecs', '').split(',') if c]).with_args_kwargs(
                                                           *kombu_msg.payload.get('args', []),
                                                           **kombu_msg.payload.get('kwargs', {})))
 
@@ -118,15 +134,29 @@ class ReplyMessage(LofarMessage):
     message. These use topic exchanges and thus are routed by the 'subject' property
     """
 
-    def __init__(self, content, handled_successfully: bool, subject:str=None, priority:int=4, ttl:float=None, id=None, error_message: Optional[str]= ""):
+    def __init__(self, content, handled_successfully: bool, subject:str=None, priority:int=4, ttl:float=None, id=None, error_message: Optional[str]= "",
+                 correlation_id: Optional[str]=None):
+        """
+        :param correlation_id: the id of the RequestMessage this is the reply to,
+                               so the RPCClient can match the reply to the request on its shared reply queue.
+        """
         super(ReplyMessage, self).__init__(content=content, subject=subject, priority=priority, ttl=ttl, id=id)
         self.handled_successfully = handled_successfully
         self.error_message = error_message
+        self.correlation_id = str(correlation_id) if correlation_id is not None else None
+
+    @property
+    def metrics_subject(self) -> str:
+        """the subject of a reply is the address of a (temporary) reply queue, which is unique per RPCClient.
+        Label all replies the same, so the number of metrics does not grow with each new RPCClient."""
+        return 'reply'
 
     def as_kombu_publish_kwargs(self):
         publish_kwargs = super(ReplyMessage, self).as_kombu_publish_kwargs()
         publish_kwargs['headers']['handled_successfully'] = self.handled_successfully
         publish_kwargs['headers']['error_message'] = self.error_message
+        if self.correlation_id is not None:
+            publish_kwargs['correlation_id'] = self.correlation_id
         return publish_kwargs
 
     def __str__(self):
@@ -142,7 +172,8 @@ MessageFactory.register(ReplyMessage,
                                                         subject=kombu_msg.headers.get('Subject'),
                                                         id=kombu_msg.headers.get('MessageId'),
                                                         priority=kombu_msg.properties.get('priority',4),
-                                                        error_message=kombu_msg.headers.get('error_message')))
+                                                        error_message=kombu_msg.headers.get('error_message'),
+                                                        correlation_id=kombu_msg.properties.get('correlation_id')))
 
 class ServiceMessageHandler(UsingToBusMixin, AbstractMessageHandler):
     def __init__(self):
@@ -155,6 +186,9 @@ class ServiceMessageHandler(UsingToBusMixin, AbstractMessageHandler):
         self.service_name = service_name
         self.register_public_handler_methods()
 
+        # each service can be asked for the messaging metrics of its process
+        self.register_service_method('get_bus_metrics', metrics.snapshot)
+
     def register_public_handler_methods(self) -> None:
         excluded_class_names = (ServiceMessageHandler.__name__,) + tuple(x.__name__ for x in ServiceMessageHandler.__bases__)
 
@@ -201,16 +235,18 @@ class ServiceMessageHandler(UsingToBusMixin, AbstractMessageHandler):
             reply_msg = ReplyMessage(content=result,
                                      handled_successfully=True,
                                      subject=msg.reply_to,
-                                     error_message=None)
+                                     error_message=None,
+                                     correlation_id=msg.id)
         except Exception as e:
             logger.warning(e)
             reply_msg = ReplyMessage(content=None,
                                      handled_successfully=False,
                                      subject=msg.reply_to,
-                                     error_message=str(e))
+                                     error_message=str(e),
+                                     correlation_id=msg.id)
 
         # try to send back the reply, might raise on itself, which is ok, it's handled by the buslistener.
-        self.send(reply_msg)
+        reply_msg = self._send_reply(msg, reply_msg)
 
         # send was ok, no exception
         # now check reply_msg.handled_successfully state variable,
@@ -219,6 +255,35 @@ class ServiceMessageHandler(UsingToBusMixin, AbstractMessageHandler):
             raise Exception(reply_msg.error_message)
 
 
+    def _send_reply(self, request_msg: RequestMessage, reply_msg: ReplyMessage) -> ReplyMessage:
+        """send the reply_msg in the best codec which the requester accepts, if any. Otherwise the tobus' default codec is used.
+        If the reply content cannot be encoded in that codec, then it is sent pickled if the requester accepts that.
+        If the content cannot be encoded at all, then an error reply is sent instead, so the requester does not have to wait for its timeout.
+        :return: the reply message which was actually sent"""
+        codec = negotiate_codec(request_msg.accept_codecs)
+        codecs = [codec]
+        if codec not in (None, PICKLE_CODEC) and PICKLE_CODEC in request_msg.accept_codecs:
+            codecs.append(PICKLE_CODEC)
+
+        for codec in codecs:
+            reply_msg.codec = codec
+            try:
+                self.send(reply_msg)
+                return reply_msg
+            except MessageEncodingError as e:
+                logger.warning("could not encode the reply for %s: %s", request_msg.subject, e)
+                encoding_error = e
+
+        metrics.increment('service_reply_encoding_errors', service_method=request_msg.subject)
+        error_reply_msg = ReplyMessage(content=None,
+                                       handled_successfully=False,
+                                       subject=request_msg.reply_to,
+                                       error_message="%s: %s" % (encoding_error.__class__.__name__, encoding_error),
+                                       correlation_id=request_msg.id)
+        error_reply_msg.codec = codecs[0]
+        self.send(error_reply_msg)
+        return error_reply_msg
+
     def _service_handle_message(self, request_msg: RequestMessage) -> Optional[object]:
         """do a lookup in the registered service handler methods based on the subject of the request_msg,
         and call it, returning the service handler method's result."""
@@ -250,9 +315,11 @@ class ServiceMessageHandler(UsingToBusMixin, AbstractMessageHandler):
                                                            ', '.join(str(arg) for arg in rpc_args),
                                                            ', ' if len(rpc_args) else '',
                                                            ', '.join("%s=%s" % (k,v) for k,v in rpc_kwargs.items()))
-            return service_handler_method(*rpc_args, **rpc_kwargs)
+            with metrics.timed('service_method_time', service_method=request_msg.subject):
+                return service_handler_method(*rpc_args, **rpc_kwargs)
 
         except Exception as e:
+            metrics.increment('service_method_errors', service_method=request_msg.subject)
             logger.exception(str(e))
             raise Exception("%s: Error while handling msg with subject %s in service %s in method %s: %s" % (
                          self.__class__.__name__,
@@ -303,6 +370,20 @@ class RPCClient():
     An RPCClient instance enables the execution of remote procedure calls on a remotely running RPCService.
     It is assumed/expected that a RPCService is running and listening on the given, otherwise nobody will answer.
     See example usage at the top of this module file.
+
+    Upon open, the RPCClient creates one (temporary) reply queue, which is used for all its calls until it is closed.
+    The replies are received on a background thread, and matched to their requests by the reply's correlation_id
+    (which is the id of the request), so multiple threads can execute calls concurrently on the same RPCClient.
+
+    Besides the blocking execute method, there are:
+     - execute_async, which sends the request and returns a concurrent.futures.Future for the result,
+     - execute_asyncio, the asyncio coroutine variant, to be awaited in an asyncio event loop,
+     - execute_many, which pipelines many requests with bounded concurrency, and gathers their results.
+
+    >>> with RPCClient("MyService") as rpc:                                     # doctest: +SKIP
+    ...     future = rpc.execute_async("foo", my_param=1)
+    ...     results = rpc.execute_many([("foo", (), {'my_param': i}) for i in range(100)], max_concurrency=8)
+    ...     result = future.result()
     """
 
     def __init__(self, service_name: str,
@@ -318,12 +399,46 @@ class RPCClient():
         self._timeout = timeout
         self._request_sender = ToBus(exchange=exchange, broker=broker, connection_log_level=logging.DEBUG)
 
+        # the reply queue, its receiver, and the thread receiving the replies. They live from open until close.
+        self._reply_queue = None
+        self._reply_receiver = None
+        self._reply_receiver_thread = None
+        self._reply_receiver_lock = Lock()
+        self._running = Event()
+
+        # the pending requests: mapping of request message id to a (future, deadline, service_method) tuple, guarded by the _pending_replies_lock
+        self._pending_replies = {}
+        self._pending_replies_lock = Lock()
+
     def open(self):
-        """Open the rcp request sender connection to the broker. Recommended to be used in a 'with' context."""
+        """Open the rcp request sender connection to the broker, and the reply queue and receiver.
+        Recommended to be used in a 'with' context."""
         self._request_sender.open()
 
+        with self._reply_receiver_lock:
+            if self._reply_receiver_thread is None:
+                self._open_reply_receiver()
+                self._running.set()
+                self._reply_receiver_thread = Thread(target=self._receive_replies_loop, daemon=True,
+                                                     name="rpc-reply-receiver-for-%s" % (self._service_name,))
+                self._reply_receiver_thread.start()
+
     def close(self):
-        """Close the rcp request sender connection to the broker. Recommended to be used in a 'with' context."""
+        """Close the rcp request sender connection to the broker, and the reply queue and receiver.
+        Recommended to be used in a 'with' context."""
+        with self._reply_receiver_lock:
+            if self._reply_receiver_thread is not None:
+                self._running.clear()
+                self._reply_receiver_thread.join()
+                self._reply_receiver_thread = None
+                self._close_reply_receiver()
+
+                # nobody will receive the replies for the still pending requests anymore
+                with self._pending_replies_lock:
+                    for future, deadline, service_method in self._pending_replies.values():
+                        future.set_exception(RPCException("rpc call to service.method=%s was not answered before the RPCClient was closed" % (service_method,)))
+                    self._pending_replies.clear()
+
         self._request_sender.close()
 
     def __enter__(self):
@@ -335,71 +450,205 @@ class RPCClient():
         """leave the 'with' context, close the request sender"""
         self.close()
 
-    def execute(self, method_name, *args, **kwargs):
-        """execute the given <method_name> procedure remotely on the service"""
-        start_time = datetime.utcnow()
+    def _open_reply_receiver(self):
+        """create the temporary reply queue bound to the request exchange, and connect a receiver to it"""
+        self._reply_queue = TemporaryQueue(name_prefix="rpc-reply-for-%s-%s" % (program_name(include_extension=False), self._service_name),
+                                           exchange=self._request_sender.exchange,
+                                           broker=self._request_sender.broker,
+                                           addressed_to_me_only=True)
+        self._reply_queue.open()
+        self._reply_receiver = self._reply_queue.create_frombus()
+        self._reply_receiver.open()
+
+    def _close_reply_receiver(self):
+        """disconnect the receiver from the temporary reply queue, and delete the queue"""
+        try:
+            if self._reply_receiver is not None:
+                self._reply_receiver.close()
+        except Exception as e:
+            logger.error(e)
+        finally:
+            self._reply_receiver = None
+
+        if self._reply_queue is not None:
+            self._reply_queue.close()
+            self._reply_queue = None
+
+    def _receive_replies_loop(self):
+        """receive the replies on the reply queue, and hand each reply over to the pending request it belongs to."""
+        while self._running.is_set():
+            self._expire_pending_requests()
+
+            try:
+                reply = self._reply_receiver.receive(timeout=0.1)
+            except Exception as e:
+                # the reply queue might be gone, for example after a broker restart. Recreate it.
+                # The requests which are pending right now will time out.
+                logger.warning("rpc reply receiver for service %s could not receive replies: %s. Recreating the reply queue.",
+                               self._service_name, e)
+                try:
+                    self._close_reply_receiver()
+                    self._open_reply_receiver()
+                except Exception as e:
+                    logger.error("could not recreate the rpc reply queue for service %s: %s", self._service_name, e)
+                    sleep(1)
+                continue
+
+            if reply is not None:
+                self._handle_reply(reply)
+
+    def _handle_reply(self, reply):
+        """resolve the future of the pending request the given reply belongs to"""
+        with self._pending_replies_lock:
+            correlation_id = getattr(reply, 'correlation_id', None)
+            if correlation_id is None and len(self._pending_replies) == 1:
+                # a reply from a service which does not set the correlation_id (yet). It can only be for the single pending request.
+                correlation_id = next(iter(self._pending_replies.keys()))
+
+            pending_reply = self._pending_replies.pop(correlation_id, None)
+
+        if pending_reply is None:
+            logger.debug("discarding rpc reply for service %s which does not belong to any pending request (timed out?): %s",
+                         self._service_name, reply)
+            return
+
+        future, deadline, service_method = pending_reply
+        metrics.observe('rpc_roundtrip_time', time() - (deadline - self._timeout), service_method=service_method)
+
+        if not isinstance(reply, ReplyMessage):
+            future.set_exception(ValueError("rpc call to service.method=%s via exchange=%s received an unexpected non-ReplyMessage of type %s" % (
+                                            service_method, self.exchange, reply.__class__.__name__)))
+        elif reply.handled_successfully:
+            logger.debug("executed rpc call to service.method=%s via exchange=%s received valid answer", service_method, self.exchange)
+            future.set_result(reply.content)
+        else:
+            future.set_exception(RPCException(reply.error_message))
+
+    def _expire_pending_requests(self):
+        """let the futures of the pending requests which were not answered in time raise an RPCTimeoutException"""
+        now = time()
+        with self._pending_replies_lock:
+            expired_ids = [id for id, (future, deadline, service_method) in self._pending_replies.items() if deadline <= now]
+            expired_replies = [self._pending_replies.pop(id) for id in expired_ids]
+
+        for future, deadline, service_method in expired_replies:
+            metrics.increment('rpc_timeouts', service_method=service_method)
+            future.set_exception(RPCTimeoutException("rpc call to service.method=%s via exchange=%s timed out after %.1fsec" % (
+                                                     service_method, self.exchange, self._timeout)))
+
+    def execute_async(self, method_name, *args, **kwargs) -> Future:
+        """
+        send the request to execute the given <method_name> procedure remotely on the service, without waiting for the answer.
+        :return: a concurrent.futures.Future, which gets the result of the remote procedure, or its RPCException,
+                 or an RPCTimeoutException if the service did not answer within the timeout.
+        """
+        if self._reply_receiver_thread is None:
+            raise RPCException("cannot execute rpc call to service %s on an RPCClient which is not opened" % (self._service_name,))
+
+        reply_queue = self._reply_queue
+        if reply_queue is None or reply_queue.address is None:
+            raise RPCException("cannot execute rpc call to service %s, the reply queue is not available" % (self._service_name,))
 
         # use the same exchange/broker as the request sender
         exchange = self._request_sender.exchange
-        broker = self._request_sender.broker
-
-        # setup a temporary queue on which we can receive the answer from the service
-        with TemporaryQueue(name_prefix="rpc-reply-for-%s-%s" % (program_name(include_extension=False), self._service_name),
-                            exchange=exchange,
-                            broker=broker,
-                            addressed_to_me_only=True) as tmp_reply_queue:
-            with tmp_reply_queue.create_frombus() as reply_receiver:
-                elapsed = (datetime.utcnow() - start_time).total_seconds()
-
-                # by convention, the service listens for any message starting with the service_name,
-                # and then calls the method given after the '.'
-                service_method = "%s.%s" % (self._service_name, method_name)
-
-                # create a request message, make sure it's routed to the service using the <service_method>
-                # specify where to send the reply to (to our tmp queue)
-                # and set a ttl (time-to-live), so the broker will automatically purge messages which are not handled in time.
-                # pass along the given args and kwargs as arguments for the remote service method.
-                request_msg = RequestMessage(subject=service_method,
-                                             reply_to=tmp_reply_queue.address,
-                                             ttl=max(0, self._timeout - elapsed),
-                                             priority=4).with_args_kwargs(*args, **kwargs)
-
-                logger.debug("executing rpc call to service.method=%s via exchange=%s args=%s kwargs=%s waiting for answer on %s",
-                             service_method,
-                             exchange,
-                             args, kwargs,
-                             tmp_reply_queue.address)
-
-                self._request_sender.send(request_msg)
-
-                elapsed = (datetime.utcnow() - start_time).total_seconds()
-                wait_time = max(0.001, self._timeout - elapsed)
+        reply_address = reply_queue.address
+
+        # by convention, the service listens for any message starting with the service_name,
+        # and then calls the method given after the '.'
+        service_method = "%s.%s" % (self._service_name, method_name)
+
+        # create a request message, make sure it's routed to the service using the <service_method>
+        # specify where to send the reply to (to our reply queue)
+        # and set a ttl (time-to-live), so the broker will automatically purge messages which are not handled in time.
+        # pass along the given args and kwargs as arguments for the remote service method.
+        request_msg = RequestMessage(subject=service_method,
+                                     reply_to=reply_address,
+                                     ttl=self._timeout,
+                                     priority=4,
+                                     accept_codecs=supported_codecs()).with_args_kwargs(*args, **kwargs)
+
+        # the future is resolved by the reply receiver thread. It cannot be cancelled, because the request is sent anyway.
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        # register the pending request before sending it, so a fast reply cannot be missed.
+        with self._pending_replies_lock:
+            self._pending_replies[str(request_msg.id)] = (future, time() + self._timeout, service_method)
+
+        logger.debug("executing rpc call to service.method=%s via exchange=%s args=%s kwargs=%s waiting for answer on %s",
+                     service_method,
+                     exchange,
+                     args, kwargs,
+                     reply_address)
 
-                logger.debug("executed rpc call to service.method=%s via exchange=%s waiting %.1fsec for answer on %s",
-                             service_method,
-                             exchange,
-                             wait_time,
-                             tmp_reply_queue.address)
-
-                answer = reply_receiver.receive(wait_time)
-
-                if answer is None:
-                    raise RPCTimeoutException("rpc call to service.method=%s via exchange=%s timed out after %.1fsec" % (
-                                               service_method, exchange, self._timeout))
-
-                if not isinstance(answer, ReplyMessage):
-                    raise ValueError("rpc call to service.method=%s via exchange=%s received an unexpected non-ReplyMessage of type %s" % (
-                                     service_method, exchange, answer.__class__.__name__))
+        try:
+            self._request_sender.send(request_msg)
+        except Exception:
+            with self._pending_replies_lock:
+                self._pending_replies.pop(str(request_msg.id), None)
+            raise
 
-                logger.debug("executed rpc call to service.method=%s via exchange=%s received valid answer on %s",
-                             service_method,
-                             exchange,
-                             tmp_reply_queue.address)
+        return future
 
-                if answer.handled_successfully:
-                    return answer.content
+    def execute(self, method_name, *args, **kwargs):
+        """execute the given <method_name> procedure remotely on the service, and wait for the answer"""
+        future = self.execute_async(method_name, *args, **kwargs)
 
-                raise RPCException(answer.error_message)
+        # the reply receiver thread resolves the future upon the reply, or upon the timeout.
+        # Waiting a bit longer than the timeout ourselves is just a safety net.
+        try:
+            return future.result(self._timeout + 5)
+        except RPCTimeoutException:
+            raise
+        except FutureTimeoutError:
+            raise RPCTimeoutException("rpc call to service.method=%s.%s via exchange=%s timed out after %.1fsec" % (
+                                       self._service_name, method_name, self.exchange, self._timeout))
+
+    async def execute_asyncio(self, method_name, *args, **kwargs):
+        """asyncio coroutine which executes the given <method_name> procedure remotely on the service.
+        The request is sent right away, and the coroutine awaits the answer without blocking the event loop."""
+        return await asyncio.wrap_future(self.execute_async(method_name, *args, **kwargs))
+
+    def execute_many(self, calls, max_concurrency: int=DEFAULT_RPC_MAX_CONCURRENCY, return_exceptions: bool=False) -> list:
+        """
+        execute many procedures remotely on the service, with at most max_concurrency requests in flight at the same time.
+        The requests are pipelined: a new request is sent as soon as a reply for a previous one is received.
+        :param calls: iterable of (method_name, args, kwargs) tuples
+        :param max_concurrency: the maximum number of requests waiting for an answer at the same time
+        :param return_exceptions: if True, then the exception of a failed call is returned in the results,
+                                  otherwise the first exception (in order of the calls) is raised after all calls are done.
+                                  If sending a request fails, then no further requests are sent, and that exception is raised
+                                  after the requests in flight are done.
+        :return: the list of results, in the order of the calls
+        """
+        semaphore = BoundedSemaphore(max(1, max_concurrency))
+        futures = []
+
+        for method_name, args, kwargs in calls:
+            semaphore.acquire()
+            try:
+                future = self.execute_async(method_name, *(args or ()), **(kwargs or {}))
+            except Exception as e:
+                semaphore.release()
+                future = Future()
+                future.set_exception(e)
+                if not return_exceptions:
+                    futures.append(future)
+                    break
+            else:
+                future.add_done_callback(lambda f: semaphore.release())
+            futures.append(future)
+
+        # wait for all calls to be done before returning or raising, so no reply is left behind unhandled.
+        wait_for_futures(futures)
+
+        results = []
+        for future in futures:
+            exception = future.exception()
+            if exception is not None and not return_exceptions:
+                raise exception
+            results.append(exception if exception is not None else future.result())
+        return results
 
 
 class RPCClientContextManagerMixin:
@@ -426,7 +675,7 @@ class RPCClientContextManagerMixin:
         self.close()
 
 
-__all__ = ['DEFAULT_RPC_TIMEOUT', 'ServiceMessageHandler', 'RPCService', 'RPCClient', 'RPCClientContextManagerMixin',
+__all__ = ['DEFAULT_RPC_TIMEOUT', 'DEFAULT_RPC_MAX_CONCURRENCY', 'ServiceMessageHandler', 'RPCService', 'RPCClient', 'RPCClientContextManagerMixin',
            'RequestMessage', 'ReplyMessage', 'RPCException', 'RPCTimeoutException']
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# serialization.py: codecs for the content of LofarMessages.
+#
+# Copyright (C) 2015
+# ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Codecs for the content of LofarMessages, registered as kombu serializers.
+
+Historically, all message content is pickled, which is unsafe to accept from the bus, and which can only be read by python peers.
+This module provides two codecs which are safe to decode:
+ - 'lofar-json': json, extended with datetime, date, timedelta, uuid, bytes, set, tuple, dicts with non-str keys and numpy types.
+ - 'lofar-msgpack': msgpack with the same extensions, only available if the msgpack module is installed.
+
+Both codecs roundtrip the same python types as pickle does for the typical lofar message content,
+so a handler cannot tell which codec was used. Use "python3 -m lofar.messaging.benchmark --codecs" to compare
+their encode/decode times and payload sizes on typical RADB/OTDB/disk-usage replies.
+
+The codec of a message is stored by kombu in the message's content_type property, and the receiving side decodes
+the content with the codec for that content_type. Content above a size threshold is compressed,
+which kombu denotes in the message's 'compression' header. So any receiver with this module can decode any message.
+
+The sender decides which codec to use:
+ - a ToBus uses its codec (default: DEFAULT_CODEC, which is 'pickle', so old receivers can decode all messages),
+ - an RPCClient advertises the codecs it accepts in the request's 'AcceptCodecs' header,
+   and the RPCService replies with the first of those codecs which it supports as well.
+   Old clients do not advertise any codec, so they get pickled replies.
+"""
+
+import os
+import json
+import uuid
+import base64
+import logging
+from datetime import datetime, date, timedelta
+
+import kombu.serialization
+import kombu.compression
+
+from lofar.messaging.exceptions import MessageEncodingError
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+JSON_CODEC = 'lofar-json'
+MSGPACK_CODEC = 'lofar-msgpack'
+PICKLE_CODEC = 'pickle'
+
+# the codec used by a ToBus by default. Stick to pickle until all receivers on the bus know the new codecs.
+DEFAULT_CODEC = os.environ.get('LOFAR_DEFAULT_MESSAGING_CODEC', PICKLE_CODEC)
+
+# content which is encoded to more bytes than this threshold is compressed (with zlib)
+DEFAULT_COMPRESSION_THRESHOLD = 64*1024
+DEFAULT_COMPRESSION = 'zlib'
+
+# the (json) key for the type tag of an extended type
+_TYPE_KEY = '__lofar_type__'
+_VALUE_KEY = 'v'
+
+
+def _encode_extended(type_name: str, value) -> dict:
+    return {_TYPE_KEY: type_name, _VALUE_KEY: value}
+
+def _to_json_compatible(obj):
+    """recursively convert obj to a structure of json compatible types, with the extended types tagged by type name"""
+    obj_type = type(obj)
+
+    if obj_type in (str, int, float, bool) or obj is None:
+        return obj
+    if obj_type is list:
+        return [_to_json_compatible(x) for x in obj]
+    if obj_type is dict:
+        if all(type(k) is str for k in obj.keys()) and _TYPE_KEY not in obj:
+            return {k: _to_json_compatible(v) for k, v in obj.items()}
+        # json only supports str keys, so store the (key, value) pairs
+        return _encode_extended('dict', [[_to_json_compatible(k), _to_json_compatible(v)] for k, v in obj.items()])
+    if obj_type is tuple:
+        return _encode_extended('tuple', [_to_json_compatible(x) for x in obj])
+    if obj_type is datetime:
+        return _encode_extended('datetime', obj.isoformat())
+    if obj_type is date:
+        return _encode_extended('date', obj.isoformat())
+    if obj_type is timedelta:
+        return _encode_extended('timedelta', [obj.days, obj.seconds, obj.microseconds])
+    if obj_type is uuid.UUID:
+        return _encode_extended('uuid', str(obj))
+    if obj_type in (set, frozenset):
+        return _encode_extended(obj_type.__name__, [_to_json_compatible(x) for x in obj])
+    if obj_type is bytes:
+        return _encode_extended('bytes', base64.b64encode(obj).decode('ascii'))
+
+    if numpy is not None:
+        if obj_type is numpy.ndarray and obj.dtype != object:
+            return _encode_extended('ndarray', [obj.dtype.str, list(obj.shape),
+                                                base64.b64encode(numpy.ascontiguousarray(obj).tobytes()).decode('ascii')])
+        if isinstance(obj, numpy.generic):
+            return _to_json_compatible(obj.item())
+
+    # subclasses of the basic types (like OrderedDict, IntEnum or namedtuple) are converted to their base type
+    for base_type in (dict, list, tuple, str, int, float):
+        if isinstance(obj, base_type):
+            return _to_json_compatible(base_type(obj))
+
+    raise TypeError("Cannot encode object of type %s with the %s codec" % (obj_type.__name__, JSON_CODEC))
+
+def _decode_extended(type_name: str, value):
+    if type_name == 'dict':
+        return {_hashable(k): v for k, v in value}
+    if type_name == 'tuple':
+        return tuple(value)
+    if type_name == 'datetime':
+        return datetime.fromisoformat(value)
+    if type_name == 'date':
+        return date.fromisoformat(value)
+    if type_name == 'timedelta':
+        return timedelta(days=value[0], seconds=value[1], microseconds=value[2])
+    if type_name == 'uuid':
+        return uuid.UUID(value)
+    if type_name == 'set':
+        return set(_hashable(x) for x in value)
+    if type_name == 'frozenset':
+        return frozenset(_hashable(x) for x in value)
+    if type_name == 'bytes':
+        return base64.b64decode(value)
+    if type_name == 'ndarray':
+        if numpy is None:
+            raise TypeError("Cannot decode a numpy array without numpy")
+        dtype, shape, data = value
+        return numpy.frombuffer(base64.b64decode(data), dtype=numpy.dtype(dtype)).reshape(shape).copy()
+    raise TypeError("Cannot decode unknown type %s with the %s codec" % (type_name, JSON_CODEC))
+
+def _hashable(obj):
+    """dict keys and set items which were tuples are stored as lists by the json codec, convert them back"""
+    return tuple(_hashable(x) for x in obj) if isinstance(obj, list) else obj
+
+def _json_object_hook(obj: dict):
+    if _TYPE_KEY in obj:
+        return _decode_extended(obj[_TYPE_KEY], obj[_VALUE_KEY])
+    return obj
+
+def encode_json(obj) -> str:
+    """encode obj with the lofar-json codec"""
+    return json.dumps(_to_json_compatible(obj), separators=(',', ':'))
+
+def decode_json(data):
+    """decode data which was encoded with the lofar-json codec"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8')
+    return json.loads(data, object_hook=_json_object_hook)
+
+
+# the msgpack extension type codes
+_MSGPACK_EXT_TYPES = ('tuple', 'datetime', 'date', 'timedelta', 'uuid', 'set', 'frozenset', 'ndarray', 'dict')
+_MSGPACK_EXT_CODES = {type_name: code for code, type_name in enumerate(_MSGPACK_EXT_TYPES, start=1)}
+
+def _msgpack_default(obj):
+    """the msgpack default hook, called for the (extended) types which msgpack cannot pack natively (with strict_types)"""
+    obj_type = type(obj)
+
+    if obj_type is tuple:
+        return msgpack.ExtType(_MSGPACK_EXT_CODES['tuple'], _packb(list(obj)))
+    if obj_type is datetime:
+        return msgpack.ExtType(_MSGPACK_EXT_CODES['datetime'], obj.isoformat().encode('ascii'))
+    if obj_type is date:
+        return msgpack.ExtType(_MSGPACK_EXT_CODES['date'], obj.isoformat().encode('ascii'))
+    if obj_type is timedelta:
+        return msgpack.ExtType(_MSGPACK_EXT_CODES['timedelta'], _packb([obj.days, obj.seconds, obj.microseconds]))
+    if obj_type is uuid.UUID:
+        return msgpack.ExtType(_MSGPACK_EXT_CODES['uuid'], obj.bytes)
+    if obj_type in (set, frozenset):
+        return msgpack.ExtType(_MSGPACK_EXT_CODES[obj_type.__name__], _packb(list(obj)))
+
+    if numpy is not None:
+        if obj_type is numpy.ndarray and obj.dtype != object:
+            return msgpack.ExtType(_MSGPACK_EXT_CODES['ndarray'],
+                                   _packb([obj.dtype.str, list(obj.shape), numpy.ascontiguousarray(obj).tobytes()]))
+        if isinstance(obj, numpy.generic):
+            return obj.item()
+
+    for base_type in (dict, list, tuple, str, int, float):
+        if isinstance(obj, base_type):
+            return base_type(obj)
+
+    raise TypeError("Cannot encode object of type %s with the %s codec" % (obj_type.__name__, MSGPACK_CODEC))
+
+def _msgpack_ext_hook(code, data):
+    type_name = _MSGPACK_EXT_TYPES[code-1] if 0 < code <= len(_MSGPACK_EXT_TYPES) else None
+
+    if type_name == 'tuple':
+        return tuple(_unpackb(data))
+    if type_name in ('datetime', 'date'):
+        return _decode_extended(type_name, data.decode('ascii'))
+    if type_name == 'uuid':
+        return uuid.UUID(bytes=data)
+    if type_name == 'ndarray':
+        dtype, shape, data = _unpackb(data)
+        return numpy.frombuffer(data, dtype=numpy.dtype(dtype)).reshape(shape).copy()
+    if type_name is not None:
+        return _decode_extended(type_name, _unpackb(data))
+    return msgpack.ExtType(code, data)
+
+def _packb(obj) -> bytes:
+    return msgpack.packb(obj, default=_msgpack_default, strict_types=True, use_bin_type=True)
+
+def _unpackb(data):
+    # tuple keys are packed as ext types, so they are unpacked as (hashable) tuples again.
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+
+def encode_msgpack(obj) -> bytes:
+    """encode obj with the lofar-msgpack codec"""
+    return _packb(obj)
+
+def decode_msgpack(data):
+    """decode data which was encoded with the lofar-msgpack codec"""
+    return _unpackb(bytes(data))
+
+
+kombu.serialization.register(JSON_CODEC, encode_json, decode_json,
+                             content_type='application/x-lofar-json', content_encoding='utf-8')
+
+if msgpack is not None:
+    kombu.serialization.register(MSGPACK_CODEC, encode_msgpack, decode_msgpack,
+                                 content_type='application/x-lofar-msgpack', content_encoding='binary')
+
+def supported_codecs() -> list:
+    """:return: the names of the codecs supported in this process, in order of preference"""
+    return ([MSGPACK_CODEC] if msgpack is not None else []) + [JSON_CODEC, PICKLE_CODEC]
+
+def negotiate_codec(accepted_codecs) -> str:
+    """
+    :param accepted_codecs: the codecs accepted by the peer, in order of its preference (or None if unknown)
+    :return: the first of the accepted_codecs which is supported in this process as well, or None if there is none.
+    """
+    codecs = supported_codecs()
+    for codec in (accepted_codecs or []):
+        if codec in codecs:
+            return codec
+    return None
+
+def encode(content, codec: str=None, compression_threshold: int=DEFAULT_COMPRESSION_THRESHOLD) -> (str, str, bytes, str):
+    """
+    encode the given content with the given codec, and compress it if it is larger than the compression_threshold.
+    :param content: the content to encode
+    :param codec: the name of the codec, default: DEFAULT_CODEC
+    :param compression_threshold: compress the encoded content if it is larger than this number of bytes. None means never.
+    :return: tuple of content_type, content_encoding, encoded (and maybe compressed) body, and the compression header (None if not compressed)
+    :raises MessageEncodingError: if the content cannot be encoded with the codec, for example because it contains an unsupported type.
+    """
+    try:
+        content_type, content_encoding, body = kombu.serialization.dumps(content, serializer=codec or DEFAULT_CODEC)
+    except Exception as e:
+        # kombu wraps the TypeError of the codec in its own EncodeError. Raise one error type for all codecs.
+        raise MessageEncodingError("Cannot encode message content with the %s codec: %s" % (codec or DEFAULT_CODEC, e)) from e
+
+    if compression_threshold is not None and len(body) > compression_threshold:
+        if isinstance(body, str):
+            body = body.encode(content_encoding)
+        body, compression = kombu.compression.compress(body, DEFAULT_COMPRESSION)
+        return content_type, content_encoding, body, compression
+
+    return content_type, content_encoding, body, None
+
+def decode(body, content_type: str, content_encoding: str, compression: str=None):
+    """decode the given body which was encoded (and maybe compressed) with the encode function"""
+    if compression:
+        body = kombu.compression.decompress(body, compression)
+    return kombu.serialization.loads(body, content_type, content_encoding)
+
+
+__all__ = ['JSON_CODEC', 'MSGPACK_CODEC', 'PICKLE_CODEC', 'DEFAULT_CODEC', 'DEFAULT_COMPRESSION_THRESHOLD',
+           'supported_codecs', 'negotiate_codec', 'encode', 'decode']
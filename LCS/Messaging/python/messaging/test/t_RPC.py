@@ -10,9 +10,14 @@ logging.basicConfig(format='%(asctime)s %(process)d %(levelname)s %(message)s',
 import unittest
 import uuid
 from time import sleep
+from datetime import datetime
+from threading import Thread
+import asyncio
+from decimal import Decimal
+from threading import Lock
 
 from lofar.messaging.messagebus import TemporaryExchange, can_connect_to_broker, exchange_exists, queue_exists, BusListenerJanitor
-from lofar.messaging.rpc import RPCClient, RPCService, RPCException, RPCTimeoutException, ServiceMessageHandler
+from lofar.messaging.rpc import RPCClient, RPCService, RPCException, RPCTimeoutException, ServiceMessageHandler, RequestMessage, ReplyMessage
 
 TEST_SERVICE_NAME = "%s.%s" % (__name__, uuid.uuid4())
 
@@ -34,6 +39,14 @@ class MyServiceMessageHandler(ServiceMessageHandler):
     def my_public_slow_method(self):
         sleep(2)
 
+    def my_public_decimal_method(self):
+        # a Decimal cannot be encoded with the json/msgpack codecs, only with pickle
+        return Decimal('3.14')
+
+    def my_public_unencodable_method(self):
+        # a Lock cannot be encoded with any codec
+        return Lock()
+
 
 class RPCServiceTests(unittest.TestCase):
     def test_designated_queue_name_contains_subclass_name(self):
@@ -48,6 +61,16 @@ class RPCServiceTests(unittest.TestCase):
             self.assertFalse(".BusListener." in queue_name)
 
 
+class RPCMessageTests(unittest.TestCase):
+    def test_metrics_subject(self):
+        request = RequestMessage(subject="MyService.foo", reply_to="MyService.reply.%s" % uuid.uuid4())
+        self.assertEqual("MyService.foo", request.metrics_subject)
+
+        # all replies are labelled the same in the metrics, because each reply queue has a unique address
+        reply = ReplyMessage(content=None, handled_successfully=True, subject=request.reply_to, correlation_id=request.id)
+        self.assertEqual("reply", reply.metrics_subject)
+
+
 class TestRPC(unittest.TestCase):
     def test_registered_service_methods(self):
         handler = MyServiceMessageHandler("foo", "bar")
@@ -87,6 +110,85 @@ class TestRPC(unittest.TestCase):
         self.assertFalse(queue_exists(service_queue_address))
         self.assertFalse(exchange_exists(tmp_exchange_address))
 
+    def test_concurrent_rpc_calls_share_one_reply_queue(self):
+        with TemporaryExchange(__name__) as tmp_exchange:
+            with BusListenerJanitor(RPCService(TEST_SERVICE_NAME,
+                            handler_type=MyServiceMessageHandler,
+                            handler_kwargs={'my_arg1': "foo",
+                                            'my_arg2': "bar"},
+                            exchange=tmp_exchange.address,
+                            num_threads=4)):
+                with RPCClient(service_name=TEST_SERVICE_NAME, exchange=tmp_exchange.address, timeout=5) as rpc_client:
+                    reply_queue_address = rpc_client._reply_queue.address
+                    self.assertTrue(queue_exists(reply_queue_address))
+
+                    # each thread should get the reply to its own request
+                    results = {}
+                    def call(i):
+                        results[i] = rpc_client.execute("my_public_method2", i)
+
+                    threads = [Thread(target=call, args=(i,)) for i in range(16)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+
+                    self.assertEqual({i: ("bar", i) for i in range(16)}, results)
+                    self.assertEqual(reply_queue_address, rpc_client._reply_queue.address)
+
+                self.assertFalse(queue_exists(reply_queue_address))
+
+    def test_async_and_pipelined_rpc_calls(self):
+        with TemporaryExchange(__name__) as tmp_exchange:
+            with BusListenerJanitor(RPCService(TEST_SERVICE_NAME,
+                            handler_type=MyServiceMessageHandler,
+                            handler_kwargs={'my_arg1': "foo",
+                                            'my_arg2': "bar"},
+                            exchange=tmp_exchange.address,
+                            num_threads=4)):
+                with RPCClient(service_name=TEST_SERVICE_NAME, exchange=tmp_exchange.address, timeout=5) as rpc_client:
+                    # execute_async returns a future right away
+                    futures = [rpc_client.execute_async("my_public_method2", i) for i in range(8)]
+                    self.assertEqual([("bar", i) for i in range(8)], [f.result() for f in futures])
+
+                    failing_future = rpc_client.execute_async("my_public_failing_method")
+                    self.assertRaises(RPCException, failing_future.result)
+
+                    # execute_many returns the results in the order of the calls
+                    results = rpc_client.execute_many([("my_public_method2", (i,), None) for i in range(32)], max_concurrency=4)
+                    self.assertEqual([("bar", i) for i in range(32)], results)
+
+                    results = rpc_client.execute_many([("my_public_method1", None, None),
+                                                       ("my_public_failing_method", None, None)], return_exceptions=True)
+                    self.assertEqual(("foo", "bar"), results[0])
+                    self.assertTrue(isinstance(results[1], RPCException))
+
+                    with self.assertRaises(RPCException):
+                        rpc_client.execute_many([("my_public_failing_method", None, None)])
+
+                    # a reply which cannot be encoded in the negotiated codec is sent pickled
+                    self.assertEqual(Decimal('3.14'), rpc_client.execute("my_public_decimal_method"))
+
+                    # a reply which cannot be encoded at all results in an RPCException right away, and not in a timeout
+                    start = datetime.utcnow()
+                    with self.assertRaises(RPCException) as context:
+                        rpc_client.execute("my_public_unencodable_method")
+                    self.assertNotIsInstance(context.exception, RPCTimeoutException)
+                    self.assertIn("MessageEncodingError", str(context.exception))
+                    self.assertLess((datetime.utcnow() - start).total_seconds(), 5)
+
+                    # and the asyncio variant can be awaited concurrently
+                    async def gather():
+                        return await asyncio.gather(*[rpc_client.execute_asyncio("my_public_method2", i) for i in range(4)])
+
+                    self.assertEqual([("bar", i) for i in range(4)], asyncio.run(gather()))
+
+                    # each service has a built-in method to get the messaging metrics
+                    bus_metrics = rpc_client.execute("get_bus_metrics")
+                    service_method = "%s.my_public_method2" % (TEST_SERVICE_NAME,)
+                    self.assertGreaterEqual(bus_metrics['histograms']['service_method_time{service_method=%s}' % service_method]['count'], 44)
+                    self.assertGreaterEqual(bus_metrics['histograms']['rpc_roundtrip_time{service_method=%s}' % service_method]['count'], 44)
+
 if __name__ == '__main__':
     if not can_connect_to_broker():
         logger.error("Cannot connect to default rabbitmq broker. Skipping test.")
@@ -615,6 +615,92 @@ class RejectorTester(unittest.TestCase):
         self.assertFalse(queue_exists(rejector_address))
 
 
+class ConnectionPoolTester(unittest.TestCase):
+    def test_short_lived_buses_reuse_pooled_connection(self):
+        with TemporaryExchange("Pool") as tmp_exchange:
+            with tmp_exchange.create_temporary_queue() as tmp_queue:
+                connection_pool.clear()
+
+                with ToBus(tmp_exchange.address) as tobus:
+                    local_address = tobus.local_address
+                    tobus.send(EventMessage(content="foo"))
+
+                # the next short-lived ToBus should get the same connection (so the same local socket)
+                with ToBus(tmp_exchange.address) as tobus:
+                    self.assertEqual(local_address, tobus.local_address)
+                    tobus.send(EventMessage(content="bar"))
+
+                # and so does a FromBus, on its own channel
+                with FromBus(tmp_queue.address) as frombus:
+                    self.assertEqual(local_address, frombus.local_address)
+                    self.assertEqual("foo", frombus.receive().content)
+                    # do not ack this message...
+                    self.assertEqual("bar", frombus.receive(acknowledge=False).content)
+
+                # ... so it is redelivered after the FromBus closed its channel, even though the connection stays open in the pool
+                with FromBus(tmp_queue.address) as frombus:
+                    self.assertEqual("bar", frombus.receive().content)
+
+    def test_reconnect_does_not_reuse_connection(self):
+        with TemporaryExchange("Pool") as tmp_exchange:
+            connection_pool.clear()
+
+            with ToBus(tmp_exchange.address) as tobus:
+                local_address = tobus.local_address
+                tobus.reconnect()
+                self.assertNotEqual(local_address, tobus.local_address)
+
+            # the unhealthy connection was not put back in the pool, just the new one
+            self.assertEqual(1, len(connection_pool._idle_connections[tmp_exchange.broker]))
+
+
+class BatchTester(unittest.TestCase):
+    def test_receive_batch_and_ack_batch(self):
+        with TemporaryExchange("Batch") as tmp_exchange:
+            with tmp_exchange.create_temporary_queue() as tmp_queue:
+                with tmp_exchange.create_tobus() as tobus:
+                    for i in range(10):
+                        tobus.send(EventMessage(content=i))
+
+                with FromBus(tmp_queue.address, prefetch_count=10) as frombus:
+                    msgs = frombus.receive_batch(4, timeout=5, acknowledge=False)
+                    self.assertEqual([0, 1, 2, 3], [msg.content for msg in msgs])
+                    frombus.ack_batch(msgs)
+
+                    msgs = frombus.receive_batch(100, timeout=5, batch_timeout=0.5)
+                    self.assertEqual(list(range(4, 10)), [msg.content for msg in msgs])
+
+                    self.assertEqual([], frombus.receive_batch(100, timeout=0.1))
+                    self.assertEqual(0, frombus.nr_of_messages_in_queue())
+
+    def test_buslistener_in_batch_mode(self):
+        handled_batches = []
+        handled_all_event = ThreadingEvent()
+
+        class BatchHandler(AbstractMessageHandler):
+            def handle_messages(self, msgs):
+                handled_batches.append([msg.content for msg in msgs])
+                if sum(len(batch) for batch in handled_batches) >= 100:
+                    handled_all_event.set()
+                # reject the odd messages
+                return [msg for msg in msgs if msg.content % 2]
+
+        with TemporaryExchange("Batch") as tmp_exchange:
+            with BusListenerJanitor(BusListener(handler_type=BatchHandler, exchange=tmp_exchange.address,
+                                                prefetch_count=20, batch_size=20, batch_timeout=0.5)) as listener:
+                with tmp_exchange.create_tobus() as tobus:
+                    for i in range(100):
+                        tobus.send(EventMessage(content=i))
+
+                self.assertTrue(handled_all_event.wait(10))
+                self.assertTrue(all(len(batch) <= 20 for batch in handled_batches))
+                self.assertLess(len(handled_batches), 100)
+                self.assertEqual(list(range(100)), sorted(sum(handled_batches, [])))
+
+                with FromBus(listener.address) as frombus:
+                    self.assertEqual(0, frombus.nr_of_messages_in_queue())
+
+
 
 class PingPongPlayer(BusListener):
     """
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Program to test the messaging metrics of the Messaging package.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s %(process)d %(levelname)s %(message)s', level=logging.DEBUG)
+
+import unittest
+from time import sleep
+
+from lofar.messaging.metrics import Metrics, MetricsReporter, metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_counters_and_gauges(self):
+        m = Metrics()
+        m.increment('messages_received', queue='q', subject='a')
+        m.increment('messages_received', subject='a', queue='q')
+        m.increment('messages_received', 3, queue='q', subject='b')
+        m.set_gauge('queue_depth', 10, queue='q')
+        m.set_gauge('queue_depth', 5, queue='q')
+
+        snapshot = m.snapshot()
+        self.assertEqual({'messages_received{queue=q,subject=a}': 2,
+                          'messages_received{queue=q,subject=b}': 3}, snapshot['counters'])
+        self.assertEqual({'queue_depth{queue=q}': 5}, snapshot['gauges'])
+
+        m.reset()
+        self.assertEqual({}, m.snapshot()['counters'])
+
+    def test_histograms(self):
+        m = Metrics()
+        for i in range(1, 101):
+            m.observe('handle_time', i/1000.0, subject='a')
+
+        with m.timed('handle_time', subject='b'):
+            sleep(0.01)
+
+        histograms = m.snapshot()['histograms']
+        self.assertEqual(100, histograms['handle_time{subject=a}']['count'])
+        self.assertAlmostEqual(0.001, histograms['handle_time{subject=a}']['min'])
+        self.assertAlmostEqual(0.1, histograms['handle_time{subject=a}']['max'])
+        self.assertAlmostEqual(0.05, histograms['handle_time{subject=a}']['p50'], delta=0.002)
+        self.assertAlmostEqual(0.095, histograms['handle_time{subject=a}']['p95'], delta=0.002)
+        self.assertGreaterEqual(histograms['handle_time{subject=b}']['max'], 0.01)
+
+        # the histogram with the most total time comes first in the summary
+        summary_lines = m.format_summary().split('\n')
+        self.assertTrue(summary_lines[1].strip().startswith('handle_time{subject=a}'))
+
+    def test_unknown_gauge(self):
+        m = Metrics()
+        m.set_gauge('queue_depth', None, queue='q')
+        self.assertEqual({'queue_depth{queue=q}': None}, m.snapshot()['gauges'])
+        self.assertIn('queue_depth{queue=q}: unknown', m.format_summary())
+
+    def test_max_label_sets_per_metric(self):
+        m = Metrics(max_label_sets_per_metric=3)
+        for i in range(10):
+            m.increment('messages_received', queue='q', subject='reply_queue_%d' % i)
+            m.observe('handle_time', 0.1, subject='reply_queue_%d' % i)
+
+        # the already known label sets are still counted as usual
+        m.increment('messages_received', queue='q', subject='reply_queue_0')
+
+        counters = m.snapshot()['counters']
+        self.assertEqual({'messages_received{queue=q,subject=reply_queue_0}': 2,
+                          'messages_received{queue=q,subject=reply_queue_1}': 1,
+                          'messages_received{queue=q,subject=reply_queue_2}': 1,
+                          'messages_received{queue=<other>,subject=<other>}': 7}, counters)
+        self.assertEqual(7, m.snapshot()['histograms']['handle_time{subject=<other>}']['count'])
+
+    def test_disabled(self):
+        m = Metrics()
+        m.enabled = False
+        m.increment('foo')
+        m.observe('bar', 1)
+        self.assertEqual({}, m.snapshot()['counters'])
+        self.assertEqual({}, m.snapshot()['histograms'])
+
+    def test_reporter_logs_rates(self):
+        metrics.increment('t_metrics_counter', 10)
+        with self.assertLogs('lofar.messaging.metrics', level=logging.INFO) as logs:
+            with MetricsReporter(interval=0.1):
+                sleep(0.35)
+
+        self.assertTrue(any('t_metrics_counter' in line for line in logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,4 @@
+#!/bin/sh
+./runctest.sh t_metrics
+
+
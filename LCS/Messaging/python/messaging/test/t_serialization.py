@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Program to test the message content codecs of the Messaging package.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s %(process)d %(levelname)s %(message)s', level=logging.DEBUG)
+
+import unittest
+import uuid
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from threading import Lock
+
+import numpy as np
+
+from lofar.messaging.serialization import *
+from lofar.messaging.exceptions import MessageEncodingError
+
+class TestCodecs(unittest.TestCase):
+    def _roundtrip(self, content, codec, compression_threshold=None):
+        content_type, content_encoding, body, compression = encode(content, codec, compression_threshold)
+        return decode(body, content_type, content_encoding, compression)
+
+    def test_supported_codecs(self):
+        codecs = supported_codecs()
+        self.assertIn(JSON_CODEC, codecs)
+        self.assertEqual(PICKLE_CODEC, codecs[-1])
+
+    def test_roundtrip_like_pickle(self):
+        content = {'args': ('bar', 1),
+                   'kwargs': {'starttime': datetime(2019, 1, 2, 3, 4, 5, 678000),
+                              'date': date(2019, 1, 2),
+                              'duration': timedelta(hours=1, microseconds=5)},
+                   1: 'int key',
+                   (1, 2): 'tuple key',
+                   'id': uuid.uuid4(),
+                   'set': {1, 2, 3},
+                   'frozenset': frozenset(['a']),
+                   'bytes': b'\x00\x01\xff',
+                   'ordered': OrderedDict(a=1),
+                   'nested': [{'__lofar_type__': 'not a type tag'}, [1.5, True, None]]}
+
+        for codec in supported_codecs():
+            result = self._roundtrip(content, codec)
+            self.assertEqual(content, result, codec)
+            self.assertEqual(tuple, type(result['args']))
+
+    def test_numpy(self):
+        array = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+        for codec in supported_codecs():
+            result = self._roundtrip({'array': array, 'scalar': np.int64(42)}, codec)
+            self.assertTrue(np.array_equal(array, result['array']), codec)
+            self.assertEqual(array.dtype, result['array'].dtype)
+            self.assertEqual(42, result['scalar'])
+
+    def test_compression(self):
+        content = [{'id': i, 'name': 'task %s' % i, 'starttime': datetime(2019, 1, 1) + timedelta(minutes=i)} for i in range(1000)]
+
+        content_type, content_encoding, body, compression = encode(content, JSON_CODEC, compression_threshold=None)
+        self.assertIsNone(compression)
+
+        content_type, content_encoding, compressed_body, compression = encode(content, JSON_CODEC, compression_threshold=1024)
+        self.assertIsNotNone(compression)
+        self.assertLess(len(compressed_body), len(body))
+        self.assertEqual(content, decode(compressed_body, content_type, content_encoding, compression))
+
+    def test_unsupported_type(self):
+        for codec in supported_codecs()[:-1]:
+            with self.assertRaises(MessageEncodingError):
+                encode(object(), codec)
+
+            # also for unsupported types nested deep in the content
+            with self.assertRaises(MessageEncodingError):
+                encode({'result': [Decimal('1.5')]}, codec)
+
+        # pickle can encode a Decimal, but not everything
+        self.assertEqual(Decimal('1.5'), self._roundtrip(Decimal('1.5'), PICKLE_CODEC))
+        with self.assertRaises(MessageEncodingError):
+            encode(Lock(), PICKLE_CODEC)
+
+    def test_negotiate_codec(self):
+        self.assertEqual(JSON_CODEC, negotiate_codec(['unknown_codec', JSON_CODEC, PICKLE_CODEC]))
+        self.assertEqual(supported_codecs()[0], negotiate_codec(supported_codecs()))
+        self.assertIsNone(negotiate_codec(['unknown_codec']))
+        self.assertIsNone(negotiate_codec(None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,7 +18,10 @@
 import os.path
 from datetime import datetime, timedelta
 from time import sleep
+from threading import RLock, Timer
+from collections import OrderedDict
 import errno
+import fcntl
 import os
 
 # prevent annoying h5py future/deprecation warnings
@@ -28,11 +31,206 @@ import h5py
 import logging
 logger = logging.getLogger(__name__)
 
+# the file modes in which h5py opens a file for writing
+_H5_WRITE_MODES = ('r+', 'a', 'w', 'w-', 'x')
+
+class _H5FileHandleCache():
+    """
+    Process-wide cache of opened h5py.File handles, used by SharedH5File.
+    Nested users of the same file (path) in a compatible mode share one reference counted handle,
+    so for example reading the version and the parset while reading the data does not reopen the file each time.
+    Handles opened for writing are closed (and flushed) as soon as their last user releases them.
+
+    Optionally (see enable_idle_h5_file_cache), handles which were opened read-only are kept open for at most
+    max_idle_seconds after their last user released them, in a least-recently-used list of at most max_idle_handles,
+    so subsequent reads of the same file are cheap as well. This is disabled by default, because an idle read handle
+    prevents opening the same file for writing with a plain h5py.File in the same process.
+    """
+    class _Handle():
+        def __init__(self, file, mode, stat):
+            self.file = file
+            self.mode = mode
+            self.stat = stat
+            self.refcount = 1
+            self.idle_since = None
+
+    def __init__(self, max_idle_handles=0, max_idle_seconds=5):
+        self.max_idle_handles = max_idle_handles
+        self.max_idle_seconds = max_idle_seconds
+        self._lock = RLock()
+        self._handles = {}
+        self._idle_handles = OrderedDict()
+        self._eviction_timer = None
+
+    @staticmethod
+    def _stat(key):
+        try:
+            stat = os.stat(key)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def acquire(self, key, mode):
+        """
+        try to get a (shared) handle for the file (key is its real path) in the given mode.
+        :return h5py.File: the shared h5py.File, or None if there is no (compatible) handle available.
+        """
+        with self._lock:
+            self._close_expired_idle_handles()
+
+            handle = self._handles.get(key)
+            if handle is None:
+                return None
+
+            if handle.refcount > 0:
+                # a reader can always share the current handle, a writer can only share a handle which is already writable
+                if mode == 'r' or (mode in ('r+', 'a') and handle.mode in _H5_WRITE_MODES):
+                    handle.refcount += 1
+                    return handle.file
+                # conflicting mode, the caller has to wait for the current users to release the file
+                return None
+
+            # idle handle, reuse it only for readers, and only if the file was not changed in the meantime
+            if mode == 'r' and handle.mode == 'r' and handle.stat == self._stat(key):
+                del self._idle_handles[key]
+                handle.refcount = 1
+                handle.idle_since = None
+                return handle.file
+
+            self._close_handle(key)
+            return None
+
+    def register(self, key, mode, file):
+        """
+        register the freshly opened file in the cache, with a reference count of 1.
+        :return bool: True if the file was registered (and should be released with release), False if not.
+        """
+        with self._lock:
+            if key in self._handles:
+                # there is still another (conflicting) handle in use for this key, keep this one private.
+                return False
+            self._handles[key] = _H5FileHandleCache._Handle(file, mode, self._stat(key))
+            return True
+
+    def release(self, key):
+        with self._lock:
+            handle = self._handles[key]
+            handle.refcount -= 1
+
+            if handle.refcount > 0:
+                return
+
+            if handle.mode != 'r' or self.max_idle_handles <= 0 or self.max_idle_seconds <= 0:
+                self._close_handle(key)
+                return
+
+            handle.idle_since = datetime.utcnow()
+            handle.stat = self._stat(key)
+            self._idle_handles[key] = handle
+
+            while len(self._idle_handles) > self.max_idle_handles:
+                self._close_handle(next(iter(self._idle_handles)))
+
+            self._schedule_eviction()
+
+    def close_idle_handles(self):
+        """close all currently idle (cached, but unused) file handles"""
+        with self._lock:
+            for key in list(self._idle_handles.keys()):
+                self._close_handle(key)
+
+    def _close_handle(self, key):
+        handle = self._handles.pop(key)
+        self._idle_handles.pop(key, None)
+        try:
+            handle.file.close()
+        except Exception as e:
+            logger.warning("error while closing h5 file '%s': %s", key, e)
+
+    def _close_expired_idle_handles(self):
+        with self._lock:
+            now = datetime.utcnow()
+            for key, handle in list(self._idle_handles.items()):
+                if now - handle.idle_since >= timedelta(seconds=self.max_idle_seconds):
+                    self._close_handle(key)
+
+    def _on_eviction_timer(self):
+        with self._lock:
+            self._eviction_timer = None
+            self._close_expired_idle_handles()
+
+            if self._idle_handles:
+                self._schedule_eviction()
+
+    def _schedule_eviction(self):
+        # make sure idle handles are closed in time, even if this process does not use SharedH5File anymore,
+        # so other processes are not blocked by our (hdf5 library) file lock.
+        # only one timer is pending at any time, which fires when the oldest idle handle expires.
+        if self._eviction_timer is None:
+            oldest_idle_since = min(handle.idle_since for handle in self._idle_handles.values())
+            delay = self.max_idle_seconds - (datetime.utcnow() - oldest_idle_since).total_seconds()
+            self._eviction_timer = Timer(max(0.01, delay), self._on_eviction_timer)
+            self._eviction_timer.daemon = True
+            self._eviction_timer.start()
+
+_h5_file_handle_cache = _H5FileHandleCache()
+
+def enable_idle_h5_file_cache(max_idle_handles=16, max_idle_seconds=5):
+    """
+    keep at most max_idle_handles read-only h5 files open for max_idle_seconds after their last SharedH5File user closed them,
+    so repeatedly reading the same files is cheaper. Use max_idle_handles=0 to disable it again (the default).
+    Only enable it in processes which do not open these files for writing with a plain h5py.File.
+    """
+    _h5_file_handle_cache.max_idle_handles = max_idle_handles
+    _h5_file_handle_cache.max_idle_seconds = max_idle_seconds
+    if max_idle_handles <= 0:
+        close_idle_h5_files()
+
+def close_idle_h5_files():
+    """close all idle h5 files which are kept open in the process-wide SharedH5File handle cache"""
+    _h5_file_handle_cache.close_idle_handles()
+
+def _wait_for_file_lock_release(path, mode, timeout):
+    """
+    wait at most timeout seconds until no other process holds a conflicting advisory lock on the file at path.
+    The hdf5 library (>=1.10) flock's the files it opens: shared for reading, exclusive for writing.
+    Instead of blindly sleeping, we probe that lock (non-blocking) with an exponential backoff (5ms up to 100ms).
+    :return bool: True if the file is not locked (anymore), False if it is still locked after timeout seconds.
+    """
+    lock_type = fcntl.LOCK_SH if mode == 'r' else fcntl.LOCK_EX
+    deadline = datetime.utcnow() + timedelta(seconds=max(0, timeout))
+    delay = 0.005
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, lock_type | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return True
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                    return False
+
+            if datetime.utcnow() >= deadline:
+                return False
+
+            sleep(delay)
+            delay = min(0.1, 2*delay)
+    finally:
+        os.close(fd)
+
 class SharedH5File():
     """
     Wrapper class aroung h5py.File to open an hdf5 file in read, write, or read/write mode safely,
     even when the file might be used simultanously by other processes.
     It waits for <timeout> seconds until the file becomes available.
+    Within one process, nested SharedH5File's for the same file share one (cached) h5py.File handle, see _H5FileHandleCache.
+    So, do not close the returned h5py.File yourself, but close the SharedH5File (or leave its context).
 
     Example usage:
 
@@ -45,33 +243,60 @@ class SharedH5File():
         self._mode = mode
         self._timeout = timeout
         self._file = None
+        self._cache_key = None
 
     def open(self):
         start_timestamp = datetime.utcnow()
+        retry_delay = 0.01
+
+        if self._path.startswith('~'):
+            self._path = os.path.expanduser(self._path)
+
+        key = os.path.realpath(self._path)
+
+        logged_warning = False
+
         while self._file is None:
+            self._file = _h5_file_handle_cache.acquire(key, self._mode)
+            if self._file is not None:
+                self._cache_key = key
+                return self._file
+
             try:
                 self._file = h5py.File(self._path, self._mode)
+                if _h5_file_handle_cache.register(key, self._mode, self._file):
+                    self._cache_key = key
                 return self._file
             except IOError:
-                if self._path.startswith('~'):
-                    # try again with tilde replaced
-                    self._path = os.path.expanduser(self._path)
-                    continue
-
                 if not os.path.exists(self._path):
                     raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), self._path)
 
-                logger.warning("Cannot open file '%s' with mode '%s'. Trying again in 1 sec...",
-                               self._path, self._mode)
-                sleep(max(0, min(1, self._timeout)))
-                if datetime.utcnow() - start_timestamp > timedelta(seconds=self._timeout):
+                remaining_seconds = self._timeout - (datetime.utcnow() - start_timestamp).total_seconds()
+                if remaining_seconds <= 0:
                     logger.error("Cannot open file '%s' with mode '%s', even after trying for %s seconds",
                                    self._path, self._mode, self._timeout)
                     raise
 
+                if not logged_warning:
+                    logger.warning("Cannot open file '%s' with mode '%s'. Waiting until it becomes available...",
+                                   self._path, self._mode)
+                    logged_warning = True
+
+                # wait until the file is not locked by another process (anymore).
+                # Whatever the outcome of that probe (we could not open the file even though it's not locked,
+                # for example because this process uses it in another mode, or the lock could not be probed at all),
+                # always wait a (growing) short while before trying again.
+                _wait_for_file_lock_release(self._path, self._mode, remaining_seconds)
+                sleep(max(0, min(retry_delay, remaining_seconds)))
+                retry_delay = min(1.0, 2*retry_delay)
+
     def close(self):
-        self._file.close()
+        if self._cache_key is not None:
+            _h5_file_handle_cache.release(self._cache_key)
+        else:
+            self._file.close()
         self._file = None
+        self._cache_key = None
 
     def __enter__(self):
         return self.open()
@@ -24,10 +24,13 @@ Module with nice postgres helper methods and classes.
 '''
 
 import logging
-from threading import Thread, Lock
+import os
+from threading import Thread, Lock, get_ident, enumerate as enumerate_threads
 from queue import Queue, Empty
 from datetime import  datetime, timedelta
 import collections
+import itertools
+import functools
 import time
 import re
 import select
@@ -98,6 +101,18 @@ FETCH_NONE=0
 FETCH_ONE=1
 FETCH_ALL=2
 
+# the default number of rows per INSERT statement in executeValuesQuery
+DEFAULT_VALUES_PAGE_SIZE=1000
+
+# the default number of rows per roundtrip to the server for the streaming executeQueryIter and executeQueryColumns
+DEFAULT_FETCH_BATCH_SIZE=10000
+
+# unique names for the server-side cursors of executeQueryIter and executeQueryColumns
+_server_side_cursor_counter = itertools.count(1)
+
+# the maximum number of idle connections per database which are kept open in the connection_pool for reuse. 0 disables the pooling.
+DEFAULT_CONNECTION_POOL_SIZE = int(os.environ.get('LOFAR_POSTGRES_CONNECTION_POOL_SIZE', 4))
+
 class PostgresDBError(Exception):
     pass
 
@@ -107,20 +122,378 @@ class PostgresDBConnectionError(PostgresDBError):
 class PostgresDBQueryExecutionError(PostgresDBError):
     pass
 
+def _to_positional_parameters(query: str):
+    '''convert the psycopg2 %s placeholders (and %% escapes) in the query to postgres $1, $2, ... parameters.
+    :return: tuple (converted_query, nr_of_parameters), or None if the query contains other (named) placeholders.'''
+    parts = []
+    nr_of_parameters = 0
+    for part in re.split(r'(%%|%s|%\(\w+\)s)', query):
+        if part == '%%':
+            parts.append('%')
+        elif part == '%s':
+            nr_of_parameters += 1
+            parts.append('$%d' % nr_of_parameters)
+        elif part.startswith('%('):
+            return None
+        else:
+            parts.append(part)
+    return ''.join(parts), nr_of_parameters
+
+# the (builtin) functions, and the sql keywords which can be followed by a '(', which can be used in a read-only SELECT.
+# Any other function, like resource_allocation.rebuild_resource_usages_from_claims(), might change data.
+_READ_ONLY_SQL_FUNCTIONS = frozenset(
+    ['select', 'from', 'where', 'and', 'or', 'not', 'in', 'exists', 'any', 'all', 'some', 'as', 'on', 'join', 'using',
+     'values', 'over', 'filter', 'within', 'by', 'lateral', 'array', 'row', 'distinct', 'between', 'when', 'then', 'else',
+     'is', 'like', 'ilike', 'union', 'intersect', 'except', 'having',
+     'count', 'sum', 'min', 'max', 'avg', 'array_agg', 'string_agg', 'json_agg', 'jsonb_agg', 'bool_and', 'bool_or', 'every',
+     'row_number', 'rank', 'dense_rank', 'lag', 'lead', 'first_value', 'last_value',
+     'coalesce', 'nullif', 'greatest', 'least', 'cast', 'extract', 'date_trunc', 'date_part', 'to_char', 'to_timestamp',
+     'now', 'age', 'lower', 'upper', 'length', 'trim', 'substring', 'position', 'concat', 'replace', 'split_part', 'format',
+     'abs', 'round', 'floor', 'ceil', 'unnest', 'generate_series', 'array_length', 'cardinality',
+     'tsrange', 'tstzrange', 'int4range', 'int8range', 'numrange', 'daterange', 'lower_inf', 'upper_inf', 'isempty',
+     'varchar', 'char', 'character', 'numeric', 'decimal', 'timestamp', 'time', 'interval', 'pg_backend_pid'])
+
+def _is_read_only_query(query: str) -> bool:
+    '''is the query a single plain SELECT, which does not need to run in a transaction?
+    A SELECT which locks rows, or which calls any other function than the common builtin ones, is not read-only.
+    Callers which know better can pass read_only explicitly to PostgresDatabaseConnection.executeQuery.'''
+    if (re.match(r'\s*select\b', query, re.IGNORECASE) is None or
+        re.search(r'\bfor\s+(no\s+key\s+)?(update|share|key\s+share)\b', query, re.IGNORECASE) is not None or
+        re.search(r';\s*\S', query) is not None):
+        return False
+
+    # ignore anything within string literals, like 'foo(bar)'
+    query = re.sub(r"'(?:[^']|'')*'", "''", query)
+
+    for match in re.finditer(r'([A-Za-z_][\w$]*(?:\s*\.\s*[A-Za-z_][\w$]*)*)\s*\(', query):
+        function_name = match.group(1)
+        if '.' in function_name or function_name.lower() not in _READ_ONLY_SQL_FUNCTIONS:
+            # a (schema qualified) user defined function
+            return False
+    return True
+
+def _is_explainable_query(query: str) -> bool:
+    '''is the query a single statement which can be EXPLAINed?'''
+    return (re.match(r'\s*(select|insert|update|delete|values|with)\b', query, re.IGNORECASE) is not None and
+            re.search(r';\s*\S', query) is None)
+
+
+class _PooledConnection(psycopg2.extensions.connection):
+    '''a psycopg2 connection which remembers the server-side prepared statements of its session'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = {} # mapping of query to (statement_name, nr_of_parameters) tuple, or None if it cannot be prepared
+        self.uncommitted_changes = False # did the open transaction execute any (possibly) data changing statements or locks?
+
+
+class PostgresConnectionPool:
+    '''
+    A process-wide, thread-safe pool of idle psycopg2 connections per database, so that (short-lived)
+    PostgresDatabaseConnection instances do not pay a full connect and authentication on each connect,
+    and reuse the server-side prepared statements of the connection's session.
+
+    A connection is leased exclusively by one PostgresDatabaseConnection (or one of its threads) at a time.
+    Upon release, any open transaction is rolled back.
+    Connections which were idle for more than health_check_interval seconds are checked with a (cheap) roundtrip
+    to the server before they are leased out again.
+    '''
+    def __init__(self, max_idle_connections_per_database: int=DEFAULT_CONNECTION_POOL_SIZE, health_check_interval: float=5):
+        self.max_idle_connections_per_database = max_idle_connections_per_database
+        self.health_check_interval = health_check_interval
+        self._idle_connections = {} # mapping of database key to list of (connection, released_timestamp) tuples
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(dbcreds: DBCredentials) -> tuple:
+        return (dbcreds.host, dbcreds.port, dbcreds.database, dbcreds.user, dbcreds.password)
+
+    def lease(self, dbcreds: DBCredentials):
+        '''get a healthy idle connection to the given database from the pool, or None if there is none.'''
+        key = self._key(dbcreds)
+        while True:
+            with self._lock:
+                idle_connections = self._idle_connections.get(key)
+                if not idle_connections:
+                    return None
+                # take the most recently used one, which is the most likely to be healthy
+                connection, released_timestamp = idle_connections.pop()
+
+            if self._is_healthy(connection, time.time() - released_timestamp):
+                return connection
+
+            logger.debug("discarding unhealthy pooled connection to database %s", dbcreds.stringWithHiddenPassword())
+            self._close_connection(connection)
+
+    def release(self, dbcreds: DBCredentials, connection):
+        '''give the leased connection back to the pool for reuse, or close it if it is broken or if the pool is full.'''
+        if self.max_idle_connections_per_database > 0 and isinstance(connection, _PooledConnection):
+            try:
+                if connection.closed == 0 and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # do not leak uncommitted changes (or locks) to the next user of this connection
+                    connection.rollback()
+                connection.uncommitted_changes = False
+
+                if self._is_healthy(connection, 0):
+                    with self._lock:
+                        idle_connections = self._idle_connections.setdefault(self._key(dbcreds), [])
+                        if len(idle_connections) < self.max_idle_connections_per_database:
+                            idle_connections.append((connection, time.time()))
+                            return
+            except psycopg2.Error as e:
+                logger.debug("could not release connection into the pool: %s", e)
+
+        self._close_connection(connection)
+
+    def clear(self, dbcreds: DBCredentials=None):
+        '''close all idle connections in the pool (to the given database, or to all databases if None)'''
+        with self._lock:
+            keys = [self._key(dbcreds)] if dbcreds is not None else list(self._idle_connections.keys())
+            idle_connections = [connection for key in keys for connection, _ in self._idle_connections.pop(key, [])]
+
+        for connection in idle_connections:
+            self._close_connection(connection)
+
+    def _is_healthy(self, connection, idle_seconds: float) -> bool:
+        try:
+            if connection.closed != 0 or connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                return False
+
+            if idle_seconds > self.health_check_interval:
+                # do a roundtrip to the server, which fails if the server dropped the connection in the mean time.
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1;')
+                if not connection.autocommit:
+                    connection.rollback()
+
+            return True
+        except Exception as e:
+            logger.debug("pooled connection is not healthy: %s", e)
+            return False
+
+    @staticmethod
+    def _close_connection(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug("error while closing connection: %s", e)
+
+# the process-wide connection pool, used by all PostgresDatabaseConnection instances
+connection_pool = PostgresConnectionPool()
+
+
+# only the fingerprints of queries shorter than this are cached. Longer queries, like large inserts with inline values,
+# are hardly ever executed twice with the same text, and would only keep (many MB's of) dead query strings alive in the cache.
+MAX_CACHED_FINGERPRINT_QUERY_LENGTH = 4096
+
+def fingerprint_query(query: str) -> str:
+    '''normalize the query text to a fingerprint which is the same for all executions of the 'same' query,
+    by replacing the literals and parameter placeholders by '?', collapsing value lists and whitespace.
+    Example: "SELECT * FROM foo WHERE id IN (1, 2, 3) AND bar = 'x';" -> "SELECT * FROM foo WHERE id IN (?, ...) AND bar = ?"
+    '''
+    if len(query) < MAX_CACHED_FINGERPRINT_QUERY_LENGTH:
+        return _cached_fingerprint_query(query)
+    return _fingerprint_query(query)
+
+@functools.lru_cache(maxsize=1024)
+def _cached_fingerprint_query(query: str) -> str:
+    return _fingerprint_query(query)
+
+def _fingerprint_query(query: str) -> str:
+    fingerprint = re.sub(r"'(?:[^']|'')*'", '?', query)                  # string literals
+    fingerprint = re.sub(r'%\(\w+\)s|%s|\$\d+', '?', fingerprint)          # parameter placeholders
+    fingerprint = re.sub(r'\b\d+(\.\d+)?\b', '?', fingerprint)              # numeric literals
+    fingerprint = re.sub(r'\(\s*\?(\s*,\s*\?)+\s*\)', '(?, ...)', fingerprint)  # value lists
+    fingerprint = re.sub(r'(\(\?, \.\.\.\))(\s*,\s*\(\?, \.\.\.\))+', r'\1, ...', fingerprint) # multi row values
+    return ' '.join(fingerprint.split()).rstrip(';').strip()
+
+
+class _QueryStats:
+    '''the statistics of all executions of the queries with the same fingerprint. Access is serialized by the QueryProfiler.'''
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.retries = 0
+        self.reconnects = 0
+        self.explain = None
+        self.last_explain_timestamp = None
+        self._recent_times = collections.deque(maxlen=reservoir_size)
+
+    def as_dict(self) -> dict:
+        recent_times = sorted(self._recent_times)
+        def _percentile(percentile):
+            if not recent_times:
+                return None
+            return recent_times[min(len(recent_times)-1, int(round(percentile/100.0*(len(recent_times)-1))))]
+
+        return {'count': self.count,
+                'total_time': self.total_time,
+                'mean_time': self.total_time/self.count if self.count else None,
+                'p50_time': _percentile(50),
+                'p95_time': _percentile(95),
+                'max_time': self.max_time,
+                'rows': self.rows,
+                'retries': self.retries,
+                'reconnects': self.reconnects,
+                'explain': self.explain}
+
+
+class QueryProfiler:
+    '''
+    A process-wide, thread-safe profile of all queries executed by the PostgresDatabaseConnection instances,
+    aggregated per query fingerprint (see fingerprint_query): the call count, total/p50/p95/max latency in seconds,
+    the number of rows returned (or affected), and the number of retries and reconnects due to connection errors.
+
+    When explain_threshold (in seconds) is set, then the 'EXPLAIN' plan of a query which took longer than
+    explain_threshold is captured, at most once per explain_interval seconds per fingerprint, because it costs an extra
+    roundtrip and planning. The query is not executed again, so the plan holds the planner's estimates, not actual timings.
+
+    Use the process-wide 'query_profiler' instance of this module, for example via query_profiler.snapshot() or
+    query_profiler.format_summary(). Services expose it via their 'get_query_profile' rpc method.
+    '''
+    def __init__(self, reservoir_size: int=1024, max_fingerprints: int=1000, explain_interval: float=3600):
+        self.enabled = os.environ.get('LOFAR_POSTGRES_QUERY_PROFILER', 'true').lower() not in ('0', 'false', 'no', 'off')
+        explain_threshold = os.environ.get('LOFAR_POSTGRES_EXPLAIN_THRESHOLD')
+        self.explain_threshold = float(explain_threshold) if explain_threshold else None
+        self.explain_interval = explain_interval
+        self.reservoir_size = reservoir_size
+        self.max_fingerprints = max_fingerprints
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        '''clear all query statistics'''
+        with self._lock:
+            self._stats = {}
+            self._start_timestamp = time.time()
+
+    def _get_stats(self, query: str) -> _QueryStats:
+        fingerprint = fingerprint_query(query)
+        stats = self._stats.get(fingerprint)
+        if stats is None:
+            if len(self._stats) >= self.max_fingerprints:
+                # prevent unbounded growth for (badly written) queries with many distinct fingerprints
+                fingerprint = '<other>'
+                stats = self._stats.get(fingerprint)
+            if stats is None:
+                stats = self._stats[fingerprint] = _QueryStats(self.reservoir_size)
+        return stats
+
+    def record(self, query: str, elapsed: float, rows: int):
+        '''record one execution of the query which took elapsed seconds and returned (or affected) the given number of rows'''
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._get_stats(query)
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.rows += max(rows or 0, 0)
+            stats._recent_times.append(elapsed)
+
+    def add_rows(self, query: str, rows: int):
+        '''add the rows which were fetched after the recorded execution, like the next batches of a server-side cursor'''
+        if self.enabled and rows:
+            with self._lock:
+                self._get_stats(query).rows += rows
+
+    def record_retry(self, query: str):
+        if self.enabled:
+            with self._lock:
+                self._get_stats(query).retries += 1
+
+    def record_reconnect(self, query: str):
+        if self.enabled:
+            with self._lock:
+                self._get_stats(query).reconnects += 1
+
+    def should_explain(self, query: str, elapsed: float) -> bool:
+        '''should the plan of the query, which took elapsed seconds, be captured? If so, then the capture is accounted for.'''
+        if not self.enabled or self.explain_threshold is None or elapsed < self.explain_threshold:
+            return False
+        with self._lock:
+            stats = self._get_stats(query)
+            now = time.time()
+            if stats.last_explain_timestamp is not None and now - stats.last_explain_timestamp < self.explain_interval:
+                return False
+            stats.last_explain_timestamp = now
+            return True
+
+    def record_explain(self, query: str, elapsed: float, plan: str):
+        with self._lock:
+            self._get_stats(query).explain = {'timestamp': time.time(),
+                                              'query': single_line_with_single_spaces(query),
+                                              'elapsed': elapsed,
+                                              'plan': plan}
+
+    def snapshot(self) -> dict:
+        '''
+        :return dict: a json/pickle-able copy of the profile, with the per fingerprint statistics sorted by their total time, so the 'hot' ones come first.
+        '''
+        with self._lock:
+            queries = [dict(fingerprint=fingerprint, **stats.as_dict()) for fingerprint, stats in self._stats.items()]
+            return {'timestamp': time.time(),
+                    'uptime': time.time() - self._start_timestamp,
+                    'queries': sorted(queries, key=lambda q: -q['total_time'])}
+
+    def format_summary(self, limit: int=20) -> str:
+        '''format a human readable multi-line summary of the limit most time consuming queries'''
+        snapshot = self.snapshot()
+        lines = ['postgres query profile over the last %.1f seconds:' % (snapshot['uptime'],)]
+        for q in snapshot['queries'][:limit]:
+            lines.append('  count=%d mean=%.2fms p50=%.2fms p95=%.2fms max=%.2fms total=%.1fs rows=%d retries=%d reconnects=%d: %s' % (
+                         q['count'], 1000.0*(q['mean_time'] or 0), 1000.0*(q['p50_time'] or 0), 1000.0*(q['p95_time'] or 0),
+                         1000.0*q['max_time'], q['total_time'], q['rows'], q['retries'], q['reconnects'], q['fingerprint']))
+        return '\n'.join(lines)
+
+# the process-wide query profiler, fed by all PostgresDatabaseConnection instances
+query_profiler = QueryProfiler()
+
+
 class PostgresDatabaseConnection:
+    '''
+    A connection to a postgres database, with retries upon connection errors, logging and timing of queries.
+
+    The psycopg2 connection is leased from the process-wide connection_pool upon connect, and released upon disconnect.
+    With connection_per_thread=True, each thread using this instance leases its own connection (and hence has its
+    own transaction), so the instance can be shared by multiple (handler) threads.
+    With auto_commit_selects=True, the connection is in autocommit mode outside of transactions, so plain SELECTs
+    do not leave the connection idle in transaction on the server (without an extra commit roundtrip per SELECT).
+    Any other query starts a transaction, which lasts until commit() or rollback().
+    '''
     def __init__(self,
                  dbcreds: DBCredentials,
                  auto_commit_selects: bool=False,
                  num_connect_retries: int=5,
                  connect_retry_interval: float=1.0,
-                 query_timeout: float=3600):
+                 query_timeout: float=3600,
+                 use_connection_pool: bool=True,
+                 connection_per_thread: bool=False):
         self._dbcreds = dbcreds
-        self._connection = None
-        self._cursor = None
         self.__auto_commit_selects = auto_commit_selects
         self.__num_connect_retries = num_connect_retries
         self.__connect_retry_interval = connect_retry_interval
         self.__query_timeout = query_timeout
+        self.__use_connection_pool = use_connection_pool
+        self.__connection_per_thread = connection_per_thread
+        self.__leases = {} # mapping of thread id (or None if not connection_per_thread) to (connection, cursor) tuple
+        self.__leases_lock = Lock()
+
+    def _lease_key(self):
+        return get_ident() if self.__connection_per_thread else None
+
+    @property
+    def _connection(self):
+        '''the psycopg2 connection (for the current thread if connection_per_thread)'''
+        lease = self.__leases.get(self._lease_key())
+        return lease[0] if lease is not None else None
+
+    @property
+    def _cursor(self):
+        '''the psycopg2 cursor (for the current thread if connection_per_thread)'''
+        lease = self.__leases.get(self._lease_key())
+        return lease[1] if lease is not None else None
 
     def connect_if_needed(self):
         if not self.is_connected:
@@ -131,32 +504,50 @@ class PostgresDatabaseConnection:
             logger.debug("already connected to database: %s", self)
             return
 
+        # drop our (broken) connection, if any
+        self._release_lease(self._lease_key(), reusable=False)
+
+        if self.__connection_per_thread:
+            self._release_leases_of_finished_threads()
+
+        connection = connection_pool.lease(self._dbcreds) if self.__use_connection_pool else None
+        if connection is not None:
+            logger.debug("reusing pooled connection to database: %s", self)
+        else:
+            connection = self._connect_with_retries()
+
+        connection.autocommit = self.__auto_commit_selects
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        with self.__leases_lock:
+            self.__leases[self._lease_key()] = (connection, cursor)
+
+    def _connect_with_retries(self):
         for retry_cntr in range(self.__num_connect_retries+1):
             try:
                 logger.debug("connecting to database: %s", self)
 
-                self._connection = psycopg2.connect(host=self._dbcreds.host,
-                                                    user=self._dbcreds.user,
-                                                    password=self._dbcreds.password,
-                                                    database=self._dbcreds.database,
-                                                    port=self._dbcreds.port,
-                                                    connect_timeout=5)
-
-                if self._connection:
-                    self._cursor = self._connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                connection = psycopg2.connect(host=self._dbcreds.host,
+                                              user=self._dbcreds.user,
+                                              password=self._dbcreds.password,
+                                              database=self._dbcreds.database,
+                                              port=self._dbcreds.port,
+                                              connect_timeout=5,
+                                              connection_factory=_PooledConnection)
 
+                if connection:
                     logger.info("connected to database: %s", self)
 
                     # see http://initd.org/psycopg/docs/connection.html#connection.notices
                     # try to set the notices attribute with a non-list collection,
                     # so we can log more than 50 messages. Is only available since 2.7, so encapsulate in try/except.
                     try:
-                        self._connection.notices = collections.deque()
+                        connection.notices = collections.deque()
                     except TypeError:
-                        logger.warning("Cannot overwrite self._connection.notices with a deque... only max 50 notifications available per query. (That's ok, no worries.)")
+                        logger.warning("Cannot overwrite connection.notices with a deque... only max 50 notifications available per query. (That's ok, no worries.)")
 
                     # we have a proper connection, so return
-                    return
+                    return connection
             except psycopg2.DatabaseError as dbe:
                 error_string = single_line_with_single_spaces(dbe)
                 logger.error(error_string)
@@ -173,19 +564,42 @@ class PostgresDatabaseConnection:
                     raise PostgresDBError(error_string)
 
     def disconnect(self):
-        if self._connection is not None or self._cursor is not None:
-            logger.debug("disconnecting from database: %s", self)
+        '''release the connection(s) of this instance (of all threads if connection_per_thread) back into the pool'''
+        with self.__leases_lock:
+            lease_keys = list(self.__leases.keys())
 
-            if self._cursor is not None:
-                self._cursor.close()
-                self._cursor = None
+        if lease_keys:
+            logger.debug("disconnecting from database: %s", self)
 
-            if self._connection is not None:
-                self._connection.close()
-                self._connection = None
+            for lease_key in lease_keys:
+                self._release_lease(lease_key)
 
             logger.info("disconnected from database: %s", self)
 
+    def _release_lease(self, lease_key, reusable: bool=True):
+        with self.__leases_lock:
+            lease = self.__leases.pop(lease_key, None)
+
+        if lease is not None:
+            connection, cursor = lease
+            try:
+                cursor.close()
+            except Exception as e:
+                logger.debug("error while closing cursor: %s", e)
+
+            if self.__use_connection_pool and reusable:
+                connection_pool.release(self._dbcreds, connection)
+            else:
+                connection_pool._close_connection(connection)
+
+    def _release_leases_of_finished_threads(self):
+        alive_thread_ids = set(t.ident for t in enumerate_threads())
+        with self.__leases_lock:
+            finished_thread_ids = [thread_id for thread_id in self.__leases.keys() if thread_id not in alive_thread_ids]
+
+        for thread_id in finished_thread_ids:
+            self._release_lease(thread_id)
+
     def _is_recoverable_connection_error(self, error: psycopg2.DatabaseError) -> bool:
         '''test if psycopg2.DatabaseError is a recoverable connection error'''
         if isinstance(error, psycopg2.OperationalError) and re.search('connection', str(error), re.IGNORECASE):
@@ -218,7 +632,10 @@ class PostgresDatabaseConnection:
 
     def reconnect(self):
         logger.info("reconnecting %s", self)
-        self.disconnect()
+        # do not give our (probably broken) connection back to the pool,
+        # and drop the other idle connections to this database as well, which are probably broken too.
+        self._release_lease(self._lease_key(), reusable=False)
+        connection_pool.clear(self._dbcreds)
         self.connect()
 
     def __enter__(self):
@@ -237,36 +654,222 @@ class PostgresDatabaseConnection:
             line = line % tuple(['\'%s\'' % a if isinstance(a, str) else a for a in qargs])
         return line
 
-    def executeQuery(self, query, qargs=None, fetch=FETCH_NONE):
+    def executeQuery(self, query, qargs=None, fetch=FETCH_NONE, prepare=False, read_only: bool=None):
+        '''execute the query with the (optional) qargs, and fetch the results.
+        :param prepare: if True, then execute the query as a server-side prepared statement, which is parsed and planned
+                        only once per connection. Use it for frequently executed queries with the same query text.
+        :param read_only: does the query only read data? Read-only queries do not start a transaction (with auto_commit_selects).
+                          None means: derive it from the query, in which only plain SELECTs without user defined functions are read-only.
+                          Pass True for a SELECT of a function which is known to only read data.
+        '''
+        if read_only is None:
+            read_only = _is_read_only_query(query)
+        return self._execute_with_reconnect(lambda: self._do_execute_query(query, qargs, fetch, prepare, read_only),
+                                            lambda: self._queryAsSingleLine(query, qargs), query)
+
+    def executeValuesQuery(self, query, values, template=None, page_size=DEFAULT_VALUES_PAGE_SIZE, fetch=FETCH_NONE):
+        '''execute a bulk query with a single 'VALUES %s' placeholder, like 'INSERT INTO foo (a, b) VALUES %s RETURNING id;',
+        for the given list of value tuples, using psycopg2.extras.execute_values.
+        The values are sent in statements of at most page_size rows each, which is much faster than executing
+        one statement per row (executemany), and prevents building and parsing one huge query string.
+        :param query: the query with a single %s placeholder for the VALUES
+        :param values: list of value tuples (or dicts, if the template uses named placeholders)
+        :param template: optional template for each row, like '(%s, %s, now())'. Default: '(%s, %s, ...)'
+        :param page_size: the maximum number of rows per statement
+        :param fetch: FETCH_NONE, FETCH_ONE or FETCH_ALL rows returned (by a RETURNING clause) over all pages
+        '''
+        return self._execute_with_reconnect(lambda: self._do_execute_values_query(query, values, fetch, template, page_size),
+                                            lambda: self._queryAsSingleLine(query), query)
+
+    def executeQueryIter(self, query, qargs=None, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+        '''execute the (select) query with a server-side cursor, and yield the resulting rows as dicts,
+        fetching batch_size rows per roundtrip. In contrast to executeQuery with FETCH_ALL, the result set
+        is not transferred and stored in the client's memory as a whole, so use it for (very) large results.
+        Connection errors are only retried before the first row is yielded.
+        Do not use the connection (in the same thread) for other queries while iterating.
+        '''
+        for rows in self._iter_server_side_cursor(query, qargs, batch_size, psycopg2.extras.RealDictCursor):
+            for row in rows:
+                yield dict(row)
+
+    def executeQueryColumns(self, query, qargs=None, batch_size=DEFAULT_FETCH_BATCH_SIZE, as_numpy=False):
+        '''execute the (select) query with a server-side cursor, and return the result column-wise,
+        without creating a dict per row like executeQuery does.
+        :param as_numpy: if True, return a numpy array per column (datetime columns as datetime64[us]), else a tuple per column.
+        :return: an (ordered) dict of column_name -> tuple or numpy array of all the values of that column.
+        '''
+        if as_numpy:
+            try:
+                # import numpy here and not at top of file, so anybody can use this module, but is not forced into having numpy.
+                import numpy as np
+            except ImportError:
+                raise PostgresDBError("Cannot return the query result as numpy arrays without numpy. Please install numpy.")
+
+        column_names = None
+        columns = None
+        for rows in self._iter_server_side_cursor(query, qargs, batch_size, psycopg2.extensions.cursor,
+                                                  yield_description=True):
+            if column_names is None:
+                # the first item is the cursor description
+                column_names = [column[0] for column in rows]
+                columns = [[] for _ in column_names]
+                continue
+
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+
+        if as_numpy:
+            def _to_numpy(values):
+                if values and all(isinstance(v, datetime) for v in values):
+                    return np.array(values, dtype='datetime64[us]')
+                return np.array(values)
+            columns = [_to_numpy(column) for column in columns]
+        else:
+            columns = [tuple(column) for column in columns]
+
+        return collections.OrderedDict(zip(column_names, columns))
+
+    def _iter_server_side_cursor(self, query, qargs, batch_size, cursor_factory, yield_description=False):
+        '''execute the query with a named (server-side) cursor, and yield the rows in batches of batch_size.'''
+        query_log_line = self._queryAsSingleLine(query, qargs)
+        cursor, rows, opened_transaction = self._execute_with_reconnect(lambda: self._do_open_server_side_cursor(query, qargs, batch_size,
+                                                                                                                   cursor_factory, query_log_line),
+                                                                         lambda: query_log_line, query)
+        try:
+            if yield_description:
+                yield cursor.description or []
+
+            nr_of_rows = 0
+            while rows:
+                nr_of_rows += len(rows)
+                yield rows
+                if len(rows) < batch_size:
+                    break
+                rows = self._do_fetch_server_side_cursor_batch(cursor, batch_size, query_log_line)
+                query_profiler.add_rows(query, len(rows))
+
+            logger.debug('fetched %s rows in batches of %s: %s', nr_of_rows, batch_size, query_log_line)
+        finally:
+            self._close_server_side_cursor(cursor, opened_transaction)
+
+    def _do_open_server_side_cursor(self, query, qargs, batch_size, cursor_factory, query_log_line):
+        '''declare the named cursor for the query, and fetch the first batch'''
+        try:
+            self.connect_if_needed()
+
+            # a named cursor lives in a transaction, so leave autocommit mode for the duration of the iteration.
+            opened_transaction = self._connection.autocommit
+            if opened_transaction:
+                self._connection.autocommit = False
+
+            # log
+            logger.debug('executing streaming query: %s', query_log_line)
+
+            # execute and fetch the first batch (and time it)
+            start = datetime.utcnow()
+            cursor = self._connection.cursor(name='lofar_cursor_%d' % next(_server_side_cursor_counter),
+                                             cursor_factory=cursor_factory)
+            cursor.execute(query, qargs)
+            rows = cursor.fetchmany(batch_size)
+            elapsed = datetime.utcnow() - start
+            elapsed_ms = 1000.0 * totalSeconds(elapsed)
+
+            # log execution result
+            logger.info('executed streaming query in %.1fms%s yielding a first batch of %s rows: %s', elapsed_ms,
+                                                                                                    ' (SLOW!)' if elapsed_ms > 250 else '', # for easy log grep'ing
+                                                                                                    len(rows),
+                                                                                                    query_log_line)
+            query_profiler.record(query, totalSeconds(elapsed), len(rows))
+
+            # log any notifications from within the database itself
+            self._log_database_notifications()
+
+            return cursor, rows, opened_transaction
+
+        except psycopg2.OperationalError as oe:
+            if self._is_recoverable_connection_error(oe):
+                raise PostgresDBConnectionError("Could not execute query due to connection errors. '%s' error=%s" %
+                                                (query_log_line,
+                                                 single_line_with_single_spaces(oe)))
+            else:
+                self._log_error_rollback_and_raise(oe, query_log_line)
+
+        except Exception as e:
+            self._log_error_rollback_and_raise(e, query_log_line)
+
+    def _do_fetch_server_side_cursor_batch(self, cursor, batch_size, query_log_line):
+        '''fetch the next batch from the named cursor. Connection errors cannot be retried halfway a result, so they are raised.'''
+        try:
+            return cursor.fetchmany(batch_size)
+        except psycopg2.OperationalError as oe:
+            if self._is_recoverable_connection_error(oe):
+                raise PostgresDBConnectionError("Could not fetch query results due to connection errors. '%s' error=%s" %
+                                                (query_log_line,
+                                                 single_line_with_single_spaces(oe)))
+            else:
+                self._log_error_rollback_and_raise(oe, query_log_line)
+
+        except Exception as e:
+            self._log_error_rollback_and_raise(e, query_log_line)
+
+    def _close_server_side_cursor(self, cursor, opened_transaction):
+        try:
+            if not cursor.closed:
+                cursor.close()
+
+            if opened_transaction and self.is_connected:
+                # end our read-only transaction (releasing its snapshot), and return to autocommit mode
+                self._connection.commit()
+                self._connection.autocommit = True
+        except psycopg2.Error as e:
+            logger.warning("error while closing server-side cursor: %s", single_line_with_single_spaces(e))
+
+    def _execute_with_reconnect(self, do_execute, query_log_line, query):
+        '''call do_execute, and reconnect and retry upon connection errors until the query_timeout is reached.
+        A query within a transaction with uncommitted changes is not retried, because the transaction is lost with the connection.'''
         start = datetime.utcnow()
         while True:
+            had_uncommitted_changes = self._has_uncommitted_changes
             try:
-                return self._do_execute_query(query, qargs, fetch)
+                return do_execute()
             except PostgresDBConnectionError as e:
                 logger.warning(e)
+                if had_uncommitted_changes:
+                    # retrying would execute the query without the earlier statements (and locks) of the caller's transaction,
+                    # and outside of it. So, drop the broken connection, and let the caller redo the whole transaction.
+                    self._release_lease(self._lease_key(), reusable=False)
+                    connection_pool.clear(self._dbcreds)
+                    raise PostgresDBConnectionError("%s The transaction with uncommitted changes is lost, so the query is not retried." % e) from e
+
                 if datetime.utcnow() - start < timedelta(seconds=self.__query_timeout):
                     try:
                         # reconnect, log retrying..., and do the retry in the next loop iteration
+                        query_profiler.record_retry(query)
                         self.reconnect()
-                        logger.info("retrying %s", self._queryAsSingleLine(query, qargs))
+                        query_profiler.record_reconnect(query)
+                        logger.info("retrying %s", query_log_line())
                     except PostgresDBConnectionError as ce:
                         logger.warning(ce)
                 else:
                     raise
 
-    def _do_execute_query(self, query, qargs=None, fetch=FETCH_NONE):
+    def _do_execute_query(self, query, qargs=None, fetch=FETCH_NONE, prepare=False, read_only=False):
         '''execute the query and reconnect upon OperationalError'''
         query_log_line = self._queryAsSingleLine(query, qargs)
 
         try:
             self.connect_if_needed()
+            self._begin_transaction_if_needed(read_only)
 
             # log
             logger.debug('executing query: %s', query_log_line)
 
             # execute (and time it)
             start = datetime.utcnow()
-            self._cursor.execute(query, qargs)
+            if prepare:
+                self._execute_prepared_statement(query, qargs)
+            else:
+                self._cursor.execute(query, qargs)
             elapsed = datetime.utcnow() - start
             elapsed_ms = 1000.0 * totalSeconds(elapsed)
 
@@ -279,14 +882,72 @@ class PostgresDatabaseConnection:
             # log any notifications from within the database itself
             self._log_database_notifications()
 
-            self._commit_selects_if_needed(query)
-
-            # fetch and return results
+            # fetch results
             if fetch == FETCH_ONE:
                 row = self._cursor.fetchone()
-                return dict(row) if row is not None else None
+                result = dict(row) if row is not None else None
+            elif fetch == FETCH_ALL:
+                result = [dict(row) for row in self._cursor.fetchall() if row is not None]
+            else:
+                result = []
+
+            self._mark_uncommitted_changes_if_needed(read_only)
+
+            # profile
+            query_profiler.record(query, totalSeconds(elapsed), self._cursor.rowcount)
+            if _is_explainable_query(query) and query_profiler.should_explain(query, totalSeconds(elapsed)):
+                self._capture_explain(query, qargs, totalSeconds(elapsed))
+
+            return result
+
+        except psycopg2.OperationalError as oe:
+            if self._is_recoverable_connection_error(oe):
+                raise PostgresDBConnectionError("Could not execute query due to connection errors. '%s' error=%s" %
+                                                (query_log_line,
+                                                 single_line_with_single_spaces(oe)))
+            else:
+                self._log_error_rollback_and_raise(oe, query_log_line)
+
+        except Exception as e:
+            self._log_error_rollback_and_raise(e, query_log_line)
+
+    def _do_execute_values_query(self, query, values, fetch=FETCH_NONE, template=None, page_size=DEFAULT_VALUES_PAGE_SIZE):
+        '''execute the bulk values query and reconnect upon OperationalError'''
+        query_log_line = '%s [with %d values in pages of %d]' % (self._queryAsSingleLine(query), len(values), page_size)
+
+        try:
+            self.connect_if_needed()
+            self._begin_transaction_if_needed(_is_read_only_query(query))
+
+            # log
+            logger.debug('executing values query: %s', query_log_line)
+
+            # execute (and time it)
+            start = datetime.utcnow()
+            rows = psycopg2.extras.execute_values(self._cursor, query, values,
+                                                  template=template, page_size=page_size,
+                                                  fetch=fetch != FETCH_NONE)
+            elapsed = datetime.utcnow() - start
+            elapsed_ms = 1000.0 * totalSeconds(elapsed)
+
+            # log execution result
+            logger.info('executed values query in %.1fms%s for %s rows: %s', elapsed_ms,
+                                                                            ' (SLOW!)' if elapsed_ms > 250 else '', # for easy log grep'ing
+                                                                            len(values),
+                                                                            query_log_line)
+
+            # log any notifications from within the database itself
+            self._log_database_notifications()
+
+            self._mark_uncommitted_changes_if_needed(_is_read_only_query(query))
+
+            query_profiler.record(query, totalSeconds(elapsed), len(values))
+
+            # return results
+            if fetch == FETCH_ONE:
+                return dict(rows[0]) if rows else None
             if fetch == FETCH_ALL:
-                return [dict(row) for row in self._cursor.fetchall() if row is not None]
+                return [dict(row) for row in rows if row is not None]
             return []
 
         except psycopg2.OperationalError as oe:
@@ -300,6 +961,32 @@ class PostgresDatabaseConnection:
         except Exception as e:
             self._log_error_rollback_and_raise(e, query_log_line)
 
+    def _capture_explain(self, query, qargs, elapsed: float):
+        '''get the plan of the slow query with EXPLAIN, and record it in the query_profiler.
+        A plain EXPLAIN (without ANALYZE) only plans the query, and does not execute it (again).'''
+        # a failing EXPLAIN aborts the current transaction, so guard it by a savepoint when we're in a transaction
+        in_transaction = self._connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            with self._connection.cursor() as cursor:
+                if in_transaction:
+                    cursor.execute('SAVEPOINT lofar_explain;')
+                cursor.execute('EXPLAIN ' + query, qargs)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                if in_transaction:
+                    cursor.execute('RELEASE SAVEPOINT lofar_explain;')
+
+            logger.info('captured plan of slow query (%.1fms): %s\n%s', 1000.0*elapsed, self._queryAsSingleLine(query, qargs), plan)
+            query_profiler.record_explain(query, elapsed, plan)
+        except psycopg2.DatabaseError as e:
+            logger.warning("could not capture the plan of query %s error=%s",
+                           self._queryAsSingleLine(query, qargs), single_line_with_single_spaces(e))
+            if in_transaction:
+                try:
+                    with self._connection.cursor() as cursor:
+                        cursor.execute('ROLLBACK TO SAVEPOINT lofar_explain;')
+                except psycopg2.Error:
+                    pass
+
     def _log_error_rollback_and_raise(self, e: Exception, query_log_line: str):
         self._log_database_notifications()
         error_string = single_line_with_single_spaces(e)
@@ -312,10 +999,73 @@ class PostgresDatabaseConnection:
             # wrap original error in PostgresDBQueryExecutionError
             raise PostgresDBQueryExecutionError("Could not execute query '%s' error=%s" % (query_log_line, error_string))
 
-    def _commit_selects_if_needed(self, query):
-        if self.__auto_commit_selects and re.search('select', query, re.IGNORECASE):
-            # prevent dangling in idle transaction on server
-            self.commit()
+    def _begin_transaction_if_needed(self, read_only: bool):
+        if self.__auto_commit_selects and self._connection.autocommit and not read_only:
+            # plain selects run in autocommit mode, preventing dangling in idle transaction on server.
+            # any other query starts a transaction (psycopg2 issues the BEGIN), which lasts until commit/rollback.
+            self._connection.autocommit = False
+
+    def _end_transaction(self):
+        self._connection.uncommitted_changes = False
+        if self.__auto_commit_selects:
+            self._connection.autocommit = True
+
+    def _mark_uncommitted_changes_if_needed(self, read_only: bool):
+        if not read_only and not self._connection.autocommit:
+            self._connection.uncommitted_changes = True
+
+    @property
+    def _has_uncommitted_changes(self) -> bool:
+        return self.is_connected and getattr(self._connection, 'uncommitted_changes', False)
+
+    def _execute_prepared_statement(self, query, qargs=None):
+        '''execute the query as a server-side prepared statement. The statement is prepared upon first use on the
+        connection. Queries which cannot be prepared are executed normally.'''
+        prepared_statements = getattr(self._connection, 'prepared_statements', None)
+        if prepared_statements is None:
+            self._cursor.execute(query, qargs)
+            return
+
+        if query not in prepared_statements:
+            prepared_statements[query] = self._prepare_statement(query, 'lofar_stmt_%d' % (len(prepared_statements)+1,))
+
+        prepared_statement = prepared_statements[query]
+        if prepared_statement is None or prepared_statement[1] != len(qargs or []):
+            self._cursor.execute(query, qargs)
+            return
+
+        statement_name, nr_of_parameters = prepared_statement
+        if nr_of_parameters:
+            self._cursor.execute('EXECUTE %s (%s);' % (statement_name, ', '.join(['%s']*nr_of_parameters)), qargs)
+        else:
+            self._cursor.execute('EXECUTE %s;' % (statement_name,))
+
+    def _prepare_statement(self, query, statement_name):
+        '''prepare the query on the server with the given statement_name.
+        :return: tuple (statement_name, nr_of_parameters), or None if the query cannot be prepared.'''
+        positional_query = _to_positional_parameters(query)
+        if positional_query is None:
+            return None
+
+        # a failing PREPARE aborts the current transaction, so guard it by a savepoint when we're in a transaction
+        in_transaction = self._connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            if in_transaction:
+                self._cursor.execute('SAVEPOINT lofar_prepare;')
+            self._cursor.execute('PREPARE %s AS %s' % (statement_name, positional_query[0].strip().rstrip(';')))
+            if in_transaction:
+                self._cursor.execute('RELEASE SAVEPOINT lofar_prepare;')
+            return statement_name, positional_query[1]
+        except psycopg2.OperationalError:
+            raise
+        except psycopg2.DatabaseError as e:
+            logger.warning("cannot prepare query, executing it unprepared: %s error=%s",
+                           self._queryAsSingleLine(query), single_line_with_single_spaces(e))
+            if in_transaction:
+                self._cursor.execute('ROLLBACK TO SAVEPOINT lofar_prepare;')
+            elif not self._connection.autocommit:
+                self._connection.rollback()
+            return None
 
     def _log_database_notifications(self):
         try:
@@ -333,11 +1083,13 @@ class PostgresDatabaseConnection:
         if self.is_connected:
             logger.info('commit')
             self._connection.commit()
+            self._end_transaction()
 
     def rollback(self):
         if self.is_connected:
             logger.info('rollback')
             self._connection.rollback()
+            self._end_transaction()
 
 
 class PostgresListener(PostgresDatabaseConnection):
@@ -370,8 +1122,9 @@ class PostgresListener(PostgresDatabaseConnection):
     '''
     def __init__(self, dbcreds: DBCredentials):
         '''Create a new PostgresListener'''
+        # the listener's connection is in autocommit mode, and keeps its LISTEN subscriptions, so it's not pooled.
         super(PostgresListener, self).__init__(dbcreds=dbcreds,
-                                               auto_commit_selects=True)
+                                               use_connection_pool=False)
         self.__listening = False
         self.__lock = Lock()
         self.__callbacks = {}
@@ -26,7 +26,7 @@ logger = logging.getLogger(__name__)
 
 import testing.postgresql
 from lofar.common.dbcredentials import Credentials
-from lofar.common.postgres import PostgresDatabaseConnection
+from lofar.common.postgres import PostgresDatabaseConnection, connection_pool
 
 class PostgresTestDatabaseInstance():
     ''' A helper class which instantiates a running postgres server (not interfering with any other test/production postgres servers)
@@ -87,6 +87,8 @@ class PostgresTestDatabaseInstance():
         try:
             if self._postgresql:
                 logger.info('removing test-database instance at %s', self.dbcreds.stringWithHiddenPassword())
+                # close the idle pooled connections, which would otherwise keep the server from shutting down
+                connection_pool.clear(self.dbcreds)
                 self._postgresql.stop()
                 logger.info('test-database instance removed')
         except Exception as e:
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+import tempfile
+import os
+from time import sleep
+from datetime import datetime
+from multiprocessing import Process, Event
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+from lofar.common.h5_utils import *
+from lofar.common.h5_utils import _h5_file_handle_cache
+
+def _hold_file_open_for_writing(path, opened_event, duration):
+    with h5py.File(path, 'r+') as file:
+        opened_event.set()
+        sleep(duration)
+
+class TestSharedH5File(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+        with h5py.File(self.path, 'w') as file:
+            file['foo'] = 42
+
+    def tearDown(self):
+        close_idle_h5_files()
+        os.remove(self.path)
+
+    def test_nested_readers_share_one_handle(self):
+        with SharedH5File(self.path, 'r') as outer_file:
+            with SharedH5File(self.path, 'r') as inner_file:
+                self.assertTrue(outer_file is inner_file)
+                self.assertEqual(42, inner_file['foo'][()])
+
+            # closing the inner SharedH5File should not close the shared handle
+            self.assertEqual(42, outer_file['foo'][()])
+
+    def test_reader_shares_writable_handle(self):
+        with SharedH5File(self.path, 'r+') as writable_file:
+            writable_file['bar'] = 3.14
+            with SharedH5File(self.path, 'r') as read_only_file:
+                self.assertTrue(writable_file is read_only_file)
+                self.assertAlmostEqual(3.14, read_only_file['bar'][()])
+
+    def test_idle_read_handles_are_not_cached_by_default(self):
+        with SharedH5File(self.path, 'r') as file:
+            pass
+        self.assertFalse(bool(file.id.valid))
+
+        # so the file can be opened for writing with plain h5py right away
+        with h5py.File(self.path, 'r+') as file:
+            file['bar'] = 1
+
+    def test_idle_read_handle_is_reused_and_closed_for_writers(self):
+        enable_idle_h5_file_cache()
+        self.addCleanup(enable_idle_h5_file_cache, 0)
+
+        with SharedH5File(self.path, 'r') as file:
+            first_file = file
+
+        with SharedH5File(self.path, 'r') as file:
+            self.assertTrue(first_file is file)
+
+        # opening the file for writing should close the idle read handle
+        with SharedH5File(self.path, 'r+', timeout=5) as file:
+            self.assertFalse(first_file is file)
+            self.assertFalse(bool(first_file.id.valid))
+            file['bar'] = 1
+
+        with SharedH5File(self.path, 'r') as file:
+            self.assertEqual(1, file['bar'][()])
+
+    def test_idle_handles_are_closed_after_timeout(self):
+        enable_idle_h5_file_cache(max_idle_seconds=0.2)
+        self.addCleanup(enable_idle_h5_file_cache, 0)
+
+        for _ in range(5):
+            with SharedH5File(self.path, 'r') as file:
+                pass
+
+        # reusing the idle handle multiple times should not result in multiple eviction timers
+        self.assertEqual(1, len([t for t in threading.enumerate() if t is _h5_file_handle_cache._eviction_timer]))
+        self.assertEqual(1, len([t for t in threading.enumerate() if isinstance(t, threading.Timer) and t.is_alive()]))
+
+        sleep(0.5)
+        self.assertFalse(bool(file.id.valid))
+        self.assertIsNone(_h5_file_handle_cache._eviction_timer)
+
+    def test_retries_are_delayed_when_lock_probe_fails(self):
+        with mock.patch('lofar.common.h5_utils.h5py.File', side_effect=IOError("mocked open error")) as mocked_open, \
+             mock.patch('lofar.common.h5_utils._wait_for_file_lock_release', return_value=False):
+            with self.assertRaises(IOError):
+                SharedH5File(self.path, 'r', timeout=0.5).open()
+
+            # with a backoff starting at 10ms, there should only be a handful of attempts in 0.5 seconds
+            self.assertLess(mocked_open.call_count, 10)
+
+    def test_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            SharedH5File(self.path + '.does_not_exist', 'r').open()
+
+    def test_wait_until_other_process_releases_file(self):
+        opened_event = Event()
+        writer = Process(target=_hold_file_open_for_writing, args=(self.path, opened_event, 1.0))
+        writer.start()
+        try:
+            self.assertTrue(opened_event.wait(10))
+            start = datetime.utcnow()
+
+            with SharedH5File(self.path, 'r', timeout=10) as file:
+                waited = (datetime.utcnow() - start).total_seconds()
+                self.assertEqual(42, file['foo'][()])
+
+            # we should have been able to open the file shortly after the writer released it.
+            logger.info('waited %.3f seconds for the file to become available', waited)
+            self.assertLess(waited, 2.0)
+        finally:
+            writer.join()
+
+def main(argv):
+    unittest.main()
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    # run all tests
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,2 @@
+#!/bin/sh
+./runctest.sh t_h5_utils
@@ -3,6 +3,7 @@
 import unittest
 from unittest import mock
 from lofar.common.postgres import *
+from lofar.common.postgres import _is_read_only_query
 from lofar.common.testing.postgres import PostgresTestDatabaseInstance, PostgresTestMixin
 import psycopg2
 import signal
@@ -96,6 +97,25 @@ class TestPostgres(MyPostgresTestMixin, unittest.TestCase):
             self.assertEqual([{'id':1, 'bar': 'my_value'}], result2)
             self.assertTrue(db.reconnect_was_called)
 
+    def test_no_retry_upon_connection_loss_in_transaction_with_changes(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds) as db:
+            db.executeQuery("INSERT INTO foo (bar) VALUES ('lost_value');")
+            pid = db.executeQuery("SELECT * FROM pg_backend_pid();", fetch=FETCH_ONE)['pg_backend_pid']
+
+            # kill the session of db, and with it the open transaction with the uncommitted insert
+            with PostgresDatabaseConnection(dbcreds=self.dbcreds) as other_db:
+                other_db.executeQuery("SELECT pg_terminate_backend(%s);", (pid,), fetch=FETCH_ALL)
+                other_db.commit()
+
+            # the second insert should not be retried in a new connection, without the lost first insert
+            with mock.patch.object(db, 'reconnect', wraps=db.reconnect) as reconnect:
+                with self.assertRaises(PostgresDBConnectionError):
+                    db.executeQuery("INSERT INTO foo (bar) VALUES ('other_value');")
+                reconnect.assert_not_called()
+
+            # the next query reconnects, and starts a new transaction
+            self.assertEqual([], db.executeQuery("SELECT * FROM foo WHERE bar in ('lost_value', 'other_value');", fetch=FETCH_ALL))
+
     def test_handling_of_database_exceptions(self):
         with PostgresDatabaseConnection(dbcreds=self.dbcreds) as db:
 
@@ -109,6 +129,196 @@ class TestPostgres(MyPostgresTestMixin, unittest.TestCase):
             with self.assertRaises(PostgresDBQueryExecutionError):
                 db.executeQuery("SELECT * FROM error_func();")
 
+    def test_connection_is_reused_from_pool(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds) as db:
+            backend_pid = db.executeQuery("SELECT pg_backend_pid() as pid;", fetch=FETCH_ONE)['pid']
+
+        # a new PostgresDatabaseConnection should reuse the released connection
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds) as db:
+            self.assertEqual(backend_pid, db.executeQuery("SELECT pg_backend_pid() as pid;", fetch=FETCH_ONE)['pid'])
+
+        # unless the pool is not used
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds, use_connection_pool=False) as db:
+            self.assertNotEqual(backend_pid, db.executeQuery("SELECT pg_backend_pid() as pid;", fetch=FETCH_ONE)['pid'])
+
+    def test_connection_per_thread(self):
+        from threading import Thread
+
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds, connection_per_thread=True) as db:
+            backend_pids = [db.executeQuery("SELECT pg_backend_pid() as pid;", fetch=FETCH_ONE)['pid']]
+
+            def get_backend_pid():
+                backend_pids.append(db.executeQuery("SELECT pg_backend_pid() as pid;", fetch=FETCH_ONE)['pid'])
+
+            thread = Thread(target=get_backend_pid)
+            thread.start()
+            thread.join()
+
+            self.assertEqual(2, len(backend_pids))
+            self.assertNotEqual(backend_pids[0], backend_pids[1])
+
+    def test_prepared_statement(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds) as db:
+            db.executeQuery("INSERT INTO foo (bar) VALUES ('prepared_value');")
+            db.commit()
+
+            query = "SELECT * FROM foo WHERE bar LIKE 'prepared%%' AND bar = ANY(%s);"
+            result = db.executeQuery(query, (['prepared_value', 'other_value'],), fetch=FETCH_ALL, prepare=True)
+            self.assertEqual(result, db.executeQuery(query, (['prepared_value', 'other_value'],), fetch=FETCH_ALL))
+            self.assertEqual(1, len(result))
+
+            statements_query = "SELECT statement FROM pg_prepared_statements WHERE statement LIKE '%prepared%';"
+            statements = db.executeQuery(statements_query, fetch=FETCH_ALL)
+            self.assertEqual(1, len(statements))
+            self.assertTrue('$1' in statements[0]['statement'])
+
+            # executing it again should reuse the same prepared statement
+            self.assertEqual(result, db.executeQuery(query, (['prepared_value', 'other_value'],), fetch=FETCH_ALL, prepare=True))
+            self.assertEqual(1, len(db.executeQuery(statements_query, fetch=FETCH_ALL)))
+
+    def test_auto_commit_selects_do_not_idle_in_transaction(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds, auto_commit_selects=True) as db:
+            db.executeQuery("SELECT * FROM foo;", fetch=FETCH_ALL)
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE, db._connection.get_transaction_status())
+
+            db.executeQuery("INSERT INTO foo (bar) VALUES ('in_transaction');")
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_INTRANS, db._connection.get_transaction_status())
+
+            # selects within the transaction see the uncommitted insert
+            self.assertEqual(1, len(db.executeQuery("SELECT * FROM foo WHERE bar = 'in_transaction';", fetch=FETCH_ALL)))
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_INTRANS, db._connection.get_transaction_status())
+
+            db.commit()
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE, db._connection.get_transaction_status())
+
+    def test_auto_commit_selects_of_functions_run_in_transaction(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds, auto_commit_selects=True) as db:
+            db.executeQuery("CREATE OR REPLACE FUNCTION insert_foo(_bar text) RETURNS void AS $$ "
+                            "INSERT INTO foo (bar) VALUES (_bar); $$ LANGUAGE SQL;")
+            db.commit()
+
+            # a select of a function might change data, so it runs in a transaction...
+            db.executeQuery("SELECT * FROM insert_foo('via_function');", fetch=FETCH_ALL)
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_INTRANS, db._connection.get_transaction_status())
+            db.rollback()
+            self.assertEqual(0, len(db.executeQuery("SELECT * FROM foo WHERE bar = 'via_function';", fetch=FETCH_ALL)))
+
+            # ...unless the caller tells it is read-only
+            db.executeQuery("SELECT * FROM pg_backend_pid();", fetch=FETCH_ALL)
+            db.executeQuery("SELECT * FROM upper('foo');", fetch=FETCH_ALL, read_only=True)
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE, db._connection.get_transaction_status())
+
+    def test_streaming_and_columnar_results(self):
+        with PostgresDatabaseConnection(dbcreds=self.dbcreds, auto_commit_selects=True) as db:
+            query = "SELECT i as id, 'value_' || i as bar FROM generate_series(1, %s) as i ORDER BY i;"
+            expected = db.executeQuery(query, (2500,), fetch=FETCH_ALL)
+
+            # stream in batches smaller than, and not a multiple of, the number of rows
+            self.assertEqual(expected, list(db.executeQueryIter(query, (2500,), batch_size=1000)))
+            self.assertEqual([], list(db.executeQueryIter(query, (0,))))
+
+            # the streaming should not leave the connection in a transaction
+            self.assertEqual(psycopg2.extensions.TRANSACTION_STATUS_IDLE, db._connection.get_transaction_status())
+
+            columns = db.executeQueryColumns(query, (2500,), batch_size=1000)
+            self.assertEqual(['id', 'bar'], list(columns.keys()))
+            self.assertEqual(tuple(row['id'] for row in expected), columns['id'])
+            self.assertEqual(tuple(row['bar'] for row in expected), columns['bar'])
+
+            self.assertEqual({'id': (), 'bar': ()}, dict(db.executeQueryColumns(query, (0,))))
+
+    def test_query_profiler(self):
+        query_profiler.reset()
+        with mock.patch.object(query_profiler, 'explain_threshold', 0):
+            with PostgresDatabaseConnection(dbcreds=self.dbcreds, auto_commit_selects=True) as db:
+                for i in range(3):
+                    db.executeQuery("SELECT * FROM foo WHERE id = %s;", (i,), fetch=FETCH_ALL)
+
+                # capturing the plan of a 'slow' insert should not execute it again
+                db.executeQuery("INSERT INTO foo (bar) VALUES ('explained');")
+                db.commit()
+                self.assertEqual(1, len(db.executeQuery("SELECT * FROM foo WHERE bar = 'explained';", fetch=FETCH_ALL)))
+
+        profile = query_profiler.snapshot()
+        query_profile = [q for q in profile['queries'] if q['fingerprint'] == 'SELECT * FROM foo WHERE id = ?']
+        self.assertEqual(1, len(query_profile))
+        self.assertEqual(3, query_profile[0]['count'])
+        self.assertEqual(0, query_profile[0]['retries'])
+        self.assertGreaterEqual(query_profile[0]['max_time'], query_profile[0]['p50_time'])
+
+        # the plan of the 'slow' select was captured
+        self.assertTrue('Scan' in query_profile[0]['explain']['plan'])
+
+
+class TestQueryProfiler(unittest.TestCase):
+    def test_fingerprint_query(self):
+        self.assertEqual("SELECT * FROM foo WHERE id IN (?, ...) AND bar = ?",
+                         fingerprint_query("SELECT *  FROM foo\n WHERE id IN (1, 2, 3) AND bar = 'it''s';"))
+        self.assertEqual("SELECT * FROM foo WHERE id = ANY(?) AND starttime >= ?",
+                         fingerprint_query("SELECT * FROM foo WHERE id = ANY(%s) AND starttime >= %(lower_bound)s"))
+        self.assertEqual("INSERT INTO foo (id, bar) VALUES (?, ...), ...",
+                         fingerprint_query("INSERT INTO foo (id, bar) VALUES (1, 'a'), (2, 'b');"))
+
+    def test_fingerprint_of_long_query_is_not_cached(self):
+        long_query = "INSERT INTO foo (id, bar) VALUES %s;" % ', '.join("(%d, 'bar_%d')" % (i, i) for i in range(1000))
+        self.assertGreater(len(long_query), MAX_CACHED_FINGERPRINT_QUERY_LENGTH)
+
+        with mock.patch('lofar.common.postgres._cached_fingerprint_query') as cached_fingerprint_query:
+            self.assertEqual("INSERT INTO foo (id, bar) VALUES (?, ...), ...", fingerprint_query(long_query))
+            cached_fingerprint_query.assert_not_called()
+
+    def test_is_read_only_query(self):
+        self.assertTrue(_is_read_only_query("SELECT * FROM foo WHERE id = ANY(%s);"))
+        self.assertTrue(_is_read_only_query("select min(starttime) as min_starttime, max(endtime) "
+                                            "from resource_allocation.task_view where status_id = ANY(%s);"))
+        self.assertTrue(_is_read_only_query("SELECT * FROM foo WHERE bar = 'rebuild_foo(1)' AND baz IN (1, 2);"))
+
+        # not a select, or a locking select
+        self.assertFalse(_is_read_only_query("INSERT INTO foo (bar) VALUES (1);"))
+        self.assertFalse(_is_read_only_query("SELECT * FROM foo WHERE id = 1 FOR UPDATE;"))
+
+        # multiple statements
+        self.assertFalse(_is_read_only_query("SELECT * FROM foo; DELETE FROM foo;"))
+
+        # selects calling (user defined) functions might change data
+        self.assertFalse(_is_read_only_query("SELECT * from resource_allocation.rebuild_resource_usages_from_claims()"))
+        self.assertFalse(_is_read_only_query("SELECT * from rebuild_resource_usages_from_claims_for_resource(%s)"))
+        self.assertFalse(_is_read_only_query("SELECT id, setval('foo_id_seq', 1) FROM foo;"))
+
+    def test_statistics(self):
+        profiler = QueryProfiler()
+        for i in range(1, 101):
+            profiler.record("SELECT * FROM foo WHERE id = %d;" % i, i/1000.0, 2)
+        profiler.record_retry("SELECT * FROM foo WHERE id = 1;")
+        profiler.record_reconnect("SELECT * FROM foo WHERE id = 1;")
+        profiler.record("UPDATE foo SET bar = 'a';", 10.0, 10)
+
+        queries = profiler.snapshot()['queries']
+        self.assertEqual(2, len(queries))
+
+        # sorted by total time
+        self.assertEqual("UPDATE foo SET bar = ?", queries[0]['fingerprint'])
+
+        select_profile = queries[1]
+        self.assertEqual(100, select_profile['count'])
+        self.assertEqual(200, select_profile['rows'])
+        self.assertEqual(1, select_profile['retries'])
+        self.assertEqual(1, select_profile['reconnects'])
+        self.assertAlmostEqual(0.051, select_profile['p50_time'])
+        self.assertAlmostEqual(0.095, select_profile['p95_time'])
+        self.assertAlmostEqual(0.1, select_profile['max_time'])
+
+    def test_should_explain(self):
+        profiler = QueryProfiler(explain_interval=3600)
+        profiler.explain_threshold = None
+        self.assertFalse(profiler.should_explain("SELECT * FROM foo;", 10))
+
+        profiler.explain_threshold = 1
+        self.assertFalse(profiler.should_explain("SELECT * FROM foo;", 0.5))
+        self.assertTrue(profiler.should_explain("SELECT * FROM foo;", 10))
+        # not again within the explain_interval
+        self.assertFalse(profiler.should_explain("SELECT * FROM foo;", 10))
+
 
 logging.basicConfig(format='%(asctime)s %(process)s %(threadName)s %(levelname)s %(message)s', level=logging.DEBUG)
 
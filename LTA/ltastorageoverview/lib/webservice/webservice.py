@@ -34,6 +34,7 @@ from flask import json
 from lofar.lta.ltastorageoverview import store
 from lofar.common.util import humanreadablesize
 from lofar.common.datetimeutils import monthRanges
+from lofar.common.postgres import query_profiler
 
 logger = logging.getLogger(__name__)
 
@@ -218,6 +219,10 @@ def get_filesInDirectory(dir_id):
     files = {'files': db.filesInDirectory(dir_id)}
     return json.jsonify(files)
 
+@app.route('/rest/query_profile')
+def get_query_profile():
+    return json.jsonify(query_profiler.snapshot())
+
 
 def main():
     from optparse import OptionParser
@@ -51,82 +51,553 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"]="3"
 
 import h5py
 import errno
+import itertools
+import multiprocessing
 import numpy as np
 from time import sleep
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 import logging
 logger = logging.getLogger(__name__)
 
 np.set_printoptions(precision=1)
 
-from lofar.common.h5_utils import SharedH5File
+from lofar.common.h5_utils import SharedH5File, close_idle_h5_files
 
+# the visibilities are processed in chunks of baselines of at most this number of bytes,
+# which bounds the size of the temporary arrays numpy needs for the percentile and scaling computations.
+QUANTIZATION_CHUNK_NBYTES = 64*1024*1024
 
-def write_hypercube(path, saps, parset=None, sas_id=None, wsrta_id=None, do_compress=True, **kwargs):
+# the version of the hypercube files written by this module, and the (older) versions which can still be read.
+HYPERCUBE_VERSION = '1.4'
+SUPPORTED_READ_VERSIONS = ('1.2', '1.3', '1.4')
+
+def _baseline_chunk_slices(array, max_chunk_nbytes=None):
     """
-    write a hypercube of visibility/flagging data for all saps of an observation/pipeline.
+    helper generator yielding slices along the baseline axis (axis 0) of the given array,
+    such that each slice spans at most max_chunk_nbytes bytes (but always at least one baseline).
+    """
+    if max_chunk_nbytes is None:
+        max_chunk_nbytes = QUANTIZATION_CHUNK_NBYTES
+    num_baselines = array.shape[0]
+    # compute the nbytes from the shape and dtype, so this also works for (not yet read) h5py datasets
+    baseline_nbytes = max(1, int(np.prod(array.shape[1:])) * array.dtype.itemsize)
+    chunk_size = max(1, max_chunk_nbytes // baseline_nbytes)
+    for start in range(0, num_baselines, chunk_size):
+        yield slice(start, min(start+chunk_size, num_baselines))
+
+def compute_visibility_scale_factors(visibility_amplitudes_dB, percentile=99.5):
+    """
+    compute the scale factors per baseline per subband per polarization to map the visibilities_dB onto the [-128..127] int8 range.
+    The 99.5 percentile along the time axis is used instead of the max to get rid of spikes.
 
-    :param str path: full path of the resulting h5 file. By convention we advise to use <observation_id>.MS_exctract.h5
-                     where observation_id is L<sas_id> for lofar and WSRTA<wsrta_id> for apertif
-    :param dict saps: each key is the id of a sap, and holds per sap a dict with the following key/value pairs:
+    :param numpy.array visibility_amplitudes_dB: the 4D (baseline, time, subband, polarization) array of 10log10 visibility amplitudes.
+    :param float percentile: the percentile along the time axis which is mapped onto 127.
+    :return numpy.array: 3D (baseline, subband, polarization) float32 array of scale factors,
+                         as stored in the 'visibility_scale_factors' dataset (format 1.4)
+    """
+    scale_factors = np.empty(shape=(visibility_amplitudes_dB.shape[0],
+                                    visibility_amplitudes_dB.shape[2],
+                                    visibility_amplitudes_dB.shape[3]), dtype=np.float32)
 
-                          baselines: [string], list of stationpairs (tuples) (these are the ticks on the baseline axis of the visibilities)
+    for bl_slice in _baseline_chunk_slices(visibility_amplitudes_dB):
+        max_abs_vis = np.maximum(1.0, np.percentile(visibility_amplitudes_dB[bl_slice], percentile, axis=1))
+        scale_factors[bl_slice] = 1.0/(127.0/max_abs_vis)
 
-                          timestamps: [np.double], list of Modified Julian Date (these are the ticks on the time axis of the visibilities)
+    return scale_factors
 
-                          central_frequencies: [np.double], list of central frequencies of the subbands (these are the ticks on the frequency axis of the visibilities)
+def quantize_visibilities(visibilities_dB, scale_factors):
+    """
+    scale the complex visibilities_dB with the inverse scale_factors, and pack the real and imag parts into 2 int8's.
 
-                          subbands: [np.int], list of subbands numbers (each subband has a corresponding central_frequency)
+    :param numpy.array visibilities_dB: the 4D (baseline, time, subband, polarization) array of complex dB visibilities.
+    :param numpy.array scale_factors: the 3D (baseline, subband, polarization) array of scale factors, see compute_visibility_scale_factors
+    :return numpy.array: 5D (baseline, time, subband, polarization, real/imag) int8 array, as stored in the 'visibilities' dataset (format 1.4)
+    """
+    scaled_visibilities = np.empty(visibilities_dB.shape + (2,), dtype=np.int8)
 
-                          polarizations: [string], list of polarization, one up to four, any of 'XX', 'XY', 'YX', 'YY'
+    # broadcast the inverse scale factors along the time axis
+    inverse_scale_factors = (1.0 / scale_factors)[:, np.newaxis, :, :]
 
-                          visibilities: numpy.array, the 4D array of visibilities. In the file these are reduced from doubles to chars by taking the 10.log10 and normalizing the result to fit in the [-128..127] range.
+    for bl_slice in _baseline_chunk_slices(visibilities_dB):
+        scaled_visibilities[bl_slice,:,:,:,0] = inverse_scale_factors[bl_slice]*visibilities_dB[bl_slice].real
+        scaled_visibilities[bl_slice,:,:,:,1] = inverse_scale_factors[bl_slice]*visibilities_dB[bl_slice].imag
 
-                          flagging: numpy.array, the 4D array of flagging booleans.
-    :param parameterset parset: the optional paramaterset with all the settings which were used for this observation/pipeline
-    :param int sas_id: the optional observation/pipeline sas_id (the main id to track lofar observations/pipelines)
-    :param int wsrta_id: the optional observation wsrta_id (the main id to track wsrt apertif observations)
-    :param bool do_compress: compress the visibilities and flagging data (with lzf compression, slower but smaller output size)
-    :param dict kwargs: optional extra arguments
-    :return None
+    return scaled_visibilities
+
+def dequantize_visibilities(normalized_visibilities, scale_factors):
+    """
+    inverse of quantize_visibilities: multiply the stored int8 real and imag parts with the scale_factors,
+    and combine them into complex dB visibilities.
+
+    :param numpy.array normalized_visibilities: 5D (baseline, time, subband, polarization, real/imag) int8 array, as stored in the 'visibilities' dataset
+    :param numpy.array scale_factors: the 3D (baseline, subband, polarization) array of scale factors, as stored in the 'visibility_scale_factors' dataset
+    :return numpy.array: 4D (baseline, time, subband, polarization) complex64 array of dB visibilities
+    """
+    visibilities = np.empty(normalized_visibilities.shape[:-1], dtype=np.complex64)
+
+    # broadcast the scale factors along the time axis
+    scale_factors = scale_factors[:, np.newaxis, :, :]
+    visibilities.real = scale_factors*normalized_visibilities[:,:,:,:,0]
+    visibilities.imag = scale_factors*normalized_visibilities[:,:,:,:,1]
+    return visibilities
+
+def _read_dequantized_visibilities(sap_group, version, hyperslab):
+    """
+    helper method to read the given hyperslab of the visibilities in the sap_group of a hypercube file of the given version,
+    and de-quantize them into complex dB visibilities (as in version 1.4).
+    Files of older versions are de-quantized on the fly, so they can be read without converting (and thus writing) them.
+    For version 1.2 files, the result differs slightly from a converted file, because it skips the re-quantization of the conversion.
     """
-    logger.info('writing hypercube to file: %s', path)
+    scale_factors_ds = sap_group['visibility_scale_factors']
+    normalized_visibilities = hyperslab.read(sap_group['visibilities'], extra_axes=1)
+    scale_factors_shape = (normalized_visibilities.shape[0], normalized_visibilities.shape[2], normalized_visibilities.shape[3])
+
+    if version == '1.4':
+        # scale factors per baseline, per subband, per polarization
+        scale_factors = _Hyperslab((hyperslab.indices[0], hyperslab.indices[2], hyperslab.indices[3]),
+                                   scale_factors_ds.shape).read(scale_factors_ds)
+        return dequantize_visibilities(normalized_visibilities, scale_factors)
+
+    if version == '1.3':
+        # scale factors per subband, per polarization, equal for all baselines
+        scale_factors = _Hyperslab((hyperslab.indices[2], hyperslab.indices[3]), scale_factors_ds.shape).read(scale_factors_ds)
+        return dequantize_visibilities(normalized_visibilities, np.broadcast_to(scale_factors, scale_factors_shape))
+
+    if version == '1.2':
+        # scale factors per subband (and optionally per polarization), equal for all baselines
+        if scale_factors_ds.ndim == 1:
+            scale_factors = _Hyperslab((hyperslab.indices[2],), scale_factors_ds.shape).read(scale_factors_ds)[:, np.newaxis]
+        else:
+            scale_factors = _Hyperslab((hyperslab.indices[2], hyperslab.indices[3]), scale_factors_ds.shape).read(scale_factors_ds)
+        visibilities = dequantize_visibilities(normalized_visibilities, np.broadcast_to(scale_factors, scale_factors_shape))
+
+        # v1.2 stored the (incorrect) 10*log10 of the complex visibilities.
+        # the real part of that is the amplitude in dB, and the imag part is the phase times 10/ln(10).
+        return (visibilities.real * np.exp(1j * (0.1 * np.log(10.0)) * visibilities.imag)).astype(np.complex64)
+
+    raise ValueError('Cannot read version %s' % (version,))
+
+def _compute_min_non_zero_or_nan_abs_value(visibilities, max_chunk_nbytes=None):
+    """
+    helper method to determine the smallest non-zero and non-NaN absolute value in the given visibilities,
+    with a lower bound of 1e-9, or 1e-12 if there are no such values at all.
+    The visibilities are processed in baseline chunks to prevent a full size temporary copy.
+    """
+    chunk_minima = []
+    for bl_slice in _baseline_chunk_slices(visibilities, max_chunk_nbytes):
+        abs_visibilities = np.abs(visibilities[bl_slice])
+        abs_non_zero_or_nan_visibilities = abs_visibilities[(abs_visibilities != 0.0) & ~np.isnan(visibilities[bl_slice])]
+        if abs_non_zero_or_nan_visibilities.size:
+            chunk_minima.append(np.min(abs_non_zero_or_nan_visibilities))
+
+    if not chunk_minima:
+        return 1e-12
+
+    return max(1e-9, min(chunk_minima))
+
+class HypercubeLayout():
+    """
+    Chunk layout and compression profile for the visibilities and flagging datasets in a hypercube h5 file.
+    The best layout depends on how the file is read: per baseline (plots), per subband (clustering), or all at once.
+    See HYPERCUBE_LAYOUTS for the predefined profiles, and the benchmark_hdf5_io script to compare them on your data.
+    """
+    def __init__(self, chunks=None, compression='lzf', compression_opts=None, shuffle=False, max_chunk_nbytes=4*1024*1024):
+        """
+        :param tuple chunks: the chunk shape along the (baseline, time, subband, polarization) axes,
+                             where 0 or None for an axis means the full axis length (shrunk if needed to fit in max_chunk_nbytes).
+                             If chunks is None, then h5py determines the chunk shapes (for compressed datasets only).
+        :param str compression: 'lzf', 'gzip', 'blosc' (needs the optional hdf5plugin package), or None for no compression.
+                                Without compression and explicit chunks the datasets are stored contiguously.
+        :param compression_opts: optional compression options, for example the gzip level (0-9), or the blosc compressor name.
+        :param bool shuffle: apply the hdf5 byte-shuffle filter before compression.
+        :param int max_chunk_nbytes: the maximum number of bytes of a chunk with explicit chunk shape.
+        """
+        self.chunks = tuple(chunks) if chunks is not None else None
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.max_chunk_nbytes = max_chunk_nbytes
+
+    def __repr__(self):
+        return 'HypercubeLayout(chunks=%s, compression=%s, compression_opts=%s, shuffle=%s)' % (
+            self.chunks, self.compression, self.compression_opts, self.shuffle)
+
+    def chunk_shape(self, shape, itemsize):
+        """
+        compute the chunk shape for a dataset with the given (4D) shape and itemsize following this layout's chunks.
+        The full length axes are halved (largest first) until the chunk fits in max_chunk_nbytes.
+        :return tuple: the chunk shape, or None if h5py should determine it.
+        """
+        if self.chunks is None:
+            return None
+
+        chunk_shape = [min(c, length) if c else length for c, length in zip(self.chunks, shape)]
+        chunk_shape = [max(1, c) for c in chunk_shape]
+        shrinkable_axes = [axis for axis, c in enumerate(self.chunks) if not c]
+
+        while int(np.prod(chunk_shape)) * itemsize > self.max_chunk_nbytes:
+            axis = max(shrinkable_axes, key=lambda a: chunk_shape[a], default=None)
+            if axis is None or chunk_shape[axis] <= 1:
+                break
+            chunk_shape[axis] = (chunk_shape[axis] + 1) // 2
+
+        return tuple(chunk_shape)
+
+    def dataset_kwargs(self, shape, dtype, chunks=None):
+        """
+        :param tuple shape: the shape of the dataset, which is 4D (baseline, time, subband, polarization) plus optional extra axes
+                            which are never split into multiple chunks (like the real/imag axis of the visibilities).
+        :param dtype: the dtype of the dataset
+        :param tuple chunks: optional explicit chunk shape, overruling this layout's chunk shape.
+        :return dict: the chunk and compression keyword arguments for h5py's create_dataset.
+        """
+        itemsize = np.dtype(dtype).itemsize * int(np.prod(shape[4:]))
+        chunks = chunks or self.chunk_shape(shape[:4], itemsize)
+        if chunks is not None:
+            chunks = tuple(chunks[:4]) + tuple(shape[4:])
+
+        if self.compression is None:
+            return {'chunks': chunks, 'shuffle': self.shuffle or None}
+
+        if self.compression == 'blosc':
+            try:
+                # try to import hdf5plugin here and not at the top of the file
+                # to make this hdf5_io module as loosly coupled to optional packages as possible
+                import hdf5plugin
+                compression_kwargs = dict(hdf5plugin.Blosc(cname=self.compression_opts or 'lz4',
+                                                           shuffle=hdf5plugin.Blosc.SHUFFLE if self.shuffle else hdf5plugin.Blosc.NOSHUFFLE))
+                return dict(chunks=chunks or True, **compression_kwargs)
+            except ImportError:
+                logger.warning("blosc compression is not available (install the hdf5plugin package). Using lzf compression instead.")
+                return {'chunks': chunks or True, 'compression': 'lzf', 'shuffle': self.shuffle or None}
+
+        return {'chunks': chunks or True,
+                'compression': self.compression,
+                'compression_opts': self.compression_opts,
+                'shuffle': self.shuffle or None}
+
+# the predefined hypercube layout profiles, see HypercubeLayout.
+# 'default' and 'uncompressed' are the layouts which are used for do_compress=True and do_compress=False.
+HYPERCUBE_LAYOUTS = {'default': HypercubeLayout(chunks=None, compression='lzf'),
+                     'uncompressed': HypercubeLayout(chunks=None, compression=None),
+                     'per_baseline': HypercubeLayout(chunks=(1, 0, 0, 0), compression='lzf', shuffle=True),
+                     'per_subband': HypercubeLayout(chunks=(0, 0, 1, 0), compression='lzf', shuffle=True),
+                     'gzip': HypercubeLayout(chunks=None, compression='gzip', compression_opts=4, shuffle=True),
+                     'gzip_per_subband': HypercubeLayout(chunks=(0, 0, 1, 0), compression='gzip', compression_opts=4, shuffle=True),
+                     'blosc': HypercubeLayout(chunks=(0, 0, 1, 0), compression='blosc', compression_opts='lz4', shuffle=True)}
+
+def get_hypercube_layout(layout=None, do_compress=True):
+    """
+    :param layout: a HypercubeLayout, the name of one of the HYPERCUBE_LAYOUTS, or None for the default (un)compressed layout.
+    :param bool do_compress: only used when layout is None, selecting the 'default' or 'uncompressed' layout.
+    :return HypercubeLayout: the layout
+    """
+    if layout is None:
+        return HYPERCUBE_LAYOUTS['default' if do_compress else 'uncompressed']
+
+    if isinstance(layout, HypercubeLayout):
+        return layout
 
-    save_dir = os.path.dirname(path)
-    if not os.path.isabs(save_dir):
-        save_dir = os.path.join(os.getcwd(), save_dir)
+    if layout not in HYPERCUBE_LAYOUTS:
+        raise ValueError("Unknown hypercube layout '%s'. Choose one of: %s" % (layout, ', '.join(sorted(HYPERCUBE_LAYOUTS.keys()))))
 
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+    return HYPERCUBE_LAYOUTS[layout]
 
-    with SharedH5File(path, "w") as file:
-        version = '1.4'
+class HypercubeWriter():
+    """
+    Incremental writer for (version 1.4) hypercube h5 files, see write_hypercube for the file contents.
+    Instead of handing over the complete 4D visibilities and flagging arrays of each sap at once,
+    you can write them per chunk of baselines (each chunk having all timestamps, subbands and polarizations),
+    straight into the (chunked) h5 datasets. This bounds the peak memory usage by the chunk size instead of the cube size.
+
+    Example usage:
+
+    with HypercubeWriter(path, parset=parset, sas_id=sas_id) as writer:
+        writer.create_sap(0, baselines, timestamps, central_frequencies, subbands, polarizations)
+
+        for bl_offset in range(0, len(baselines), 64):
+            visibilities, flagging = read_my_baselines(bl_offset, 64)
+            writer.write_baselines(0, bl_offset, visibilities, flagging)
+    """
+    def __init__(self, path, parset=None, sas_id=None, wsrta_id=None, do_compress=True, layout=None, **kwargs):
+        """
+        :param str path: full path of the resulting h5 file. See write_hypercube.
+        :param parameterset parset: the optional paramaterset with all the settings which were used for this observation/pipeline
+        :param int sas_id: the optional observation/pipeline sas_id (the main id to track lofar observations/pipelines)
+        :param int wsrta_id: the optional observation wsrta_id (the main id to track wsrt apertif observations)
+        :param bool do_compress: compress the visibilities and flagging data (with lzf compression, slower but smaller output size)
+        :param layout: optional chunk layout and compression profile (a HypercubeLayout, or the name of one of the HYPERCUBE_LAYOUTS)
+                       for the visibilities and flagging. If given, it overrules do_compress.
+        :param dict kwargs: optional extra arguments
+        """
+        self._path = path
+        self._parset = parset
+        self._sas_id = sas_id
+        self._wsrta_id = wsrta_id
+        self._layout = get_hypercube_layout(layout, do_compress)
+        self._shared_file = None
+        self._file = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def file(self):
+        """the opened h5py.File which is being written"""
+        return self._file
+
+    @property
+    def layout(self):
+        """the HypercubeLayout of the visibilities and flagging datasets"""
+        return self._layout
+
+    def open(self):
+        logger.info('writing hypercube to file: %s', self._path)
+
+        save_dir = os.path.dirname(self._path)
+        if not os.path.isabs(save_dir):
+            save_dir = os.path.join(os.getcwd(), save_dir)
+
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+
+        self._shared_file = SharedH5File(self._path, "w")
+        self._file = self._shared_file.open()
+
+        version = HYPERCUBE_VERSION
         # 1.1 -> 1.2 change is not backwards compatible by design.
         # 1.2 -> 1.3 change is almost backwards compatible, it just needs a dB/linear correction. see convert_12_to_13
         # 1.3 -> 1.4 storing scale factors per baseline per subband per pol, see convert_13_to_14
-        ds = file.create_dataset('version', (1,), h5py.special_dtype(vlen=str), version)
+        ds = self._file.create_dataset('version', (1,), h5py.special_dtype(vlen=str), version)
         ds.attrs['description'] = 'version of this hdf5 MS extract file'
 
-        measurement_group = file.create_group('measurement')
+        measurement_group = self._file.create_group('measurement')
         measurement_group.attrs['description'] = 'all data (visibilities, flagging, parset, ...) for this measurement (observation/pipeline)'
 
-        if parset is not None:
-            ds = file.create_dataset('measurement/parset', (1,), h5py.special_dtype(vlen=str),
-                                     [str(parset).encode('utf-8')],
-                                     compression="lzf")
+        if self._parset is not None:
+            ds = self._file.create_dataset('measurement/parset', (1,), h5py.special_dtype(vlen=str),
+                                           [str(self._parset).encode('utf-8')],
+                                           compression="lzf")
             ds.attrs['description'] = 'the parset of this observation/pipeline with all settings how this data was created'
 
-        if sas_id is not None:
-            ds = file.create_dataset('measurement/sas_id', data=[sas_id])
+        if self._sas_id is not None:
+            ds = self._file.create_dataset('measurement/sas_id', data=[self._sas_id])
             ds.attrs['description'] = 'lofar observation/pipeline sas id'
 
-        if wsrta_id is not None:
-            ds = file.create_dataset('measurement/wsrta_id', data=[wsrta_id])
+        if self._wsrta_id is not None:
+            ds = self._file.create_dataset('measurement/wsrta_id', data=[self._wsrta_id])
             ds.attrs['description'] = 'apertif observation wsrta id'
 
-        saps_group = file.create_group('measurement/saps')
+        saps_group = self._file.create_group('measurement/saps')
         saps_group.attrs['description'] = 'the data (visibilities, flagging, ...) is stored per sub-array-pointing (sap)'
 
+        return self
+
+    def close(self, failed=False):
+        """
+        close the file, and fill its info folder from the parset.
+        :param bool failed: if True, then the file was not written completely (because of an error), so it is just closed.
+        """
+        if self._shared_file is None:
+            return
+
+        self._shared_file.close()
+        self._shared_file = None
+        self._file = None
+
+        if failed:
+            logger.error('failed writing hypercube to file: %s. The file is incomplete.', self._path)
+            return
+
+        if self._parset is not None:
+            fill_info_folder_from_parset(self._path)
+
+        try:
+            # try to import the lofar.common.util.humanreadablesize here and not at the top of the file
+            # to make this hdf5_io module as loosly coupled to other lofar code as possible
+            from lofar.common.util import humanreadablesize
+            logger.info('finished writing %s hypercube to file: %s', humanreadablesize(os.path.getsize(self._path)), self._path)
+        except ImportError:
+            logger.info('finished writing hypercube to file: %s', self._path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(failed=exc_type is not None)
+
+    def create_sap(self, sap_nr, baselines, timestamps, central_frequencies, subbands, polarizations, antenna_locations=None,
+                   visibilities_chunks=None, flagging_chunks=None):
+        """
+        create the group for the given sap, write its axes, and create the (empty) visibilities, flagging and scale factor datasets,
+        which can subsequently be filled with write_baselines.
+        See write_hypercube for an explanation of the parameters.
+        The optional visibilities_chunks and flagging_chunks are the explicit chunk shapes of the visibilities and flagging datasets.
+        If None, then the chunk shapes follow the writer's layout.
+        """
+        assert len(central_frequencies)==len(subbands)
+
+        sap_group = self._file.create_group('measurement/saps/%d' % sap_nr)
+        ds = sap_group.create_dataset('polarizations', (len(polarizations),), h5py.special_dtype(vlen=str),
+                                      [p.encode('utf-8') for p in polarizations])
+        ds.attrs['description'] = 'polarizations of the visibilities'
+
+        ds = sap_group.create_dataset('baselines', (len(baselines),2), h5py.special_dtype(vlen=str),
+                                [[bl[0].encode('utf-8'), bl[1].encode('utf-8')] for bl in baselines])
+        ds.attrs['description'] = 'pairs of baselines between stations'
+
+        if any(isinstance(t, datetime) for t in timestamps):
+            # try to import lofar.common.datetimeutils here and not at the top of the file
+            # to make this hdf5_io module as loosly coupled to other lofar code as possible
+            # do raise the possible ImportError, because we cannot proceed without converted datetimes.
+            from lofar.common.datetimeutils import to_modified_julian_date_in_seconds
+            timestamps = [to_modified_julian_date_in_seconds(t) if isinstance(t, datetime) else t for t in timestamps]
+
+        ds = sap_group.create_dataset('timestamps', data=timestamps)
+        ds.attrs['units'] = 'modified julian date, (fractional) seconds since epoch 1858-11-17 00:00:00'
+
+        ds = sap_group.create_dataset('central_frequencies', data=central_frequencies)
+        ds.attrs['units'] = 'Hz'
+
+        ds = sap_group.create_dataset('subbands', data=subbands)
+        ds.attrs['description'] = 'subband number'
+
+        if antenna_locations:
+            location_group = sap_group.create_group('antenna_locations')
+            location_group.attrs['description'] = 'the antenna locations in XYZ, PQR, WGS84 coordinates (units: meters and/or radians)'
+
+            for ref_frame in ['XYZ', 'PQR', 'WGS84']:
+                location_sub_group = location_group.create_group(ref_frame)
+                location_sub_group.attrs['description'] = 'the antenna locations in %s coordinates (units: meters and/or radians)' % (ref_frame,)
+
+                for antenna, location in antenna_locations[ref_frame].items():
+                    location_sub_group.create_dataset(antenna, data=location)
+
+        shape = (len(baselines), len(timestamps), len(subbands), len(polarizations))
+
+        scale_factor_ds = sap_group.create_dataset('visibility_scale_factors', shape=(shape[0], shape[2], shape[3]), dtype=np.float32)
+        scale_factor_ds.attrs['description'] = 'scale factors per baseline per subband per polatization to un-normalize the stored visibilities'
+        scale_factor_ds.attrs['description'] = 'multiply real and imag parts of the visibilities with this factor per baseline per subband per polatization to un-normalize them and get the 10log10 values of the real and imag parts of the visibilities'
+        scale_factor_ds.attrs['units'] = '-'
+
+        ds = sap_group.create_dataset('visibilities', shape=shape + (2,), dtype=np.int8,
+                                      **self._layout.dataset_kwargs(shape + (2,), np.int8, visibilities_chunks))
+        ds.attrs['units'] = 'normalized dB within [-128..127]'
+        ds.attrs['dim[0]'] = 'baselines'
+        ds.attrs['dim[1]'] = 'timestamps'
+        ds.attrs['dim[2]'] = 'central_frequencies & subbands'
+        ds.attrs['dim[3]'] = 'polarizations'
+        ds.attrs['dim[4]'] = 'real part of normalized within [-128..127] 10log10(visibilities)'
+        ds.attrs['dim[5]'] = 'imag part of normalized within [-128..127] 10log10(visibilities)'
+
+        ds = sap_group.create_dataset('flagging', shape=shape, dtype=np.bool_,
+                                      **self._layout.dataset_kwargs(shape, np.bool_, flagging_chunks))
+        ds.attrs['units'] = 'bool (true=flagged)'
+        ds.attrs['dim[0]'] = 'baselines'
+        ds.attrs['dim[1]'] = 'timestamps'
+        ds.attrs['dim[2]'] = 'central_frequencies & subbands'
+        ds.attrs['dim[3]'] = 'polarizations'
+        ds.attrs['dim[4]'] = 'flagging values'
+
+    def write_baselines(self, sap_nr, baseline_offset, visibilities, flagging, min_abs_value=None):
+        """
+        normalize, quantize and write a chunk of consecutive baselines of the given sap, starting at baseline index baseline_offset.
+        Note that, just like write_hypercube does for the full arrays, the given visibilities and flagging arrays are modified in place:
+        the zero's and NaN's in the visibilities are flagged, and replaced by the min_abs_value.
+
+        :param int sap_nr: the sap number, for which create_sap has been called already
+        :param int baseline_offset: the index of the first baseline of this chunk along the baseline axis of the sap
+        :param numpy.array visibilities: the 4D (baseline, time, subband, polarization) array of complex visibilities for this chunk of baselines
+        :param numpy.array flagging: the 4D (baseline, time, subband, polarization) array of flagging booleans for this chunk of baselines
+        :param float min_abs_value: the value to fill in for the zero's and NaN's in the visibilities.
+                                    If None, then the smallest non-zero/non-NaN absolute value of this chunk is used.
+        """
+        sap_group = self._file['measurement/saps/%d' % sap_nr]
+        vis_ds = sap_group['visibilities']
+
+        # make sure all dimensions match
+        assert visibilities.shape == flagging.shape
+        assert visibilities.shape[1:] == vis_ds.shape[1:-1]
+        assert baseline_offset + visibilities.shape[0] <= vis_ds.shape[0]
+
+        bl_slice = slice(baseline_offset, baseline_offset + visibilities.shape[0])
+
+        logger.debug('''flagging NaN's and zero's in visibilities for baselines [%s:%s] of sap %s for file %s''',
+                     bl_slice.start, bl_slice.stop, sap_nr, self._path)
+        zero_or_nan = np.absolute(visibilities) == 0.0
+        zero_or_nan[np.isnan(visibilities)] = True
+        flagging[zero_or_nan] = True
+
+        #we'll scale the 10log10(visibilities) so the complex-float can be mapped onto 2*int8
+        #remove any NaN and/or 0 values in the visibilities? log(0) or log(nan) crashes,
+        # so determine smallest non-zero abs value, and fill that in for the flagged visibilities
+        if min_abs_value is None:
+            min_abs_value = _compute_min_non_zero_or_nan_abs_value(visibilities)
+
+        # overwrite all visibilities values where flagging (or 0's or NaN's) occur with the min_non_flagged_value
+        # that enables us to take the log, and have good dynamic range when scaling to -128...127
+        visibilities[zero_or_nan] = min_abs_value
+        del zero_or_nan
+
+        # reduce dynamic range (so we fit more data in the available bits)
+        visibility_amplitudes = np.abs(visibilities)
+        visibility_amplitudes_dB = 10.0*np.log10(visibility_amplitudes)
+        del visibility_amplitudes
+        visibility_phases = np.exp(1j*np.angle(visibilities))
+        visibilities_dB = visibility_amplitudes_dB * visibility_phases
+        del visibility_phases
+
+        # compute scale factor per baseline/subband/pol to map the visibilities_dB from complex64 to 2xint8
+        scale_factors = compute_visibility_scale_factors(visibility_amplitudes_dB)
+        del visibility_amplitudes_dB
+
+        # split the complex value into two scaled int8's for real and imag part
+        logger.debug('converting visibilities from complexfloat to 2xint8 for baselines [%s:%s] of sap %s for file %s',
+                     bl_slice.start, bl_slice.stop, sap_nr, self._path)
+        scaled_visibilities = quantize_visibilities(visibilities_dB, scale_factors)
+        del visibilities_dB
+
+        sap_group['visibility_scale_factors'][bl_slice] = scale_factors
+        vis_ds[bl_slice] = scaled_visibilities
+        sap_group['flagging'][bl_slice] = flagging
+
+def write_hypercube(path, saps, parset=None, sas_id=None, wsrta_id=None, do_compress=True, max_chunk_nbytes=None, layout=None, **kwargs):
+    """
+    write a hypercube of visibility/flagging data for all saps of an observation/pipeline.
+
+    :param str path: full path of the resulting h5 file. By convention we advise to use <observation_id>.MS_exctract.h5
+                     where observation_id is L<sas_id> for lofar and WSRTA<wsrta_id> for apertif
+    :param dict saps: each key is the id of a sap, and holds per sap a dict with the following key/value pairs:
+
+                          baselines: [string], list of stationpairs (tuples) (these are the ticks on the baseline axis of the visibilities)
+
+                          timestamps: [np.double], list of Modified Julian Date (these are the ticks on the time axis of the visibilities)
+
+                          central_frequencies: [np.double], list of central frequencies of the subbands (these are the ticks on the frequency axis of the visibilities)
+
+                          subbands: [np.int], list of subbands numbers (each subband has a corresponding central_frequency)
+
+                          polarizations: [string], list of polarization, one up to four, any of 'XX', 'XY', 'YX', 'YY'
+
+                          visibilities: numpy.array, the 4D array of visibilities. In the file these are reduced from doubles to chars by taking the 10.log10 and normalizing the result to fit in the [-128..127] range.
+
+                          flagging: numpy.array, the 4D array of flagging booleans.
+    :param parameterset parset: the optional paramaterset with all the settings which were used for this observation/pipeline
+    :param int sas_id: the optional observation/pipeline sas_id (the main id to track lofar observations/pipelines)
+    :param int wsrta_id: the optional observation wsrta_id (the main id to track wsrt apertif observations)
+    :param bool do_compress: compress the visibilities and flagging data (with lzf compression, slower but smaller output size)
+    :param int max_chunk_nbytes: the visibilities are normalized and written per chunk of baselines of at most this number of bytes.
+                                 The peak memory usage on top of the given saps is a small multiple (~6x) of this chunk size.
+                                 If None, then QUANTIZATION_CHUNK_NBYTES is used.
+    :param layout: optional chunk layout and compression profile (a HypercubeLayout, or the name of one of the HYPERCUBE_LAYOUTS)
+                   for the visibilities and flagging. If given, it overrules do_compress.
+    :param dict kwargs: optional extra arguments
+    :return None
+    seealso:: HypercubeWriter
+    """
+    with HypercubeWriter(path, parset=parset, sas_id=sas_id, wsrta_id=wsrta_id, do_compress=do_compress, layout=layout, **kwargs) as writer:
         for sap_nr in sorted(saps.keys()):
             sap_dict = saps[sap_nr]
             baselines = sap_dict['baselines']
@@ -145,133 +616,15 @@ def write_hypercube(path, saps, parset=None, sas_id=None, wsrta_id=None, do_comp
             assert len(subbands)==visibilities.shape[2]
             assert len(polarizations)==visibilities.shape[3]
 
-            sap_group = file.create_group('measurement/saps/%d' % sap_nr)
-            ds = sap_group.create_dataset('polarizations', (len(polarizations),), h5py.special_dtype(vlen=str),
-                                          [p.encode('utf-8') for p in polarizations])
-            ds.attrs['description'] = 'polarizations of the visibilities'
+            writer.create_sap(sap_nr, baselines, timestamps, central_frequencies, subbands, polarizations,
+                              antenna_locations=antenna_locations)
 
-            ds = sap_group.create_dataset('baselines', (len(baselines),2), h5py.special_dtype(vlen=str),
-                                    [[bl[0].encode('utf-8'), bl[1].encode('utf-8')] for bl in baselines])
-            ds.attrs['description'] = 'pairs of baselines between stations'
+            # use the same min value for the flagged visibilities for all baseline chunks, as if the sap was processed at once
+            min_non_zero_or_nan_abs_value = _compute_min_non_zero_or_nan_abs_value(visibilities, max_chunk_nbytes)
 
-            if any(isinstance(t, datetime) for t in timestamps):
-                # try to import lofar.common.datetimeutils here and not at the top of the file
-                # to make this hdf5_io module as loosly coupled to other lofar code as possible
-                # do raise the possible ImportError, because we cannot proceed without converted datetimes.
-                from lofar.common.datetimeutils import to_modified_julian_date_in_seconds
-                timestamps = [to_modified_julian_date_in_seconds(t) if isinstance(t, datetime) else t for t in timestamps]
-
-            ds = sap_group.create_dataset('timestamps', data=timestamps)
-            ds.attrs['units'] = 'modified julian date, (fractional) seconds since epoch 1858-11-17 00:00:00'
-
-            ds = sap_group.create_dataset('central_frequencies', data=central_frequencies)
-            ds.attrs['units'] = 'Hz'
-
-            ds = sap_group.create_dataset('subbands', data=subbands)
-            ds.attrs['description'] = 'subband number'
-
-            if antenna_locations:
-                location_group = sap_group.create_group('antenna_locations')
-                location_group.attrs['description'] = 'the antenna locations in XYZ, PQR, WGS84 coordinates (units: meters and/or radians)'
-
-                for ref_frame in ['XYZ', 'PQR', 'WGS84']:
-                    location_sub_group = location_group.create_group(ref_frame)
-                    location_sub_group.attrs['description'] = 'the antenna locations in %s coordinates (units: meters and/or radians)' % (ref_frame,)
-
-                    for antenna, location in antenna_locations[ref_frame].items():
-                        location_sub_group.create_dataset(antenna, data=location)
-
-            logger.debug('''flagging NaN's and zero's in visibilities for file %s''', path)
-            zero_or_nan = np.absolute(visibilities) == 0.0
-            zero_or_nan[np.isnan(visibilities)] = True
-            flagging[zero_or_nan] = True
-
-            #we'll scale the 10log10(visibilities) so the complex-float can be mapped onto 2*int8
-            logger.debug('normalizing visibilities for file %s', path)
-            #remove any NaN and/or 0 values in the visibilities? log(0) or log(nan) crashes,
-            # so determine smallest non-zero abs value, and fill that in for the flagged visibilities
-            try:
-                abs_non_zero_or_nan_visibilities = np.abs(visibilities)[zero_or_nan == False]
-                min_non_zero_or_nan_abs_value = max(1e-9, np.min(abs_non_zero_or_nan_visibilities))
-                del abs_non_zero_or_nan_visibilities
-            except ValueError:
-                min_non_zero_or_nan_abs_value = 1e-12
-
-            # overwrite all visibilities values where flagging (or 0's or NaN's) occur with the min_non_flagged_value
-            # that enables us to take the log, and have good dynamic range when scaling to -128...127
-            visibilities[zero_or_nan] = min_non_zero_or_nan_abs_value
-            del zero_or_nan
-
-            # reduce dynamic range (so we fit more data in the available bits)
-            visibility_amplitudes = np.abs(visibilities)
-            visibility_amplitudes_dB = 10.0*np.log10(visibility_amplitudes)
-            visibility_phases = np.exp(1j*np.angle(visibilities))
-            visibilities_dB = visibility_amplitudes_dB * visibility_phases
-
-            #compute scale factors per subband, per polarization
-            scale_factors = np.empty(shape=(len(baselines),len(subbands),len(polarizations)), dtype=np.float32)
-
-            # compute scale factor per baseline/subband/pol to map the visibilities_dB from complex64 to 2xint8
-            for bl_idx in range(len(baselines)):
-                for pol_idx in range(len(polarizations)):
-                    for sb_idx in range(len(subbands)):
-                        #use 99.5 percentile instead if max to get rid of spikes
-                        max_abs_vis_sb = max(1.0, np.percentile(visibility_amplitudes_dB[bl_idx,:,sb_idx,pol_idx], 99.5))
-                        scale_factor = 127.0 / max_abs_vis_sb
-                        scale_factors[bl_idx, sb_idx, pol_idx] = 1.0/scale_factor
-
-            # store the scale_factors in the file
-            scale_factor_ds = sap_group.create_dataset('visibility_scale_factors', data=scale_factors)
-            scale_factor_ds.attrs['description'] = 'scale factors per baseline per subband per polatization to un-normalize the stored visibilities'
-            scale_factor_ds.attrs['description'] = 'multiply real and imag parts of the visibilities with this factor per baseline per subband per polatization to un-normalize them and get the 10log10 values of the real and imag parts of the visibilities'
-            scale_factor_ds.attrs['units'] = '-'
-
-            # create a array with one extra dimension, so we can split the complex value into two scaled int8's for real and imag part
-            # looping in python is not the most cpu efficient way
-            # but is saves us extra copies of the large visibilities array, which might not fit in memory?
-            logger.debug('converting visibilities from complexfloat to 2xint8 for file %s', path)
-            extended_shape = visibilities_dB.shape[:] + (2,)
-            scaled_visibilities = np.empty(extended_shape, dtype=np.int8)
-
-            for bl_idx in range(len(baselines)):
-                for pol_idx in range(len(polarizations)):
-                    for sb_idx in range(len(subbands)):
-                        scale_factor = 1.0 / scale_factors[bl_idx, sb_idx, pol_idx]
-                        scaled_visibilities[bl_idx,:,sb_idx,pol_idx,0] = scale_factor*visibilities_dB[bl_idx,:,sb_idx,pol_idx].real
-                        scaled_visibilities[bl_idx,:,sb_idx,pol_idx,1] = scale_factor*visibilities_dB[bl_idx,:,sb_idx,pol_idx].imag
-
-            logger.debug('reduced visibilities size from %s to %s bytes (factor %s)',
-                         visibilities.nbytes, scaled_visibilities.nbytes, visibilities.nbytes/scaled_visibilities.nbytes)
-
-            ds = sap_group.create_dataset('visibilities', data=scaled_visibilities,
-                                          compression="lzf" if do_compress else None)
-            ds.attrs['units'] = 'normalized dB within [-128..127]'
-            ds.attrs['dim[0]'] = 'baselines'
-            ds.attrs['dim[1]'] = 'timestamps'
-            ds.attrs['dim[2]'] = 'central_frequencies & subbands'
-            ds.attrs['dim[3]'] = 'polarizations'
-            ds.attrs['dim[4]'] = 'real part of normalized within [-128..127] 10log10(visibilities)'
-            ds.attrs['dim[5]'] = 'imag part of normalized within [-128..127] 10log10(visibilities)'
-
-            ds = sap_group.create_dataset('flagging', data=flagging,
-                                          compression="lzf" if do_compress else None)
-            ds.attrs['units'] = 'bool (true=flagged)'
-            ds.attrs['dim[0]'] = 'baselines'
-            ds.attrs['dim[1]'] = 'timestamps'
-            ds.attrs['dim[2]'] = 'central_frequencies & subbands'
-            ds.attrs['dim[3]'] = 'polarizations'
-            ds.attrs['dim[4]'] = 'flagging values'
-
-    if parset is not None:
-        fill_info_folder_from_parset(path)
-
-    try:
-        # try to import the lofar.common.util.humanreadablesize here and not at the top of the file
-        # to make this hdf5_io module as loosly coupled to other lofar code as possible
-        from lofar.common.util import humanreadablesize
-        logger.info('finished writing %s hypercube to file: %s', humanreadablesize(os.path.getsize(path)), path)
-    except ImportError:
-        logger.info('finished writing hypercube to file: %s', path)
+            for bl_slice in _baseline_chunk_slices(visibilities, max_chunk_nbytes):
+                writer.write_baselines(sap_nr, bl_slice.start, visibilities[bl_slice], flagging[bl_slice],
+                                       min_abs_value=min_non_zero_or_nan_abs_value)
 
 
 def read_sap_numbers(path):
@@ -285,17 +638,192 @@ def read_sap_numbers(path):
     with SharedH5File(path, "r") as file:
         version_str = read_version(path)
 
-        if version_str not in ['1.2', '1.3', '1.4']:
+        if version_str not in SUPPORTED_READ_VERSIONS:
             raise ValueError('Cannot read version %s' % (version_str,))
 
         return sorted([int(sap_nr) for sap_nr in file['measurement/saps'].keys()])
 
 def read_version(h5_path):
     with SharedH5File(h5_path, "r") as file:
-        version = file['version'][0]
-        if isinstance(version, bytes):
-            return version.decode('utf-8')
-        return version
+        return _read_version_from_file(file)
+
+def _read_version_from_file(file):
+    version = file['version'][0]
+    if isinstance(version, bytes):
+        return version.decode('utf-8')
+    return version
+
+def _decode_strings(array):
+    """helper method to decode the (vlen) strings as read from h5py (which are bytes in h5py>=3) into a numpy array of str"""
+    array = np.asarray(array)
+    if array.dtype == object:
+        # h5py vlen strings are returned as an object array of bytes (or str)
+        return np.array([s.decode('utf-8') if isinstance(s, bytes) else s for s in array.ravel()], dtype=str).reshape(array.shape)
+    if array.dtype.kind == 'S':
+        return np.char.decode(array, 'utf-8')
+    return array.astype(str)
+
+def _split_station_filter(station_filter):
+    """helper method to split a comma seperated station_filter string into a list of station patterns.
+    A list (or tuple) of station patterns is returned as is."""
+    if isinstance(station_filter, str):
+        return [x.strip() for x in station_filter.split(',') if x.strip()]
+    return list(station_filter) if station_filter else []
+
+class BaselineIndex():
+    """
+    Vectorized index of the baselines of a sap: a table of the (unique, sorted) station names,
+    and the antenna1 and antenna2 numpy arrays holding for each baseline the index of its stations in that table.
+    Baseline selections (by station pattern, auto- or crosscorrelation) are computed as numpy masks,
+    and the resulting baseline indices can be used directly for (h5py) fancy indexing along the baseline axis.
+    The index is computed once per SapView (i.e. per opened file), or once per list of baselines, see from_baselines.
+
+    Example usage:
+
+    index = BaselineIndex.from_baselines([('CS001', 'CS001'), ('CS001', 'CS002'), ('CS002', 'CS002')])
+    index.indices(keep_autocorrelations=False)  # -> array([1])
+    index.select(antenna1_filter='CS001')       # -> [('CS001', 'CS001'), ('CS001', 'CS002')]
+    """
+    def __init__(self, stations, antenna1, antenna2):
+        """
+        :param numpy.array stations: the (unique, sorted) station names
+        :param numpy.array antenna1: for each baseline the index of its first station in stations
+        :param numpy.array antenna2: for each baseline the index of its second station in stations
+        """
+        assert len(antenna1) == len(antenna2)
+        self.stations = np.asarray(stations, dtype=str)
+        self.antenna1 = np.asarray(antenna1, dtype=np.int32)
+        self.antenna2 = np.asarray(antenna2, dtype=np.int32)
+        self._baselines = None
+        self._station_ids = None
+
+    @staticmethod
+    def from_baselines(baselines):
+        """
+        create the BaselineIndex for the given baselines.
+        :param baselines: list of station pairs (tuples), or the (n,2) array as read from the h5 baselines dataset.
+        :return BaselineIndex:
+        """
+        if len(baselines) == 0:
+            return BaselineIndex(np.empty(0, dtype=str), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+
+        baselines = np.asarray(baselines)
+        if baselines.dtype != object and baselines.dtype.kind not in 'SU':
+            raise ValueError('cannot create a BaselineIndex for baselines of dtype %s' % (baselines.dtype,))
+
+        # find the unique stations in the raw (possibly bytes) baselines, so only the few unique station names need decoding.
+        raw_stations, inverse = np.unique(baselines.reshape(-1), return_inverse=True)
+        stations = _decode_strings(raw_stations)
+        inverse = inverse.reshape(-1, 2)
+        return BaselineIndex(stations, inverse[:,0], inverse[:,1])
+
+    @staticmethod
+    def from_sap_group(sap_group):
+        """
+        create the BaselineIndex for the baselines in the given (opened) h5py sap group.
+        :return BaselineIndex:
+        """
+        return BaselineIndex.from_baselines(sap_group['baselines'][:])
+
+    def __len__(self):
+        return len(self.antenna1)
+
+    @property
+    def baselines(self):
+        """the baselines as list of station pairs (tuples), like the baselines in read_hypercube's result."""
+        if self._baselines is None:
+            self._baselines = list(zip(self.stations[self.antenna1].tolist(), self.stations[self.antenna2].tolist()))
+        return self._baselines
+
+    @property
+    def used_stations(self):
+        """the sorted list of stations which are used in at least one baseline"""
+        used = np.zeros(len(self.stations), dtype=bool)
+        used[self.antenna1] = True
+        used[self.antenna2] = True
+        return self.stations[used].tolist()
+
+    def station_mask(self, station_filter):
+        """
+        :param station_filter: comma seperated string, or list, of station patterns. A station matches if any pattern is a substring of its name.
+        :return numpy.array: boolean mask over the stations table, or None if the filter is empty (i.e. all stations match).
+        """
+        patterns = _split_station_filter(station_filter)
+        if not patterns:
+            return None
+        return np.array([any(p in station for p in patterns) for station in self.stations.tolist()], dtype=bool)
+
+    def mask(self, keep_autocorrelations: bool=True, keep_crosscorrelations: bool=True, antenna1_filter='', antenna2_filter=''):
+        """
+        compute the boolean mask over the baselines for the given selection, see filter_baselines for the parameters.
+        :return numpy.array: boolean mask with True for the selected baselines
+        """
+        mask = np.ones(len(self), dtype=bool)
+
+        if not keep_autocorrelations:
+            mask &= self.antenna1 != self.antenna2
+
+        if not keep_crosscorrelations:
+            mask &= self.antenna1 == self.antenna2
+
+        for antenna, station_filter in ((self.antenna1, antenna1_filter), (self.antenna2, antenna2_filter)):
+            station_mask = self.station_mask(station_filter)
+            if station_mask is not None:
+                mask &= station_mask[antenna]
+
+        return mask
+
+    def indices(self, **kwargs):
+        """
+        :param kwargs: the selection, see mask
+        :return numpy.array: the (sorted) indices of the selected baselines, which can be used for h5py fancy indexing.
+        """
+        return np.flatnonzero(self.mask(**kwargs))
+
+    def select(self, **kwargs):
+        """
+        :param kwargs: the selection, see mask
+        :return list: the selected baselines as list of station pairs (tuples)
+        """
+        baselines = self.baselines
+        return [baselines[idx] for idx in self.indices(**kwargs).tolist()]
+
+    def _baseline_codes(self, baselines):
+        """helper method which encodes the given baselines as antenna1*#stations+antenna2, with -1 for unknown stations"""
+        if self._station_ids is None:
+            self._station_ids = {station: idx for idx, station in enumerate(self.stations.tolist())}
+
+        pairs = _decode_strings(np.asarray(baselines).reshape(-1, 2)) if len(baselines) else np.empty((0, 2), dtype=str)
+        antenna1 = np.array([self._station_ids.get(s, -1) for s in pairs[:,0].tolist()], dtype=np.int64)
+        antenna2 = np.array([self._station_ids.get(s, -1) for s in pairs[:,1].tolist()], dtype=np.int64)
+        codes = antenna1*len(self.stations) + antenna2
+        codes[(antenna1 < 0) | (antenna2 < 0)] = -1
+        return codes
+
+    def isin(self, baselines):
+        """
+        :param list baselines: list of station pairs (tuples)
+        :return numpy.array: boolean mask over this index's baselines, True for each baseline which is in the given baselines
+        """
+        codes = self.antenna1.astype(np.int64)*len(self.stations) + self.antenna2
+        return np.isin(codes, self._baseline_codes(baselines))
+
+    def lookup(self, baselines):
+        """
+        lookup the indices along the baseline axis for the given baselines.
+        :param list baselines: list of station pairs (tuples)
+        :return numpy.array: the baseline indices (in the order of the given baselines). Raises a KeyError if a baseline is not in this index.
+        """
+        codes = self.antenna1.astype(np.int64)*len(self.stations) + self.antenna2
+        sorter = np.argsort(codes, kind='stable')
+        requested_codes = self._baseline_codes(baselines)
+        positions = np.searchsorted(codes, requested_codes, sorter=sorter)
+        positions = np.minimum(positions, max(0, len(codes)-1))
+        indices = sorter[positions] if len(codes) else np.empty(0, dtype=np.int64)
+        found = (requested_codes >= 0) & (codes[indices] == requested_codes) if len(codes) else np.zeros(len(requested_codes), dtype=bool)
+        if not np.all(found):
+            raise KeyError(tuple(baselines[np.flatnonzero(~found)[0]]))
+        return indices.astype(np.int64)
 
 def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_visibilities=True, read_flagging=True,
                    saps_to_read=None, baselines_to_read=None):
@@ -314,16 +842,11 @@ def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_v
     """
     logger.info('reading hypercube from file: %s', path)
 
-    if read_version(path) == '1.2':
-        convert_12_to_13(path)
-
-    if read_version(path) == '1.3':
-        convert_13_to_14(path)
-
-    # reopen file read-only for safety reasons.
     with SharedH5File(path, "r") as file:
-        if read_version(path) != '1.4':
-            raise ValueError('Cannot read version %s' % (file['version'][0],))
+        # older versions are de-quantized on the fly, the file is not converted. See migrate_hypercube.
+        version_str = _read_version_from_file(file)
+        if version_str not in SUPPORTED_READ_VERSIONS:
+            raise ValueError('Cannot read version %s' % (version_str,))
 
         result = {}
         if 'measurement/parset' in file:
@@ -352,24 +875,17 @@ def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_v
             polarizations = [p.decode('utf-8') if isinstance(p, bytes) else p for p in sap_dict['polarizations']]
             sap_result['polarizations'] = polarizations
 
-            baselines = sap_dict['baselines'][:]
-            baselines = [(bl[0].decode('utf-8') if isinstance(bl[0], bytes) else bl[0],
-                          bl[1].decode('utf-8') if isinstance(bl[1], bytes) else bl[1]) for bl in baselines]
+            baseline_index = BaselineIndex.from_sap_group(sap_dict)
 
             # apply baselines_to_read filter
-            baseline_indices_to_read = []
-            filtered_baselines = []
-            for bl_idx, bl in enumerate(baselines):
-                if baselines_to_read is not None and bl not in baselines_to_read:
-                    continue
+            baseline_indices_to_read = np.flatnonzero(baseline_index.isin(baselines_to_read)) if baselines_to_read is not None else []
 
-                baseline_indices_to_read.append(bl_idx)
-                filtered_baselines.append(bl)
-
-            if not baseline_indices_to_read:
+            if len(baseline_indices_to_read) == 0 or len(baseline_indices_to_read) == len(baseline_index):
                 # read all
-                filtered_baselines = baselines
-                baseline_indices_to_read = range(len(baselines))
+                filtered_baselines = baseline_index.baselines
+                baseline_indices_to_read = slice(None)
+            else:
+                filtered_baselines = [baseline_index.baselines[idx] for idx in baseline_indices_to_read.tolist()]
 
             sap_result['baselines'] = filtered_baselines
 
@@ -406,19 +922,9 @@ def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_v
             if read_visibilities:
                 # read the visibility_scale_factors and (scaled_)visibilities
                 # denormalize them and convert back to complex
-                scale_factors = sap_dict['visibility_scale_factors'][baseline_indices_to_read,:,:]
-                normalized_visibilities = sap_dict['visibilities'][baseline_indices_to_read,:,:,:]
-
                 logger.debug('denormalizing and converting real/imag to complex visibilities for file sap %s in %s', sap_nr, path)
-                reduced_shape = normalized_visibilities.shape[:-1]
-                visibilities = np.empty(reduced_shape, dtype=np.complex64)
-
-                for bl_idx in range(len(baseline_indices_to_read)):
-                    for sb_idx in range(len(subbands)):
-                        for pol_idx in range(len(polarizations)):
-                            scale_factor = scale_factors[bl_idx, sb_idx, pol_idx]
-                            visibilities[bl_idx,:,sb_idx,pol_idx].real = scale_factor*normalized_visibilities[bl_idx,:,sb_idx,pol_idx,0]
-                            visibilities[bl_idx,:,sb_idx,pol_idx].imag = scale_factor*normalized_visibilities[bl_idx,:,sb_idx,pol_idx,1]
+                visibilities = _read_dequantized_visibilities(sap_dict, version_str,
+                                                              _Hyperslab(baseline_indices_to_read, sap_dict['flagging'].shape))
 
                 if not visibilities_in_dB:
                     logger.debug('converting visibilities from dB to raw linear for file sap %s in %s', sap_nr, path)
@@ -435,7 +941,7 @@ def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_v
                 sap_result['visibilities'] = visibilities
                 sap_result['visibilities_in_dB'] = visibilities_in_dB
 
-            antennae = set([bl[0] for bl in sap_result['baselines']] + [bl[1] for bl in sap_result['baselines']])
+            antennae = get_stations_from_baselines(sap_result['baselines'])
 
             logger.info('sap: %s, #subbands: %s, #timestamps: %s, #baselines: %s, #antennae: %s, #polarizations: %s',
                         sap_nr,
@@ -449,6 +955,316 @@ def read_hypercube(path, visibilities_in_dB=True, python_datetimes=False, read_v
 
     return result
 
+def _normalize_hyperslab_key(key, ndim):
+    """
+    helper method to expand a numpy-style index key (with an optional Ellipsis) into a tuple of exactly ndim per-axis indices.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    if any(k is Ellipsis for k in key):
+        ellipsis_idx = next(i for i, k in enumerate(key) if k is Ellipsis)
+        key = key[:ellipsis_idx] + (slice(None),)*(ndim-len(key)+1) + key[ellipsis_idx+1:]
+
+    if len(key) > ndim:
+        raise IndexError('too many indices: %d given for %d dimensions' % (len(key), ndim))
+
+    key = key + (slice(None),)*(ndim-len(key))
+    return key
+
+class _Hyperslab():
+    """
+    helper class which translates a numpy-style index key into an h5py-compatible selection on a dataset,
+    plus the numpy post-processing needed to get the result numpy would have given.
+    h5py only supports slices with positive steps, integers, and at most one increasing list of indices per selection.
+    """
+    def __init__(self, key, shape):
+        self.shape = tuple(shape)
+        self.squeeze_axes = []
+        self.indices = []
+
+        for axis, (k, length) in enumerate(zip(_normalize_hyperslab_key(key, len(shape)), shape)):
+            if isinstance(k, (int, np.integer)):
+                if k < -length or k >= length:
+                    raise IndexError('index %d is out of bounds for axis %d with size %d' % (k, axis, length))
+                self.squeeze_axes.append(axis)
+                k = slice(k % length, k % length + 1)
+
+            if isinstance(k, slice):
+                start, stop, step = k.indices(length)
+                if step < 0:
+                    k = np.arange(start, stop, step)
+                else:
+                    k = slice(start, max(start, stop), step)
+
+            if not isinstance(k, slice):
+                k = np.asarray(k)
+                if k.dtype == bool:
+                    k = np.flatnonzero(k)
+                k = k.astype(np.int64)
+                if np.any(k >= length) or np.any(k < -length):
+                    raise IndexError('index out of bounds for axis %d with size %d' % (axis, length))
+                k = k % length if length else k
+
+            self.indices.append(k)
+
+    def axis_indices(self, axis):
+        """the selected indices along the given axis as a numpy array"""
+        k = self.indices[axis]
+        if isinstance(k, slice):
+            return np.arange(k.start, k.stop, k.step)
+        return k
+
+    def read(self, dataset, extra_axes=0):
+        """
+        read this hyperslab from the (h5py) dataset, which may have some extra trailing axes which are read completely.
+        The integer indexed axes are not squeezed yet, so the result has the same number of dimensions as the dataset.
+        """
+        h5_selection = []
+        post_selection = []
+        used_h5_list_index = False
+        for k in self.indices:
+            if isinstance(k, slice):
+                h5_selection.append(k)
+                post_selection.append(slice(None))
+            elif len(k) == 0:
+                h5_selection.append(slice(0, 0))
+                post_selection.append(slice(None))
+            elif not used_h5_list_index:
+                # let h5py read only the unique sorted indices, and reorder/duplicate them afterwards with numpy
+                unique_indices, inverse = np.unique(k, return_inverse=True)
+                h5_selection.append(unique_indices.tolist())
+                post_selection.append(inverse)
+                used_h5_list_index = True
+            else:
+                # read the bounding range with h5py, and pick the indices afterwards with numpy
+                lower, upper = int(np.min(k)), int(np.max(k))+1
+                h5_selection.append(slice(lower, upper))
+                post_selection.append(k - lower)
+
+        data = dataset[tuple(h5_selection) + (slice(None),)*extra_axes]
+
+        for axis, p in enumerate(post_selection):
+            if not isinstance(p, slice):
+                data = np.take(data, p, axis=axis)
+
+        return data
+
+    def squeeze(self, data):
+        return np.squeeze(data, axis=tuple(self.squeeze_axes)) if self.squeeze_axes else data
+
+class _LazyArray():
+    """
+    helper class exposing a numpy-style sliceable (read-only) array, which only reads the requested hyperslab when indexed.
+    """
+    def __init__(self, shape, dtype, reader):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+        self._reader = reader
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        hyperslab = _Hyperslab(key, self.shape)
+        return hyperslab.squeeze(self._reader(hyperslab))
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data.astype(dtype) if dtype is not None else data
+
+class SapView():
+    """
+    Lazy view on the data of one sap in an opened hypercube h5 file, see HypercubeView.
+    The axes (baselines, timestamps, subbands, ...) are read upon first access,
+    and the visibilities and flagging are only read (and de-quantized) for the requested hyperslab.
+    """
+    def __init__(self, hypercube_view, sap_nr, sap_group):
+        self._hypercube_view = hypercube_view
+        self.sap_nr = sap_nr
+        self._sap_group = sap_group
+        self._baseline_index = None
+
+        self.shape = sap_group['flagging'].shape
+
+        self.visibilities = _LazyArray(self.shape, np.complex64, self._read_visibilities)
+        self.flagging = _LazyArray(self.shape, np.bool_, self._read_flagging)
+
+    @property
+    def visibilities_in_dB(self):
+        return self._hypercube_view.visibilities_in_dB
+
+    @property
+    def baseline_index(self):
+        """the BaselineIndex of this sap, which is computed once upon first access"""
+        if self._baseline_index is None:
+            self._baseline_index = BaselineIndex.from_sap_group(self._sap_group)
+        return self._baseline_index
+
+    @property
+    def baselines(self):
+        return self.baseline_index.baselines
+
+    @property
+    def polarizations(self):
+        return [p.decode('utf-8') if isinstance(p, bytes) else p for p in self._sap_group['polarizations']]
+
+    @property
+    def timestamps(self):
+        timestamps = self._sap_group['timestamps'][:]
+        if self._hypercube_view.python_datetimes:
+            try:
+                # try to import lofar.common.datetimeutils here and not at the top of the file
+                # to make this hdf5_io module as loosly coupled to other lofar code as possible
+                from lofar.common.datetimeutils import from_modified_julian_date_in_seconds
+                timestamps = [from_modified_julian_date_in_seconds(t) for t in timestamps]
+            except ImportError as e:
+                logger.warning("Could not convert timestamps from modified julian date to python datetimes.")
+        return timestamps
+
+    @property
+    def central_frequencies(self):
+        return self._sap_group['central_frequencies'][:]
+
+    @property
+    def subbands(self):
+        return self._sap_group['subbands'][:]
+
+    @property
+    def antenna_locations(self):
+        antenna_locations = {}
+        if 'antenna_locations' in self._sap_group:
+            for ref_frame, location_sub_group in self._sap_group['antenna_locations'].items():
+                antenna_locations[ref_frame] = {}
+                for antenna, location in location_sub_group.items():
+                    antenna_locations[ref_frame][antenna] = tuple(location)
+        return antenna_locations
+
+    def baseline_indices(self, baselines):
+        """
+        lookup the indices along the baseline axis for the given baselines, for example to use as index in the visibilities.
+        :param list baselines: list of station pairs (tuples)
+        :return numpy.array: the baseline indices. Raises a KeyError if a baseline is not in this sap.
+        """
+        return self.baseline_index.lookup(baselines)
+
+    def select_baseline_indices(self, keep_autocorrelations: bool=True, keep_crosscorrelations: bool=True, antenna1_filter='', antenna2_filter=''):
+        """
+        select the indices along the baseline axis for the given baseline selection, see filter_baselines for the parameters.
+        The (sorted) indices can be used directly as index in the visibilities and flagging.
+        :return numpy.array: the baseline indices.
+        """
+        return self.baseline_index.indices(keep_autocorrelations=keep_autocorrelations, keep_crosscorrelations=keep_crosscorrelations,
+                                           antenna1_filter=antenna1_filter, antenna2_filter=antenna2_filter)
+
+    def subband_indices(self, subbands):
+        """
+        lookup the indices along the subband axis for the given subband numbers.
+        :param list subbands: list of subband numbers
+        :return numpy.array: the subband indices. Raises a KeyError if a subband is not in this sap.
+        """
+        subband_indices = {sb: idx for idx, sb in enumerate(self.subbands.tolist())}
+        return np.array([subband_indices[sb] for sb in subbands], dtype=np.int64)
+
+    def _read_flagging(self, hyperslab):
+        return hyperslab.read(self._sap_group['flagging'])
+
+    def _read_visibilities(self, hyperslab):
+        logger.debug('reading visibilities hyperslab of shape %s from sap %s in %s',
+                     tuple(len(hyperslab.axis_indices(axis)) for axis in range(4)), self.sap_nr, self._hypercube_view.path)
+
+        visibilities = _read_dequantized_visibilities(self._sap_group, self._hypercube_view.version, hyperslab)
+
+        if not self.visibilities_in_dB:
+            visibilities = np.power(10, 0.1*np.abs(visibilities)) * np.exp(1j * np.angle(visibilities))
+
+        #HACK: explicitely set non-XX-polarizations to 0 for apertif
+        if self._hypercube_view.wsrta_id is not None:
+            visibilities[:,:,:,hyperslab.axis_indices(3) != 0] = 0
+
+        #explicitely set flagged visibilities to 0
+        visibilities[self._read_flagging(hyperslab)] = 0.0
+
+        return visibilities
+
+class HypercubeView():
+    """
+    Lazy, sliceable, read-only view on a hypercube h5 file.
+    Contrary to read_hypercube, which reads all data of all saps into memory,
+    the HypercubeView only reads and de-quantizes the hyperslab you ask for, so you can
+    for example read one subband or one baseline without loading a multi-GB file.
+    Files of older versions (1.2, 1.3) are de-quantized on the fly, they are not converted.
+    The per-sap visibilities and flagging can be indexed numpy-style along the (baseline, time, subband, polarization) axes
+    with integers, slices, and lists/arrays of indices (or booleans). Note that, just like in h5py,
+    multiple index lists are applied independently per axis (outer indexing), and not broadcasted together like numpy does.
+
+    Example usage:
+
+    with HypercubeView(path, visibilities_in_dB=True) as view:
+        sap = view.saps[0]
+        # all timestamps and polarizations for the first baseline in subband 3
+        visibilities = sap.visibilities[0,:,3,:]
+        # all timestamps for two given baselines and all subbands for polarization 'XX'
+        visibilities = sap.visibilities[sap.baseline_indices([('CS001', 'CS002'), ('CS001', 'CS003')]),:,:,0]
+        # the autocorrelations of all core stations
+        visibilities = sap.visibilities[sap.select_baseline_indices(keep_crosscorrelations=False, antenna1_filter='CS')]
+    """
+    def __init__(self, path, visibilities_in_dB=True, python_datetimes=False):
+        """
+        :param str path: path to the hdf5 file you want to read
+        :param bool visibilities_in_dB: return the in dB scale, or linear scale.
+        :param bool python_datetimes: return the timestamps as python datetime's when True (otherwise modified_julian_date/double)
+        """
+        self.path = path
+        self.visibilities_in_dB = visibilities_in_dB
+        self.python_datetimes = python_datetimes
+        self.version = None
+        self.sas_id = None
+        self.wsrta_id = None
+        self.saps = {}
+        self._shared_file = None
+        self._file = None
+
+    def open(self):
+        logger.info('opening hypercube view on file: %s', self.path)
+
+        self._shared_file = SharedH5File(self.path, "r")
+        self._file = self._shared_file.open()
+
+        self.version = _read_version_from_file(self._file)
+        if self.version not in SUPPORTED_READ_VERSIONS:
+            version = self.version
+            self.close()
+            raise ValueError('Cannot read version %s' % (version,))
+
+        if 'measurement/sas_id' in self._file:
+            self.sas_id = self._file['measurement/sas_id'][0]
+
+        if 'measurement/wsrta_id' in self._file:
+            self.wsrta_id = self._file['measurement/wsrta_id'][0]
+
+        self.saps = {int(sap_nr): SapView(self, int(sap_nr), sap_group)
+                     for sap_nr, sap_group in self._file['measurement/saps'].items()}
+        return self
+
+    def close(self):
+        if self._shared_file is not None:
+            self._shared_file.close()
+            self._shared_file = None
+            self._file = None
+            self.saps = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def parset(self):
+        return read_hypercube_parset(self.path)
+
 def convert_12_to_13(h5_path):
     with SharedH5File(h5_path, "r+") as file:
         version_str = read_version(h5_path)
@@ -554,6 +1370,141 @@ def convert_13_to_14(h5_path):
 
         logger.info("converted %s from version %s to 1.4", h5_path, version_str)
 
+# suffix of the temporary datasets created by migrate_hypercube, which replace the original datasets when the migration is complete.
+_MIGRATION_DATASET_SUFFIX = '_migrating'
+
+def migrate_hypercube(h5_path, max_chunk_nbytes=None):
+    """
+    upgrade the hypercube h5 file at h5_path in place to the current version (1.4), if needed.
+    Contrary to convert_12_to_13 and convert_13_to_14, which rewrite complete datasets in memory,
+    the data is migrated in chunks of baselines, so the memory usage is bounded by max_chunk_nbytes.
+    The new scale factors (and for version 1.2 the re-quantized visibilities) are written in temporary datasets first,
+    which only replace the original ones when all saps are migrated. So, an interrupted migration leaves a valid file
+    of the original version, which can be migrated again.
+    Note that hdf5 does not reclaim the space of the replaced datasets. Use h5repack if you need to shrink the file.
+    Also note that reading older versions does not require a migration, see read_hypercube and HypercubeView.
+
+    :param str h5_path: path to the hdf5 file you want to migrate
+    :param int max_chunk_nbytes: the maximum number of bytes of (complex64) visibilities to process at once.
+                                 If None, then QUANTIZATION_CHUNK_NBYTES is used.
+    :return str: the version of the file before the migration.
+    """
+    with SharedH5File(h5_path, "r+") as file:
+        version_str = _read_version_from_file(file)
+
+        if version_str == HYPERCUBE_VERSION:
+            logger.debug("%s is already at version %s", h5_path, version_str)
+            return version_str
+
+        if version_str not in SUPPORTED_READ_VERSIONS:
+            raise ValueError('Cannot migrate version %s to %s' % (version_str, HYPERCUBE_VERSION))
+
+        logger.info("migrating %s from version %s to %s", h5_path, version_str, HYPERCUBE_VERSION)
+
+        sap_groups = list(file['measurement/saps'].values())
+
+        for sap_group in sap_groups:
+            _migrate_sap(sap_group, version_str, max_chunk_nbytes)
+
+        # all saps are migrated, so replace the original datasets by the migrated ones, and update the version number.
+        for sap_group in sap_groups:
+            for name in ['visibility_scale_factors', 'visibilities']:
+                if name + _MIGRATION_DATASET_SUFFIX in sap_group:
+                    del sap_group[name]
+                    sap_group.move(name + _MIGRATION_DATASET_SUFFIX, name)
+
+        file['version'][0] = HYPERCUBE_VERSION
+
+        logger.info("migrated %s from version %s to %s", h5_path, version_str, HYPERCUBE_VERSION)
+        return version_str
+
+def _migrate_sap(sap_group, version, max_chunk_nbytes=None):
+    """
+    helper method for migrate_hypercube, which writes the version 1.4 scale factors (and visibilities) of the sap_group
+    into temporary datasets, processing the visibilities in chunks of baselines.
+    """
+    if max_chunk_nbytes is None:
+        max_chunk_nbytes = QUANTIZATION_CHUNK_NBYTES
+
+    # remove any leftovers of a previously interrupted migration
+    for name in ['visibility_scale_factors', 'visibilities']:
+        if name + _MIGRATION_DATASET_SUFFIX in sap_group:
+            del sap_group[name + _MIGRATION_DATASET_SUFFIX]
+
+    visibilities_ds = sap_group['visibilities']
+    shape = visibilities_ds.shape[:4]
+
+    scale_factor_ds = sap_group.create_dataset('visibility_scale_factors' + _MIGRATION_DATASET_SUFFIX,
+                                               shape=(shape[0], shape[2], shape[3]), dtype=np.float32)
+    for key, value in sap_group['visibility_scale_factors'].attrs.items():
+        scale_factor_ds.attrs[key] = value
+    scale_factor_ds.attrs['description'] = 'multiply real and imag parts of the visibilities with this factor per baseline per subband per polatization to un-normalize them and get the 10log10 values of the real and imag parts of the visibilities'
+    scale_factor_ds.attrs['units'] = '-'
+
+    if version == '1.2':
+        # the v1.2 visibilities need re-quantization, so store them in a new dataset with the same layout as the original.
+        migrated_visibilities_ds = sap_group.create_dataset('visibilities' + _MIGRATION_DATASET_SUFFIX,
+                                                            shape=visibilities_ds.shape, dtype=np.int8,
+                                                            chunks=visibilities_ds.chunks,
+                                                            compression=visibilities_ds.compression,
+                                                            compression_opts=visibilities_ds.compression_opts,
+                                                            shuffle=visibilities_ds.shuffle)
+        for key, value in visibilities_ds.attrs.items():
+            migrated_visibilities_ds.attrs[key] = value
+
+    if version == '1.3':
+        # in v1.3 the scale factors were stored per subband per pol, and the visibilities are unchanged in v1.4
+        v13_scale_factors = sap_group['visibility_scale_factors'][:]
+
+    # the int8 real/imag pairs are de-quantized into complex64's, which take 4 times as many bytes.
+    for bl_slice in _baseline_chunk_slices(visibilities_ds, max(1, max_chunk_nbytes // 4)):
+        if version == '1.3':
+            scale_factor_ds[bl_slice] = np.broadcast_to(v13_scale_factors, (bl_slice.stop - bl_slice.start,) + v13_scale_factors.shape)
+        else:
+            visibilities_dB = _read_dequantized_visibilities(sap_group, version, _Hyperslab(bl_slice, shape))
+            # these visibilities were quantized before (so spikes are clipped already). Scale by the maximum, to prevent int8 overflows.
+            scale_factors = compute_visibility_scale_factors(np.abs(visibilities_dB), percentile=100)
+            scale_factor_ds[bl_slice] = scale_factors
+            migrated_visibilities_ds[bl_slice] = quantize_visibilities(visibilities_dB, scale_factors)
+
+def migrate_hypercubes(h5_paths, num_workers=None, max_chunk_nbytes=None):
+    """
+    migrate the given hypercube h5 files in parallel to the current version (1.4), see migrate_hypercube.
+    :param [str] h5_paths: paths of the hdf5 files you want to migrate
+    :param int num_workers: the number of worker processes. If None, then the number of cpu's (max 8) is used.
+                            If 1, then all files are migrated in this process.
+    :param int max_chunk_nbytes: the maximum number of bytes of visibilities to process at once per worker, see migrate_hypercube
+    :return dict: mapping of the path to the original version of each successfully migrated file.
+    """
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+
+    # release our cached read-only handles to these files, so the (worker) processes can open them for writing right away.
+    close_idle_h5_files()
+
+    results = {}
+
+    if num_workers > 1 and len(h5_paths) > 1:
+        # use 'spawn'ed worker processes, so they do not inherit any of our open h5 files.
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(migrate_hypercube, path, max_chunk_nbytes): path for path in h5_paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    logger.error('could not migrate %s: %s', path, e)
+    else:
+        for path in h5_paths:
+            try:
+                results[path] = migrate_hypercube(path, max_chunk_nbytes)
+            except Exception as e:
+                logger.error('could not migrate %s: %s', path, e)
+
+    logger.info('migrated %d of %d hypercube files to version %s',
+                len([v for v in results.values() if v != HYPERCUBE_VERSION]), len(h5_paths), HYPERCUBE_VERSION)
+    return results
+
 def add_parset_to_hypercube(h5_path, otdbrpc):
     """
     helper method which tries to get the parset for the sas_id in the h5 file from otdb via the otdbrpc, and add it to the h5 file.
@@ -626,225 +1577,294 @@ def get_default_h5_filename(data, timestamped_if_unknown=True):
         return datetime.utcnow().strftime('%Y%m%d%H%M%s') + '.MS_extract.h5'
     return obs_id + '.MS_extract.h5'
 
-def combine_hypercubes(input_paths, output_dir, output_filename=None, do_compress=True):
+def _read_combine_input_metadata(path):
+    """
+    helper function for combine_hypercubes, which reads the (small) metadata of all saps in the input file at path.
+    It is a module level function, so it can be executed in a worker process.
+    """
+    with SharedH5File(path, "r") as file:
+        metadata = {'path': path,
+                    'version': _read_version_from_file(file),
+                    'sas_id': file['measurement/sas_id'][0] if 'measurement/sas_id' in file else None,
+                    'wsrta_id': file['measurement/wsrta_id'][0] if 'measurement/wsrta_id' in file else None,
+                    'saps': {}}
+
+        if 'measurement/parset' in file:
+            parset_contents = file['measurement/parset'][0]
+            if isinstance(parset_contents, bytes):
+                parset_contents = parset_contents.decode('utf-8')
+            metadata['parset'] = parset_contents
+
+        for sap_nr, sap_group in file['measurement/saps'].items():
+            sap_metadata = {'baselines': BaselineIndex.from_sap_group(sap_group).baselines,
+                            'polarizations': [p.decode('utf-8') if isinstance(p, bytes) else p for p in sap_group['polarizations']],
+                            'timestamps': sap_group['timestamps'][:],
+                            'subbands': sap_group['subbands'][:],
+                            'central_frequencies': sap_group['central_frequencies'][:],
+                            'antenna_locations': {}}
+
+            for name in ['visibilities', 'flagging']:
+                ds = sap_group[name]
+                sap_metadata[name + '_layout'] = (ds.chunks, ds.compression, ds.compression_opts, ds.shuffle)
+
+            if 'antenna_locations' in sap_group:
+                for ref_frame, location_sub_group in sap_group['antenna_locations'].items():
+                    sap_metadata['antenna_locations'][ref_frame] = {antenna: location[:]
+                                                                    for antenna, location in location_sub_group.items()}
+
+            metadata['saps'][int(sap_nr)] = sap_metadata
+
+        return metadata
+
+def _read_raw_chunks(dataset):
+    """
+    helper generator yielding (offset, filter_mask, raw_bytes) for all chunks in the given chunked dataset,
+    as stored on disk, so without decompression.
+    """
+    for offset in itertools.product(*[range(0, length, chunk_length)
+                                      for length, chunk_length in zip(dataset.shape, dataset.chunks)]):
+        filter_mask, raw_bytes = dataset.id.read_direct_chunk(offset)
+        yield offset, filter_mask, raw_bytes
+
+def _read_combine_input_sap(path, sap_nr, raw_chunks):
+    """
+    helper function for combine_hypercubes, which reads the scale factors, visibilities and flagging of a sap in the input file at path.
+    The visibilities and flagging are read as raw (compressed) chunks if raw_chunks is True, else as numpy arrays.
+    It is a module level function, so it can be executed in a worker process.
+    """
+    with SharedH5File(path, "r") as file:
+        version_str = _read_version_from_file(file)
+        sap_group = file['measurement/saps/%d' % sap_nr]
+        result = {'path': path,
+                  'sap_nr': sap_nr}
+
+        if version_str == '1.2':
+            # re-quantize the on the fly de-quantized v1.2 visibilities the v1.4 way
+            visibilities_dB = _read_dequantized_visibilities(sap_group, version_str, _Hyperslab(Ellipsis, sap_group['flagging'].shape))
+            # these visibilities were quantized before (so spikes are clipped already). Scale by the maximum, to prevent int8 overflows.
+            result['visibility_scale_factors'] = compute_visibility_scale_factors(np.abs(visibilities_dB), percentile=100)
+            result['visibilities'] = quantize_visibilities(visibilities_dB, result['visibility_scale_factors'])
+            del visibilities_dB
+        elif version_str == '1.3':
+            # expand the v1.3 per subband per pol scale factors to all baselines. The visibilities are unchanged in v1.4
+            scale_factors = sap_group['visibility_scale_factors'][:]
+            result['visibility_scale_factors'] = np.repeat(scale_factors[np.newaxis], sap_group['baselines'].shape[0], axis=0)
+        else:
+            result['visibility_scale_factors'] = sap_group['visibility_scale_factors'][:]
+
+        for name in ['visibilities', 'flagging']:
+            if name in result:
+                continue
+            if raw_chunks:
+                result[name] = list(_read_raw_chunks(sap_group[name]))
+            else:
+                result[name] = sap_group[name][:]
+
+        return result
+
+def combine_hypercubes(input_paths, output_dir, output_filename=None, do_compress=True, num_workers=None, layout=None):
     """
     combine list of hypercubes into one file, for example when you created many h5 file in parallel with one subband per file.
+    The input files are read with a pool of worker processes, and their subbands are written in the preallocated output datasets
+    as soon as they arrive, so at most a few input files (times num_workers) are held in memory at any time.
+    When the (compressed) input visibilities and flagging are chunked per subband in the same way, and compressed like the output,
+    then the raw chunks are copied directly, without decompressing and recompressing them.
     :param [str] input_paths: paths of the hdf5 files you want to read and combine
     :param str output_dir: directory where to save the resulting combined h5 file
     :param str output_filename: optional output filename. if None, then <get_observation_id_str>.MS_extract.h5 is used
     :param bool do_compress: compress the visibilities and flagging data (with lzf compression, slower but smaller output size)
+    :param int num_workers: the number of worker processes reading the input files. If None, then the number of cpu's (max 8) is used.
+                            If 1, then all files are read in this process.
+    :param layout: optional chunk layout and compression profile (a HypercubeLayout, or the name of one of the HYPERCUBE_LAYOUTS)
+                   for the output visibilities and flagging. If given, it overrules do_compress.
     """
-    input_files = []
     output_path = None
+    executor = None
     try:
+        start_timestamp = datetime.utcnow()
         input_paths = sorted(input_paths)
         existing_paths = [p for p in input_paths if os.path.exists(p)]
         if not existing_paths:
             raise ValueError('No input h5 files with valid paths given: %s' % (', '.join(input_paths),))
 
-        # convert any 1.2 to 1.3 file if needed
-        for path in existing_paths:
-            with SharedH5File(path, "r") as file:
-                if read_version(path) == '1.2':
-                    convert_12_to_13(path)
-
-        # convert any 1.3 to 1.4 file if needed
-        for path in existing_paths:
-            with SharedH5File(path, "r") as file:
-                if read_version(path) == '1.3':
-                    convert_13_to_14(path)
-
-        input_files = [SharedH5File(p, "r").open() for p in existing_paths]
-
-        versions = set([file['version'][0] for file in input_files])
+        if num_workers is None:
+            num_workers = min(8, os.cpu_count() or 1)
 
-        if len(versions) != 1:
-            raise ValueError('Cannot combine h5 files of multiple versions: %s' % (', '.join(versions),))
+        if num_workers > 1 and len(existing_paths) > 1:
+            # use 'spawn'ed worker processes, so they do not inherit any of our open (output) h5 files.
+            executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+            input_metadatas = list(executor.map(_read_combine_input_metadata, existing_paths))
+        else:
+            input_metadatas = [_read_combine_input_metadata(path) for path in existing_paths]
 
-        version_str = list(versions)[0]
+        # older input versions are de-quantized (and if needed re-quantized) on the fly. The output is always the current version.
+        unsupported_versions = set([metadata['version'] for metadata in input_metadatas]) - set(SUPPORTED_READ_VERSIONS)
 
-        if version_str != '1.4':
-            raise ValueError('Cannot read version %s' % (version_str,))
+        if unsupported_versions:
+            raise ValueError('Cannot read version %s' % (', '.join(unsupported_versions),))
 
-        sas_ids = set([file['measurement/sas_id'][0] for file in input_files if 'measurement/sas_id' in file])
+        sas_ids = set([metadata['sas_id'] for metadata in input_metadatas if metadata['sas_id'] is not None])
         if len(sas_ids) > 1:
-            raise ValueError('Cannot combine h5 files of multiple observations with multiple sas_ids: %s' % (', '.join(sas_ids),))
+            raise ValueError('Cannot combine h5 files of multiple observations with multiple sas_ids: %s' % (', '.join(str(x) for x in sas_ids),))
         sas_id = list(sas_ids)[0] if sas_ids else None
 
-        wsrta_ids = set([file['measurement/wsrta_id'][0] for file in input_files if 'measurement/wsrta_id' in file])
+        wsrta_ids = set([metadata['wsrta_id'] for metadata in input_metadatas if metadata['wsrta_id'] is not None])
         if len(wsrta_ids) > 1:
-            raise ValueError('Cannot combine h5 files of multiple observations with multiple wsrta_ids: %s' % (', '.join(wsrta_ids),))
+            raise ValueError('Cannot combine h5 files of multiple observations with multiple wsrta_ids: %s' % (', '.join(str(x) for x in wsrta_ids),))
         wsrta_id = list(wsrta_ids)[0] if wsrta_ids else None
 
         if output_filename is None:
             output_filename = get_default_h5_filename({'sas_id':sas_id} if sas_id else
-                                                      {'wsrta_id': wsrta_id} if wsrta_id else None)
+                                                      {'wsrta_id': wsrta_id} if wsrta_id else {})
 
         output_path = os.path.join(output_dir, output_filename)
         logger.info('combine_hypercubes: combining %s h5 files into %s', len(input_paths), output_path)
 
-        with SharedH5File(output_path, "w") as output_file:
-            version = '1.4'
-            ds = output_file.create_dataset('version', (1,), h5py.special_dtype(vlen=str), version)
-            ds.attrs['description'] = 'version of this hdf5 MS extract file'
-
-            measurement_group = output_file.create_group('measurement')
-            measurement_group.attrs['description'] = 'all data (visibilities, flagging, parset, ...) for this measurement (observation/pipeline)'
-
-            if sas_id is not None:
-                ds = output_file.create_dataset('measurement/sas_id', data=[sas_id])
-                ds.attrs['description'] = 'observation/pipeline sas id'
-
-            #copy parset from the first input file containing one. assume parset is equal in all input files.
-            for input_file in input_files:
-                if 'measurement/parset' in input_file:
-                    parset_contents = input_file['measurement/parset'][0]
-                    if isinstance(parset_contents, bytes):
-                        parset_contents = parset_contents.decode('utf-8')
-                    ds = output_file.create_dataset('measurement/parset', (1,), h5py.special_dtype(vlen=str),
-                                                    [str(parset_contents).encode('utf-8')], compression="lzf")
-                    ds.attrs['description'] = 'the parset of this observation/pipeline with all settings how this data was created'
-                    break
-
-            #make saps group and description
-            saps_group = output_file.create_group('measurement/saps')
-            saps_group.attrs['description'] = 'the data (visibilities, flagging, ...) is stored per sub-array-pointing (sap)'
-
-            #rest of the items are multi dimensional, and may have different dimensions across the input files (only along the subband axis)
-            #gather item values of all files, per sap, then combine, then write in output_file
-            value_dicts_per_sap = {}
-            for input_file in input_files:
-                logger.info('combine_hypercubes: parsing file %s', input_file.filename)
-
-                for sap_nr, sap_dict in input_file['measurement/saps'].items():
-                    sap_nr = int(sap_nr)
-                    logger.info('combine_hypercubes:   parsing sap %d in file %s', sap_nr, input_file.filename)
-
-                    #gather all items of one sap of one file in one dict
-                    file_sap_value_dict = {}
-
-                    for item in sap_dict.keys():
-                        key = 'measurement/saps/%s/%s' % (sap_nr, item)
-                        if item == 'antenna_locations':
-                            file_sap_value_dict[key] = {}
-                            location_group = sap_dict['antenna_locations']
-                            for ref_frame, location_sub_group in location_group.items():
-                                file_sap_value_dict[key][ref_frame] = {}
-                                for antenna, location in location_sub_group.items():
-                                    file_sap_value_dict[key][ref_frame][antenna] = location
-                        else:
-                            file_sap_value_dict[key] = input_file[key][:]
-
-                    #now, all items of this sap in input_file have been gathered into file_sap_value_dict
-                    #this sap of this input file may contain mutiple subbands
-                    #split out file_value_dict per subband
-                    if sap_nr not in value_dicts_per_sap:
-                        #per sap we make lists of value_dicts (one value_dict per file)
-                        #we'll sort and combine them later
-                        value_dicts_per_sap[sap_nr] = []
-
-                    num_subbands_in_sap_in_input_file = len(file_sap_value_dict['measurement/saps/%s/subbands' % (sap_nr,)])
-                    logger.info('combine_hypercubes:   num_subbands=%d in sap %d in file %s', num_subbands_in_sap_in_input_file, sap_nr, input_file.filename)
-
-                    for sb_cntr in range(num_subbands_in_sap_in_input_file):
-                        value_dict = {}
-                        for key,data in file_sap_value_dict.items():
-                            if 'visibilities' in key:
-                                value_dict[key] = data[:,:,sb_cntr,:,:]
-                            elif 'flagging' in key:
-                                value_dict[key] = data[:,:,sb_cntr,:]
-                            elif any(item in key for item in ['baselines', 'polarizations', 'timestamps', 'antenna_locations']):
-                                value_dict[key] = data
-                            elif 'visibility_scale_factors' in key:
-                                value_dict[key] = data[:, sb_cntr,:]
-                            else:
-                                value_dict[key] = data[sb_cntr]
-
-                        #append the value_dict holding the items of a single subband to the subband list of this sap
-                        value_dicts_per_sap[sap_nr].append(value_dict)
-
-            logger.info('combine_hypercubes: sorting and combining all subbands and saps into one output file: %s', output_path)
-
-            #all saps and all subbands have been parsed and put into value_dicts_per_sap
-            #sort and combine them
-            for sap_nr,sap_value_dicts in value_dicts_per_sap.items():
-                num_subbands = len(sap_value_dicts)
-                logger.info('combine_hypercubes:   sorting and combining %d subbands for sap %d', num_subbands, sap_nr)
-                #sort the sap_value_dicts by subband
-                sap_value_dicts = sorted(sap_value_dicts, key=lambda x: x['measurement/saps/%s/subbands' % (sap_nr,)])
-
-                #combine all seperate subbands
-                if sap_value_dicts:
-                    combined_value_dict = {}
-                    #setup numpy arrays based on shape and type of first value_dict, extend sb dimension to num_subbands
-                    for key,data in sap_value_dicts[0].items():
-                        if 'visibilities' in key or 'flagging' in key:
-                            shape = list(data.shape)
-                            shape.insert(2, num_subbands)
-                            shape = tuple(shape)
-                        elif 'visibility_scale_factors' in key:
-                            # from (#bl,#pol) to (#bl,#sb,#pol)
-                            shape = (data.shape[0], num_subbands, data.shape[1])
-                        else:
-                            shape = (num_subbands,)
-
-                        if 'antenna_locations' not in key:
-                            combined_value_dict[key] = np.empty(shape=shape, dtype=data.dtype)
-
-                    #now loop over all value_dicts and copy data to it's subband slice in the just created empty numpy arrays
-                    for sb_cntr, value_dict in enumerate(sap_value_dicts):
-                        for key,data in value_dict.items():
-                            if 'visibilities' in key:
-                                combined_value_dict[key][:,:,sb_cntr,:,:] = data
-                            elif 'flagging' in key:
-                                combined_value_dict[key][:,:,sb_cntr,:] = data
-                            elif any(item in key for item in ['baselines', 'polarizations', 'timestamps', 'antenna_locations']):
-                                combined_value_dict[key] = data
-                            elif 'visibility_scale_factors' in key:
-                                combined_value_dict[key][:,sb_cntr,:] = data
-                            else:
-                                combined_value_dict[key][sb_cntr] = data
-
-                    for key,data in combined_value_dict.items():
-                        logger.info('combine_hypercubes:   storing %s in %s', key, output_filename)
-                        ds_out = None
-                        if 'visibilities' in key or 'flagging' in key:
-                            ds_out = output_file.create_dataset(key, data=data,
-                                                                compression="lzf" if do_compress else None)
-                        elif 'antenna_locations' in key:
-                            location_group = output_file.create_group(key)
-                            location_group.attrs['description'] = 'the antenna locations in XYZ, PQR, WGS84 coordinates (units: meters and/or radians)'
-                            for ref_frame, antenna_locations in data.items():
-                                location_sub_group = location_group.create_group(ref_frame)
-                                location_sub_group.attrs['description'] = 'the antenna locations in %s coordinates (units: meters and/or radians)' % (ref_frame,)
-
-                                for antenna, location in antenna_locations.items():
-                                    location_sub_group.create_dataset(antenna, data=location)
-                        else:
-                            ds_out = output_file.create_dataset(key, data=data)
-
-                        #search first input_file containing this keys
-                        #and copy all dataset attributes from the input_file to the output_file
-                        try:
-                            if ds_out:
-                                input_file = next(f for f in input_files if key in f)
-                                ds_in = input_file[key]
-
-                                for attr_key, attr_value in ds_in.attrs.items():
-                                    ds_out.attrs[attr_key] = attr_value
-                        except StopIteration:
-                            pass #no input file with key, so nothing to copy.
-
-        fill_info_folder_from_parset(output_path)
+        #copy parset from the first input file containing one. assume parset is equal in all input files.
+        parset = next((metadata['parset'] for metadata in input_metadatas if 'parset' in metadata), None)
+
+        #the items of the saps may have different dimensions across the input files (only along the subband axis)
+        #gather the per subband metadata of all files, per sap, then sort them, to determine the output subband index of each input subband
+        #each item in the per sap list is a tuple (subband, input_file_idx, subband_idx_in_input_file)
+        subbands_per_sap = {}
+        for file_idx, metadata in enumerate(input_metadatas):
+            for sap_nr, sap_metadata in metadata['saps'].items():
+                logger.info('combine_hypercubes:   num_subbands=%d in sap %d in file %s',
+                            len(sap_metadata['subbands']), sap_nr, metadata['path'])
+                subbands_per_sap.setdefault(sap_nr, []).extend((subband, file_idx, sb_idx)
+                                                               for sb_idx, subband in enumerate(sap_metadata['subbands']))
+
+        output_subband_indices = {}
+        raw_chunk_copy_per_sap = {}
+
+        with HypercubeWriter(output_path, parset=parset, sas_id=sas_id, wsrta_id=wsrta_id, do_compress=do_compress, layout=layout) as writer:
+            for sap_nr in sorted(subbands_per_sap.keys()):
+                sap_subbands = sorted(subbands_per_sap[sap_nr])
+                logger.info('combine_hypercubes:   preallocating %d subbands for sap %d', len(sap_subbands), sap_nr)
+
+                for output_sb_idx, (subband, file_idx, sb_idx) in enumerate(sap_subbands):
+                    output_subband_indices[(file_idx, sap_nr, sb_idx)] = output_sb_idx
+
+                sap_file_indices = sorted(set(x[1] for x in sap_subbands))
+                sap_metadatas = [input_metadatas[file_idx]['saps'][sap_nr] for file_idx in sap_file_indices]
+                first_sap_metadata = sap_metadatas[0]
+
+                # raw chunks can only be copied when all inputs have the same per-subband chunking and compression as the output,
+                # and when the visibilities do not need to be re-quantized (v1.2).
+                output_shape = (len(first_sap_metadata['baselines']), len(first_sap_metadata['timestamps']),
+                                len(sap_subbands), len(first_sap_metadata['polarizations']))
+                raw_chunk_copy = all(input_metadatas[file_idx]['version'] != '1.2' for file_idx in sap_file_indices) and \
+                                 all(sap_metadata[name + '_layout'] == first_sap_metadata[name + '_layout'] and
+                                     _can_copy_raw_chunks(sap_metadata[name + '_layout'], writer.layout, output_shape, itemsize)
+                                     for sap_metadata in sap_metadatas
+                                     for name, itemsize in [('visibilities', 2), ('flagging', 1)])
+                raw_chunk_copy_per_sap[sap_nr] = raw_chunk_copy
+                logger.info('combine_hypercubes:   %s visibilities and flagging for sap %d', 'copying raw chunks of' if raw_chunk_copy else 'recompressing', sap_nr)
+
+                central_frequencies = [input_metadatas[file_idx]['saps'][sap_nr]['central_frequencies'][sb_idx]
+                                       for (subband, file_idx, sb_idx) in sap_subbands]
+
+                writer.create_sap(sap_nr,
+                                  baselines=first_sap_metadata['baselines'],
+                                  timestamps=first_sap_metadata['timestamps'],
+                                  central_frequencies=central_frequencies,
+                                  subbands=[x[0] for x in sap_subbands],
+                                  polarizations=first_sap_metadata['polarizations'],
+                                  antenna_locations=first_sap_metadata['antenna_locations'],
+                                  visibilities_chunks=first_sap_metadata['visibilities_layout'][0] if raw_chunk_copy else
+                                                      _one_subband_wide_chunk_shape(writer.layout, output_shape, 2),
+                                  flagging_chunks=first_sap_metadata['flagging_layout'][0] if raw_chunk_copy else
+                                                  _one_subband_wide_chunk_shape(writer.layout, output_shape, 1))
+
+            # now read the data of all saps in all input files, and write it into the output datasets
+            read_jobs = [(metadata['path'], sap_nr, raw_chunk_copy_per_sap[sap_nr], file_idx)
+                         for file_idx, metadata in enumerate(input_metadatas)
+                         for sap_nr in sorted(metadata['saps'].keys())]
+
+            for (path, sap_nr, raw_chunk_copy, file_idx), sap_data in _execute_read_jobs(executor, num_workers, read_jobs):
+                logger.info('combine_hypercubes:   storing sap %d of file %s in %s', sap_nr, path, output_filename)
+                sap_group = writer.file['measurement/saps/%d' % sap_nr]
+                num_subbands_in_file = sap_data['visibility_scale_factors'].shape[1]
+                output_sb_indices = [output_subband_indices[(file_idx, sap_nr, sb_idx)] for sb_idx in range(num_subbands_in_file)]
+
+                for sb_idx, output_sb_idx in enumerate(output_sb_indices):
+                    sap_group['visibility_scale_factors'][:, output_sb_idx, :] = sap_data['visibility_scale_factors'][:, sb_idx, :]
+
+                for name in ['visibilities', 'flagging']:
+                    ds_out = sap_group[name]
+                    if raw_chunk_copy:
+                        for offset, filter_mask, raw_bytes in sap_data[name]:
+                            # the chunks are one subband wide, so only the subband offset needs to be mapped.
+                            output_offset = offset[:2] + (output_sb_indices[offset[2]],) + offset[3:]
+                            ds_out.id.write_direct_chunk(output_offset, raw_bytes, filter_mask)
+                    else:
+                        for sb_idx, output_sb_idx in enumerate(output_sb_indices):
+                            ds_out[:, :, output_sb_idx] = sap_data[name][:, :, sb_idx]
+
+        input_nbytes = sum(os.path.getsize(p) for p in existing_paths)
+        elapsed_seconds = max(1e-6, (datetime.utcnow() - start_timestamp).total_seconds())
+        logger.info('combine_hypercubes: read %.1f MB from %d files in %.1f seconds: %.1f MB/s',
+                    input_nbytes/1e6, len(existing_paths), elapsed_seconds, input_nbytes/1e6/elapsed_seconds)
     except Exception as e:
         logger.exception('combine_hypercubes: %s', e)
     finally:
-        for h5file in input_files:
-            h5file.close()
+        if executor is not None:
+            executor.shutdown()
 
     logger.info('combine_hypercubes: finished combining %s h5 files into %s', len(input_paths), output_path)
     return output_path
 
+def _one_subband_wide_chunk_shape(layout, shape, itemsize):
+    """
+    helper function for combine_hypercubes, which computes the chunk shape following the given HypercubeLayout,
+    but only one subband wide. combine_hypercubes writes the (recompressed) data per subband, so this way each chunk
+    is compressed exactly once, instead of being decompressed and recompressed for each subband it spans.
+    :return tuple: the chunk shape, or None for a contiguous (uncompressed, unchunked) dataset.
+    """
+    if layout.compression is None and layout.chunks is None:
+        return None
+
+    chunks = list(layout.chunks) if layout.chunks is not None else [0, 0, 1, 0]
+    chunks[2] = 1
+    return HypercubeLayout(chunks=chunks, max_chunk_nbytes=layout.max_chunk_nbytes).chunk_shape(shape, itemsize)
+
+def _can_copy_raw_chunks(input_layout, output_layout, output_shape, itemsize):
+    """
+    helper function for combine_hypercubes, which checks if the raw chunks of an input dataset with the given
+    input_layout (chunks, compression, compression_opts, shuffle) can be copied into the output dataset with the given HypercubeLayout.
+    """
+    chunks, compression, compression_opts, shuffle = input_layout
+
+    if chunks is None or chunks[2] != 1 or compression is None:
+        return False
+
+    if compression != output_layout.compression or compression_opts != output_layout.compression_opts or bool(shuffle) != bool(output_layout.shuffle):
+        return False
+
+    # if the output layout has an explicit chunk shape, then the input chunks should match it.
+    return output_layout.chunks is None or tuple(chunks[:4]) == output_layout.chunk_shape(output_shape, itemsize)
+
+def _execute_read_jobs(executor, num_workers, read_jobs):
+    """
+    helper generator for combine_hypercubes, yielding (read_job, sap_data) tuples in order of completion.
+    At most 2*num_workers jobs are in flight (and thus in memory) at any time.
+    """
+    if executor is None:
+        for read_job in read_jobs:
+            yield read_job, _read_combine_input_sap(*read_job[:3])
+        return
+
+    read_jobs = list(read_jobs)
+    pending = {}
+    while read_jobs or pending:
+        while read_jobs and len(pending) < 2*num_workers:
+            read_job = read_jobs.pop(0)
+            pending[executor.submit(_read_combine_input_sap, *read_job[:3])] = read_job
+
+        done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
 def _write_common_clustering_groups(h5_path, saps_dict, label: str = None):
     """
     helper method to write some common groups when writing clustering results into the h5_path
@@ -1251,54 +2271,38 @@ def read_file_annotations(h5_path):
                                            'timestamp': datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')})
     return result_annotations
 
-def get_baselines(h5_path):
+def get_baseline_index(h5_path):
+    """
+    :return BaselineIndex: the baseline index of the first sap in the given h5 file
+    """
     with SharedH5File(h5_path, "r") as file:
         for sap_dict in file['measurement/saps'].values():
-            baselines = sap_dict['baselines'][:]
-            baselines = [(bl[0].decode('utf-8') if isinstance(bl[0], bytes) else bl[0],
-                          bl[1].decode('utf-8') if isinstance(bl[1], bytes) else bl[1]) for bl in baselines]
-            return baselines
+            return BaselineIndex.from_sap_group(sap_dict)
+
+def get_baselines(h5_path):
+    return get_baseline_index(h5_path).baselines
 
 def get_stations_from_baselines(baselines: []):
-    stations = set()
-    for bl in baselines:
-        stations.add(bl[0])
-        stations.add(bl[1])
-    return sorted(stations)
+    if isinstance(baselines, BaselineIndex):
+        return baselines.used_stations
+    return BaselineIndex.from_baselines(baselines).stations.tolist()
 
 def get_stations(h5_path):
-    return get_stations_from_baselines(get_baselines(h5_path))
+    return get_baseline_index(h5_path).used_stations
 
 def filter_baselines(baselines: [], keep_autocorrelations: bool=True, keep_crosscorrelations: bool=True, antenna1_filter: str='', antenna2_filter: str=''):
-    if not keep_autocorrelations:
-        # filter out auto-correlation baselines
-        baselines = [bl for bl in baselines if bl[0] != bl[1]]
-
-    if not keep_crosscorrelations:
-        # filter out cross-correlation baselines
-        baselines = [bl for bl in baselines if bl[0] == bl[1]]
-
-    antenna1_filters = []
-    if isinstance(antenna1_filter, str):
-        antenna1_filters = [x.strip() for x in antenna1_filter.split(',') if x.strip()]
-    elif antenna1_filter:
-        antenna1_filters = antenna1_filter
-
-    antenna2_filters = []
-    if isinstance(antenna2_filter, str):
-        antenna2_filters = [x.strip() for x in antenna2_filter.split(',') if x.strip()]
-    elif antenna2_filter:
-        antenna2_filters = antenna2_filter
-
-    if antenna1_filters:
-        # filter out baselines which do not match (one of the) antenna1_filters
-        baselines = [bl for bl in baselines if any(f for f in antenna1_filters if f in  bl[0])]
-
-    if antenna2_filters:
-        # filter out baselines which do not match (one of the) antenna2_filters
-        baselines = [bl for bl in baselines if any(f for f in antenna2_filters if f in  bl[1])]
-
-    return baselines
+    """
+    filter the given baselines.
+    :param baselines: list of station pairs (tuples), or a BaselineIndex
+    :param bool keep_autocorrelations: when False, filter out the auto-correlation baselines
+    :param bool keep_crosscorrelations: when False, filter out the cross-correlation baselines
+    :param antenna1_filter: comma seperated string, or list, of station patterns. Only keep the baselines of which antenna1 matches (one of) the patterns.
+    :param antenna2_filter: comma seperated string, or list, of station patterns. Only keep the baselines of which antenna2 matches (one of) the patterns.
+    :return list: the filtered baselines as list of station pairs (tuples)
+    """
+    baseline_index = baselines if isinstance(baselines, BaselineIndex) else BaselineIndex.from_baselines(baselines)
+    return baseline_index.select(keep_autocorrelations=keep_autocorrelations, keep_crosscorrelations=keep_crosscorrelations,
+                                 antenna1_filter=antenna1_filter, antenna2_filter=antenna2_filter)
 
 def read_info_from_hdf5(h5_path, read_data_info=True, read_parset_info=True):
     """
@@ -18,10 +18,12 @@
 # with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+from unittest import mock
 import logging
 import tempfile
 import os
 import random
+import shutil
 import numpy as np
 from datetime import datetime, timedelta
 
@@ -142,6 +144,27 @@ class TestHdf5_IO(unittest.TestCase):
                 self.assertEqual(i+1, len(filtered_baselines))
                 for bl in filtered_baselines:
                     self.assertEqual(station, bl[1])
+
+            # the vectorized baseline index of the file should give the same selections, as indices along the baseline axis
+            baseline_index = get_baseline_index(path)
+            self.assertEqual(expected_stations, baseline_index.stations.tolist())
+            self.assertEqual(expected_baselines, baseline_index.baselines)
+            self.assertEqual(filter_baselines(baselines, keep_autocorrelations=False, antenna1_filter='CS001,CS003'),
+                             [baselines[idx] for idx in baseline_index.indices(keep_autocorrelations=False, antenna1_filter='CS001,CS003')])
+            self.assertEqual([3, 0, len(baselines)-1],
+                             baseline_index.lookup([baselines[3], baselines[0], baselines[-1]]).tolist())
+            self.assertEqual([False, True] + [False]*(len(baselines)-2),
+                             baseline_index.isin([baselines[1], ('CS001', 'RS999')]).tolist())
+            with self.assertRaises(KeyError):
+                baseline_index.lookup([('CS001', 'RS999')])
+
+            with HypercubeView(path) as view:
+                sap_view = view.saps[0]
+                autocorrelation_indices = sap_view.select_baseline_indices(keep_crosscorrelations=False)
+                self.assertEqual(num_stations, len(autocorrelation_indices))
+                self.assertEqual(sap_view.baseline_indices(filter_baselines(baselines, keep_crosscorrelations=False)).tolist(),
+                                 autocorrelation_indices.tolist())
+                self.assertEqual((num_stations,) + sap_view.shape[1:], sap_view.visibilities[autocorrelation_indices].shape)
         finally:
             logger.info('removing test file: %s', path)
             os.remove(path)
@@ -345,6 +368,155 @@ class TestHdf5_IO(unittest.TestCase):
             logger.info('removing test file: %s', path)
             os.remove(path)
 
+    @unit_test
+    def test_vectorized_quantization_equals_loops(self):
+        '''verify that the vectorized scale factor computation and int8 packing
+        results in exactly the same bytes as the original per baseline/subband/pol loops.'''
+        logger.info('test_vectorized_quantization_equals_loops')
+
+        saps_in = create_hypercube(num_saps=1, num_stations=5, num_timestamps=17,
+                                   num_subbands_per_sap={0: 7}, snr=0.5, max_signal_amplitude=1000)
+        visibilities = saps_in[0]['visibilities']
+        visibility_amplitudes_dB = 10.0*np.log10(np.abs(visibilities))
+        visibilities_dB = visibility_amplitudes_dB * np.exp(1j*np.angle(visibilities))
+
+        # the original v1.4 loops
+        num_baselines, num_timestamps, num_subbands, num_polarizations = visibilities.shape
+        expected_scale_factors = np.empty(shape=(num_baselines, num_subbands, num_polarizations), dtype=np.float32)
+        expected_scaled_visibilities = np.empty(visibilities.shape + (2,), dtype=np.int8)
+        for bl_idx in range(num_baselines):
+            for pol_idx in range(num_polarizations):
+                for sb_idx in range(num_subbands):
+                    max_abs_vis_sb = max(1.0, np.percentile(visibility_amplitudes_dB[bl_idx,:,sb_idx,pol_idx], 99.5))
+                    expected_scale_factors[bl_idx, sb_idx, pol_idx] = 1.0/(127.0 / max_abs_vis_sb)
+
+                    scale_factor = 1.0 / expected_scale_factors[bl_idx, sb_idx, pol_idx]
+                    expected_scaled_visibilities[bl_idx,:,sb_idx,pol_idx,0] = scale_factor*visibilities_dB[bl_idx,:,sb_idx,pol_idx].real
+                    expected_scaled_visibilities[bl_idx,:,sb_idx,pol_idx,1] = scale_factor*visibilities_dB[bl_idx,:,sb_idx,pol_idx].imag
+
+        scale_factors = compute_visibility_scale_factors(visibility_amplitudes_dB)
+        scaled_visibilities = quantize_visibilities(visibilities_dB, scale_factors)
+
+        self.assertEqual(expected_scale_factors.dtype, scale_factors.dtype)
+        self.assertEqual(expected_scale_factors.tobytes(), scale_factors.tobytes())
+        self.assertEqual(expected_scaled_visibilities.dtype, scaled_visibilities.dtype)
+        self.assertEqual(expected_scaled_visibilities.tobytes(), scaled_visibilities.tobytes())
+
+    @unit_test
+    def test_incremental_hypercube_writer(self):
+        '''write the same hypercube at once with write_hypercube, and per chunk of baselines with the HypercubeWriter,
+        and check that both files contain the same data.'''
+        logger.info('test_incremental_hypercube_writer')
+
+        path_at_once = tempfile.mkstemp()[1]
+        path_incremental = tempfile.mkstemp()[1]
+        try:
+            saps_in = create_hypercube(num_saps=2, num_stations=5, num_timestamps=7)
+
+            write_hypercube(path_at_once, saps_in, sas_id=123456)
+
+            with HypercubeWriter(path_incremental, sas_id=123456) as writer:
+                for sap_nr, sap_in in saps_in.items():
+                    writer.create_sap(sap_nr, sap_in['baselines'], sap_in['timestamps'], sap_in['central_frequencies'],
+                                      sap_in['subbands'], sap_in['polarizations'], sap_in['antenna_locations'])
+
+                    # write in chunks of 4 baselines, the last chunk is smaller
+                    num_baselines = len(sap_in['baselines'])
+                    for bl_offset in range(0, num_baselines, 4):
+                        writer.write_baselines(sap_nr, bl_offset,
+                                               sap_in['visibilities'][bl_offset:bl_offset+4].copy(),
+                                               sap_in['flagging'][bl_offset:bl_offset+4].copy())
+
+            result_at_once = read_hypercube(path_at_once, visibilities_in_dB=False)
+            result_incremental = read_hypercube(path_incremental, visibilities_in_dB=False)
+
+            self.assertEqual(123456, result_incremental['sas_id'])
+            self.assertEqual(sorted(result_at_once['saps'].keys()), sorted(result_incremental['saps'].keys()))
+
+            for sap_nr, sap_at_once in result_at_once['saps'].items():
+                sap_incremental = result_incremental['saps'][sap_nr]
+                self.assertEqual(sap_at_once['baselines'], sap_incremental['baselines'])
+                self.assertTrue(np.array_equal(sap_at_once['subbands'], sap_incremental['subbands']))
+                self.assertTrue(np.array_equal(sap_at_once['timestamps'], sap_incremental['timestamps']))
+                self.assertTrue(np.array_equal(sap_at_once['flagging'], sap_incremental['flagging']))
+                self.assertTrue(np.array_equal(sap_at_once['visibilities'], sap_incremental['visibilities']))
+
+            with h5py.File(path_incremental, "r") as file:
+                self.assertEqual((len(saps_in[0]['baselines']), len(saps_in[0]['subbands']), 4),
+                                 file['measurement/saps/0/visibility_scale_factors'].shape)
+        finally:
+            for path in [path_at_once, path_incremental]:
+                logger.info('removing test file: %s', path)
+                os.remove(path)
+
+    @unit_test
+    def test_incremental_hypercube_writer_failure(self):
+        '''an error while writing should not result in a file with a filled info folder which looks complete.'''
+        logger.info('test_incremental_hypercube_writer_failure')
+
+        path = tempfile.mkstemp()[1]
+        try:
+            with mock.patch('lofar.qa.hdf5_io.fill_info_folder_from_parset') as mocked_fill_info_folder:
+                with self.assertRaises(RuntimeError):
+                    with HypercubeWriter(path, parset=parameterset(), sas_id=123456):
+                        raise RuntimeError("simulated error while writing")
+
+                mocked_fill_info_folder.assert_not_called()
+
+                # and a normal close does fill the info folder
+                with HypercubeWriter(path, parset=parameterset(), sas_id=123456):
+                    pass
+
+                mocked_fill_info_folder.assert_called_once_with(path)
+        finally:
+            logger.info('removing test file: %s', path)
+            os.remove(path)
+
+    @unit_test
+    def test_hypercube_view(self):
+        '''compare hyperslabs read via the lazy HypercubeView with the same slices of the fully read hypercube.'''
+        logger.info('test_hypercube_view')
+
+        path = tempfile.mkstemp()[1]
+        try:
+            saps_in = create_hypercube(num_saps=2, num_stations=4, num_timestamps=6)
+            saps_in[0]['flagging'][1,2,3,0] = True
+            write_hypercube(path, saps_in)
+
+            for visibilities_in_dB in [True, False]:
+                result = read_hypercube(path, visibilities_in_dB=visibilities_in_dB)
+
+                with HypercubeView(path, visibilities_in_dB=visibilities_in_dB) as view:
+                    self.assertEqual(sorted(result['saps'].keys()), sorted(view.saps.keys()))
+
+                    for sap_nr, sap_view in view.saps.items():
+                        sap_out = result['saps'][sap_nr]
+                        self.assertEqual(sap_out['baselines'], sap_view.baselines)
+                        self.assertEqual(sap_out['polarizations'], sap_view.polarizations)
+                        self.assertTrue(np.array_equal(sap_out['subbands'], sap_view.subbands))
+                        self.assertEqual(sap_out['visibilities'].shape, sap_view.visibilities.shape)
+
+                        for key in [Ellipsis, (0,), (1, slice(None), 3), (slice(None), 2, slice(1, 9, 3), 0),
+                                    ([3, 1, 1],), (slice(None, None, -1), -1), (-2, -1, -1, -1),
+                                    (np.arange(len(sap_view.baselines)) % 2 == 0, Ellipsis, slice(0, 4, 3))]:
+                            self.assertTrue(np.array_equal(sap_out['visibilities'][key], sap_view.visibilities[key]))
+                            self.assertTrue(np.array_equal(sap_out['flagging'][key], sap_view.flagging[key]))
+
+                        # multiple index lists are applied per axis
+                        self.assertTrue(np.array_equal(sap_out['visibilities'][[3, 1]][:, :, [5, 0, 2]],
+                                                       sap_view.visibilities[[3, 1], :, [5, 0, 2]]))
+
+                        # lookup by baseline
+                        baselines = [sap_view.baselines[4], sap_view.baselines[2]]
+                        self.assertTrue(np.array_equal(sap_out['visibilities'][[4, 2]],
+                                                       sap_view.visibilities[sap_view.baseline_indices(baselines)]))
+
+                        with self.assertRaises(IndexError):
+                            sap_view.visibilities[len(sap_view.baselines)]
+        finally:
+            logger.info('removing test file: %s', path)
+            os.remove(path)
+
     @unit_test
     def test_12_to_13_to_14_conversion(self):
         path = tempfile.mkstemp()[1]
@@ -362,9 +534,7 @@ class TestHdf5_IO(unittest.TestCase):
             write_hypercube(path, saps_in, sas_id=123456)
 
             # check if version is 1.4
-            with h5py.File(path, "r") as file:
-                version_str = file['version'][0]
-                self.assertEqual('1.4', version_str)
+            self.assertEqual('1.4', read_version(path))
 
             # change version back to 1.2
             # and modify visibility data to have the 1.2 incorrect phases
@@ -408,66 +578,92 @@ class TestHdf5_IO(unittest.TestCase):
                     sap_group.create_dataset('visibilities', data=scaled_visibilities)
 
             # check if version is 1.2
-            with h5py.File(path, "r") as file:
-                version_str = file['version'][0]
-                self.assertEqual('1.2', version_str)
-
-            # reading the 1.2 file should result in automatic conversion via 1.3 to 1.4 and correction of phases
+            self.assertEqual('1.2', read_version(path))
+
+            # make a v1.3 copy of the file, with the old in-memory conversion
+            path13 = path + '.v13.h5'
+            shutil.copyfile(path, path13)
+            convert_12_to_13(path13)
+            self.assertEqual('1.3', read_version(path13))
+
+            # reading the 1.3 file should de-quantize it on the fly, without converting the file
+            result13 = read_hypercube(path13, visibilities_in_dB=True)
+            self.assertEqual('1.3', read_version(path13))
+
+            with HypercubeView(path13) as view:
+                for sap_nr, sap_out in result13['saps'].items():
+                    self.assertTrue(np.array_equal(sap_out['visibilities'], view.saps[sap_nr].visibilities[...]))
+                    self.assertTrue(np.array_equal(sap_out['visibilities'][:, :, [3, 1], 0], view.saps[sap_nr].visibilities[:, :, [3, 1], 0]))
+
+            # the 1.3 to 1.4 migration does not touch the visibilities, so the result should be exactly equal.
+            self.assertEqual('1.3', migrate_hypercube(path13))
+            self.assertEqual('1.4', read_version(path13))
+            result14 = read_hypercube(path13, visibilities_in_dB=True)
+            for sap_nr, sap_out in result13['saps'].items():
+                self.assertTrue(np.array_equal(sap_out['visibilities'], result14['saps'][sap_nr]['visibilities']))
+                self.assertTrue(np.array_equal(sap_out['flagging'], result14['saps'][sap_nr]['flagging']))
+
+            # reading the 1.2 file should de-quantize it on the fly and correct the phases, without converting the file
             result_raw = read_hypercube(path, visibilities_in_dB=False, python_datetimes=True)
-
-            # check if version is now 1.3
-            with h5py.File(path, "r") as file:
-                version_str = file['version'][0]
-                self.assertEqual('1.4', version_str)
-
             # read in dB as well because we usually plot the visibilities in dB
             result_dB = read_hypercube(path, visibilities_in_dB=True, python_datetimes=True)
-
-            saps_out_raw = result_raw['saps']
-            saps_out_dB = result_dB['saps']
-
-            for sap_nr, sap_in_raw in saps_in.items():
-                sap_out_raw = saps_out_raw[sap_nr]
-                sap_out_dB = saps_out_dB[sap_nr]
-
-                # compare all in/out visibilities
-                vis_in_raw = sap_in_raw['visibilities']
-                vis_out_raw = sap_out_raw['visibilities']
-                vis_out_dB = sap_out_dB['visibilities']
-
-                # for the raw visibilities, comparison is easy...
-                # just check the differences in amplitude and in phase
-                abs_diff_raw = np.abs(vis_in_raw) - np.abs(vis_out_raw)
-                abs_phase_diff_raw = np.abs(np.unwrap(np.angle(vis_in_raw) - np.angle(vis_out_raw), axis=2))
-                # phase has no 'meaning' for small (insignificant) amplitudes,
-                # so just set the phase difference to zero there
-                abs_phase_diff_raw[np.abs(vis_in_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
-                abs_phase_diff_raw[np.abs(vis_out_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
-
-                # for the visibilities in dB, the phases should be equal to the input phases,
-                # no matter whether the visibilities are in dB or raw.
-                # but the amplitudes need conversion from dB back to raw first.
-                abs_vis_out_raw_from_dB = np.power(10, 0.1 * np.abs(vis_out_dB))
-                abs_diff_raw_dB = np.abs(vis_in_raw) - abs_vis_out_raw_from_dB
-                abs_phase_diff_raw_dB = np.abs(np.unwrap(np.angle(vis_in_raw) - np.angle(vis_out_dB), axis=2))
-                # phase has no 'meaning' for small (insignificant) amplitudes, so just set it to zero there
-                abs_phase_diff_raw_dB[np.abs(vis_in_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
-                abs_phase_diff_raw_dB[abs_vis_out_raw_from_dB <= max(1.0, 1e-3 * max_amplitude)] = 0
-
-                amplitude_threshold = 0.10 * max_amplitude
-                phase_threshold = 0.025 * 2 * np.pi
-
-                for i in range(vis_in_raw.shape[0]):
-                    for j in range(vis_in_raw.shape[1]):
-                        for k in range(vis_in_raw.shape[2]):
-                            for l in range(vis_in_raw.shape[3]):
-                                self.assertLess(abs_diff_raw[i, j, k, l], amplitude_threshold)
-                                self.assertLess(abs_diff_raw_dB[i, j, k, l], amplitude_threshold)
-                                self.assertLess(abs_phase_diff_raw[i, j, k, l], phase_threshold)
-                                self.assertLess(abs_phase_diff_raw_dB[i, j, k, l], phase_threshold)
+            self.assertEqual('1.2', read_version(path))
+
+            # migrate the 1.2 file in place to 1.4 (in small chunks of baselines), and read it again
+            self.assertEqual('1.2', migrate_hypercube(path, max_chunk_nbytes=1024))
+            self.assertEqual('1.4', read_version(path))
+            self.assertEqual('1.4', migrate_hypercube(path))
+            migrated_result_raw = read_hypercube(path, visibilities_in_dB=False, python_datetimes=True)
+            migrated_result_dB = read_hypercube(path, visibilities_in_dB=True, python_datetimes=True)
+
+            for result_raw, result_dB in [(result_raw, result_dB), (migrated_result_raw, migrated_result_dB)]:
+                saps_out_raw = result_raw['saps']
+                saps_out_dB = result_dB['saps']
+
+                for sap_nr, sap_in_raw in saps_in.items():
+                    sap_out_raw = saps_out_raw[sap_nr]
+                    sap_out_dB = saps_out_dB[sap_nr]
+
+                    # compare all in/out visibilities
+                    vis_in_raw = sap_in_raw['visibilities']
+                    vis_out_raw = sap_out_raw['visibilities']
+                    vis_out_dB = sap_out_dB['visibilities']
+
+                    # for the raw visibilities, comparison is easy...
+                    # just check the differences in amplitude and in phase
+                    abs_diff_raw = np.abs(vis_in_raw) - np.abs(vis_out_raw)
+                    abs_phase_diff_raw = np.abs(np.unwrap(np.angle(vis_in_raw) - np.angle(vis_out_raw), axis=2))
+                    # phase has no 'meaning' for small (insignificant) amplitudes,
+                    # so just set the phase difference to zero there
+                    abs_phase_diff_raw[np.abs(vis_in_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
+                    abs_phase_diff_raw[np.abs(vis_out_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
+
+                    # for the visibilities in dB, the phases should be equal to the input phases,
+                    # no matter whether the visibilities are in dB or raw.
+                    # but the amplitudes need conversion from dB back to raw first.
+                    abs_vis_out_raw_from_dB = np.power(10, 0.1 * np.abs(vis_out_dB))
+                    abs_diff_raw_dB = np.abs(vis_in_raw) - abs_vis_out_raw_from_dB
+                    abs_phase_diff_raw_dB = np.abs(np.unwrap(np.angle(vis_in_raw) - np.angle(vis_out_dB), axis=2))
+                    # phase has no 'meaning' for small (insignificant) amplitudes, so just set it to zero there
+                    abs_phase_diff_raw_dB[np.abs(vis_in_raw) <= max(1.0, 1e-3 * max_amplitude)] = 0
+                    abs_phase_diff_raw_dB[abs_vis_out_raw_from_dB <= max(1.0, 1e-3 * max_amplitude)] = 0
+
+                    amplitude_threshold = 0.10 * max_amplitude
+                    phase_threshold = 0.025 * 2 * np.pi
+
+                    for i in range(vis_in_raw.shape[0]):
+                        for j in range(vis_in_raw.shape[1]):
+                            for k in range(vis_in_raw.shape[2]):
+                                for l in range(vis_in_raw.shape[3]):
+                                    self.assertLess(abs_diff_raw[i, j, k, l], amplitude_threshold)
+                                    self.assertLess(abs_diff_raw_dB[i, j, k, l], amplitude_threshold)
+                                    self.assertLess(abs_phase_diff_raw[i, j, k, l], phase_threshold)
+                                    self.assertLess(abs_phase_diff_raw_dB[i, j, k, l], phase_threshold)
         finally:
             logger.info('removing test file: %s', path)
             os.remove(path)
+            if os.path.exists(path + '.v13.h5'):
+                os.remove(path + '.v13.h5')
 
 
     @unit_test
@@ -524,6 +720,110 @@ class TestHdf5_IO(unittest.TestCase):
                 logger.info('removing test file: %s', path)
                 os.remove(path)
 
+    @unit_test
+    def test_combine_hypercubes_per_subband(self):
+        '''combine many one-subband files (like ms2hdf5 creates them on cep4) into one file,
+        both via the raw chunk copy and the recompressing code path, and compare the result with the hypercube written at once.'''
+        logger.info('test_combine_hypercubes_per_subband')
+
+        paths = []
+        try:
+            num_subbands = 5
+            saps_in = create_hypercube(num_saps=1, num_stations=3, num_timestamps=4, num_subbands_per_sap={0: num_subbands})
+            sap_in = saps_in[0]
+
+            path = tempfile.mkstemp()[1]
+            paths.append(path)
+            write_hypercube(path, saps_in, sas_id=999999)
+            expected = read_hypercube(path, visibilities_in_dB=True)['saps'][0]
+
+            # write each subband to a seperate file
+            subband_paths = []
+            for sb_idx in range(num_subbands):
+                path = tempfile.mkstemp()[1]
+                paths.append(path)
+                subband_paths.append(path)
+                sap_sb = dict(sap_in)
+                sap_sb['subbands'] = sap_in['subbands'][sb_idx:sb_idx+1]
+                sap_sb['central_frequencies'] = sap_in['central_frequencies'][sb_idx:sb_idx+1]
+                sap_sb['visibilities'] = sap_in['visibilities'][:,:,sb_idx:sb_idx+1,:].copy()
+                sap_sb['flagging'] = sap_in['flagging'][:,:,sb_idx:sb_idx+1,:].copy()
+                write_hypercube(path, {0: sap_sb}, sas_id=999999)
+
+            for do_compress, num_workers, layout in [(True, 2, None), (True, 1, None), (False, 1, None), (True, 1, 'gzip')]:
+                combined_filepath = combine_hypercubes(subband_paths, output_dir='/tmp',
+                                                       output_filename=os.path.basename(tempfile.mkstemp()[1]),
+                                                       do_compress=do_compress, num_workers=num_workers, layout=layout)
+                self.assertIsNotNone(combined_filepath)
+                paths.append(combined_filepath)
+
+                with h5py.File(combined_filepath, "r") as file:
+                    visibilities = file['measurement/saps/0/visibilities']
+                    self.assertEqual(layout or ('lzf' if do_compress else None), visibilities.compression)
+
+                    if visibilities.compression:
+                        # the per subband written (copied or recompressed) data is chunked per subband
+                        self.assertEqual(1, visibilities.chunks[2])
+
+                result = read_hypercube(combined_filepath, visibilities_in_dB=True)
+                self.assertEqual(999999, result['sas_id'])
+                sap_out = result['saps'][0]
+                self.assertTrue(np.array_equal(expected['subbands'], sap_out['subbands']))
+                self.assertTrue(np.array_equal(expected['central_frequencies'], sap_out['central_frequencies']))
+                self.assertTrue(np.array_equal(expected['flagging'], sap_out['flagging']))
+                self.assertTrue(np.array_equal(expected['visibilities'], sap_out['visibilities']))
+        finally:
+            for path in paths:
+                logger.info('removing test file: %s', path)
+                os.remove(path)
+
+    @unit_test
+    def test_hypercube_layouts(self):
+        '''write the same hypercube with all layout profiles, check the resulting chunking/compression and the data read back.'''
+        logger.info('test_hypercube_layouts')
+
+        paths = []
+        try:
+            saps_in = create_hypercube(num_saps=1, num_stations=4, num_timestamps=6, num_subbands_per_sap={0: 3})
+
+            path = tempfile.mkstemp()[1]
+            paths.append(path)
+            write_hypercube(path, saps_in)
+            expected = read_hypercube(path)['saps'][0]
+
+            for name, layout in sorted(HYPERCUBE_LAYOUTS.items()):
+                path = tempfile.mkstemp()[1]
+                paths.append(path)
+                write_hypercube(path, saps_in, layout=name)
+
+                with HypercubeView(path) as view:
+                    sap_view = view.saps[0]
+                    shape = sap_view.shape
+                    self.assertTrue(np.array_equal(expected['visibilities'], sap_view.visibilities[...]))
+                    self.assertTrue(np.array_equal(expected['flagging'], sap_view.flagging[...]))
+
+                    ds = view._file['measurement/saps/0/visibilities']
+                    if layout.compression in ('lzf', 'gzip'):
+                        self.assertEqual(layout.compression, ds.compression)
+                        self.assertEqual(layout.shuffle, ds.shuffle)
+                    elif layout.compression is None:
+                        self.assertIsNone(ds.compression)
+                        self.assertIsNone(ds.chunks)
+
+                    if layout.chunks is not None:
+                        self.assertEqual(layout.chunk_shape(shape, 2) + (2,), ds.chunks)
+
+            # explicit chunk shapes are shrunk to fit in max_chunk_nbytes along the full length axes.
+            layout = HypercubeLayout(chunks=(1, 0, 0, 0), max_chunk_nbytes=100)
+            self.assertEqual((1, 25, 1, 4), layout.chunk_shape((10, 100, 1, 4), 1))
+
+            with self.assertRaises(ValueError):
+                write_hypercube(path, saps_in, layout='no_such_layout')
+        finally:
+            for path in paths:
+                logger.info('removing test file: %s', path)
+                os.remove(path)
+
     @unit_test
     def test_common_info_from_parset(self):
         logger.info('test_common_info_from_parset')
@@ -61,6 +61,12 @@ class QAEventMessageHandler(AbstractMessageHandler):
             self.onFinished(msg.content)
         elif stripped_subject == 'Error':
             self.onError(msg.content)
+        elif stripped_subject == 'JobQueued':
+            self.onJobQueued(msg.content)
+        elif stripped_subject == 'JobStarted':
+            self.onJobStarted(msg.content)
+        elif stripped_subject == 'JobDone':
+            self.onJobDone(msg.content)
         else:
             raise ValueError("QAEventMessageHandler.handleMessage: unknown subject: %s" %  msg.subject)
 
@@ -82,6 +88,15 @@ class QAEventMessageHandler(AbstractMessageHandler):
     def onError(self, msg_content):
         logger.info("%s.onError(%s)", self.__class__.__name__, single_line_with_single_spaces(msg_content))
 
+    def onJobQueued(self, msg_content):
+        logger.info("%s.onJobQueued(%s)", self.__class__.__name__, single_line_with_single_spaces(msg_content))
+
+    def onJobStarted(self, msg_content):
+        logger.info("%s.onJobStarted(%s)", self.__class__.__name__, single_line_with_single_spaces(msg_content))
+
+    def onJobDone(self, msg_content):
+        logger.info("%s.onJobDone(%s)", self.__class__.__name__, single_line_with_single_spaces(msg_content))
+
 class QABusListener(BusListener):
     def __init__(self,
                  handler_type: QAEventMessageHandler.__class__ = QAEventMessageHandler,
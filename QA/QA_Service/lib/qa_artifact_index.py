@@ -0,0 +1,170 @@
+# Copyright (C) 2012-2015  ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O. Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+# $Id$
+
+'''
+The QAArtifactIndex keeps track of the artifacts (h5 files, plot dirs, ...) which the qa_service produced
+for each otdb_id, together with the key of the input they were made from, and the version of the tool which made them.
+The qa_service uses it to skip the qa steps which are already up to date, and anybody can use it to answer the question
+'is qa done for otdb_id X?' without an ssh round-trip to cep4.
+'''
+
+import os
+import sqlite3
+import logging
+from datetime import datetime
+from threading import RLock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QA_ARTIFACT_INDEX_PATH = os.path.expanduser('~/.lofar/qa/qa_artifact_index.sqlite')
+
+# the qa steps which need to be done (and up to date) before the qa for an otdb_id is considered done.
+QA_DONE_STEPS = ('convert', 'copy_h5', 'move_plots')
+
+
+class QAArtifactIndex:
+    '''
+    A small (thread-safe) sqlite database with one record per otdb_id and qa step, holding the path of the step's artifact,
+    the input_key of the step's input (for example a fingerprint of the input dataset mtimes),
+    the tool_version of the tool which created the artifact (for example the docker image id), and the creation timestamp.
+
+    Usage:
+        with QAArtifactIndex() as index:
+            if not index.get_up_to_date_artifact(otdb_id, 'convert', input_key, tool_version):
+                hdf5_path = convert(...)
+                index.register_artifact(otdb_id, 'convert', hdf5_path, input_key, tool_version)
+    '''
+    def __init__(self, db_path: str=DEFAULT_QA_ARTIFACT_INDEX_PATH):
+        '''
+        :param str db_path: the path to the sqlite database file. It is created (including its directory) when needed.
+        '''
+        self.db_path = db_path
+        self._connection = None
+        self._lock = RLock()
+
+    def open(self):
+        with self._lock:
+            if self._connection is None:
+                if self.db_path != ':memory:':
+                    os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+                # the qa_service uses the index from multiple threads, which is serialized by our own _lock.
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+                self._connection.row_factory = sqlite3.Row
+                with self._connection:
+                    self._connection.execute('''CREATE TABLE IF NOT EXISTS artifacts (
+                                                otdb_id INTEGER NOT NULL,
+                                                step TEXT NOT NULL,
+                                                path TEXT,
+                                                input_key TEXT,
+                                                tool_version TEXT,
+                                                created_at TEXT NOT NULL,
+                                                PRIMARY KEY (otdb_id, step))''')
+                logger.debug('opened qa artifact index %s', self.db_path)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+                logger.debug('closed qa artifact index %s', self.db_path)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            self.open()
+            with self._connection:
+                return [dict(row) for row in self._connection.execute(query, params)]
+
+    def register_artifact(self, otdb_id: int, step: str, path: str, input_key: str=None, tool_version: str=None):
+        '''
+        register (or replace) the artifact for the given otdb_id and qa step.
+        :param int otdb_id: the task's otdb database id
+        :param str step: the name of the qa step, like 'convert', 'cluster', 'plot_0', ...
+        :param str path: the path of the created artifact
+        :param str input_key: the key of the input from which the artifact was created, or None if unknown
+        :param str tool_version: the version of the tool which created the artifact, or None if unknown
+        :return dict: the registered artifact
+        '''
+        created_at = datetime.utcnow().isoformat()
+        self._execute('INSERT OR REPLACE INTO artifacts (otdb_id, step, path, input_key, tool_version, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                      (otdb_id, step, path, input_key, tool_version, created_at))
+        logger.debug('registered qa artifact otdb_id=%s step=%s path=%s input_key=%s tool_version=%s',
+                     otdb_id, step, path, input_key, tool_version)
+        return {'otdb_id': otdb_id, 'step': step, 'path': path, 'input_key': input_key,
+                'tool_version': tool_version, 'created_at': created_at}
+
+    def get_artifact(self, otdb_id: int, step: str):
+        '''
+        :return dict: the registered artifact for the given otdb_id and qa step (regardless if it is up to date), or None
+        '''
+        rows = self._execute('SELECT * FROM artifacts WHERE otdb_id = ? AND step = ?', (otdb_id, step))
+        return rows[0] if rows else None
+
+    def get_artifacts(self, otdb_id: int):
+        '''
+        :return dict: mapping of qa step name to the registered artifact for all steps of the given otdb_id
+        '''
+        return {row['step']: row for row in self._execute('SELECT * FROM artifacts WHERE otdb_id = ?', (otdb_id,))}
+
+    def get_up_to_date_artifact(self, otdb_id: int, step: str, input_key: str, tool_version: str):
+        '''
+        get the artifact for the given otdb_id and qa step, but only if it was created from the same input with the same tool version.
+        An unknown (None) input_key or tool_version is never up to date, so then the step needs to be (re)done.
+        :return dict: the up to date artifact, or None
+        '''
+        if input_key is None or tool_version is None:
+            return None
+
+        artifact = self.get_artifact(otdb_id, step)
+        if artifact and artifact['input_key'] == input_key and artifact['tool_version'] == tool_version:
+            return artifact
+        return None
+
+    def invalidate(self, otdb_id: int, step: str=None):
+        '''
+        remove the artifact(s) for the given otdb_id from the index, so the qa step(s) will be redone.
+        :param int otdb_id: the task's otdb database id
+        :param str step: the qa step to invalidate, or None to invalidate all steps of the otdb_id
+        '''
+        if step is None:
+            self._execute('DELETE FROM artifacts WHERE otdb_id = ?', (otdb_id,))
+        else:
+            self._execute('DELETE FROM artifacts WHERE otdb_id = ? AND step = ?', (otdb_id, step))
+
+    def is_qa_done(self, otdb_id: int):
+        '''
+        :return bool: True if all QA_DONE_STEPS are registered for the given otdb_id
+        '''
+        return all(step in self.get_artifacts(otdb_id) for step in QA_DONE_STEPS)
+
+    def get_qa_done_otdb_ids(self):
+        '''
+        :return set: the otdb_ids for which all QA_DONE_STEPS are registered
+        '''
+        rows = self._execute('SELECT otdb_id FROM artifacts WHERE step IN (%s) GROUP BY otdb_id HAVING COUNT(DISTINCT step) = ?' %
+                             (', '.join('?' * len(QA_DONE_STEPS)),),
+                             QA_DONE_STEPS + (len(QA_DONE_STEPS),))
+        return set(row['otdb_id'] for row in rows)
@@ -19,15 +19,19 @@
 
 import os.path
 import logging
+import hashlib
+from time import time
 from subprocess import call, Popen, PIPE, STDOUT
 from optparse import OptionParser, OptionGroup
-from threading import Thread
+from threading import Thread, RLock
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from lofar.common.util import waitForInterrupt
 from lofar.sas.otdb.OTDBBusListener import OTDBBusListener, OTDBEventMessageHandler, DEFAULT_OTDB_NOTIFICATION_SUBJECT
 from lofar.messaging import UsingToBusMixin, BusListener
 from lofar.messaging.messages import EventMessage
 from lofar.messaging import DEFAULT_BROKER, DEFAULT_BUSNAME
 from lofar.qa.service.config import DEFAULT_QA_NOTIFICATION_SUBJECT_PREFIX
+from lofar.qa.service.qa_artifact_index import QAArtifactIndex, DEFAULT_QA_ARTIFACT_INDEX_PATH
 from lofar.common.cep4_utils import *
 from lofar.parameterset import parameterset
 from lofar.sas.otdb.otdbrpc import OTDBRPC
@@ -38,8 +42,48 @@ QA_LUSTRE_BASE_DIR = '/data/qa'
 QA_NFS_BASE_DIR = '/qa'
 DEFAULT_FILTERED_OTDB_NOTIFICATION_SUBJECT = "filtered.%s" % (DEFAULT_OTDB_NOTIFICATION_SUBJECT,)
 
+# the maximum number of observations/pipelines for which the qa steps run at the same time. The others are queued.
+DEFAULT_MAX_CONCURRENT_QA_JOBS = 2
+
+# the plot_hdf5_dynamic_spectra options for each of the inspection plot variants
+INSPECTION_PLOT_OPTIONS = [['-1', '-acb'], # 'hot' autocor/crosscor, per baseline scaling with distinct polarization scales, in dB
+                           ['-1', '-acg'], # 'complex' autocor/crosscor, all baseline scaling with same polarization scales, in dB
+                           ['-1', '-acn', '--raw'], # normalized 'hot' autocor/crosscor, raw
+                           ['-4']] # delay-rate
+
+# the docker image ids (which are used as the tool versions in the qa artifact index) are cached for this many seconds
+TOOL_VERSION_CACHE_SECONDS = 600
+
 #TODO:  idea: convert periodically while observing?
 
+def _execute_steps(executor, steps):
+    '''
+    execute the given steps as a dependency graph: each step is submitted to the executor as soon as all its prerequisite steps are done,
+    so independent steps run in parallel.
+    :param concurrent.futures.Executor executor: the executor running the steps
+    :param dict steps: mapping of step name to a tuple (step_function, [names of prerequisite steps]).
+                       Each step_function is called with one argument: the dict of the results of the steps which are done so far.
+    :return dict: mapping of step name to the result of its step_function
+    '''
+    results = {}
+    remaining_steps = dict(steps)
+    running_steps = {}
+
+    while remaining_steps or running_steps:
+        for name, (step_function, prerequisites) in list(remaining_steps.items()):
+            if all(prerequisite in results for prerequisite in prerequisites):
+                running_steps[executor.submit(step_function, dict(results))] = name
+                del remaining_steps[name]
+
+        if not running_steps:
+            raise ValueError('cannot execute steps with unknown or cyclic prerequisites: %s' % (', '.join(remaining_steps.keys()),))
+
+        done, _ = wait(running_steps.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            results[running_steps.pop(future)] = future.result()
+
+    return results
+
 class QAFilteringOTDBBusListener(OTDBBusListener):
     class QAFilteringOTDBEventMessageHandler(UsingToBusMixin, OTDBEventMessageHandler):
         def _send_filtered_event_message(self, otdb_id: int, modificationTime: datetime, state: str):
@@ -83,10 +127,40 @@ class QAFilteredOTDBBusListener(BusListener):
         QAFilteredOTDBEventMessageHandler listens on the lofar otdb message bus for NotificationMessages and starts qa processes
         upon observation/pipeline completion. The qa processes convert MS (measurement sets) to hdf5 qa files,
         and then starts generating plots from the hdf5 file.
+        The qa jobs for multiple observations/pipelines run concurrently (at most max_concurrent_jobs at the same time),
+        and the qa steps within a job run in parallel where possible, see do_qa.
+        The artifacts of the qa steps are registered in a QAArtifactIndex, so steps which are already up to date are skipped
+        when the completing and finished events both fire, or when events are replayed.
         '''
-        def __init__(self):
+        def __init__(self, max_concurrent_jobs: int=DEFAULT_MAX_CONCURRENT_QA_JOBS,
+                     artifact_index_path: str=DEFAULT_QA_ARTIFACT_INDEX_PATH):
             super().__init__()
             self._unfinished_otdb_id_map = {}
+            self._artifact_index = QAArtifactIndex(artifact_index_path)
+            self._tool_versions = {}
+
+            # the qa jobs (futures) per otdb_id, and the queued and running otdb_ids (in order), guarded by the _jobs_lock
+            self._jobs = {}
+            self._queued_otdb_ids = []
+            self._running_otdb_ids = []
+            self._jobs_lock = RLock()
+            self._job_executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs)
+            # each job runs at most 1+len(INSPECTION_PLOT_OPTIONS) steps in parallel
+            self._step_executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs*(1+len(INSPECTION_PLOT_OPTIONS)))
+
+        def stop_handling(self):
+            with self._jobs_lock:
+                for otdb_id in list(self._queued_otdb_ids):
+                    if self._jobs[otdb_id].cancel():
+                        logger.info('cancelled queued qa job for otdb_id %s', otdb_id)
+                        self._queued_otdb_ids.remove(otdb_id)
+                        del self._jobs[otdb_id]
+
+            # wait for the running jobs to finish (they need the tobus to send their event messages)
+            self._job_executor.shutdown(wait=True)
+            self._step_executor.shutdown(wait=True)
+            self._artifact_index.close()
+            super().stop_handling()
 
         def onObservationCompleting(self, otdb_id, modificationTime):
             '''
@@ -110,34 +184,100 @@ class QAFilteredOTDBBusListener(BusListener):
             '''
             logger.info("task with otdb_id %s finished. trying to add parset (with feedback) to h5 file", otdb_id)
 
-            # lookup the hdf5_file_path for the given otdb_id
-            # and (re)add the parset to the file (which now includes feedback)
-            hdf5_file_path = self._unfinished_otdb_id_map.get(otdb_id)
-            if hdf5_file_path:
-                del self._unfinished_otdb_id_map[otdb_id]
+            with self._jobs_lock:
+                job = self._jobs.get(otdb_id)
+                if job is not None:
+                    # the qa job for this otdb_id is still queued or running, so add the parset when it's done.
+                    logger.info("qa job for otdb_id %s is not done yet. adding the parset when it's done.", otdb_id)
+                    job.add_done_callback(lambda _: self._add_parset_to_hdf5_file(otdb_id))
+                    return
 
-                try:
-                    cmd = ['add_parset_to_hdf5', hdf5_file_path]
-                    cmd = wrap_command_for_docker(cmd, 'adder', 'latest')
-                    cmd = wrap_command_in_cep4_random_node_ssh_call(cmd, partition=SLURM_CPU_PARTITION, via_head=True)
+            self._add_parset_to_hdf5_file(otdb_id)
 
-                    logger.info(' '.join(cmd))
-                    if call(cmd) == 0:
-                        self._copy_hdf5_to_nfs_dir(hdf5_file_path)
-                except Exception as e:
-                    logger.warning("Cannot add parset with feedback for otdb=%s. error: %s", otdb_id, e)
+        def _add_parset_to_hdf5_file(self, otdb_id):
+            '''
+            (re)add the parset (which now includes the feedback) to the h5 file of the given otdb_id, and copy it to the nfs dir.
+            :param int otdb_id: the task's otdb database id
+            :return: None
+            '''
+            # lookup the hdf5_file_path for the given otdb_id (in the index if this service did not convert it since its start)
+            # and (re)add the parset to the file (which now includes feedback)
+            hdf5_file_path = self._unfinished_otdb_id_map.pop(otdb_id, None)
+            convert_artifact = self._artifact_index.get_artifact(otdb_id, 'convert')
+            if hdf5_file_path is None and convert_artifact:
+                hdf5_file_path = convert_artifact['path']
+
+            if hdf5_file_path:
+                def add_parset():
+                    try:
+                        cmd = ['add_parset_to_hdf5', hdf5_file_path]
+                        cmd = wrap_command_for_docker(cmd, 'adder', 'latest')
+                        cmd = wrap_command_in_cep4_random_node_ssh_call(cmd, partition=SLURM_CPU_PARTITION, via_head=True)
+
+                        logger.info(' '.join(cmd))
+                        if call(cmd) == 0:
+                            return self._copy_hdf5_to_nfs_dir(hdf5_file_path)
+                    except Exception as e:
+                        logger.warning("Cannot add parset with feedback for otdb=%s. error: %s", otdb_id, e)
+
+                self._run_indexed_step(otdb_id, 'add_parset', self._get_artifacts_key(convert_artifact),
+                                       self._get_tool_version('adder'), add_parset)
             else:
                 logger.info("Could not find the h5 file for task with otdb_id %s to add the parset to.", otdb_id)
 
         def do_qa(self, otdb_id):
             '''
-            try to do all qa (quality assurance) steps for the given otdb_id
-            resulting in an h5 MS-extract file and inspection plots
+            queue a qa job doing all qa (quality assurance) steps for the given otdb_id, see _do_qa.
+            At most max_concurrent_jobs qa jobs run at the same time, the others wait in the queue.
+            The queued and running jobs are published in JobQueued, JobStarted and JobDone event messages.
             :param int otdb_id: observation/pipeline otdb id for which the conversion needs to be done.
             :return: None
             '''
+            with self._jobs_lock:
+                if otdb_id in self._jobs:
+                    logger.info("qa job for otdb_id %s is already queued or running", otdb_id)
+                    return
+
+                self._queued_otdb_ids.append(otdb_id)
+                self._jobs[otdb_id] = self._job_executor.submit(self._run_qa_job, otdb_id)
+                logger.info("queued qa job for otdb_id %s. #queued=%s #running=%s", otdb_id, len(self._queued_otdb_ids), len(self._running_otdb_ids))
+                self._send_job_event_message('JobQueued', otdb_id)
 
-            hdf5_file_path = None
+        def _run_qa_job(self, otdb_id):
+            with self._jobs_lock:
+                self._queued_otdb_ids.remove(otdb_id)
+                self._running_otdb_ids.append(otdb_id)
+                self._send_job_event_message('JobStarted', otdb_id)
+
+            try:
+                self._do_qa(otdb_id)
+            except Exception as e:
+                logger.exception('error in qa job for otdb_id %s: %s', otdb_id, e)
+                self._send_event_message('Error', {'otdb_id': otdb_id, 'message': str(e)})
+            finally:
+                with self._jobs_lock:
+                    self._running_otdb_ids.remove(otdb_id)
+                    del self._jobs[otdb_id]
+                    self._send_job_event_message('JobDone', otdb_id)
+
+        def _send_job_event_message(self, subject_suffix, otdb_id):
+            with self._jobs_lock:
+                self._send_event_message(subject_suffix, {'otdb_id': otdb_id,
+                                                          'queued_otdb_ids': list(self._queued_otdb_ids),
+                                                          'running_otdb_ids': list(self._running_otdb_ids)})
+
+        def _do_qa(self, otdb_id):
+            '''
+            try to do all qa (quality assurance) steps for the given otdb_id
+            resulting in an h5 MS-extract file and inspection plots.
+            Once the h5 file exists, the clustering and the plot variants run in parallel,
+            followed by the copy of the (clustered) h5 file and the move of the plots to the nfs dir.
+            Each step is skipped if the artifact index holds an up to date artifact for it, see _run_indexed_step.
+            The conversion is up to date if the input dataproducts did not change, and the other steps are up to date
+            if the artifacts of their prerequisite steps did not change.
+            :param int otdb_id: observation/pipeline otdb id for which the conversion needs to be done.
+            :return: None
+            '''
 
             with OTDBRPC.create(exchange=self.exchange, broker=self.broker, timeout=5) as otdbrpc:
                 parset = parameterset(otdbrpc.taskGetSpecification(otdb_id=otdb_id).get("specification", ''))
@@ -147,30 +287,144 @@ class QAFilteredOTDBBusListener(BusListener):
                     return
 
                 if parset.getBool('ObsSW.Observation.DataProducts.Output_Correlated.enabled'):
-                    hdf5_file_path = self._convert_ms2hdf5(otdb_id)
+                    dataproducts_type, convert_method = 'Output_Correlated', self._convert_ms2hdf5
                 elif parset.getBool('ObsSW.Observation.DataProducts.Output_CoherentStokes.enabled'):
-                    hdf5_file_path = self._convert_bf2hdf5(otdb_id)
+                    dataproducts_type, convert_method = 'Output_CoherentStokes', self._convert_bf2hdf5
                 else:
                     logger.info("No uv or cs dataproducts avaiblable to convert for otdb_id %s", otdb_id)
                     return
 
-            if hdf5_file_path:
-                # keep a note of where the h5 file was stored for this unfinished otdb_id
-                self._unfinished_otdb_id_map[otdb_id] = hdf5_file_path
+            input_key = self._get_input_key(parset, dataproducts_type)
+            # only reconvert an existing h5 file if we know that the input dataproducts changed since its conversion.
+            convert_artifact = self._artifact_index.get_artifact(otdb_id, 'convert')
+            force_convert = convert_artifact is not None and input_key is not None and convert_artifact['input_key'] != input_key
+
+            convert_artifact = self._run_indexed_step(otdb_id, 'convert', input_key, self._get_tool_version('adder'),
+                                                      lambda: convert_method(otdb_id, force=force_convert),
+                                                      return_artifact=True)
 
-                # cluster it
-                self._cluster_h5_file(hdf5_file_path, otdb_id)
+            if convert_artifact:
+                hdf5_file_path = convert_artifact['path']
 
-                self._copy_hdf5_to_nfs_dir(hdf5_file_path)
+                # keep a note of where the h5 file was stored for this unfinished otdb_id
+                self._unfinished_otdb_id_map[otdb_id] = hdf5_file_path
 
-                plot_dir_path = self._create_plots_for_h5_file(hdf5_file_path, otdb_id)
-                plot_dir_path = self._move_plots_to_nfs_dir(plot_dir_path)
+                def indexed_step(step, prerequisites, image_name, step_function):
+                    # wrap the step_function, so it is skipped when its artifact is up to date with the prerequisites' artifacts
+                    def run_step(results):
+                        return self._run_indexed_step(otdb_id, step,
+                                                      self._get_artifacts_key(convert_artifact, *[results[p] for p in prerequisites]),
+                                                      self._get_tool_version(image_name) if image_name else '',
+                                                      lambda: step_function(results),
+                                                      return_artifact=True)
+                    return (run_step, prerequisites)
+
+                # the qa steps and their prerequisites.
+                # the clustering writes into the h5 file, so copy the file to the nfs dir when the clustering is done.
+                steps = {'cluster': indexed_step('cluster', [], 'adder_clustering',
+                                                 lambda results: self._cluster_h5_file(hdf5_file_path, otdb_id)),
+                         'copy_h5': indexed_step('copy_h5', ['cluster'], None,
+                                                 lambda results: self._copy_hdf5_to_nfs_dir(hdf5_file_path))}
+
+                plot_steps = ['plot_%d' % i for i in range(len(INSPECTION_PLOT_OPTIONS))]
+                for plot_step, plot_options in zip(plot_steps, INSPECTION_PLOT_OPTIONS):
+                    steps[plot_step] = indexed_step(plot_step, [], 'adder',
+                                                    lambda results, plot_options=plot_options: self._create_plot_for_h5_file(hdf5_file_path, plot_options, otdb_id))
+
+                steps['move_plots'] = indexed_step('move_plots', plot_steps, None,
+                                                   lambda results: self._move_plots_to_nfs_dir(
+                                                       self._created_plots_for_h5_file(hdf5_file_path,
+                                                                                       [results[s]['path'] if results[s] else None for s in plot_steps],
+                                                                                       otdb_id)))
+
+                results = _execute_steps(self._step_executor, steps)
+                plot_dir_path = results['move_plots']['path'] if results['move_plots'] else None
 
                 # and notify that we're finished
                 self._send_event_message('Finished', {'otdb_id': otdb_id,
                                                       'hdf5_file_path': hdf5_file_path,
                                                       'plot_dir_path': plot_dir_path or ''})
 
+        def _run_indexed_step(self, otdb_id, step, input_key, tool_version, step_function, return_artifact=False):
+            '''
+            run the step_function, unless the artifact index holds an up to date artifact for the given otdb_id and step.
+            The path returned by the step_function is registered in the index as the step's artifact. A step_function
+            returning None is considered failed, and is not registered, so it is retried the next time.
+            :param int otdb_id: the task's otdb database id
+            :param str step: the name of the qa step
+            :param str input_key: the key of the step's input, or None if unknown (then the step is always run)
+            :param str tool_version: the version of the tool doing the step, or None if unknown (then the step is always run)
+            :param step_function: function without arguments doing the step, returning the path of the created artifact or None
+            :param bool return_artifact: return the artifact dict instead of only its path
+            :return: the path of the (already) created artifact (or its artifact dict), or None if the step failed.
+            '''
+            artifact = self._artifact_index.get_up_to_date_artifact(otdb_id, step, input_key, tool_version)
+            if artifact:
+                logger.info('skipping qa step %s for otdb_id %s, its artifact %s is up to date', step, otdb_id, artifact['path'])
+            else:
+                path = step_function()
+                if path:
+                    artifact = self._artifact_index.register_artifact(otdb_id, step, path, input_key, tool_version)
+
+            if return_artifact:
+                return artifact
+            return artifact['path'] if artifact else None
+
+        @staticmethod
+        def _get_artifacts_key(*artifacts):
+            '''
+            :return str: a key for the given prerequisite artifacts, which changes when any of the artifacts is (re)created,
+                         or None if any of the artifacts is missing.
+            '''
+            if not all(artifacts):
+                return None
+            return ','.join('%s@%s' % (a['step'], a['created_at']) for a in artifacts)
+
+        def _get_input_key(self, parset, dataproducts_type):
+            '''
+            get a key for the input dataproducts of the qa, which changes when any of the dataproducts changes:
+            the sha1 of the paths, modification times and sizes of the dataproducts and their direct contents,
+            which are listed with one ssh call to the cep4 head node.
+            :param parameterset parset: the task's parset
+            :param str dataproducts_type: 'Output_Correlated' or 'Output_CoherentStokes'
+            :return str: the input key, or None if it could not be determined.
+            '''
+            try:
+                prefix = 'ObsSW.Observation.DataProducts.%s.' % (dataproducts_type,)
+                locations = parset.getStringVector(prefix + 'locations', [], True)
+                filenames = parset.getStringVector(prefix + 'filenames', [], True)
+                # the locations are formatted as <host>:<directory>
+                paths = sorted(os.path.join(location.split(':')[-1], filename) for location, filename in zip(locations, filenames))
+
+                if not paths:
+                    return None
+
+                cmd = ['find'] + paths + ['-maxdepth', '1', '-printf', '"%p %T@ %s\\n"']
+                cmd = wrap_command_in_cep4_head_node_ssh_call(cmd)
+                listing = check_output_returning_strings(cmd)
+                return hashlib.sha1('\n'.join(sorted(listing.splitlines())).encode('utf-8')).hexdigest()
+            except Exception as e:
+                logger.warning('could not determine the input key for the %s dataproducts: %s', dataproducts_type, e)
+                return None
+
+        def _get_tool_version(self, image_name):
+            '''
+            get the id of the latest docker image with the given name on cep4, which is used as the version of the qa tools in it.
+            The ids are cached for TOOL_VERSION_CACHE_SECONDS.
+            :return str: the docker image id, or None if it could not be determined.
+            '''
+            timestamp, image_id = self._tool_versions.get(image_name, (0, None))
+            if time() - timestamp > TOOL_VERSION_CACHE_SECONDS:
+                try:
+                    cmd = ['docker', 'image', 'inspect', '--format', '"{{.Id}}"', '%s:latest' % (image_name,)]
+                    cmd = wrap_command_in_cep4_head_node_ssh_call(cmd)
+                    image_id = check_output_returning_strings(cmd).strip() or None
+                except Exception as e:
+                    logger.warning('could not determine the id of docker image %s: %s', image_name, e)
+                    image_id = None
+                self._tool_versions[image_name] = (time(), image_id)
+            return image_id
+
         def _send_event_message(self, subject_suffix, content):
             try:
                 subject = '%s.%s' % (DEFAULT_QA_NOTIFICATION_SUBJECT_PREFIX, subject_suffix)
@@ -180,13 +434,14 @@ class QAFilteredOTDBBusListener(BusListener):
             except Exception as e:
                 logger.error('Could not send event message: %s', e)
 
-        def _convert_ms2hdf5(self, otdb_id):
+        def _convert_ms2hdf5(self, otdb_id, force=False):
             '''
             convert the MS for the given otdb_id to an h5 MS-extract file.
             The conversion will run via ssh on cep4 with massive parellelization.
             When running on cep4, it is assumed that a docker image called adder exists on head.cep4
             When running locally, it is assumed that ms2hdf5 is installed locally.
             :param int otdb_id: observation/pipeline otdb id for which the conversion needs to be done.
+            :param bool force: convert, even if the h5 file already exists.
             :return string: path to the generated h5 file.
             '''
             try:
@@ -198,7 +453,7 @@ class QAFilteredOTDBBusListener(BusListener):
                 cmd = ['ls', hdf5_path]
                 cmd = wrap_command_in_cep4_head_node_ssh_call(cmd)
 
-                if call(cmd) == 0:
+                if not force and call(cmd) == 0:
                     logger.info('uv dataset with otdb_id %s was already converted to hdf5 file %s', otdb_id, hdf5_path)
                     return hdf5_path
 
@@ -227,60 +482,64 @@ class QAFilteredOTDBBusListener(BusListener):
                 self._send_event_message('Error', {'otdb_id': otdb_id, 'message': str(e)})
             return None
 
-        def _create_plots_for_h5_file(self, hdf5_path, otdb_id=None):
+        def _create_plot_for_h5_file(self, hdf5_path, plot_options, otdb_id=None):
             '''
-            create plots for the given h5 file. The plots are created via an ssh call to cep4
+            create one variant of the plots for the given h5 file. The plots are created via an ssh call to cep4
             where the plots are created in parallel in the docker image.
             :param hdf5_path: the full path to the hdf5 file for which we want the plots.
+            :param plot_options: the plot_hdf5_dynamic_spectra options for this plot variant, see INSPECTION_PLOT_OPTIONS
             :param otdb_id: the otdb_id of the converted observation/pipeline (is used for logging only)
-            :return: the full directory path to the directory containing the created plots.
+            :return: the full directory path to the directory containing the created plots, or None if the plotting failed.
             '''
             try:
                 #use default cep4 qa output dir.
                 plot_dir_path = os.path.join(QA_LUSTRE_BASE_DIR, 'plots')
-                task_plot_dir_path = ''
-                all_plots_succeeded = True
 
-                for plot_options in [['-1', '-acb'], # 'hot' autocor/crosscor, per baseline scaling with distinct polarization scales, in dB
-                                     ['-1', '-acg'], # 'complex' autocor/crosscor, all baseline scaling with same polarization scales, in dB
-                                     ['-1', '-acn', '--raw'], # normalized 'hot' autocor/crosscor, raw
-                                     ['-4']]: # delay-rate
-                    cmd = ['plot_hdf5_dynamic_spectra', '-o %s' % (plot_dir_path,), '--force', '--cep4'] + plot_options + [hdf5_path]
+                cmd = ['plot_hdf5_dynamic_spectra', '-o %s' % (plot_dir_path,), '--force', '--cep4'] + plot_options + [hdf5_path]
 
-                    # wrap the command in a cep4 ssh call to docker container
-                    cmd = wrap_command_for_docker(cmd, 'adder', 'latest')
-                    cmd = wrap_command_in_cep4_available_node_with_lowest_load_ssh_call(cmd, partition=SLURM_CPU_PARTITION, via_head=True)
+                # wrap the command in a cep4 ssh call to docker container
+                cmd = wrap_command_for_docker(cmd, 'adder', 'latest')
+                cmd = wrap_command_in_cep4_available_node_with_lowest_load_ssh_call(cmd, partition=SLURM_CPU_PARTITION, via_head=True)
 
-                    logger.info('generating plots for otdb_id %s, executing: %s', otdb_id, ' '.join(cmd))
+                logger.info('generating plots for otdb_id %s, executing: %s', otdb_id, ' '.join(cmd))
 
-                    if call(cmd) == 0:
-                        task_plot_dir_path = os.path.join(plot_dir_path, 'L%s' % otdb_id)
-                        logger.info('generated plots for otdb_id %s in %s with command=%s', otdb_id,
-                                                                                            task_plot_dir_path,
-                                                                                            ' '.join(cmd))
-                    else:
-                        all_plots_succeeded &= False
-                        msg = 'could not generate plots for otdb_id %s cmd=%s' % (otdb_id, ' '.join(cmd))
-                        logger.error(msg)
-                        self._send_event_message('Error', {'otdb_id': otdb_id,
-                                                           'message': msg})
-
-
-                self._send_event_message('CreatedInspectionPlots', {'otdb_id': otdb_id,
-                                                                    'hdf5_file_path': hdf5_path,
-                                                                    'plot_dir_path': task_plot_dir_path})
-                return task_plot_dir_path
+                if call(cmd) == 0:
+                    task_plot_dir_path = os.path.join(plot_dir_path, 'L%s' % otdb_id)
+                    logger.info('generated plots for otdb_id %s in %s with command=%s', otdb_id,
+                                                                                        task_plot_dir_path,
+                                                                                        ' '.join(cmd))
+                    return task_plot_dir_path
+                else:
+                    msg = 'could not generate plots for otdb_id %s cmd=%s' % (otdb_id, ' '.join(cmd))
+                    logger.error(msg)
+                    self._send_event_message('Error', {'otdb_id': otdb_id,
+                                                       'message': msg})
             except Exception as e:
-                logging.exception('error in _create_plots_for_h5_file: %s', e)
+                logging.exception('error in _create_plot_for_h5_file: %s', e)
                 self._send_event_message('Error', {'otdb_id': otdb_id, 'message': str(e)})
             return None
 
-        def _convert_bf2hdf5(self, otdb_id):
+        def _created_plots_for_h5_file(self, hdf5_path, task_plot_dir_paths, otdb_id=None):
+            '''
+            notify that all plot variants for the given h5 file were created.
+            :param hdf5_path: the full path to the hdf5 file for which we created the plots.
+            :param task_plot_dir_paths: the results of _create_plot_for_h5_file for each plot variant.
+            :param otdb_id: the otdb_id of the converted observation/pipeline
+            :return: the full directory path to the directory containing the created plots.
+            '''
+            task_plot_dir_path = next((path for path in task_plot_dir_paths if path), '')
+            self._send_event_message('CreatedInspectionPlots', {'otdb_id': otdb_id,
+                                                                'hdf5_file_path': hdf5_path,
+                                                                'plot_dir_path': task_plot_dir_path})
+            return task_plot_dir_path
+
+        def _convert_bf2hdf5(self, otdb_id, force=False):
             '''
             convert the beamformed h5 dataset for the given otdb_id to an h5 MS-extract file.
             When running on cep4, it is assumed that a docker image called adder exists on head.cep4
             When running locally, it is assumed that ms2hdf5 is installed locally.
             :param int otdb_id: observation/pipeline otdb id for which the conversion needs to be done.
+            :param bool force: convert, even if the h5 file already exists.
             :return string: path to the generated h5 file.
             '''
             try:
@@ -292,7 +551,7 @@ class QAFilteredOTDBBusListener(BusListener):
                 cmd = ['ls', hdf5_path]
                 cmd = wrap_command_in_cep4_head_node_ssh_call(cmd)
 
-                if call(cmd, stdout=None, stderr=None) == 0:
+                if not force and call(cmd, stdout=None, stderr=None) == 0:
                     logger.info('bf dataset with otdb_id %s was already converted to hdf5 file %s', otdb_id, hdf5_path)
                     return hdf5_path
 
@@ -370,7 +629,7 @@ class QAFilteredOTDBBusListener(BusListener):
             In the future, we might incorporate the clustering code from the github repo in to the LOFAR source tree.
             :param hdf5_path: the full path to the hdf5 file for which we want the plots.
             :param otdb_id: the otdb_id of the converted observation/pipeline (is used for logging only)
-            :return: None
+            :return: the hdf5_path if the file is clustered, or None if the clustering failed.
             '''
             try:
                 cmd = ['show_hdf5_info', hdf5_path, '|', 'grep', 'clusters']
@@ -379,7 +638,7 @@ class QAFilteredOTDBBusListener(BusListener):
 
                 if call(cmd) == 0:
                     logger.info('hdf5 file %s otdb_id %s was already clustered', hdf5_path, otdb_id)
-                    return
+                    return hdf5_path
 
                 # the command to cluster the given h5 file (executed in the e-science adder docker image)
                 cmd = ['cluster_this.py', hdf5_path]
@@ -393,6 +652,7 @@ class QAFilteredOTDBBusListener(BusListener):
 
                     self._send_event_message('Clustered', {'otdb_id': otdb_id,
                                                            'hdf5_file_path': hdf5_path})
+                    return hdf5_path
                 else:
                     msg = 'could not cluster hdf5 file %s otdb_id %s' % (hdf5_path, otdb_id)
                     logger.error(msg)
@@ -401,22 +661,31 @@ class QAFilteredOTDBBusListener(BusListener):
                 logging.exception('error in _cluster_h5_file: %s', e)
                 self._send_event_message('Error', {'otdb_id': otdb_id, 'message': str(e)})
 
-    def __init__(self, exchange: str = DEFAULT_BUSNAME, broker: str = DEFAULT_BROKER):
+    def __init__(self, exchange: str = DEFAULT_BUSNAME, broker: str = DEFAULT_BROKER,
+                 max_concurrent_jobs: int = DEFAULT_MAX_CONCURRENT_QA_JOBS,
+                 artifact_index_path: str = DEFAULT_QA_ARTIFACT_INDEX_PATH):
         super().__init__(handler_type=QAFilteredOTDBBusListener.QAFilteredOTDBEventMessageHandler,
-                         handler_kwargs={},
+                         handler_kwargs={'max_concurrent_jobs': max_concurrent_jobs,
+                                         'artifact_index_path': artifact_index_path},
                          exchange=exchange,
                          routing_key="%s.#" % (DEFAULT_FILTERED_OTDB_NOTIFICATION_SUBJECT,),
                          num_threads=1,
                          broker=broker)
 
 class QAService:
-    def __init__(self, exchange: str=DEFAULT_BUSNAME, broker: str=DEFAULT_BROKER):
+    def __init__(self, exchange: str=DEFAULT_BUSNAME, broker: str=DEFAULT_BROKER,
+                 max_concurrent_jobs: int=DEFAULT_MAX_CONCURRENT_QA_JOBS,
+                 artifact_index_path: str=DEFAULT_QA_ARTIFACT_INDEX_PATH):
         """
         :param exchange: valid message exchange address
         :param broker: valid broker host (default: None, which means localhost)
+        :param max_concurrent_jobs: the maximum number of observations/pipelines for which the qa steps run at the same time
+        :param artifact_index_path: path to the sqlite QAArtifactIndex of the qa artifacts
         """
         self.filtering_buslistener = QAFilteringOTDBBusListener(exchange = exchange, broker = broker)
-        self.filtered_buslistener = QAFilteredOTDBBusListener(exchange = exchange, broker = broker)
+        self.filtered_buslistener = QAFilteredOTDBBusListener(exchange = exchange, broker = broker,
+                                                              max_concurrent_jobs = max_concurrent_jobs,
+                                                              artifact_index_path = artifact_index_path)
 
     def __enter__(self):
         self.filtering_buslistener.start_listening()
@@ -443,13 +712,20 @@ def main():
                       default=DEFAULT_BUSNAME,
                       help="Bus or queue where the OTDB notifications are published. [default: %default]")
     parser.add_option_group(group)
+    group = OptionGroup(parser, 'QA options')
+    group.add_option('-j', '--max_concurrent_jobs', dest='max_concurrent_jobs', type='int', default=DEFAULT_MAX_CONCURRENT_QA_JOBS,
+                     help='the maximum number of observations/pipelines for which the qa steps run at the same time, default: %default')
+    group.add_option('-i', '--artifact_index', dest='artifact_index', type='string', default=DEFAULT_QA_ARTIFACT_INDEX_PATH,
+                     help='path to the sqlite index of the qa artifacts, which is used to skip the qa steps which are already up to date, default: %default')
+    parser.add_option_group(group)
     (options, args) = parser.parse_args()
 
     #config logging
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
 
     #start the qa service
-    with QAService(exchange=options.exchange, broker=options.broker):
+    with QAService(exchange=options.exchange, broker=options.broker, max_concurrent_jobs=options.max_concurrent_jobs,
+                   artifact_index_path=options.artifact_index):
         #loop and wait for messages or interrupt.
         waitForInterrupt()
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2012-2015  ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O. Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import tempfile
+import shutil
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+from lofar.qa.service.qa_artifact_index import QAArtifactIndex, QA_DONE_STEPS
+
+
+class TestQAArtifactIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'sub_dir', 'qa_artifact_index.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_up_to_date(self):
+        with QAArtifactIndex(self.db_path) as index:
+            self.assertIsNone(index.get_artifact(123, 'convert'))
+
+            index.register_artifact(123, 'convert', '/data/qa/ms_extract/L123.MS_extract.h5', 'input_key_1', 'image_1')
+
+            self.assertEqual('/data/qa/ms_extract/L123.MS_extract.h5',
+                             index.get_up_to_date_artifact(123, 'convert', 'input_key_1', 'image_1')['path'])
+
+            # changed input, changed tool, or unknown input/tool is not up to date
+            self.assertIsNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_2', 'image_1'))
+            self.assertIsNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_1', 'image_2'))
+            self.assertIsNone(index.get_up_to_date_artifact(123, 'convert', None, 'image_1'))
+            self.assertIsNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_1', None))
+
+            # re-registering replaces the artifact
+            index.register_artifact(123, 'convert', '/data/qa/ms_extract/L123.MS_extract.h5', 'input_key_2', 'image_1')
+            self.assertIsNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_1', 'image_1'))
+            self.assertIsNotNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_2', 'image_1'))
+
+        # the index persists
+        with QAArtifactIndex(self.db_path) as index:
+            self.assertIsNotNone(index.get_up_to_date_artifact(123, 'convert', 'input_key_2', 'image_1'))
+
+    def test_is_qa_done_and_invalidate(self):
+        with QAArtifactIndex(self.db_path) as index:
+            for step in QA_DONE_STEPS[:-1]:
+                index.register_artifact(123, step, '/path/%s' % step)
+                index.register_artifact(456, step, '/path/%s' % step)
+            index.register_artifact(456, 'plot_0', '/path/plot_0')
+
+            self.assertFalse(index.is_qa_done(123))
+            self.assertEqual(set(), index.get_qa_done_otdb_ids())
+
+            index.register_artifact(123, QA_DONE_STEPS[-1], '/path/done')
+            self.assertTrue(index.is_qa_done(123))
+            self.assertFalse(index.is_qa_done(456))
+            self.assertEqual({123}, index.get_qa_done_otdb_ids())
+
+            index.invalidate(123, QA_DONE_STEPS[0])
+            self.assertFalse(index.is_qa_done(123))
+            self.assertEqual(len(QA_DONE_STEPS)-1, len(index.get_artifacts(123)))
+
+            index.invalidate(456)
+            self.assertEqual({}, index.get_artifacts(456))
+
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+if __name__ == '__main__':
+    #run the unit tests
+    unittest.main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2012-2015  ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O. Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+import tempfile
+import shutil
+import os
+from threading import Event, Lock
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+from lofar.qa.service.qa_service import _execute_steps, QAFilteredOTDBBusListener
+
+
+class TestExecuteSteps(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_dependency_ordering(self):
+        order = []
+        order_lock = Lock()
+
+        def step(name):
+            def step_function(results):
+                with order_lock:
+                    order.append(name)
+                return {'name': name, 'prerequisite_results': sorted(results.keys())}
+            return step_function
+
+        steps = {'convert': (step('convert'), []),
+                 'cluster': (step('cluster'), ['convert']),
+                 'plot': (step('plot'), ['convert']),
+                 'copy': (step('copy'), ['cluster', 'plot'])}
+
+        results = _execute_steps(self.executor, steps)
+
+        self.assertEqual(sorted(steps.keys()), sorted(results.keys()))
+        self.assertEqual('convert', order[0])
+        self.assertEqual('copy', order[-1])
+
+        # each step gets (at least) the results of its prerequisites
+        for name, (_, prerequisites) in steps.items():
+            self.assertEqual(name, results[name]['name'])
+            self.assertTrue(set(prerequisites).issubset(results[name]['prerequisite_results']))
+
+    def test_independent_steps_run_in_parallel(self):
+        both_running = Event()
+        running = []
+
+        def step_function(results):
+            running.append(1)
+            if len(running) == 2:
+                both_running.set()
+            # would time out (and return False) if the steps were executed one after the other
+            return both_running.wait(5)
+
+        results = _execute_steps(self.executor, {'a': (step_function, []), 'b': (step_function, [])})
+        self.assertEqual({'a': True, 'b': True}, results)
+
+    def test_cyclic_prerequisites(self):
+        with self.assertRaises(ValueError):
+            _execute_steps(self.executor, {'a': (lambda results: 1, []),
+                                           'b': (lambda results: 2, ['c']),
+                                           'c': (lambda results: 3, ['b'])})
+
+    def test_unknown_prerequisite(self):
+        with self.assertRaises(ValueError):
+            _execute_steps(self.executor, {'a': (lambda results: 1, ['does_not_exist'])})
+
+    def test_step_error_is_raised(self):
+        def failing_step(results):
+            raise RuntimeError("step failed")
+
+        with self.assertRaises(RuntimeError):
+            _execute_steps(self.executor, {'a': (failing_step, [])})
+
+
+class TestQAJobQueue(unittest.TestCase):
+    '''tests for the queueing and concurrency of the qa jobs, with the actual qa steps (_do_qa) mocked away'''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+        self.handler = QAFilteredOTDBBusListener.QAFilteredOTDBEventMessageHandler(
+                            max_concurrent_jobs=2,
+                            artifact_index_path=os.path.join(self.tmp_dir, 'qa_artifact_index.sqlite'))
+        self.handler._tobus = mock.MagicMock()
+
+        # record the sent event messages instead of sending them
+        self.sent_events = []
+        self.handler._send_event_message = lambda subject_suffix, content: self.sent_events.append((subject_suffix, content))
+
+        # the mocked _do_qa blocks until the job is released, and keeps track of the number of concurrently running jobs
+        self.release_jobs = Event()
+        self.lock = Lock()
+        self.running_jobs = 0
+        self.max_running_jobs = 0
+        self.done_otdb_ids = []
+
+        def mocked_do_qa(otdb_id):
+            with self.lock:
+                self.running_jobs += 1
+                self.max_running_jobs = max(self.max_running_jobs, self.running_jobs)
+            try:
+                self.assertTrue(self.release_jobs.wait(10))
+            finally:
+                with self.lock:
+                    self.running_jobs -= 1
+                    self.done_otdb_ids.append(otdb_id)
+
+        self.handler._do_qa = mock.MagicMock(side_effect=mocked_do_qa)
+        self.handler._add_parset_to_hdf5_file = mock.MagicMock()
+
+    def tearDown(self):
+        self.release_jobs.set()
+        self.handler.stop_handling()
+
+    def _wait_until(self, predicate, timeout=10):
+        for _ in range(int(timeout/0.01)):
+            if predicate():
+                return True
+            sleep(0.01)
+        return False
+
+    def _wait_until_all_jobs_done(self):
+        self.assertTrue(self._wait_until(lambda: not self.handler._jobs))
+
+    def test_concurrency_limit(self):
+        for otdb_id in [1, 2, 3, 4]:
+            self.handler.do_qa(otdb_id)
+
+        # only max_concurrent_jobs jobs run, the others are queued in order
+        self.assertTrue(self._wait_until(lambda: self.running_jobs == 2))
+        sleep(0.1)
+        self.assertEqual(2, self.running_jobs)
+        self.assertEqual([1, 2], self.handler._running_otdb_ids)
+        self.assertEqual([3, 4], self.handler._queued_otdb_ids)
+
+        self.release_jobs.set()
+        self._wait_until_all_jobs_done()
+
+        self.assertEqual(2, self.max_running_jobs)
+        self.assertEqual([1, 2, 3, 4], sorted(self.done_otdb_ids))
+        self.assertEqual([], self.handler._running_otdb_ids)
+        self.assertEqual([], self.handler._queued_otdb_ids)
+
+        for subject_suffix in ['JobQueued', 'JobStarted', 'JobDone']:
+            self.assertEqual([1, 2, 3, 4], sorted(content['otdb_id'] for suffix, content in self.sent_events if suffix == subject_suffix))
+
+    def test_deduplication_of_jobs_for_same_otdb_id(self):
+        # the completing and the finished event (or a replayed event) for the same otdb_id should result in one job
+        self.handler.do_qa(1)
+        self.handler.do_qa(1)
+        self.assertTrue(self._wait_until(lambda: self.running_jobs == 1))
+        self.handler.do_qa(1)
+
+        self.release_jobs.set()
+        self._wait_until_all_jobs_done()
+        self.assertEqual(1, self.handler._do_qa.call_count)
+
+        # once the job is done, a new job can be queued for the same otdb_id
+        self.handler.do_qa(1)
+        self._wait_until_all_jobs_done()
+        self.assertEqual(2, self.handler._do_qa.call_count)
+
+    def test_parset_is_added_when_running_job_is_done(self):
+        self.handler.do_qa(1)
+        self.assertTrue(self._wait_until(lambda: self.running_jobs == 1))
+
+        # the observation finished while its qa job is still running, so the parset should be added after the job
+        self.handler.onObservationFinished(1, None)
+        sleep(0.1)
+        self.handler._add_parset_to_hdf5_file.assert_not_called()
+
+        self.release_jobs.set()
+        self.assertTrue(self._wait_until(lambda: self.handler._add_parset_to_hdf5_file.called))
+        self.handler._add_parset_to_hdf5_file.assert_called_once_with(1)
+
+    def test_parset_is_added_right_away_without_job(self):
+        self.handler.onObservationFinished(1, None)
+        self.handler._add_parset_to_hdf5_file.assert_called_once_with(1)
+        self.handler._do_qa.assert_not_called()
+
+    def test_queued_jobs_are_cancelled_upon_stop(self):
+        for otdb_id in [1, 2, 3]:
+            self.handler.do_qa(otdb_id)
+        self.assertTrue(self._wait_until(lambda: self.running_jobs == 2))
+
+        self.release_jobs.set()
+        self.handler.stop_handling()
+
+        # the running jobs finished, the queued job was either cancelled, or started before the cancellation
+        self.assertIn(sorted(self.done_otdb_ids), ([1, 2], [1, 2, 3]))
+        self.assertEqual({}, self.handler._jobs)
+
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+if __name__ == '__main__':
+    #run the unit tests
+    unittest.main()
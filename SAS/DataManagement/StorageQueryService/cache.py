@@ -9,16 +9,18 @@ import datetime
 from time import sleep
 from threading import Thread, RLock, Event, current_thread
 import os.path
-import shutil
-from functools import cmp_to_key
+from queue import PriorityQueue, Empty
+from collections import OrderedDict
 from concurrent import futures
 
 from lofar.messaging import EventMessage, ToBus, DEFAULT_BROKER, DEFAULT_BUSNAME
 from lofar.common.util import humanreadablesize
 from lofar.common.datetimeutils import format_timedelta
 from lofar.sas.datamanagement.storagequery.diskusage import getDiskUsageForPath as du_getDiskUsageForPath
+from lofar.sas.datamanagement.storagequery.diskusage import getDiskUsageForPaths as du_getDiskUsageForPaths
 from lofar.sas.datamanagement.storagequery.diskusage import getOTDBIdFromPath
 from lofar.sas.datamanagement.storagequery.diskusage import DiskUsage
+from lofar.sas.datamanagement.storagequery.cachestore import DiskUsageCacheStore
 from lofar.sas.datamanagement.common.datamanagementbuslistener import DataManagementBusListener, DataManagementEventMessageHandler
 from lofar.sas.otdb.OTDBBusListener import OTDBBusListener, OTDBEventMessageHandler
 from lofar.common.util import waitForInterrupt
@@ -29,6 +31,9 @@ logger = logging.getLogger(__name__)
 
 MAX_CACHE_ENTRY_AGE = datetime.timedelta(hours=3*24)
 
+# the default maximum number of simultaneous (ssh'd) du calls to refresh old cache entries
+DEFAULT_DU_CONCURRENCY = 4
+
 
 class _CacheManagerOTDBEventMessageHandler(OTDBEventMessageHandler):
     def __init__(self, cache_manager: 'CacheManager'):
@@ -51,11 +56,18 @@ class _CacheManagerDataManagementEventMessageHandler(DataManagementEventMessageH
 
 class CacheManager:
     def __init__(self,
-                 cache_path='.du_cache.py',
+                 cache_path='.du_cache.sqlite',
                  mountpoint=CEP4_DATA_MOUNTPOINT,
                  exchange=DEFAULT_BUSNAME,
-                 broker=DEFAULT_BROKER):
-
+                 broker=DEFAULT_BROKER,
+                 du_concurrency=DEFAULT_DU_CONCURRENCY):
+        '''
+        :param cache_path: the path of the (sqlite) file in which the cache is persisted
+        :param mountpoint: the mountpoint of the cep4 data filesystem
+        :param exchange: the exchange on which the otdb and datamanagement events are received, and the notifications are sent
+        :param broker: the messaging broker
+        :param du_concurrency: the maximum number of simultaneous (ssh'd) du calls to refresh old cache entries in the background
+        '''
         self._cache_path = cache_path
 
         self.otdb_listener = OTDBBusListener(_CacheManagerOTDBEventMessageHandler,
@@ -75,10 +87,18 @@ class CacheManager:
         self._updateCacheThread = None
         self._running = False
 
+        # priority queue of (priority, path) tuples of cache entries which need to be refreshed by the worker threads,
+        # and the currently queued priority per path, to prevent queueing the same path multiple times.
+        self._du_concurrency = max(1, du_concurrency)
+        self._refreshWorkerThreads = []
+        self._refreshQueue = PriorityQueue()
+        self._refreshQueuedPaths = {}
+        self._refreshQueueLock = RLock()
+
         self._cacheLock = RLock()
 
         self._cache = {'path_du_results': {}, 'otdb_id2path': {} }
-        self._last_cache_write_timestamp = datetime.datetime(1970, 1, 1)
+        self._cache_store = DiskUsageCacheStore(cache_path)
         self._readCacheFromDisk()
 
         # dict to hold threading Events per path to prevent expensive multiple du calls for each path
@@ -102,59 +122,56 @@ class CacheManager:
             logger.error(str(e))
 
     def _readCacheFromDisk(self):
-        # maybe this cache on disk is slow, if so, revert to proper db solution
         try:
-            if os.path.exists(self._cache_path):
-                with open(self._cache_path, 'r') as file:
-                    cache_from_disk = eval(file.read().strip()) #slow!
-                    with self._cacheLock:
-                        self._cache = cache_from_disk
-                        if not isinstance(self._cache, dict):
-                            self._cache = {'path_du_results': {}, 'otdb_id2path': {} }
-                        if 'path_du_results' not in self._cache:
-                            self._cache['path_du_results'] = {}
-                        if 'otdb_id2path' not in self._cache:
-                            self._cache['otdb_id2path'] = {}
+            if self._cache_store.is_empty():
+                self._migrateLegacyCacheFile()
+
+            path_du_results, otdb_id2path = self._cache_store.load()
+            with self._cacheLock:
+                self._cache = {'path_du_results': path_du_results, 'otdb_id2path': otdb_id2path }
         except Exception as e:
             logger.error("Error while reading in du cache: %s", e)
             with self._cacheLock:
                 self._cache = {'path_du_results': {}, 'otdb_id2path': {} }
 
+    def _migrateLegacyCacheFile(self):
+        """import the (depth<=1) du results from the legacy python-dict cache file (if any) into the cache store, once."""
+        legacy_cache_path = os.path.splitext(self._cache_path)[0] + '.py'
+        if legacy_cache_path == self._cache_path or not os.path.exists(legacy_cache_path):
+            return
 
-    def _writeCacheToDisk(self):
         try:
-            # only persist (a subset of) the cache to disk every once in a while.
-            if datetime.datetime.utcnow() - self._last_cache_write_timestamp > datetime.timedelta(minutes=5):
-                cache_str = ''
-                with self._cacheLock:
-                    # Take a subset of the entire cache
-                    # only the path_du_results for paths at project level (like /data/projects, /data/projects/LC9_001)
-                    # Do not store path_du_results for deeper levels on disk, because that makes the disk read/write too slow,
-                    # and the deeper levels can be obtained via rhb-du calls quite fast anyway.
-                    # Furthermore, once a deeper level du results is stored in the memory cache, then it is also available for fast lookup.
-                    # We just don't store these deep levels on disk.
-                    sub_cache = { path:du_result for path,du_result in list(self._cache['path_du_results'].items())
-                                  if self.getDepthToProjectsDir(path) <= 1 and du_result.get('found') }
-                    cache_str = str(sub_cache)
-
-                tmp_path = '/tmp/tmp_storagequery_cache.py'
-                with open(tmp_path, 'w') as file:
-                    file.write(cache_str)
-                dir_path = os.path.dirname(self._cache_path)
-                if dir_path:
-                    os.makedirs(dir_path, exist_ok=True)
-                shutil.move(tmp_path, self._cache_path)
-                self._last_cache_write_timestamp = datetime.datetime.utcnow()
+            logger.info("migrating legacy du cache file %s to %s", legacy_cache_path, self._cache_path)
+            with open(legacy_cache_path, 'r') as file:
+                # the legacy file is a repr of a dict of dicts with datetimes. Evaluate it without any builtins.
+                legacy_cache = eval(file.read().strip(), {'__builtins__': {}, 'datetime': datetime})
+
+            if isinstance(legacy_cache, dict):
+                # older versions wrote the whole cache, later versions only the path_du_results
+                path_du_results = legacy_cache.get('path_du_results', legacy_cache)
+                otdb_id2path = legacy_cache.get('otdb_id2path', {})
+                path_du_results = {path: du_result for path, du_result in path_du_results.items()
+                                   if isinstance(du_result, dict) and du_result.get('path') == path}
+                self._cache_store.import_cache(path_du_results, otdb_id2path)
+
+            os.rename(legacy_cache_path, legacy_cache_path + '.migrated')
         except Exception as e:
-            logger.error("Error while writing du cache: %s", e)
+            logger.error("Error while migrating legacy du cache file %s: %s", legacy_cache_path, e)
 
-    def _updateCache(self, du_result, send_notification=True):
+    def _updateCache(self, du_result, send_notification=True, du_timestamp=None):
+        '''
+        update the cache with the du_result, and propagate its change to the cached parent directories.
+        :param du_timestamp: the (utc) time at which the du was started, which is the cache_timestamp of the entry. Default: now.
+        '''
         if not 'path' in du_result:
             return
 
         path = du_result['path']
         otdb_id = du_result.get('otdb_id')
 
+        # a result of a failed du might not even have a disk_usage
+        du_result.setdefault('disk_usage', None)
+
         with self._cacheLock:
             path_cache = self._cache['path_du_results']
             otdb_id2path_cache = self._cache['otdb_id2path']
@@ -168,6 +185,9 @@ class CacheManager:
                 if otdb_id is None:
                     otdb_id = getOTDBIdFromPath(path)
 
+            previous_entry = path_cache.get(path)
+            previous_entry = dict(previous_entry) if previous_entry is not None else None
+
             if not path in path_cache or path_cache[path]['disk_usage'] != du_result['disk_usage']:
                 # update the cache entry, even when no du result found,
                 # cause that will save disk queries next time.
@@ -179,24 +199,131 @@ class CacheManager:
 
             if not du_result['found']:
                 # even when the du for the path is not found,
-                # keep a copy in the cache for fast lookup by clients
-                # Make sure the size is 0
-                du_result['disk_usage'] = 0
-                du_result['disk_usage_readable'] = humanreadablesize(0)
+                # keep a copy in the cache for fast lookup by clients.
+                # The size of a non-existing path is 0, but the size is unknown (None) if the du failed otherwise.
+                du_result['disk_usage_readable'] = humanreadablesize(du_result['disk_usage'])
 
-            path_cache[path]['cache_timestamp'] = datetime.datetime.utcnow()
+            path_cache[path]['cache_timestamp'] = du_timestamp or datetime.datetime.utcnow()
             path_cache[path]['needs_update'] = False
 
-        self._writeCacheToDisk()
+            # persist the updated entries right away, so a restart has a warm cache
+            try:
+                self._cache_store.upsert_du_result(path_cache[path])
+                if otdb_id != None:
+                    self._cache_store.upsert_otdb_id_path(otdb_id, path)
+            except Exception as e:
+                logger.error("Error while writing du cache entry for %s: %s", path, e)
+
+            changed_ancestors = self._propagateDiskUsageChange(path, previous_entry, path_cache[path])
 
         if send_notification:
             self._sendDiskUsageChangedNotification(path, du_result['disk_usage'], otdb_id)
+            for ancestor_entry in changed_ancestors:
+                self._sendDiskUsageChangedNotification(ancestor_entry['path'], ancestor_entry['disk_usage'], ancestor_entry.get('otdb_id'))
+
+    def _getAncestorPaths(self, path):
+        '''get the paths of all parent directories of the given path, up to and including the projects_path, nearest first.'''
+        projects_path = self.disk_usage.path_resolver.projects_path.rstrip('/')
+        ancestor_paths = []
+        parent_path = os.path.dirname(path.rstrip('/'))
+        while parent_path.startswith(projects_path) and len(parent_path) >= len(projects_path) and parent_path not in ancestor_paths:
+            ancestor_paths.append(parent_path)
+            parent_path = os.path.dirname(parent_path)
+        return ancestor_paths
+
+    def _propagateDiskUsageChange(self, path, previous_entry, du_result):
+        '''
+        Keep the cached sizes of the parent directories in line with a new du_result for the given path,
+        without re-du'ing the (large) parent directories:
+         - if the previous size of the path was known, then the difference is added to each cached parent size,
+           up to the first parent which was measured after the previous measurement of the path. That parent's size
+           already includes the change, and its own change was propagated to its parents when it was measured.
+         - if not, then only the nearest cached parent is marked as needs_update if it was measured before the path was known.
+           Once re-du'ed, its change is propagated arithmetically to its parents, without re-du'ing the whole tree.
+         - if the du failed (for another reason than a non-existing path), then the new size is unknown,
+           so all cached parents are marked as needs_update.
+        The arithmetically updated parents keep their cache_timestamp, so they are still du'ed once they are too old,
+        which corrects any drift due to changes which were not measured via the cache.
+        Should be called with the _cacheLock held.
+        :return list: the cache entries of the parent directories whose disk_usage changed.
+        '''
+        path_cache = self._cache['path_du_results']
+        disk_usage = du_result.get('disk_usage')
+
+        if disk_usage is None:
+            if not du_result.get('found', False):
+                # the du failed, so we cannot tell how much the size of the path changed.
+                for ancestor_path in self._getAncestorPaths(path):
+                    ancestor_entry = path_cache.get(ancestor_path)
+                    if ancestor_entry is not None and not ancestor_entry.get('needs_update', False):
+                        logger.info('invalidating cache entry for %s because the disk usage of %s could not be determined', ancestor_path, path)
+                        self._invalidateCacheEntryForPath(ancestor_path)
+            # size of path unknown (yet), so nothing to propagate
+            return []
+
+        previous_disk_usage = previous_entry.get('disk_usage') if previous_entry is not None else None
+
+        previous_timestamp = previous_entry.get('cache_timestamp') if previous_entry is not None else None
+
+        if previous_disk_usage is None:
+            cached_ancestor_paths = [ancestor_path for ancestor_path in self._getAncestorPaths(path) if ancestor_path in path_cache]
+            if cached_ancestor_paths:
+                ancestor_path = cached_ancestor_paths[0]
+                ancestor_entry = path_cache[ancestor_path]
+                ancestor_timestamp = ancestor_entry.get('cache_timestamp')
+                if not ancestor_entry.get('needs_update', False) and \
+                   (previous_timestamp is None or ancestor_timestamp is None or ancestor_timestamp < previous_timestamp):
+                    logger.info('invalidating cache entry for %s because the previous disk usage of %s was unknown', ancestor_path, path)
+                    self._invalidateCacheEntryForPath(ancestor_path)
+            return []
+
+        delta = disk_usage - previous_disk_usage
+        if delta == 0:
+            return []
+
+        changed_ancestors = []
+        for ancestor_path in self._getAncestorPaths(path):
+            ancestor_entry = path_cache.get(ancestor_path)
+            if ancestor_entry is None:
+                continue
+
+            ancestor_timestamp = ancestor_entry.get('cache_timestamp')
+            if previous_timestamp is not None and ancestor_timestamp is not None and ancestor_timestamp > previous_timestamp:
+                # this parent, and thereby its parents, already include the change
+                break
+
+            if ancestor_entry.get('disk_usage') is None:
+                continue
+
+            ancestor_entry['disk_usage'] = max(0, ancestor_entry['disk_usage'] + delta)
+            ancestor_entry['disk_usage_readable'] = humanreadablesize(ancestor_entry['disk_usage'])
+            logger.info('updated disk usage of %s by %s to %s because disk usage of %s changed',
+                        ancestor_path, delta, ancestor_entry['disk_usage_readable'], path)
+
+            try:
+                self._cache_store.upsert_du_result(ancestor_entry)
+            except Exception as e:
+                logger.error("Error while writing du cache entry for %s: %s", ancestor_path, e)
+
+            changed_ancestors.append(dict(ancestor_entry))
+
+        return changed_ancestors
 
     def _invalidateCacheEntryForPath(self, path):
         with self._cacheLock:
             path_cache = self._cache['path_du_results']
             if path in path_cache:
                 path_cache[path]['needs_update'] = True
+                self._persistNeedsUpdate(path)
+
+                if self._running:
+                    self._scheduleCacheEntryRefresh(path_cache[path])
+
+    def _persistNeedsUpdate(self, path):
+        try:
+            self._cache_store.set_needs_update(path)
+        except Exception as e:
+            logger.error("Error while writing du cache entry for %s: %s", path, e)
 
     def getOtdbIdsFoundOnDisk(self):
         with self._cacheLock:
@@ -206,11 +333,10 @@ class CacheManager:
     def getDiskUsagesForAllOtdbIds(self, force_update=False):
         otdb_ids = self.getOtdbIdsFoundOnDisk()
 
-        result = {}
-        for otdb_id in otdb_ids:
-            result[otdb_id] = self.getDiskUsageForOTDBId(otdb_id, force_update=force_update)
+        # du all (uncached) task paths in one go, instead of one du call per otdb_id
+        results = self._getDiskUsageForTasks([{'otdb_id': otdb_id} for otdb_id in otdb_ids], force_update=force_update)
 
-        return result
+        return dict(zip(otdb_ids, results))
 
     def getDepthToProjectsDir(self, path):
         return len(path.replace(self.disk_usage.path_resolver.projects_path, '').strip('/').split('/'))
@@ -255,6 +381,7 @@ class CacheManager:
                     if directory in path_cache:
                         # mark cache entry for directory to be updated
                         path_cache[directory]['needs_update'] = True
+                        self._persistNeedsUpdate(directory)
 
             addSubDirectoriesToCache(self.disk_usage.path_resolver.projects_path)
             logger.info('tree scan complete')
@@ -262,82 +389,49 @@ class CacheManager:
         except Exception as e:
             logger.exception(str(e))
 
+    def _isCacheEntryStale(self, cache_entry, now=None):
+        if cache_entry.get('needs_update', False) or cache_entry.get('cache_timestamp') is None:
+            return True
+        return (now or datetime.datetime.utcnow()) - cache_entry['cache_timestamp'] > MAX_CACHE_ENTRY_AGE
+
+    def _getRefreshPriority(self, cache_entry):
+        # 'needs_update' paths first, then the higher levels in the tree (the project totals), then oldest to newest.
+        return (0 if cache_entry.get('needs_update', False) else 1,
+                self.getDepthToProjectsDir(cache_entry['path']),
+                cache_entry.get('cache_timestamp') or datetime.datetime.min)
+
+    def _scheduleCacheEntryRefresh(self, cache_entry):
+        """put the path of the cache_entry in the refresh queue, unless it is already queued with the same or a higher priority."""
+        path = cache_entry.get('path')
+        if not path:
+            return False
+
+        priority = self._getRefreshPriority(cache_entry)
+        with self._refreshQueueLock:
+            queued_priority = self._refreshQueuedPaths.get(path)
+            if queued_priority is not None and queued_priority <= priority:
+                return False
+            # (re)queue it. If it was queued before with a lower priority, then that queue item is skipped by the worker.
+            self._refreshQueuedPaths[path] = priority
+            self._refreshQueue.put((priority, path))
+            return True
+
     def _updateOldEntriesInCache(self):
         logger.info('starting updating old cache entries')
         while self._running:
             try:
                 now = datetime.datetime.utcnow()
                 with self._cacheLock:
-                    path_cache = self._cache['path_du_results']
-                    old_entries = [cache_entry for cache_entry in list(path_cache.values())
-                                   if now - cache_entry['cache_timestamp'] > MAX_CACHE_ENTRY_AGE]
-                    needs_update_entries = [cache_entry for cache_entry in list(path_cache.values())
-                                            if cache_entry.get('needs_update', False)]
+                    updateable_entries = [cache_entry for cache_entry in list(self._cache['path_du_results'].values())
+                                          if self._isCacheEntryStale(cache_entry, now)]
 
-                updateable_entries = old_entries + needs_update_entries
+                nr_of_scheduled_entries = sum(1 for cache_entry in updateable_entries if self._scheduleCacheEntryRefresh(cache_entry))
 
-                logger.info('%s old cache entries need to be updated, #age:%s #needs_update:%s',
+                logger.info('%s old cache entries need to be updated, #needs_update:%s #newly_scheduled:%s #queued:%s',
                             len(updateable_entries),
-                            len(old_entries),
-                            len(needs_update_entries))
-
-                if updateable_entries:
-                    # sort them oldest to newest, 'needs_update' paths first
-                    def compareFunc(entry1, entry2):
-                        if entry1.get('needs_update') and not entry2.get('needs_update'):
-                            return -1
-                        if not entry1.get('needs_update') and entry2.get('needs_update'):
-                            return 1
-
-                        #depth1 = self.getDepthToProjectsDir(entry1['path'])
-                        #depth2 = self.getDepthToProjectsDir(entry2['path'])
-
-                        #if depth1 != depth2:
-                            ## lower level dirs are sorted in front of higher level dirs
-                            #return depth1 - depth2
-
-                        if entry1['cache_timestamp'] < entry2['cache_timestamp']:
-                            return -1
-                        if entry1['cache_timestamp'] > entry2['cache_timestamp']:
-                            return 1
-                        return 0
-
-                    updateable_entries = sorted(updateable_entries, key=cmp_to_key(compareFunc))
-
-                    cacheUpdateStart = datetime.datetime.utcnow()
-
-                    for i, cache_entry in enumerate(updateable_entries):
-                        try:
-                            # it might be that the cache_entry was already updated via another way
-                            # so only update it if still to old or needs_update
-                            now = datetime.datetime.utcnow()
-                            if now - cache_entry['cache_timestamp'] > MAX_CACHE_ENTRY_AGE or cache_entry.get('needs_update', False):
-                                path = cache_entry.get('path')
-                                if path:
-                                    logger.info('_updateOldEntriesInCache: examining entry %s/%s. timestamp:%s age:%s needs_update:%s path: \'%s\'',
-                                                i,
-                                                len(updateable_entries),
-                                                cache_entry['cache_timestamp'],
-                                                format_timedelta(now - cache_entry['cache_timestamp']),
-                                                cache_entry.get('needs_update', False),
-                                                path)
-
-                                    #du a full update from disk, which might be (really) slow.
-                                    result = du_getDiskUsageForPath(path)
-                                    logger.debug('trying to update old entry in cache: %s', result)
-                                    self._updateCache(result)
-                        except Exception as e:
-                            logger.error(str(e))
-
-                        if not self._running:
-                            logger.info('exiting _updateCacheThread')
-                            return
-
-                        if datetime.datetime.utcnow() - cacheUpdateStart > datetime.timedelta(minutes=10):
-                            # break out of cache update loop if full update takes more than 1min
-                            # next loop we'll start with the oldest cache entries again
-                            logger.info('skipping remaining %s old cache entries updates, they will be updated next time', len(updateable_entries)-i)
-                            break
+                            sum(1 for cache_entry in updateable_entries if cache_entry.get('needs_update', False)),
+                            nr_of_scheduled_entries,
+                            self._refreshQueue.qsize())
 
                 #update the CEP4 capacities in the RADB once in a while...
                 self._updateCEP4CapacitiesInRADB()
@@ -352,6 +446,39 @@ class CacheManager:
             except Exception as e:
                 logger.exception(str(e))
 
+    def _refreshCacheEntriesWorker(self):
+        """worker loop which takes the most urgent path from the refresh queue, and updates its cache entry with a new du"""
+        while self._running:
+            try:
+                priority, path = self._refreshQueue.get(timeout=1)
+            except Empty:
+                continue
+
+            with self._refreshQueueLock:
+                if self._refreshQueuedPaths.get(path) != priority:
+                    # this path was requeued with a higher priority, and is (or was) handled via that queue item.
+                    continue
+                del self._refreshQueuedPaths[path]
+
+            try:
+                # it might be that the cache_entry was already updated via another way
+                # so only update it if still to old or needs_update
+                with self._cacheLock:
+                    cache_entry = self._cache['path_du_results'].get(path)
+
+                if cache_entry is not None and self._isCacheEntryStale(cache_entry):
+                    logger.info('_refreshCacheEntriesWorker: updating entry. timestamp:%s needs_update:%s #queued:%s path: \'%s\'',
+                                cache_entry.get('cache_timestamp'),
+                                cache_entry.get('needs_update', False),
+                                self._refreshQueue.qsize(),
+                                path)
+
+                    # a full update from disk, which might be (really) slow.
+                    # getDiskUsageForPath makes sure that the same path is not du'ed at the same time by an rpc call.
+                    self.getDiskUsageForPath(path, force_update=True)
+            except Exception as e:
+                logger.error(str(e))
+
     def _updateCEP4CapacitiesInRADB(self):
         try:
             df_result = self.disk_usage.getDiskFreeSpace()
@@ -387,6 +514,11 @@ class CacheManager:
 
         self._scanProjectsTree()
 
+        self._refreshWorkerThreads = [Thread(target=self._refreshCacheEntriesWorker, name='du_refresh_worker_%d' % i, daemon=True)
+                                      for i in range(self._du_concurrency)]
+        for thread in self._refreshWorkerThreads:
+            thread.start()
+
         self._updateCacheThread = Thread(target=self._updateOldEntriesInCache)
         self._updateCacheThread.daemon = True
         self._updateCacheThread.start()
@@ -402,9 +534,13 @@ class CacheManager:
         self.otdb_listener.stop_listening()
         self.dm_listener.stop_listening()
         self._updateCacheThread.join()
+        for thread in self._refreshWorkerThreads:
+            thread.join()
+        self._refreshWorkerThreads = []
 
         self.event_bus.close()
         self.disk_usage.close()
+        self._cache_store.close()
         logger.info("closed storagequeryservice cache")
 
     def __enter__(self):
@@ -421,33 +557,47 @@ class CacheManager:
         self._onDiskActivityForOTDBId(otdb_id)
 
     def onTaskDeleted(self, otdb_id, deleted, paths, message=''):
-        self._onDiskActivityForOTDBId(otdb_id)
+        with self._cacheLock:
+            task_path = self._cache['otdb_id2path'].get(otdb_id) if otdb_id != None else None
+
+        # the deleted paths have no size anymore, which we can subtract from the parents right away.
+        deleted_paths = self._onPathsDeleted(paths) if deleted and paths else []
+
+        if task_path is None or task_path not in deleted_paths:
+            # only part of the task's data was deleted (or we don't know which part), so measure what's left.
+            self._onDiskActivityForOTDBId(otdb_id)
 
         with self._cacheLock:
             if deleted and otdb_id != None and otdb_id in self._cache['otdb_id2path']:
                 del self._cache['otdb_id2path'][otdb_id]
+                try:
+                    self._cache_store.delete_otdb_id(otdb_id)
+                except Exception as e:
+                    logger.error("Error while deleting otdb_id %s from du cache: %s", otdb_id, e)
+
+    def _onPathsDeleted(self, paths):
+        '''
+        set the cached disk_usage of the deleted paths, and of all their cached sub directories, to 0.
+        The deepest directories are done first, so each size is subtracted only once from its parents.
+        :return list: the deleted paths
+        '''
+        paths = [path.rstrip('/') for path in paths if path]
+        with self._cacheLock:
+            cached_paths = [cached_path for cached_path in self._cache['path_du_results'].keys()
+                            if any(cached_path == path or cached_path.startswith(path + '/') for path in paths)]
+
+        for cached_path in sorted(cached_paths, key=lambda p: p.count('/'), reverse=True):
+            logger.info('setting disk usage for deleted path %s to 0', cached_path)
+            self._updateCache({'found': False, 'path': cached_path, 'disk_usage': 0, 'name': cached_path.split('/')[-1],
+                               'message': 'No such path: %s' % cached_path},
+                              send_notification=cached_path in paths)
+        return paths
 
     def _onDiskActivityForOTDBId(self, otdb_id):
+        # the (delta of the) new disk usage of the task is propagated to its parents in _updateCache
+        du_timestamp = datetime.datetime.utcnow()
         result = self.disk_usage.getDiskUsageForOTDBId(otdb_id)
-        self._updateCache(result)
-
-        task_path = result.get('path')
-        projects_path = self.disk_usage.path_resolver.projects_path
-
-        # update all paths up the tree up to the projects_path
-        # update the resource availability in the radb as well
-        path = task_path
-        while path:
-            parent_path = '/'.join(path.split('/')[:-1])
-
-            if projects_path.startswith(parent_path) and len(parent_path) < len(projects_path):
-                break
-
-            logger.info('invalidating cache entry for %s because disk usage for task %s in %s changed', parent_path, otdb_id, task_path)
-
-            self._invalidateCacheEntryForPath(parent_path)
-
-            path = parent_path
+        self._updateCache(result, du_timestamp=du_timestamp)
 
     def getDiskUsageForOTDBId(self, otdb_id, include_scratch_paths=True, force_update=False):
         return self.getDiskUsageForTask(otdb_id=otdb_id, include_scratch_paths=include_scratch_paths, force_update=force_update)
@@ -462,51 +612,66 @@ class CacheManager:
         logger.info("cache.getDiskUsageForTask(radb_id=%s, mom_id=%s, otdb_id=%s, include_scratch_paths=%s, force_update=%s)",
                     radb_id, mom_id, otdb_id, include_scratch_paths, force_update)
 
+        path_result = self._getPathsForTask(radb_id=radb_id, mom_id=mom_id, otdb_id=otdb_id, include_scratch_paths=include_scratch_paths)
+        return self._getDiskUsageForTaskPaths(path_result, force_update=force_update)
+
+    def _getPathsForTask(self, radb_id=None, mom_id=None, otdb_id=None, include_scratch_paths=True):
+        '''resolve the path (and scratch paths) for the task, using the cached otdb_id2path where possible.
+        :return dict: the path_result of the path_resolver, with 'from_cache'=True if the path came from the cache.
+        '''
         if otdb_id != None and not include_scratch_paths:
             with self._cacheLock:
                 path = self._cache['otdb_id2path'].get(otdb_id)
 
             if path:
                 logger.info('Using path from cache for otdb_id %s %s', otdb_id, path)
-                return self.getDiskUsageForPath(path, force_update=force_update)
+                return {'found': True, 'path': path, 'otdb_id': otdb_id, 'from_cache': True}
 
         logger.info("cache.getDiskUsageForTask could not find path in cache, determining path...")
 
         path_result = self.disk_usage.path_resolver.getPathForTask(radb_id=radb_id, mom_id=mom_id, otdb_id=otdb_id, include_scratch_paths=include_scratch_paths)
 
-        if path_result['found']:
-            task_path = path_result['path']
-            scratch_paths = path_result.get('scratch_paths', [])
+        if not path_result['found'] and otdb_id != None:
+            # still no path(s) found for otdb_id, now try from cache and ignore possible scratch paths
+            with self._cacheLock:
+                path = self._cache['otdb_id2path'].get(otdb_id)
 
-            # get all du's in parallel over all paths
-            paths = [task_path] + scratch_paths
-            paths_du_result = self.getDiskUsageForPaths(paths, force_update=force_update)
+            if path:
+                logger.info('Using path from cache for otdb_id %s %s (ignoring possible scratch/share paths)', otdb_id, path)
+                return {'found': True, 'path': path, 'otdb_id': otdb_id, 'from_cache': True}
 
-            # split into project and subdir
-            path_du_result = paths_du_result.pop(task_path)
-            scratch_du_result = paths_du_result
+        return path_result
 
-            task_du_result = dict(path_du_result)
+    def _getDiskUsageForTaskPaths(self, path_result, force_update=False):
+        '''get the disk usage for the task path(s) which were resolved by _getPathsForTask'''
+        if not path_result['found']:
+            return {'found': False, 'path': path_result['path']}
 
-            # yield id's for if available, or None
-            for id in ['radb_id', 'otdb_id', 'mom_id']:
-                task_du_result[id] = path_result.get(id)
+        task_path = path_result['path']
 
-            if scratch_du_result:
-                task_du_result['scratch_paths'] = scratch_du_result
+        if path_result.get('from_cache'):
+            return self.getDiskUsageForPath(task_path, force_update=force_update)
 
-            return task_du_result
+        scratch_paths = path_result.get('scratch_paths', [])
 
-        # still no path(s) found for otdb_id, now try from cache and ignore possible scratch paths
-        if otdb_id != None:
-            with self._cacheLock:
-                path = self._cache['otdb_id2path'].get(otdb_id)
+        # get all du's in one go over all paths
+        paths = [task_path] + scratch_paths
+        paths_du_result = self.getDiskUsageForPaths(paths, force_update=force_update)
 
-            if path:
-                logger.info('Using path from cache for otdb_id %s %s (ignoring possible scratch/share paths)', otdb_id, path)
-                return self.getDiskUsageForPath(path, force_update=force_update)
+        # split into project and subdir
+        path_du_result = paths_du_result.pop(task_path)
+        scratch_du_result = paths_du_result
+
+        task_du_result = dict(path_du_result)
+
+        # yield id's for if available, or None
+        for id in ['radb_id', 'otdb_id', 'mom_id']:
+            task_du_result[id] = path_result.get(id)
 
-        return {'found': False, 'path': path_result['path']}
+        if scratch_du_result:
+            task_du_result['scratch_paths'] = scratch_du_result
+
+        return task_du_result
 
     def getDiskUsageForTasks(self, radb_ids=None, mom_ids=None, otdb_ids=None, include_scratch_paths=True, force_update=False):
         logger.info("cache.getDiskUsageForTasks(radb_ids=%s, mom_ids=%s, otdb_ids=%s)" % (radb_ids, mom_ids, otdb_ids))
@@ -518,81 +683,123 @@ class CacheManager:
         if otdb_ids is None:
             otdb_ids = []
 
-        with futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        parallel_kwargs  = [{'radb_id':radb_id, 'include_scratch_paths': include_scratch_paths} for radb_id in radb_ids]
+        parallel_kwargs += [{'mom_id':mom_id, 'include_scratch_paths': include_scratch_paths} for mom_id in mom_ids]
+        parallel_kwargs += [{'otdb_id':otdb_id, 'include_scratch_paths': include_scratch_paths} for otdb_id in otdb_ids]
 
-            # helper function to expand parallel p_kwarg dict into kwargs
-            def parallel_getDiskUsageForTask(p_kwarg):
-                return self.getDiskUsageForTask(**p_kwarg)
-
-            parallel_kwargs  = [{'radb_id':radb_id, 'include_scratch_paths': include_scratch_paths, 'force_update':force_update} for radb_id in radb_ids]
-            parallel_kwargs += [{'mom_id':mom_id, 'include_scratch_paths': include_scratch_paths, 'force_update':force_update} for mom_id in mom_ids]
-            parallel_kwargs += [{'otdb_id':otdb_id, 'include_scratch_paths': include_scratch_paths, 'force_update':force_update} for otdb_id in otdb_ids]
-            results = list(executor.map(parallel_getDiskUsageForTask, parallel_kwargs))
-
-            # collect results in a dict grouped by id_type
-            for result in results:
-                if result.get('radb_id') in radb_ids:
-                    tasks_result['radb_ids'][result['radb_id']] = result
-                if result.get('mom_id') in mom_ids:
-                    tasks_result['mom_ids'][result['mom_id']] = result
-                if result.get('otdb_id') in otdb_ids:
-                    tasks_result['otdb_ids'][result['otdb_id']] = result
+        results = self._getDiskUsageForTasks(parallel_kwargs, force_update=force_update)
+
+        # collect results in a dict grouped by id_type
+        for result in results:
+            if result.get('radb_id') in radb_ids:
+                tasks_result['radb_ids'][result['radb_id']] = result
+            if result.get('mom_id') in mom_ids:
+                tasks_result['mom_ids'][result['mom_id']] = result
+            if result.get('otdb_id') in otdb_ids:
+                tasks_result['otdb_ids'][result['otdb_id']] = result
 
         logger.info("cache.getDiskUsageForTasks(radb_ids=%s, mom_ids=%s, otdb_ids=%s) returning: %s" % (radb_ids, mom_ids, otdb_ids, tasks_result))
 
         return tasks_result
 
-    def getDiskUsageForPaths(self, paths, force_update=False):
+    def _getDiskUsageForTasks(self, tasks_kwargs, force_update=False):
+        '''
+        get the disk usage for many tasks at once:
+        first resolve the paths of all tasks in parallel (which are just rpc calls),
+        then du all of their paths which are not in the cache yet in one (batched) du call, instead of one ssh call per path.
+        :param list tasks_kwargs: list of kwarg dicts for _getPathsForTask
+        :return list: the task du result for each of the tasks_kwargs
+        '''
         with futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
 
-            # helper function to expand parallel p_arg tuple into list of args
-            def parallel_getDiskUsageForPath(p_arg):
-                return self.getDiskUsageForPath(*p_arg)
+            # helper function to expand parallel p_kwarg dict into kwargs
+            def parallel_getPathsForTask(p_kwarg):
+                return self._getPathsForTask(**p_kwarg)
 
-            parallel_args = [(path, force_update) for path in paths]
-            results = list(executor.map(parallel_getDiskUsageForPath, parallel_args))
+            path_results = list(executor.map(parallel_getPathsForTask, tasks_kwargs))
 
-            return { result['path']:result for result in results }
+        all_paths = [path for path_result in path_results if path_result['found']
+                     for path in [path_result['path']] + path_result.get('scratch_paths', [])]
+        self._updateCacheForPaths(all_paths, force_update=force_update)
+
+        # now all paths are in the cache
+        return [self._getDiskUsageForTaskPaths(path_result) for path_result in path_results]
+
+    def getDiskUsageForPaths(self, paths, force_update=False):
+        self._updateCacheForPaths(paths, force_update=force_update)
+
+        # now all paths are in the cache
+        results = [self.getDiskUsageForPath(path) for path in paths]
+        return { result['path']:result for result in results }
+
+    def _updateCacheForPaths(self, paths, force_update=False):
+        '''
+        du the given paths which are not in the cache yet (or all of them when force_update) in one (batched) du call,
+        and update the cache with the results.
+        Paths which are being du'ed at the moment by another thread are not du'ed again, we wait for those instead.
+        '''
+        paths = list(OrderedDict.fromkeys(paths))
 
-    def getDiskUsageForPath(self, path, force_update=False):
-        logger.info("cache.getDiskUsageForPath('%s', force_update=%s)", path, force_update)
-        needs_cache_update = False
         if not force_update:
             with self._cacheLock:
-                needs_cache_update |= path not in self._cache['path_du_results']
+                paths = [path for path in paths if path not in self._cache['path_du_results']]
 
-        if needs_cache_update or force_update:
-            logger.info("cache update needed for %s", path)
+        if not paths:
+            return
+
+        logger.info("cache update needed for %s paths", len(paths))
 
-            # check if some other thread is already doing a du call for this path...
-            with self._du_threading_events_lock:
+        # check if some other thread is already doing a du call for these paths...
+        paths_to_du = []
+        path_threading_events_to_wait_for = []
+        with self._du_threading_events_lock:
+            for path in paths:
                 path_threading_event = self._du_threading_events.get(path)
-                need_to_do_du_call = path_threading_event is None
 
-                if need_to_do_du_call:
+                if path_threading_event is None:
                     # no other thread is currently du'ing/updating this path
                     # so create a threading Event and store it in the dict,
                     # so other threads can wait for this event.
-                    logger.info("updating the cache for %s current_thread=%s", path, current_thread().name)
-                    path_threading_event = Event()
-                    self._du_threading_events[path] = path_threading_event
-
-            if need_to_do_du_call:
-                # no other thread is currently du'ing/updating this path
-                # so we need to do it here.
-                result = du_getDiskUsageForPath(path)
-                self._updateCache(result)
+                    self._du_threading_events[path] = Event()
+                    paths_to_du.append(path)
+                else:
+                    path_threading_events_to_wait_for.append(path_threading_event)
 
+        if paths_to_du:
+            try:
+                logger.info("updating the cache for %s paths current_thread=%s", len(paths_to_du), current_thread().name)
+                # no other thread is currently du'ing/updating these paths
+                # so we need to do it here, in one go for all paths if there are multiple.
+                du_timestamp = datetime.datetime.utcnow()
+                if len(paths_to_du) == 1:
+                    results = {paths_to_du[0]: du_getDiskUsageForPath(paths_to_du[0])}
+                else:
+                    results = du_getDiskUsageForPaths(paths_to_du)
+
+                # update the deepest paths first. The delta of a sub directory is then added to the previous size of its parent,
+                # which is overwritten next by the new size of the parent, which already includes the sub directory.
+                # (Otherwise the delta of the sub directory would be added to the new size of the parent as well.)
+                for path in sorted(paths_to_du, key=lambda p: p.rstrip('/').count('/'), reverse=True):
+                    self._updateCache(results[path], du_timestamp=du_timestamp)
+            finally:
                 # signal threads waiting for this same path du call
                 # and do bookkeeping
                 with self._du_threading_events_lock:
-                    logger.info("signaling other threads that the cache was updated for %s current_thread=%s", path, current_thread().name)
-                    path_threading_event.set()
-                    del self._du_threading_events[path]
-            else:
-                logger.info("waiting for du call on other thread that will update the cache for %s current_thread=%s", path, current_thread().name)
+                    logger.info("signaling other threads that the cache was updated for %s paths current_thread=%s", len(paths_to_du), current_thread().name)
+                    for path in paths_to_du:
+                        self._du_threading_events.pop(path).set()
+
+        if path_threading_events_to_wait_for:
+            logger.info("waiting for du call(s) on other thread(s) that will update the cache for %s paths current_thread=%s",
+                        len(path_threading_events_to_wait_for), current_thread().name)
+            for path_threading_event in path_threading_events_to_wait_for:
                 path_threading_event.wait()
-                logger.info("another thread just updated the cache for %s current_thread=%s", path, current_thread().name)
+            logger.info("other thread(s) just updated the cache for %s paths current_thread=%s",
+                        len(path_threading_events_to_wait_for), current_thread().name)
+
+    def getDiskUsageForPath(self, path, force_update=False):
+        logger.info("cache.getDiskUsageForPath('%s', force_update=%s)", path, force_update)
+        self._updateCacheForPaths([path], force_update=force_update)
 
         with self._cacheLock:
             if path in self._cache['path_du_results']:
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# $Id$
+
+'''
+The DiskUsageCacheStore persists the CacheManager's in-memory disk usage cache
+(the path_du_results and the otdb_id2path mapping) in a small sqlite database.
+Each cache update is upserted right away, for all depths of the projects tree,
+so a restarted storagequeryservice starts with a warm cache instead of re-du'ing the whole tree.
+'''
+
+import os
+import json
+import sqlite3
+import logging
+import datetime
+from threading import RLock
+
+logger = logging.getLogger(__name__)
+
+# the keys of a du_result which are stored in their own column instead of in the json encoded result
+_COLUMN_KEYS = ('path', 'otdb_id', 'cache_timestamp', 'needs_update')
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_UPSERT_DU_RESULT_QUERY = '''INSERT OR REPLACE INTO path_du_results (path, otdb_id, cache_timestamp, needs_update, du_result)
+                             VALUES (?, ?, ?, ?, ?)'''
+
+
+class DiskUsageCacheStore:
+    '''
+    A small (thread-safe) sqlite database with one record per path holding its du_result, and one record per otdb_id holding its path.
+
+    Usage:
+        with DiskUsageCacheStore('/path/to/storagequery_cache.sqlite') as store:
+            path_du_results, otdb_id2path = store.load()
+            ...
+            store.upsert_du_result(du_result)
+    '''
+    def __init__(self, db_path: str):
+        '''
+        :param str db_path: the path to the sqlite database file. It is created (including its directory) when needed.
+        '''
+        self.db_path = db_path
+        self._connection = None
+        self._lock = RLock()
+
+    def open(self):
+        with self._lock:
+            if self._connection is None:
+                if self.db_path != ':memory:':
+                    os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+                # the CacheManager updates the cache from multiple threads, which is serialized by our own _lock.
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+                self._connection.row_factory = sqlite3.Row
+                # many small upserts: use a write-ahead-log, and only sync at checkpoints.
+                # A crash may lose the last few updates, which are just re-du'ed.
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                self._connection.execute('PRAGMA synchronous=NORMAL')
+                with self._connection:
+                    self._connection.execute('''CREATE TABLE IF NOT EXISTS path_du_results (
+                                                path TEXT PRIMARY KEY NOT NULL,
+                                                otdb_id INTEGER,
+                                                cache_timestamp TEXT,
+                                                needs_update INTEGER NOT NULL DEFAULT 0,
+                                                du_result TEXT NOT NULL)''')
+                    self._connection.execute('CREATE INDEX IF NOT EXISTS path_du_results_otdb_id_idx ON path_du_results (otdb_id)')
+                    self._connection.execute('CREATE INDEX IF NOT EXISTS path_du_results_cache_timestamp_idx ON path_du_results (cache_timestamp)')
+                    self._connection.execute('''CREATE TABLE IF NOT EXISTS otdb_id2path (
+                                                otdb_id INTEGER PRIMARY KEY NOT NULL,
+                                                path TEXT NOT NULL)''')
+                    self._connection.execute('CREATE INDEX IF NOT EXISTS otdb_id2path_path_idx ON otdb_id2path (path)')
+                logger.debug('opened disk usage cache store %s', self.db_path)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+                logger.debug('closed disk usage cache store %s', self.db_path)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            self.open()
+            with self._connection:
+                return [dict(row) for row in self._connection.execute(query, params)]
+
+    @staticmethod
+    def _timestamp_to_str(timestamp):
+        return timestamp.strftime(_TIMESTAMP_FORMAT) if timestamp is not None else None
+
+    @staticmethod
+    def _str_to_timestamp(timestamp_str):
+        return datetime.datetime.strptime(timestamp_str, _TIMESTAMP_FORMAT) if timestamp_str is not None else None
+
+    @classmethod
+    def _du_result_to_row(cls, du_result):
+        return (du_result['path'],
+                du_result.get('otdb_id'),
+                cls._timestamp_to_str(du_result.get('cache_timestamp')),
+                int(bool(du_result.get('needs_update', False))),
+                json.dumps({k: v for k, v in du_result.items() if k not in _COLUMN_KEYS}))
+
+    def load(self):
+        '''
+        load the complete cache.
+        :return tuple: (path_du_results, otdb_id2path) dicts, like the CacheManager keeps them in memory.
+        '''
+        path_du_results = {}
+        for row in self._execute('SELECT * FROM path_du_results'):
+            du_result = json.loads(row['du_result'])
+            du_result['path'] = row['path']
+            if row['otdb_id'] is not None:
+                du_result['otdb_id'] = row['otdb_id']
+            du_result['cache_timestamp'] = self._str_to_timestamp(row['cache_timestamp'])
+            du_result['needs_update'] = bool(row['needs_update'])
+            path_du_results[row['path']] = du_result
+
+        otdb_id2path = {row['otdb_id']: row['path'] for row in self._execute('SELECT * FROM otdb_id2path')}
+
+        logger.info('loaded %s du results and %s otdb_id paths from disk usage cache store %s',
+                    len(path_du_results), len(otdb_id2path), self.db_path)
+        return path_du_results, otdb_id2path
+
+    def is_empty(self) -> bool:
+        return not self._execute('SELECT 1 FROM path_du_results LIMIT 1')
+
+    def upsert_du_result(self, du_result: dict):
+        '''
+        insert or replace the given du_result (which should have a 'path', and usually has a 'cache_timestamp').
+        '''
+        self._execute(_UPSERT_DU_RESULT_QUERY, self._du_result_to_row(du_result))
+
+    def set_needs_update(self, path: str, needs_update: bool=True):
+        self._execute('UPDATE path_du_results SET needs_update = ? WHERE path = ?', (int(needs_update), path))
+
+    def upsert_otdb_id_path(self, otdb_id: int, path: str):
+        self._execute('INSERT OR REPLACE INTO otdb_id2path (otdb_id, path) VALUES (?, ?)', (otdb_id, path))
+
+    def delete_otdb_id(self, otdb_id: int):
+        self._execute('DELETE FROM otdb_id2path WHERE otdb_id = ?', (otdb_id,))
+
+    def import_cache(self, path_du_results: dict, otdb_id2path: dict):
+        '''
+        bulk insert (or replace) the given path_du_results and otdb_id2path in one transaction,
+        for example to migrate a legacy cache file.
+        '''
+        with self._lock:
+            self.open()
+            with self._connection:
+                self._connection.executemany(_UPSERT_DU_RESULT_QUERY,
+                                             [self._du_result_to_row(du_result) for du_result in path_du_results.values()])
+                self._connection.executemany('INSERT OR REPLACE INTO otdb_id2path (otdb_id, path) VALUES (?, ?)',
+                                             list(otdb_id2path.items()))
+        logger.info('imported %s du results and %s otdb_id paths into disk usage cache store %s',
+                    len(path_du_results), len(otdb_id2path), self.db_path)
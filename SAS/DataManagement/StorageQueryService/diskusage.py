@@ -5,6 +5,8 @@ import logging
 import subprocess
 import socket
 import os.path
+from collections import OrderedDict
+from concurrent import futures
 from optparse import OptionParser
 from lofar.common.util import humanreadablesize
 from lofar.common.subprocess_utils import communicate_returning_strings
@@ -16,6 +18,9 @@ from lofar.sas.datamanagement.common.path import PathResolver, wrap_command_in_c
 
 logger = logging.getLogger(__name__)
 
+# the maximum number of paths which are du'ed in one (ssh'd) du call
+DEFAULT_MAX_PATHS_PER_DU_CALL = 1000
+
 def getDiskUsageForPath(path):
     # 20180829: until lustre has been updated and robinhood has been switched back on (in october) use normal du
     return getDiskUsageForPath_du(path)
@@ -83,47 +88,80 @@ def getDiskUsageForPath_rbh_du(path):
 def getDiskUsageForPath_du(path):
     logger.info('getDiskUsageForPath_du(\'%s\')', path)
 
-    result = {'found': False, 'path': path, 'disk_usage': None, 'name': path.split('/')[-1] }
-
-    cmd = ['du', '-bcs', path]
-    cmd = wrap_command_in_cep4_head_node_ssh_call_if_needed(cmd)
-    logger.info(' '.join(cmd))
-
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = communicate_returning_strings(proc)
+    # use the same du call as for many paths, so a path has the same size, whether it was du'ed on its own or with others.
+    result = getDiskUsageForPaths_du([path])[path]
 
-    if proc.returncode == 0:
-        # example of out
-        # 7025510839      /data/projects/HOLOG_WINDMILL_TESTS/L662734/uv/
-        # 7025510839      total
+    logger.info('getDiskUsageForPath_du(\'%s\') returning: %s', path, result)
+    return result
 
-        #parse out
-        lines = [l.strip() for l in out.split('\n')]
-        total_lines = [l for l in lines if 'total' in l]
-        if total_lines:
-            parts = [p.strip() for p in total_lines[0].split()]
-            if len(parts) == 2:
+def getDiskUsageForPaths(paths, max_paths_per_call=DEFAULT_MAX_PATHS_PER_DU_CALL):
+    '''get the disk usage for many paths at once, with one (ssh'd) du call per max_paths_per_call paths,
+    instead of an ssh round-trip per path.
+    :param list paths: the paths to du
+    :param int max_paths_per_call: the maximum number of paths passed to one du call, to stay well within the command line limits.
+    :return dict: the du result per path, in the same format as getDiskUsageForPath
+    '''
+    paths = list(OrderedDict.fromkeys(paths))
+    batches = [paths[i:i+max_paths_per_call] for i in range(0, len(paths), max_paths_per_call)]
+
+    if len(batches) <= 1:
+        return getDiskUsageForPaths_du(paths)
+
+    with futures.ThreadPoolExecutor(max_workers=len(batches)) as executor:
+        results = {}
+        for batch_result in executor.map(getDiskUsageForPaths_du, batches):
+            results.update(batch_result)
+        return results
+
+def getDiskUsageForPaths_du(paths):
+    logger.info('getDiskUsageForPaths_du(%s paths)', len(paths))
+
+    results = {path: {'found': False, 'path': path, 'disk_usage': None, 'name': path.split('/')[-1] } for path in paths}
+
+    if paths:
+        # -b: apparent size in bytes, -s: only a total per path.
+        # -l: count hard links multiple times. du counts each inode only once per call, so without -l,
+        # a sub directory which is passed after its parent directory in the same call would be skipped or reported as (nearly) empty,
+        # because all its files were already counted for the parent. With -l, each path is measured independently.
+        # (Hard linked files within one path are then counted for each link, in single path calls as well.)
+        cmd = ['du', '-bsl'] + paths
+        cmd = wrap_command_in_cep4_head_node_ssh_call_if_needed(cmd)
+        logger.debug(' '.join(cmd))
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = communicate_returning_strings(proc)
+
+        # example of out, one line per path which could be (partially) measured
+        # 7025510839      /data/projects/HOLOG_WINDMILL_TESTS/L662734
+        # 16048128        /data/projects/HOLOG_WINDMILL_TESTS/L662735
+        for line in out.split('\n'):
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2 and parts[0].isdigit() and parts[1] in results:
+                result = results[parts[1]]
                 result['found'] = True
                 result['disk_usage'] = int(parts[0])
                 result['nr_of_files'] = None
-    else:
-        result['message'] = out + err
-        result['found'] = False
 
-        if 'No such file or directory' in err:
-            logger.warning('No such file or directory: %s', path)
-            result['disk_usage'] = 0
-        else:
-            logger.error(out + err)
-
-    result['disk_usage_readable'] = humanreadablesize(result['disk_usage'])
+        # example of err for a missing path
+        # du: cannot access '/data/projects/HOLOG_WINDMILL_TESTS/L662736': No such file or directory
+        for path, result in results.items():
+            if not result['found']:
+                result['message'] = out + err
+                if "'%s': No such file or directory" % path in err or "`%s': No such file or directory" % path in err:
+                    logger.warning('No such file or directory: %s', path)
+                    result['disk_usage'] = 0
+                else:
+                    logger.error('could not get the disk usage for %s: %s', path, out + err)
+
+    for path, result in results.items():
+        result['disk_usage_readable'] = humanreadablesize(result['disk_usage'])
 
-    otdb_id = getOTDBIdFromPath(path)
-    if otdb_id:
-        result['otdb_id'] = otdb_id
+        otdb_id = getOTDBIdFromPath(path)
+        if otdb_id:
+            result['otdb_id'] = otdb_id
 
-    logger.info('getDiskUsageForPath_du(\'%s\') returning: %s', path, result)
-    return result
+    logger.info('getDiskUsageForPaths_du(%s paths) found %s paths', len(paths), sum(1 for r in results.values() if r['found']))
+    return results
 
 def getOTDBIdFromPath(path):
     try:
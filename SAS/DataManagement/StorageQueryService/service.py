@@ -10,7 +10,7 @@ from lofar.messaging import RPCService, DEFAULT_BROKER, DEFAULT_BUSNAME, Service
 from lofar.common.util import waitForInterrupt
 
 from lofar.sas.datamanagement.storagequery.config import DEFAULT_STORAGEQUERY_SERVICENAME
-from lofar.sas.datamanagement.storagequery.cache import CacheManager
+from lofar.sas.datamanagement.storagequery.cache import CacheManager, DEFAULT_DU_CONCURRENCY
 
 logger = logging.getLogger(__name__)
 
@@ -51,8 +51,10 @@ def main():
     parser = OptionParser("%prog [options]",
                           description='runs the storagequery service')
     parser.add_option('-c', '--cache_path', dest='cache_path', type='string',
-                      default=os.path.expandvars('$LOFARROOT/etc/storagequery_cache.py'),
+                      default=os.path.expandvars('$LOFARROOT/etc/storagequery_cache.sqlite'),
                       help='path of the cache file, default: %default')
+    parser.add_option('-j', '--du_concurrency', dest='du_concurrency', type='int', default=DEFAULT_DU_CONCURRENCY,
+                      help='maximum number of simultaneous du calls to refresh old cache entries, default: %default')
     parser.add_option('-b', '--broker', dest='broker', type='string', default=DEFAULT_BROKER,
                       help='Address of the messaging broker, default: %default')
     parser.add_option("-e", "--exchange", dest="exchange", type="string", default=DEFAULT_BUSNAME,
@@ -63,7 +65,8 @@ def main():
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
                         level=logging.DEBUG if options.verbose else logging.INFO)
 
-    with CacheManager(exchange=options.exchange, broker=options.broker, cache_path=options.cache_path) as cache_manager:
+    with CacheManager(exchange=options.exchange, broker=options.broker, cache_path=options.cache_path,
+                      du_concurrency=options.du_concurrency) as cache_manager:
         with createService(exchange=options.exchange,
                            broker=options.broker,
                            cache_manager=cache_manager):
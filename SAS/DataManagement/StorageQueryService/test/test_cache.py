@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+import unittest, unittest.mock
+import logging
+import os
+import sys
+import datetime
+import tempfile
+import shutil
+from time import sleep
+from threading import Thread
+from lofar.sas.datamanagement.storagequery.cache import CacheManager, MAX_CACHE_ENTRY_AGE
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s %(threadName)s', level=logging.INFO, stream=sys.stdout)
+
+PROJECTS_PATH = '/data/projects'
+PROJECT_PATH = '/data/projects/LC1_001'
+TASK_PATH = '/data/projects/LC1_001/L123456'
+SUBDIR_PATH = '/data/projects/LC1_001/L123456/uv'
+
+
+def _du_result(path, disk_usage, found=True, message=None):
+    '''create a du result like the ones from the diskusage module'''
+    result = {'found': found, 'path': path, 'disk_usage': disk_usage, 'name': path.split('/')[-1], 'nr_of_files': None}
+    if message is not None:
+        result['message'] = message
+    return result
+
+
+class CacheManagerTestCase(unittest.TestCase):
+    '''test case with a CacheManager without any messaging, and with a stubbed (in memory) du'''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        # the sizes on 'disk' per path, and a record of all du'ed paths. A size of None makes the du fail.
+        self.disk_usages = {}
+        self.du_calls = []
+
+        def du_path(path):
+            self.du_calls.append(path)
+            if path not in self.disk_usages:
+                return _du_result(path, 0, found=False, message='No such file or directory')
+            if self.disk_usages[path] is None:
+                return _du_result(path, None, found=False, message='ssh: connect to host head.cep4: Connection timed out')
+            return _du_result(path, self.disk_usages[path])
+
+        def du_paths(paths):
+            return {path: du_path(path) for path in paths}
+
+        self.du_path = du_path
+
+        for name in ['OTDBBusListener', 'DataManagementBusListener', 'ToBus', 'DiskUsage']:
+            patcher = unittest.mock.patch('lofar.sas.datamanagement.storagequery.cache.%s' % name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for name, function in [('du_getDiskUsageForPath', du_path), ('du_getDiskUsageForPaths', du_paths)]:
+            patcher = unittest.mock.patch('lofar.sas.datamanagement.storagequery.cache.%s' % name, side_effect=function)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.cache_manager = CacheManager(cache_path=os.path.join(self.tmp_dir, 'du_cache.sqlite'))
+        self.cache_manager.disk_usage.path_resolver.projects_path = PROJECTS_PATH
+
+    def tearDown(self):
+        self.cache_manager._cache_store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def fill_cache(self, disk_usages):
+        '''put the given sizes on 'disk', and du them all into the cache'''
+        self.disk_usages.update(disk_usages)
+        self.cache_manager.getDiskUsageForPaths(list(disk_usages.keys()), force_update=True)
+        self.du_calls.clear()
+
+    def cached_disk_usage(self, path):
+        return self.cache_manager._cache['path_du_results'][path]['disk_usage']
+
+    def needs_update(self, path):
+        return self.cache_manager._cache['path_du_results'][path].get('needs_update', False)
+
+
+class TestDiskUsagePropagation(CacheManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fill_cache({PROJECTS_PATH: 1000, PROJECT_PATH: 600, TASK_PATH: 100})
+
+    def test_delta_is_propagated_to_all_ancestors(self):
+        self.disk_usages[TASK_PATH] = 150
+        self.cache_manager.getDiskUsageForPath(TASK_PATH, force_update=True)
+
+        self.assertEqual(150, self.cached_disk_usage(TASK_PATH))
+        self.assertEqual(650, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1050, self.cached_disk_usage(PROJECTS_PATH))
+
+        # the parents were not du'ed, and are not stale
+        self.assertEqual([TASK_PATH], self.du_calls)
+        self.assertFalse(self.needs_update(PROJECT_PATH))
+        self.assertFalse(self.needs_update(PROJECTS_PATH))
+
+    def test_missing_path_is_measured_as_empty(self):
+        del self.disk_usages[TASK_PATH]
+        result = self.cache_manager.getDiskUsageForPath(TASK_PATH, force_update=True)
+
+        self.assertFalse(result['found'])
+        self.assertEqual(0, self.cached_disk_usage(TASK_PATH))
+        self.assertEqual(500, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(900, self.cached_disk_usage(PROJECTS_PATH))
+
+    def test_failed_du_is_not_propagated(self):
+        self.disk_usages[TASK_PATH] = None
+        result = self.cache_manager.getDiskUsageForPath(TASK_PATH, force_update=True)
+
+        # the size of the task is unknown now, and is not taken for 0
+        self.assertFalse(result['found'])
+        self.assertIsNone(self.cached_disk_usage(TASK_PATH))
+
+        # so the sizes of the parents are not changed, but they are marked as stale, to be du'ed again.
+        self.assertEqual(600, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1000, self.cached_disk_usage(PROJECTS_PATH))
+        self.assertTrue(self.needs_update(PROJECT_PATH))
+        self.assertTrue(self.needs_update(PROJECTS_PATH))
+
+    def test_parent_and_child_in_one_batch(self):
+        # the task and its project both grow by 50, and are du'ed in one batch with the parent first
+        self.disk_usages[TASK_PATH] = 150
+        self.disk_usages[PROJECT_PATH] = 650
+        self.cache_manager.getDiskUsageForPaths([PROJECT_PATH, TASK_PATH], force_update=True)
+
+        self.assertEqual(150, self.cached_disk_usage(TASK_PATH))
+        # the growth of the task is counted once in the project and the projects dir, and not twice.
+        self.assertEqual(650, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1050, self.cached_disk_usage(PROJECTS_PATH))
+
+    def test_delta_is_not_added_to_ancestors_measured_later(self):
+        # the task grows by 50, and its project is du'ed before the task, so it already includes the growth.
+        self.disk_usages[TASK_PATH] = 150
+        self.disk_usages[PROJECT_PATH] = 650
+        self.cache_manager.getDiskUsageForPath(PROJECT_PATH, force_update=True)
+        self.assertEqual(650, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1050, self.cached_disk_usage(PROJECTS_PATH))
+
+        self.cache_manager.getDiskUsageForPath(TASK_PATH, force_update=True)
+
+        # the growth of the task is not counted again in the project, nor in the projects dir.
+        self.assertEqual(150, self.cached_disk_usage(TASK_PATH))
+        self.assertEqual(650, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1050, self.cached_disk_usage(PROJECTS_PATH))
+
+    def test_unknown_previous_size_marks_nearest_ancestor_stale(self):
+        self.fill_cache({SUBDIR_PATH: None})
+        for path in [TASK_PATH, PROJECT_PATH, PROJECTS_PATH]:
+            self.cache_manager._cache['path_du_results'][path]['needs_update'] = False
+
+        # the previous size of the subdir was unknown, so a new size says nothing about how much its parents changed.
+        self.disk_usages[SUBDIR_PATH] = 80
+        self.cache_manager.getDiskUsageForPath(SUBDIR_PATH, force_update=True)
+
+        self.assertEqual(80, self.cached_disk_usage(SUBDIR_PATH))
+        self.assertEqual(100, self.cached_disk_usage(TASK_PATH))
+        self.assertTrue(self.needs_update(TASK_PATH))
+        self.assertFalse(self.needs_update(PROJECT_PATH))
+        self.assertFalse(self.needs_update(PROJECTS_PATH))
+
+    def test_new_task_does_not_invalidate_whole_tree(self):
+        new_task_path = '/data/projects/LC1_001/L123457'
+        self.disk_usages[new_task_path] = 70
+        self.disk_usages[PROJECT_PATH] = 670
+        self.cache_manager.getDiskUsageForPath(new_task_path)
+
+        # only the project is stale, not the projects dir
+        self.assertEqual(70, self.cached_disk_usage(new_task_path))
+        self.assertTrue(self.needs_update(PROJECT_PATH))
+        self.assertFalse(self.needs_update(PROJECTS_PATH))
+
+        # re-du'ing the project propagates the size of the new task to the projects dir
+        self.cache_manager.getDiskUsageForPath(PROJECT_PATH, force_update=True)
+        self.assertEqual(670, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(1070, self.cached_disk_usage(PROJECTS_PATH))
+        self.assertEqual([new_task_path, PROJECT_PATH], self.du_calls)
+
+    def test_onTaskDeleted(self):
+        self.fill_cache({SUBDIR_PATH: 80})
+        self.assertIn(123456, self.cache_manager.getOtdbIdsFoundOnDisk())
+
+        # delete the whole task dir
+        del self.disk_usages[TASK_PATH]
+        del self.disk_usages[SUBDIR_PATH]
+        self.cache_manager.onTaskDeleted(123456, True, [TASK_PATH])
+
+        # the task and its subdir have size 0 now, without du'ing them...
+        self.assertEqual(0, self.cached_disk_usage(TASK_PATH))
+        self.assertEqual(0, self.cached_disk_usage(SUBDIR_PATH))
+        self.assertEqual([], self.du_calls)
+
+        # ...and the size of the task is subtracted once from its parents
+        self.assertEqual(500, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(900, self.cached_disk_usage(PROJECTS_PATH))
+        self.assertNotIn(123456, self.cache_manager.getOtdbIdsFoundOnDisk())
+
+    def test_onTaskDeleted_partially(self):
+        self.fill_cache({SUBDIR_PATH: 80})
+        self.cache_manager.disk_usage.getDiskUsageForOTDBId.side_effect = lambda otdb_id: self.du_path(TASK_PATH)
+
+        # delete only the uv subdir, which leaves 20 bytes in the task dir
+        del self.disk_usages[SUBDIR_PATH]
+        self.disk_usages[TASK_PATH] = 20
+        self.cache_manager.onTaskDeleted(123456, True, [SUBDIR_PATH])
+
+        self.assertEqual(0, self.cached_disk_usage(SUBDIR_PATH))
+        self.assertEqual(20, self.cached_disk_usage(TASK_PATH))
+        self.assertEqual(520, self.cached_disk_usage(PROJECT_PATH))
+        self.assertEqual(920, self.cached_disk_usage(PROJECTS_PATH))
+        self.assertEqual([TASK_PATH], self.du_calls)
+
+
+class TestRefreshWorkerPool(CacheManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fill_cache({PROJECTS_PATH: 1000, PROJECT_PATH: 600, TASK_PATH: 100, SUBDIR_PATH: 80})
+        self.worker_threads = []
+
+    def tearDown(self):
+        self.stop_workers()
+        super().tearDown()
+
+    def make_stale(self, path, extra_age=datetime.timedelta(0), needs_update=False):
+        cache_entry = self.cache_manager._cache['path_du_results'][path]
+        cache_entry['cache_timestamp'] = datetime.datetime.utcnow() - MAX_CACHE_ENTRY_AGE - datetime.timedelta(hours=1) - extra_age
+        cache_entry['needs_update'] = needs_update
+        return cache_entry
+
+    def start_workers(self, nr_of_workers=1):
+        self.cache_manager._running = True
+        self.worker_threads = [Thread(target=self.cache_manager._refreshCacheEntriesWorker, daemon=True) for _ in range(nr_of_workers)]
+        for thread in self.worker_threads:
+            thread.start()
+
+    def stop_workers(self):
+        self.cache_manager._running = False
+        for thread in self.worker_threads:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+        self.worker_threads = []
+
+    def wait_until_queue_is_done(self, nr_of_expected_du_calls):
+        for _ in range(100):
+            if self.cache_manager._refreshQueue.empty() and len(self.du_calls) >= nr_of_expected_du_calls:
+                break
+            sleep(0.05)
+
+    def test_priority_ordering(self):
+        # schedule in 'random' order
+        for cache_entry in [self.make_stale(SUBDIR_PATH, extra_age=datetime.timedelta(days=10)),
+                            self.make_stale(TASK_PATH),
+                            self.make_stale(PROJECTS_PATH),
+                            self.make_stale(PROJECT_PATH, needs_update=True)]:
+            self.assertTrue(self.cache_manager._scheduleCacheEntryRefresh(cache_entry))
+
+        self.start_workers(nr_of_workers=1)
+        self.wait_until_queue_is_done(4)
+        self.stop_workers()
+
+        # needs_update first, then the levels high up in the tree first (even when the deeper ones are older)
+        self.assertEqual([PROJECT_PATH, PROJECTS_PATH, TASK_PATH, SUBDIR_PATH], self.du_calls)
+        self.assertFalse(any(self.cache_manager._isCacheEntryStale(self.cache_manager._cache['path_du_results'][path])
+                             for path in self.du_calls))
+
+    def test_deduplication_of_queued_paths(self):
+        cache_entry = self.make_stale(TASK_PATH)
+        self.assertTrue(self.cache_manager._scheduleCacheEntryRefresh(cache_entry))
+        self.assertFalse(self.cache_manager._scheduleCacheEntryRefresh(cache_entry))
+        self.assertEqual(1, self.cache_manager._refreshQueue.qsize())
+
+        # a higher priority requeues the path, and the lower priority queue item is skipped by the worker
+        cache_entry['needs_update'] = True
+        self.assertTrue(self.cache_manager._scheduleCacheEntryRefresh(cache_entry))
+        self.assertFalse(self.cache_manager._scheduleCacheEntryRefresh(cache_entry))
+        self.assertEqual(2, self.cache_manager._refreshQueue.qsize())
+
+        self.start_workers(nr_of_workers=2)
+        self.wait_until_queue_is_done(1)
+        self.stop_workers()
+
+        self.assertEqual([TASK_PATH], self.du_calls)
+        self.assertEqual({}, self.cache_manager._refreshQueuedPaths)
+
+    def test_fresh_entries_are_not_refreshed(self):
+        # an entry which was refreshed in another way after it was queued is not du'ed again
+        self.assertTrue(self.cache_manager._scheduleCacheEntryRefresh(self.make_stale(TASK_PATH)))
+        self.cache_manager.getDiskUsageForPath(TASK_PATH, force_update=True)
+        self.du_calls.clear()
+
+        self.start_workers(nr_of_workers=1)
+        self.wait_until_queue_is_done(0)
+        self.stop_workers()
+
+        self.assertEqual([], self.du_calls)
+
+    @unittest.mock.patch('lofar.sas.datamanagement.storagequery.cache.CacheManager._updateCEP4CapacitiesInRADB')
+    @unittest.mock.patch('lofar.sas.datamanagement.storagequery.cache.CacheManager._scanProjectsTree')
+    def test_workers_are_started_and_stopped(self, scan_mock, update_capacities_mock):
+        self.make_stale(TASK_PATH)
+        self.cache_manager._du_concurrency = 3
+
+        self.cache_manager.open()
+        try:
+            self.assertEqual(3, len(self.cache_manager._refreshWorkerThreads))
+            self.assertTrue(all(thread.is_alive() for thread in self.cache_manager._refreshWorkerThreads))
+
+            # the stale entry is scheduled by the update thread, and refreshed by one of the workers
+            self.wait_until_queue_is_done(1)
+            self.assertEqual([TASK_PATH], self.du_calls)
+        finally:
+            worker_threads = list(self.cache_manager._refreshWorkerThreads)
+            self.cache_manager.close()
+
+        self.assertFalse(any(thread.is_alive() for thread in worker_threads))
+        self.assertEqual([], self.cache_manager._refreshWorkerThreads)
+
+
+if __name__ == '__main__':
+    unittest.main()
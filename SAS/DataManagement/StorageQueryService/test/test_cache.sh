@@ -0,0 +1,3 @@
+#!/bin/sh
+
+./runctest.sh test_cache
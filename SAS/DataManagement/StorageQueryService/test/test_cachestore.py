@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import unittest
+import logging
+import os
+import sys
+import datetime
+import tempfile
+import shutil
+from lofar.sas.datamanagement.storagequery.cachestore import DiskUsageCacheStore
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s %(threadName)s', level=logging.INFO, stream=sys.stdout)
+
+class TestDiskUsageCacheStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'storagequery_cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_upsert_and_reload(self):
+        now = datetime.datetime.utcnow()
+        project_result = {'found': True, 'path': '/data/projects/LC1_001', 'name': 'LC1_001',
+                          'disk_usage': 1000, 'nr_of_files': 10, 'cache_timestamp': now, 'needs_update': False}
+        task_result = {'found': True, 'path': '/data/projects/LC1_001/L123456', 'name': 'L123456', 'otdb_id': 123456,
+                       'disk_usage': 100, 'nr_of_files': None, 'cache_timestamp': now, 'needs_update': False}
+
+        with DiskUsageCacheStore(self.db_path) as store:
+            self.assertTrue(store.is_empty())
+            store.upsert_du_result(project_result)
+            store.upsert_du_result(task_result)
+            store.upsert_otdb_id_path(123456, task_result['path'])
+
+            # update an entry
+            store.upsert_du_result(dict(task_result, disk_usage=200))
+            store.set_needs_update(project_result['path'])
+
+        # 'restart', and check that all depths are loaded
+        with DiskUsageCacheStore(self.db_path) as store:
+            self.assertFalse(store.is_empty())
+            path_du_results, otdb_id2path = store.load()
+
+        self.assertEqual({123456: task_result['path']}, otdb_id2path)
+        self.assertEqual(dict(project_result, needs_update=True), path_du_results[project_result['path']])
+        self.assertEqual(dict(task_result, disk_usage=200), path_du_results[task_result['path']])
+
+    def test_delete_otdb_id_and_import(self):
+        with DiskUsageCacheStore(self.db_path) as store:
+            store.import_cache({'/data/projects': {'found': True, 'path': '/data/projects', 'disk_usage': 42}},
+                               {1: '/data/projects/LC1_001/L1', 2: '/data/projects/LC1_001/L2'})
+            store.delete_otdb_id(1)
+            path_du_results, otdb_id2path = store.load()
+
+        self.assertEqual({2: '/data/projects/LC1_001/L2'}, otdb_id2path)
+        self.assertEqual(42, path_du_results['/data/projects']['disk_usage'])
+        self.assertIsNone(path_du_results['/data/projects']['cache_timestamp'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest, unittest.mock
+import logging
+import sys
+from lofar.sas.datamanagement.storagequery.diskusage import getDiskUsageForPath_du, getDiskUsageForPaths_du
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s %(threadName)s', level=logging.INFO, stream=sys.stdout)
+
+
+class TestDuParsing(unittest.TestCase):
+    '''test the parsing of the du output, with a stubbed du process'''
+    def setUp(self):
+        self.popen_cmds = []
+        self.du_returncode, self.du_out, self.du_err = 0, '', ''
+
+        def popen(cmd, *args, **kwargs):
+            self.popen_cmds.append(cmd)
+            proc = unittest.mock.MagicMock()
+            proc.returncode = self.du_returncode
+            proc.communicate.return_value = (self.du_out.encode('UTF-8'), self.du_err.encode('UTF-8'))
+            return proc
+
+        patcher = unittest.mock.patch('lofar.sas.datamanagement.storagequery.diskusage.subprocess.Popen', side_effect=popen)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = unittest.mock.patch('lofar.sas.datamanagement.storagequery.diskusage.wrap_command_in_cep4_head_node_ssh_call_if_needed',
+                                      side_effect=lambda cmd: cmd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_found_missing_and_failed_paths(self):
+        paths = ['/data/projects/LC1_001/L123456',
+                 '/data/projects/LC1_001/L123457',
+                 '/data/projects/LC1_001/L123458',
+                 '/data/projects/LC1_001/L123459']
+
+        # du exits with 1 if any path could not be (fully) read, but still reports the sizes it found
+        self.du_returncode = 1
+        self.du_out = '7025510839\t/data/projects/LC1_001/L123456\n' \
+                      '4096\t/data/projects/LC1_001/L123459\n'
+        self.du_err = "du: cannot access '/data/projects/LC1_001/L123457': No such file or directory\n" \
+                      "du: cannot read directory '/data/projects/LC1_001/L123459/uv': Permission denied\n" \
+                      "du: fts_read failed: /data/projects/LC1_001/L123458: Input/output error\n"
+
+        results = getDiskUsageForPaths_du(paths)
+
+        self.assertEqual([['du', '-bsl'] + paths], self.popen_cmds)
+        self.assertEqual(set(paths), set(results.keys()))
+
+        # a measured path
+        self.assertTrue(results[paths[0]]['found'])
+        self.assertEqual(7025510839, results[paths[0]]['disk_usage'])
+        self.assertEqual(123456, results[paths[0]]['otdb_id'])
+
+        # a missing path has size 0
+        self.assertFalse(results[paths[1]]['found'])
+        self.assertEqual(0, results[paths[1]]['disk_usage'])
+        self.assertIn('No such file or directory', results[paths[1]]['message'])
+
+        # a path which could not be measured has an unknown size
+        self.assertFalse(results[paths[2]]['found'])
+        self.assertIsNone(results[paths[2]]['disk_usage'])
+        self.assertIn('Input/output error', results[paths[2]]['message'])
+
+        # a path which was measured, apart from an unreadable sub directory
+        self.assertTrue(results[paths[3]]['found'])
+        self.assertEqual(4096, results[paths[3]]['disk_usage'])
+
+    def test_parse_old_style_quotes_and_paths_with_spaces(self):
+        paths = ['/data/projects/LC1_001/my dir', '/data/projects/LC1_001/L123457']
+        self.du_returncode = 1
+        self.du_out = '1024\t/data/projects/LC1_001/my dir\n'
+        self.du_err = "du: cannot access `/data/projects/LC1_001/L123457': No such file or directory\n"
+
+        results = getDiskUsageForPaths_du(paths)
+
+        self.assertEqual(1024, results[paths[0]]['disk_usage'])
+        self.assertEqual(0, results[paths[1]]['disk_usage'])
+
+    def test_ssh_failure(self):
+        self.du_returncode = 255
+        self.du_err = 'ssh: connect to host head.cep4.control.lofar port 22: Connection timed out\n'
+
+        result = getDiskUsageForPath_du('/data/projects/LC1_001/L123456')
+
+        self.assertFalse(result['found'])
+        self.assertIsNone(result['disk_usage'])
+        self.assertIn('Connection timed out', result['message'])
+
+    def test_single_path_uses_same_du_call(self):
+        self.du_out = '7025510839\t/data/projects/LC1_001/L123456\n'
+
+        result = getDiskUsageForPath_du('/data/projects/LC1_001/L123456')
+
+        self.assertEqual([['du', '-bsl', '/data/projects/LC1_001/L123456']], self.popen_cmds)
+        self.assertTrue(result['found'])
+        self.assertEqual(7025510839, result['disk_usage'])
+        self.assertEqual('7.0GB', result['disk_usage_readable'])
+
+
+if __name__ == '__main__':
+    unittest.main()
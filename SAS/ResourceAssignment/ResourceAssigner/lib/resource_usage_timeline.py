@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2015-2017
+# ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+ResourceUsageTimeline is an in-memory model of the usage of resources over time, built once from a set of resource
+claims, so the usage in many time windows can be computed without querying the radb for each window.
+"""
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceUsageTimeline(object):
+    """ The summed claim sizes per resource as a step function of time.
+
+        For each resource the claims are converted into +claim_size at the claim's starttime and -claim_size at
+        its endtime. The sorted change timestamps and the cumulative usage after each change allow to compute the
+        maximum usage in a window with a bisect and a max over the changes within that window.
+
+        Example:
+
+        timeline = ResourceUsageTimeline(radb.getResourceClaims(lower_bound=..., upper_bound=..., status='claimed'))
+        usage = timeline.max_usage(resource_id, starttime, endtime)
+    """
+
+    def __init__(self, claims):
+        """
+        Creates a ResourceUsageTimeline instance
+
+        :param claims: an iterable of claim dicts, each with at least a resource_id, starttime, endtime and claim_size
+        """
+        changes_per_resource = {}
+        self._endtimes = set()
+        for claim in claims:
+            self._endtimes.add(claim['endtime'])
+            changes = changes_per_resource.setdefault(claim['resource_id'], {})
+            changes[claim['starttime']] = changes.get(claim['starttime'], 0) + claim['claim_size']
+            changes[claim['endtime']] = changes.get(claim['endtime'], 0) - claim['claim_size']
+
+        # per resource: the sorted timestamps at which the usage changes, and the usage from that timestamp onwards
+        self._timestamps = {}
+        self._usages = {}
+        for resource_id, changes in changes_per_resource.items():
+            timestamps = sorted(changes.keys())
+            self._timestamps[resource_id] = timestamps
+            self._usages[resource_id] = list(accumulate(changes[t] for t in timestamps))
+
+    @property
+    def resource_ids(self):
+        """ The ids of the resources which have any usage in this timeline. """
+        return set(self._timestamps.keys())
+
+    def usage_at(self, resource_id, timestamp):
+        """
+        Returns the usage of the given resource at the given timestamp
+
+        :param resource_id: the id of the resource
+        :param timestamp: the point in time
+        :returns the summed claim sizes of the claims with starttime <= timestamp < endtime
+        """
+        timestamps = self._timestamps.get(resource_id)
+        if not timestamps:
+            return 0
+
+        idx = bisect_right(timestamps, timestamp) - 1
+        return self._usages[resource_id][idx] if idx >= 0 else 0
+
+    def max_usage(self, resource_id, lower_bound, upper_bound):
+        """
+        Returns the maximum usage of the given resource in the window [lower_bound, upper_bound)
+
+        :param resource_id: the id of the resource
+        :param lower_bound: the (inclusive) start of the window
+        :param upper_bound: the (exclusive) end of the window
+        :returns the maximum of the summed claim sizes over the window, 0 if the resource is not used at all
+        """
+        timestamps = self._timestamps.get(resource_id)
+        if not timestamps:
+            return 0
+
+        usages = self._usages[resource_id]
+        first_idx = bisect_right(timestamps, lower_bound)
+        last_idx = bisect_left(timestamps, upper_bound)
+
+        max_usage = usages[first_idx - 1] if first_idx > 0 else 0
+        if last_idx > first_idx:
+            max_usage = max(max_usage, max(usages[first_idx:last_idx]))
+        return max_usage
+
+    def endtimes(self, lower_bound=None, upper_bound=None):
+        """
+        Returns the endtimes of the claims in the window [lower_bound, upper_bound], which are the only timestamps at
+        which the usage of a resource can drop.
+
+        :param lower_bound: if given, skip the timestamps before lower_bound
+        :param upper_bound: if given, skip the timestamps after upper_bound
+        :returns a sorted list of unique timestamps
+        """
+        return sorted(t for t in self._endtimes
+                      if (lower_bound is None or t >= lower_bound) and (upper_bound is None or t <= upper_bound))
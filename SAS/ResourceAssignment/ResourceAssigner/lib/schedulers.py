@@ -9,6 +9,7 @@ from lofar.sas.resourceassignment.database.radb import RADatabase, PostgresDBQue
 from lofar.mom.momqueryservice.momqueryrpc import MoMQueryRPC
 
 from lofar.sas.resourceassignment.resourceassigner.resource_availability_checker import CouldNotFindClaimException
+from lofar.sas.resourceassignment.resourceassigner.resource_usage_timeline import ResourceUsageTimeline
 
 from lofar.sas.resourceassignment.common.specification import Specification
 
@@ -26,6 +27,7 @@ logger = logging.getLogger(__name__)
     * The /PriorityScheduler/ enhances the BasicScheduler, and kills lower-priority tasks to make room for the given 
       task.
     * The /DwellScheduler/ enhances the PriorityScheduler, by increasing the starttime until the task can be scheduled.
+      It uses an in-memory ResourceUsageTimeline to skip the starttimes at which the task cannot fit anyway.
 
     Each level contains hooks to support the next.
 
@@ -775,20 +777,133 @@ class DwellScheduler(PriorityScheduler):
                                       commit=False)
         return changed_tasks
 
+    def _get_blocking_claims(self, claims):
+        """
+        Return the claims which the PriorityScheduler cannot move out of the way for the task at hand: all claims on
+        storage resources, and the claims of tasks without a mom_id or with a priority >= the priority of the task at
+        hand.
+
+        :param claims: the (extended) claims to filter
+        :returns the list of blocking claims
+        """
+        storage_type_id = self.resource_availability_checker.resource_types['storage']
+        other_task_ids = set(c["task_id"] for c in claims if c["resource_type_id"] != storage_type_id) - set([self.task_id])
+        other_tasks = self.radb.getTasks(task_ids=list(other_task_ids)) if other_task_ids else []
+        other_task_momids = [t["mom_id"] for t in other_tasks if t["mom_id"] is not None]
+
+        killable_task_ids = set()
+        if other_task_momids:
+            task_priorities = self.momqueryservice.get_project_priorities_for_objects(other_task_momids)
+            killable_task_ids = set(t["id"] for t in other_tasks
+                                    if t["mom_id"] is not None and task_priorities[t["mom_id"]] < self._my_task_priority())
+
+        return [c for c in claims if c["resource_type_id"] == storage_type_id or c["task_id"] not in killable_task_ids]
+
+    def _build_resource_usage_timeline(self):
+        """
+        Fetch the claimed claims and the resources for the whole dwell window once, and build the in-memory
+        ResourceUsageTimeline of the claims which block the task at hand.
+        """
+        window_endtime = self.max_starttime + self.duration
+        claims = self.radb.getResourceClaims(lower_bound=self.min_starttime, upper_bound=window_endtime,
+                                             status='claimed', extended=True)
+        resources = self.radb.getResources(include_availability=True,
+                                           claimable_capacity_lower_bound=self.min_starttime,
+                                           claimable_capacity_upper_bound=self.min_starttime + self.duration)
+
+        # the radb computes the claimable_capacity as a (time independent) base capacity minus the peak usage of all
+        # claimed claims in the requested window. Add that peak back, so we can subtract the peak of the blocking claims
+        # in any other window.
+        all_claims_timeline = ResourceUsageTimeline(claims)
+        self._unclaimed_capacities = {r["id"]: r["claimable_capacity"] + all_claims_timeline.max_usage(r["id"], self.min_starttime,
+                                                                                                       self.min_starttime + self.duration)
+                                      for r in resources}
+        self._dwell_resources = resources
+        self.resource_usage_timeline = ResourceUsageTimeline(self._get_blocking_claims(claims))
+
+        logger.info("DwellScheduler: radb_id=%s built resource usage timeline between %s and %s from %s claims on %s resources",
+                    self.task_id, self.min_starttime, window_endtime, len(claims), len(resources))
+
+    def _fits_at(self, estimates, starttime):
+        """
+        Returns whether the estimates fit in the resources which are left by the blocking claims between starttime and
+        starttime + duration, according to the resource usage timeline.
+
+        :param estimates: the resource estimates for the task at hand
+        :param starttime: the start time to check
+        """
+        endtime = starttime + self.duration
+        resources = []
+        for resource in self._dwell_resources:
+            resource = dict(resource)
+            resource["claimable_capacity"] = self._unclaimed_capacities[resource["id"]] - \
+                                             self.resource_usage_timeline.max_usage(resource["id"], starttime, endtime)
+            resources.append(resource)
+
+        try:
+            # get_is_claimable modifies the estimates, so give it a copy
+            self.resource_availability_checker.get_is_claimable(deepcopy(estimates), resources)
+            return True
+        except CouldNotFindClaimException:
+            return False
+
+    def _find_earliest_feasible_starttime(self, estimates, lower_bound):
+        """
+        Sweep over the candidate start times between lower_bound and max_starttime, and return the first one at which
+        the task fits according to the resource usage timeline. The usage of a resource only drops at the endtime of a
+        claim, so the candidates are lower_bound and the endtimes of the blocking claims plus the station setup time.
+
+        :param estimates: the resource estimates for the task at hand
+        :param lower_bound: the earliest start time to consider
+        :returns the earliest feasible start time, or None if the task does not fit before max_starttime
+        """
+        setup_time = timedelta(minutes=self.STATION_SETUP_TIME_MINUTES)
+        candidates = [lower_bound] + [t + setup_time for t in self.resource_usage_timeline.endtimes(lower_bound - setup_time,
+                                                                                                  self.max_starttime - setup_time)
+                                      if t + setup_time > lower_bound]
+
+        for starttime in candidates:
+            if not estimates or self._fits_at(estimates, starttime):
+                return starttime
+
+        return None
+
     def allocate_resources(self):
         """
         Scan between (min_starttime, max_starttime) to find the first possible slot where the task's required resources
         can be scheduled.
 
+        The candidate start times are found in the in-memory resource usage timeline, and only a feasible candidate is
+        tried in the radb by the PriorityScheduler. If that fails anyway (for example because the station list could
+        not be derived), then the scan continues from the earliest potential start time proposed by the
+        PriorityScheduler. If the timeline cannot be built, each start time is tried in the radb.
+
         :return: True if all the task's resources have successfully been allocated (either through dwelling the start
         time or and/or by killing tasks that have a lower priority) or False if not.
         :return: changed_tasks: tasks that had their status changed as a result of the task scheduling
         """
 
         changed_tasks = []
-        self._new_starttime(self.min_starttime)
+        starttime = self.min_starttime
+
+        try:
+            self._build_resource_usage_timeline()
+            estimates = self._get_estimates()
+            use_timeline = True
+        except Exception as e:
+            logger.warning("DwellScheduler: radb_id=%s could not build the resource usage timeline, trying each start time in the radb. error: %s",
+                           self.task_id, e)
+            use_timeline = False
 
         while True:
+            if use_timeline:
+                starttime = self._find_earliest_feasible_starttime(estimates, starttime)
+                if starttime is None:
+                    logger.info("DwellScheduler: radb_id=%s does not fit between %s and %s according to the resource usage timeline.",
+                                self.task_id, self.min_starttime, self.max_starttime)
+                    return (False, changed_tasks)
+
+            self._new_starttime(starttime)
             logger.info("DwellScheduler: Trying to schedule radb_id=%s with starttime=%s and endtime=%s", self.task_id, self.starttime, self.endtime)
 
             # Find a solution
@@ -805,4 +920,4 @@ class DwellScheduler(PriorityScheduler):
                 logger.info("DwellScheduler: radb_id=%s Dwelled until the end. Earliest start time is %s but cannot go beyond %s.", self.task_id, new_starttime, self.max_starttime)
                 return (False, changed_tasks)
 
-            self._new_starttime(new_starttime)
+            starttime = new_starttime
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2017
+# ASTRON (Netherlands Institute for Radio Astronomy)
+# P.O.Box 2, 7990 AA Dwingeloo, The Netherlands
+#
+# This file is part of the LOFAR software suite.
+# The LOFAR software suite is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# The LOFAR software suite is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with the LOFAR software suite. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import datetime
+import logging
+import sys
+
+from lofar.sas.resourceassignment.resourceassigner.resource_usage_timeline import ResourceUsageTimeline
+
+
+class ResourceUsageTimelineTest(unittest.TestCase):
+    def setUp(self):
+        self.t0 = datetime.datetime(2017, 1, 1, 0, 0, 0)
+
+    def claim(self, resource_id, start_hours, end_hours, claim_size):
+        return {'resource_id': resource_id,
+                'starttime': self.t0 + datetime.timedelta(hours=start_hours),
+                'endtime': self.t0 + datetime.timedelta(hours=end_hours),
+                'claim_size': claim_size}
+
+    def hours(self, hours):
+        return self.t0 + datetime.timedelta(hours=hours)
+
+    def test_empty_timeline(self):
+        timeline = ResourceUsageTimeline([])
+        self.assertEqual(0, timeline.usage_at(1, self.t0))
+        self.assertEqual(0, timeline.max_usage(1, self.t0, self.hours(1)))
+        self.assertEqual([], timeline.endtimes())
+        self.assertEqual(set(), timeline.resource_ids)
+
+    def test_usage_at(self):
+        timeline = ResourceUsageTimeline([self.claim(1, 1, 3, 10), self.claim(1, 2, 4, 5), self.claim(2, 0, 1, 7)])
+
+        self.assertEqual(0, timeline.usage_at(1, self.hours(0)))
+        self.assertEqual(10, timeline.usage_at(1, self.hours(1)))
+        self.assertEqual(15, timeline.usage_at(1, self.hours(2.5)))
+        # endtimes are exclusive
+        self.assertEqual(5, timeline.usage_at(1, self.hours(3)))
+        self.assertEqual(0, timeline.usage_at(1, self.hours(4)))
+        self.assertEqual(7, timeline.usage_at(2, self.hours(0.5)))
+        self.assertEqual({1, 2}, timeline.resource_ids)
+
+    def test_max_usage(self):
+        timeline = ResourceUsageTimeline([self.claim(1, 1, 3, 10), self.claim(1, 2, 4, 5)])
+
+        # window before, after and adjacent to the claims
+        self.assertEqual(0, timeline.max_usage(1, self.hours(0), self.hours(1)))
+        self.assertEqual(0, timeline.max_usage(1, self.hours(4), self.hours(5)))
+        # window within one claim
+        self.assertEqual(10, timeline.max_usage(1, self.hours(1.25), self.hours(1.75)))
+        # window covering the peak
+        self.assertEqual(15, timeline.max_usage(1, self.hours(0), self.hours(5)))
+        # window starting in the peak
+        self.assertEqual(15, timeline.max_usage(1, self.hours(2.5), self.hours(5)))
+        # window ending at the start of the peak
+        self.assertEqual(10, timeline.max_usage(1, self.hours(0), self.hours(2)))
+        # unknown resource
+        self.assertEqual(0, timeline.max_usage(2, self.hours(0), self.hours(5)))
+
+    def test_max_usage_equals_brute_force(self):
+        claims = [self.claim(1, s, s + d, size) for s, d, size in [(0, 2, 3), (1, 1, 4), (1.5, 3, 2), (2, 0.5, 8), (4, 1, 1)]]
+        timeline = ResourceUsageTimeline(claims)
+
+        def brute_force_max_usage(lower, upper):
+            # the usage can only change at claim boundaries, so check those and the lower bound
+            timestamps = [lower] + [t for c in claims for t in (c['starttime'], c['endtime']) if lower <= t < upper]
+            return max(sum(c['claim_size'] for c in claims if c['starttime'] <= t < c['endtime']) for t in timestamps)
+
+        for lower in range(0, 12):
+            for length in range(1, 8):
+                lower_bound, upper_bound = self.hours(lower/2.0), self.hours(lower/2.0 + length/2.0)
+                self.assertEqual(brute_force_max_usage(lower_bound, upper_bound),
+                                 timeline.max_usage(1, lower_bound, upper_bound))
+
+    def test_endtimes(self):
+        timeline = ResourceUsageTimeline([self.claim(1, 1, 3, 10), self.claim(2, 2, 3, 5), self.claim(1, 2, 4, 5)])
+
+        self.assertEqual([self.hours(3), self.hours(4)], timeline.endtimes())
+        self.assertEqual([self.hours(4)], timeline.endtimes(lower_bound=self.hours(3.5)))
+        self.assertEqual([self.hours(3)], timeline.endtimes(upper_bound=self.hours(3)))
+
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG, stream=sys.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
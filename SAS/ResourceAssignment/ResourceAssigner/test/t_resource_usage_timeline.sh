@@ -0,0 +1,3 @@
+#!/bin/sh
+
+./runctest.sh t_resource_usage_timeline
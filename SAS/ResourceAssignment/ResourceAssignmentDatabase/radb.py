@@ -44,13 +44,15 @@ class RADatabase(PostgresDatabaseConnection):
             logger.info("Read default RADB dbcreds from disk: %s" % dbcreds.stringWithHiddenPassword())
 
         super().__init__(dbcreds=dbcreds,
-                         auto_commit_selects=False,
+                         auto_commit_selects=True,
                          num_connect_retries=num_connect_retries,
                          connect_retry_interval=connect_retry_interval)
         self._taskStatusName2IdCache = {}
         self._taskTypeName2IdCache = {}
         self._claimStatusName2IdCache = {}
         self._claimStatusId2NameCache = {}
+        self._claimPropertyTypeName2IdCache = {}
+        self._claimPropertyIOTypeName2IdCache = {}
 
     def getTaskStatuses(self):
         query = '''SELECT * from resource_allocation.task_status;'''
@@ -206,8 +208,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('id = %s')
                 qargs.append(task_ids)
             elif len(task_ids) > 0: #assume a list/enumerable of id's
-                conditions.append('id in %s')
-                qargs.append(tuple(task_ids))
+                conditions.append('id = ANY(%s)')
+                qargs.append(list(task_ids))
             elif len(task_ids) == 0: #assume a list/enumerable of id's, length 0
                 return []
 
@@ -216,8 +218,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('mom_id = %s')
                 qargs.append(mom_ids)
             elif len(mom_ids) > 0: #assume a list/enumerable of id's
-                conditions.append('mom_id in %s')
-                qargs.append(tuple(mom_ids))
+                conditions.append('mom_id = ANY(%s)')
+                qargs.append(list(mom_ids))
             elif len(mom_ids) == 0: #assume a list/enumerable of id's, length 0
                 return []
 
@@ -226,8 +228,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('otdb_id = %s')
                 qargs.append(otdb_ids)
             elif len(otdb_ids) > 0: #assume a list/enumerable of id's
-                conditions.append('otdb_id in %s')
-                qargs.append(tuple(otdb_ids))
+                conditions.append('otdb_id = ANY(%s)')
+                qargs.append(list(otdb_ids))
             elif len(otdb_ids) == 0: #assume a list/enumerable of id's, length 0
                 return []
 
@@ -238,8 +240,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('status_id = %s')
                 qargs.append(task_status)
             elif len(task_status) > 0: #assume a list/enumerable of id's
-                conditions.append('status_id in %s')
-                qargs.append(tuple(task_status))
+                conditions.append('status_id = ANY(%s)')
+                qargs.append(list(task_status))
             elif len(task_status) == 0: #assume a list/enumerable of id's, length 0
                 return []
 
@@ -248,8 +250,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('type_id = %s')
                 qargs.append(task_type)
             elif len(task_type) > 0: #assume a list/enumerable of id's
-                conditions.append('type_id in %s')
-                qargs.append(tuple(task_type))
+                conditions.append('type_id = ANY(%s)')
+                qargs.append(list(task_type))
             elif len(task_type) == 0: #assume a list/enumerable of id's, length 0
                 return []
 
@@ -260,7 +262,7 @@ class RADatabase(PostgresDatabaseConnection):
         if conditions:
             query += ' WHERE ' + ' AND '.join(conditions)
 
-        tasks = list(self.executeQuery(query, qargs, fetch=FETCH_ALL))
+        tasks = list(self.executeQuery(query, qargs, fetch=FETCH_ALL, prepare=True))
 
         for task in tasks:
             if task['predecessor_ids'] is None:
@@ -760,7 +762,7 @@ class RADatabase(PostgresDatabaseConnection):
             claim_status_id = claim_status
 
         query = '''SELECT * from resource_allocation.get_current_resource_usage(%s, %s)'''
-        result = self.executeQuery(query, (resource_id, claim_status_id), fetch=FETCH_ONE)
+        result = self.executeQuery(query, (resource_id, claim_status_id), fetch=FETCH_ONE, read_only=True)
 
         if result is None or result.get('resource_id') is None:
             result = { 'resource_id': resource_id,
@@ -777,7 +779,7 @@ class RADatabase(PostgresDatabaseConnection):
             claim_status_id = claim_status
 
         query = '''SELECT * from resource_allocation.get_resource_usage_at_or_before(%s, %s, %s, %s, %s, %s)'''
-        result =  self.executeQuery(query, (resource_id, claim_status_id, timestamp, exactly_at, only_before, False), fetch=FETCH_ONE)
+        result =  self.executeQuery(query, (resource_id, claim_status_id, timestamp, exactly_at, only_before, False), fetch=FETCH_ONE, read_only=True)
 
         if result is None or result.get('resource_id') is None:
             result = { 'resource_id': resource_id,
@@ -925,12 +927,16 @@ class RADatabase(PostgresDatabaseConnection):
     def getResourceClaimPropertyTypeNames(self):
         return [x['name'] for x in self.getResourceClaimPropertyTypes()]
 
-    def getResourceClaimPropertyTypeId(self, type_name):
+    def getResourceClaimPropertyTypeId(self, type_name, from_cache=True):
+        if from_cache and type_name in self._claimPropertyTypeName2IdCache:
+            return self._claimPropertyTypeName2IdCache[type_name]
+
         query = '''SELECT id from resource_allocation.resource_claim_property_type
                    WHERE name = %s;'''
         result = self.executeQuery(query, [type_name], fetch=FETCH_ONE)
 
         if result:
+            self._claimPropertyTypeName2IdCache[type_name] = result['id']
             return result['id']
 
         raise KeyError('No such resource_claim_property_type: %s Valid values are: %s' % (type_name, ', '.join(self.getResourceClaimPropertyTypeNames())))
@@ -943,12 +949,16 @@ class RADatabase(PostgresDatabaseConnection):
     def getResourceClaimPropertyIOTypeNames(self):
         return [x['name'] for x in self.getResourceClaimPropertyIOTypes()]
 
-    def getResourceClaimPropertyIOTypeId(self, io_type_name):
+    def getResourceClaimPropertyIOTypeId(self, io_type_name, from_cache=True):
+        if from_cache and io_type_name in self._claimPropertyIOTypeName2IdCache:
+            return self._claimPropertyIOTypeName2IdCache[io_type_name]
+
         query = '''SELECT id from resource_allocation.resource_claim_property_io_type
                    WHERE name = %s;'''
         result = self.executeQuery(query, [io_type_name], fetch=FETCH_ONE)
 
         if result:
+            self._claimPropertyIOTypeName2IdCache[io_type_name] = result['id']
             return result['id']
 
         raise KeyError('No such resource_claim_property_io_type: %s Valid values are: %s' % (io_type_name, ', '.join(self.getResourceClaimPropertyIOTypeNames())))
@@ -995,6 +1005,9 @@ class RADatabase(PostgresDatabaseConnection):
         # each tuple prop is encoded as: (claim_id, type, value, io_type, sap_nr)
         #                         index: (0       , 1   , 2    , 3      , 4     )
 
+        # convert all property type and io_type strings to id's (cached, so normally without any query)
+        self._resolveResourceClaimPropertyTypeIds(props)
+
         # first insert unique sap numbers
         claim_sap_nrs = list(set([(p[0], p[4]) for p in props if p[4] is not None]))
         sap_ids = self.insertSAPNumbers(claim_sap_nrs, False)
@@ -1002,44 +1015,26 @@ class RADatabase(PostgresDatabaseConnection):
         if sap_ids == None:
             return None
 
-        # make sap_nr to sap_id mapping per claim_id
-        claim_id2sap_nr2sap_id = {}
-        for claim_sap_nr,sap_id in zip(claim_sap_nrs, sap_ids):
-            claim_id = claim_sap_nr[0]
-            sap_nr = claim_sap_nr[1]
-            if claim_id not in claim_id2sap_nr2sap_id:
-                claim_id2sap_nr2sap_id[claim_id] = {}
-            claim_id2sap_nr2sap_id[claim_id][sap_nr] = sap_id
+        # make (claim_id, sap_nr) to sap_id mapping
+        claim_sap_nr2sap_id = dict(zip(claim_sap_nrs, sap_ids))
 
         logger.info('insertResourceClaimProperties inserting %d properties' % len(props))
 
-        # convert all property type strings to id's
-        type_strings = set([p[1] for p in props if isinstance(p[1], str)])
-        type_string2id = {t:self.getResourceClaimPropertyTypeId(t) for t in type_strings}
-
-        # convert all property io_type strings to id's
-        io_type_strings = set([p[3] for p in props if isinstance(p[3], str)])
-        io_type_string2id = {t:self.getResourceClaimPropertyIOTypeId(t) for t in io_type_strings}
-
         # finally we have all the info we need,
-        # so we can build the bulk property insert query
-        insert_values = ','.join(self._cursor.mogrify('(%s, %s, %s, %s, %s)',
-                                                     (p[0],
-                                                      type_string2id[p[1]] if
-                                                      isinstance(p[1], str) else p[1],
-                                                      p[2],
-                                                      io_type_string2id[p[3]] if
-                                                      isinstance(p[3], str) else p[3],
-                                                      claim_id2sap_nr2sap_id[p[0]].get(p[4]) if
-                                                      p[0] in claim_id2sap_nr2sap_id else None)).decode('utf-8')
-                                                     for p in props)
+        # so we can bulk insert the properties
+        property_values = [(p[0],
+                            self.getResourceClaimPropertyTypeId(p[1]) if isinstance(p[1], str) else p[1],
+                            p[2],
+                            self.getResourceClaimPropertyIOTypeId(p[3]) if isinstance(p[3], str) else p[3],
+                            claim_sap_nr2sap_id.get((p[0], p[4])))
+                           for p in props]
 
         query = '''INSERT INTO resource_allocation.resource_claim_property
         (resource_claim_id, type_id, value, io_type_id, sap_id)
-        VALUES {values}
-        RETURNING id;'''.format(values=insert_values)
+        VALUES %s
+        RETURNING id;'''
 
-        ids = [x['id'] for x in self.executeQuery(query, fetch=FETCH_ALL)]
+        ids = [x['id'] for x in self.executeValuesQuery(query, property_values, fetch=FETCH_ALL)]
 
         if [x for x in ids if x < 0]:
             logger.error("One or more properties could not be inserted. Rolling back.")
@@ -1050,20 +1045,27 @@ class RADatabase(PostgresDatabaseConnection):
             self.commit()
         return ids
 
+    def _resolveResourceClaimPropertyTypeIds(self, props):
+        '''make sure the ids of all property type and io_type strings in the given props are in the cache,
+        so they do not have to be looked up one by one while inserting (and while holding the claim table locks).'''
+        for type_name in set([p[1] for p in props if isinstance(p[1], str)]):
+            self.getResourceClaimPropertyTypeId(type_name)
+
+        for io_type_name in set([p[3] for p in props if isinstance(p[3], str)]):
+            self.getResourceClaimPropertyIOTypeId(io_type_name)
+
     def insertSAPNumbers(self, sap_numbers, commit=True):
         if not sap_numbers:
             return []
 
         logger.info('insertSAPNumbers inserting %d sap numbers' % len(sap_numbers))
 
-        insert_values = ','.join(self._cursor.mogrify('(%s, %s)', rcid_sapnr).decode('utf-8') for rcid_sapnr in sap_numbers)
-
         query = '''INSERT INTO resource_allocation.sap
         (resource_claim_id, number)
-        VALUES {values}
-        RETURNING id;'''.format(values=insert_values)
+        VALUES %s
+        RETURNING id;'''
 
-        sap_ids = [x['id'] for x in self.executeQuery(query, fetch=FETCH_ALL)]
+        sap_ids = [x['id'] for x in self.executeValuesQuery(query, sap_numbers, fetch=FETCH_ALL)]
 
         if [x for x in sap_ids if x < 0]:
             logger.error("One or more sap_nr's could not be inserted. Rolling back.")
@@ -1102,17 +1104,17 @@ class RADatabase(PostgresDatabaseConnection):
                 #convert status string to status.id, if it is a string
                 qargs.append(_claimStatusId(status))
             else: #assume a list/enumerable of id's
-                conditions.append('status_id in %s')
+                conditions.append('status_id = ANY(%s)')
                 #convert status string to status.id, if they are strings
-                qargs.append(tuple([_claimStatusId(s) for s in status]))
+                qargs.append([_claimStatusId(s) for s in status])
 
         if claim_ids is not None:
             if isinstance(claim_ids, int): # just a single id
                 conditions.append('id = %s')
                 qargs.append(claim_ids)
             else: #assume a list/enumerable of id's
-                conditions.append('id in %s')
-                qargs.append(tuple(claim_ids))
+                conditions.append('id = ANY(%s)')
+                qargs.append(list(claim_ids))
 
         if lower_bound:
             conditions.append('endtime >= %s')
@@ -1127,8 +1129,8 @@ class RADatabase(PostgresDatabaseConnection):
                 conditions.append('resource_id = %s')
                 qargs.append(resource_ids)
             else: #assume a list/enumerable of id's
-                conditions.append('resource_id in %s')
-                qargs.append(tuple(resource_ids))
+                conditions.append('resource_id = ANY(%s)')
+                qargs.append(list(resource_ids))
 
         if task_ids is not None:
             #if task_id is normal positive we do a normal inclusive filter
@@ -1141,12 +1143,12 @@ class RADatabase(PostgresDatabaseConnection):
                 exclusive_task_ids = [-t for t in task_ids if t < 0]
 
                 if inclusive_task_ids:
-                    conditions.append('task_id in %s')
-                    qargs.append(tuple(inclusive_task_ids))
+                    conditions.append('task_id = ANY(%s)')
+                    qargs.append(list(inclusive_task_ids))
 
                 if exclusive_task_ids:
-                    conditions.append('task_id not in %s')
-                    qargs.append(tuple(exclusive_task_ids))
+                    conditions.append('task_id <> ALL(%s)')
+                    qargs.append(list(exclusive_task_ids))
 
         if resource_type is not None and extended:
             conditions.append('resource_type_id = %s')
@@ -1155,7 +1157,7 @@ class RADatabase(PostgresDatabaseConnection):
         if conditions:
             query += ' WHERE ' + ' AND '.join(conditions)
 
-        claims = list(self.executeQuery(query, qargs, fetch=FETCH_ALL))
+        claims = list(self.executeQuery(query, qargs, fetch=FETCH_ALL, prepare=True))
 
         if include_properties and claims:
             claimDict = {c['id']: c for c in claims}
@@ -1263,23 +1265,24 @@ class RADatabase(PostgresDatabaseConnection):
             self.rollback()
             return []
 
-        try:
-            # use psycopg2 mogrify to parse and build the insert values
-            # this way we can insert many values in one insert query, returning the id's of each inserted row.
-            # this is much faster than psycopg2's executeMany method
-            insert_values = ','.join(self._cursor.mogrify("(%s, %s, %s, %s, %s, %s, %s, %s, %s)", cv).decode("utf-8") for cv in claim_values)
-        except Exception as e:
-            logger.error("Invalid input, rolling back: %s\n%s" % (claim_values, e))
-            self.rollback()
-            return []
+        # do all lookups before we lock the claim tables below, so that the lock is only held for the inserts
+        self._resolveResourceClaimPropertyTypeIds([(None, p['type'], None, p.get('io_type', 0), None)
+                                                   for c in claims for p in c.get('properties', [])])
 
-        query = '''LOCK TABLE resource_allocation.resource_claim, resource_allocation.resource_usage, resource_allocation.task IN EXCLUSIVE MODE; '''\
-                '''INSERT INTO resource_allocation.resource_claim
+        # the claims (and their triggers) need exclusive access to the claims, usages and tasks,
+        # which is held until the end of the transaction (commit/rollback).
+        # Upon a connection loss after the lock, the inserts below are not retried without the lock, but raise a PostgresDBConnectionError.
+        self.executeQuery('''LOCK TABLE resource_allocation.resource_claim, resource_allocation.resource_usage, resource_allocation.task IN EXCLUSIVE MODE;''')
+
+        # use psycopg2 execute_values to insert many values in pages of many rows per insert query,
+        # returning the id's of each inserted row in order.
+        # this is much faster than psycopg2's executeMany method, and than building one huge insert query.
+        query = '''INSERT INTO resource_allocation.resource_claim
         (resource_id, task_id, starttime, endtime, status_id, claim_size, used_rcus, username, user_id)
-        VALUES {values}
-        RETURNING id;'''.format(values=insert_values)
+        VALUES %s
+        RETURNING id;'''
 
-        claimIds = [x['id'] for x in self.executeQuery(query, fetch=FETCH_ALL)]
+        claimIds = [x['id'] for x in self.executeValuesQuery(query, claim_values, fetch=FETCH_ALL)]
 
         if not claimIds or [x for x in claimIds if x < 0]:
             logger.error("One or more claims could not be inserted. Rolling back.")
@@ -1501,7 +1504,7 @@ class RADatabase(PostgresDatabaseConnection):
             claim_status_id = claim_status
 
         query = '''SELECT * from resource_allocation.get_overlapping_claims(%s, %s)'''
-        return list(self.executeQuery(query, (claim_id, claim_status_id), fetch=FETCH_ALL))
+        return list(self.executeQuery(query, (claim_id, claim_status_id), fetch=FETCH_ALL, read_only=True))
 
     def get_overlapping_tasks(self, claim_id, claim_status='claimed'):
         '''returns a list of tasks which overlap with given claim(s) and which prevent the given claim(s) to be claimed (cause it to be in conflict)'''
@@ -1518,7 +1521,7 @@ class RADatabase(PostgresDatabaseConnection):
         result = {'usage': 0, 'status_id': claim_status_id, 'as_of_timestamp': lower_bound, 'resource_id': resource_id}
 
         query = '''SELECT * from resource_allocation.get_max_resource_usage_between(%s, %s, %s, %s)'''
-        qresult = self.executeQuery(query, (resource_id, claim_status_id, lower_bound, upper_bound), fetch=FETCH_ONE)
+        qresult = self.executeQuery(query, (resource_id, claim_status_id, lower_bound, upper_bound), fetch=FETCH_ONE, read_only=True)
 
         if qresult and qresult.get('usage') is not None:
             result['usage'] = qresult.get('usage')
@@ -1532,7 +1535,7 @@ class RADatabase(PostgresDatabaseConnection):
             raise ValueError('resource_id and/or lower_bound and/or upper_bound cannot be None')
 
         query = '''SELECT * from resource_allocation.get_resource_claimable_capacity_between(%s, %s, %s)'''
-        qresult = self.executeQuery(query, (resource_id, lower_bound, upper_bound), fetch=FETCH_ONE)
+        qresult = self.executeQuery(query, (resource_id, lower_bound, upper_bound), fetch=FETCH_ONE, read_only=True)
         if qresult:
             return qresult.get('get_resource_claimable_capacity_between', 0)
         else:
@@ -1545,7 +1548,7 @@ class RADatabase(PostgresDatabaseConnection):
             raise ValueError('resource_ids and/or lower_bound and/or upper_bound cannot be None')
 
         query = '''SELECT * from resource_allocation.get_resource_claimable_capacities_between(%s, %s, %s)'''
-        qresult = self.executeQuery(query, (resource_ids, lower_bound, upper_bound), fetch=FETCH_ONE)
+        qresult = self.executeQuery(query, (resource_ids, lower_bound, upper_bound), fetch=FETCH_ONE, read_only=True)
         if qresult:
             claimable_capacities = qresult.get('get_resource_claimable_capacities_between', [])
             assert len(resource_ids) == len(claimable_capacities)
@@ -1728,8 +1731,8 @@ and/or claim_statuses.
                 qargs.append(resource_ids)
                 usages_per_resource[resource_ids] = {} # append default empty result dict
             elif resource_ids: #assume a list/enumerable of id's
-                conditions.append('resource_id in %s')
-                qargs.append(tuple(resource_ids))
+                conditions.append('resource_id = ANY(%s)')
+                qargs.append(list(resource_ids))
                 for resource_id in resource_ids:
                     usages_per_resource[resource_id] = {} # append default empty result dict
 
@@ -1746,8 +1749,8 @@ and/or claim_statuses.
                 claim_status_ids = [claim_status_name_to_id[x] if isinstance(x, str) else x
                                     for x in claim_status_names]
 
-            conditions.append('status_id in %s')
-            qargs.append(tuple(claim_status_ids))
+            conditions.append('status_id = ANY(%s)')
+            qargs.append(list(claim_status_ids))
 
         for rcs in self.getResourceClaimStatuses():
             for resource_id, result_dict in usages_per_resource.items():
@@ -1758,9 +1761,8 @@ and/or claim_statuses.
 
         query += ' ORDER BY as_of_timestamp'
 
-        usages = self.executeQuery(query, qargs, fetch=FETCH_ALL)
-
-        for usage in usages:
+        # stream the (potentially many) usages straight into the nested result dict
+        for usage in self.executeQueryIter(query, qargs):
             resource_id = usage['resource_id']
             if resource_id not in usages_per_resource:
                 usages_per_resource[resource_id] = {}
@@ -186,6 +186,56 @@ class ResourceAssignmentDatabaseTest(RADBCommonTestMixin, unittest.TestCase):
         logger.info('average spec delete time: %.3f', sum(delete_elapsed_list)/float(len(delete_elapsed_list)))
         logger.info('Done. Results can be found in file: %s', filename)
 
+    def test_bulk_insert_claims_performance(self):
+        ELAPSED_TRESHOLD = 30.0 #max allowed insert time in seconds for all claims and their properties
+        NUM_CLAIMS = 10000
+        NUM_PROPERTIES_PER_CLAIM = 2 # see properties below
+
+        # pretend that we have an almost unlimited amount of capacity, so the claims are not in conflict
+        self.radb.executeQuery('update resource_monitoring.resource_capacity set (available, total) = (%s, %s);', (1e15, 1e15))
+
+        # like a pipeline with many output files spread over many storage resources
+        resource_ids = [r['id'] for r in self.radb.getResources()]
+
+        now = datetime.utcnow()
+        now -= timedelta(minutes=now.minute, seconds=now.second, microseconds=now.microsecond)  # round to full hour
+        result = self.radb.insertOrUpdateSpecificationAndTask(1, 1, 'approved', 'pipeline',
+                                                              now+timedelta(hours=1), now + timedelta(hours=2),
+                                                              'content', 'CEP4')
+        task = self.radb.getTask(result['task_id'])
+
+        claims = [{'resource_id': resource_ids[i % len(resource_ids)],
+                   'starttime': task['starttime'],
+                   'endtime': task['endtime'],
+                   'status': 'tentative',
+                   'claim_size': 1+i,
+                   'properties': [{'type': 'nr_of_uv_files', 'value': 1, 'io_type': 'output', 'sap_nr': i % 3},
+                                  {'type': 'uv_file_size', 'value': 1+i, 'io_type': 'output', 'sap_nr': i % 3}]}
+                  for i in range(NUM_CLAIMS)]
+
+        start = datetime.utcnow()
+        claim_ids = self.radb.insertResourceClaims(task['id'], claims, 'foo', 1, 1)
+        elapsed_insert = totalSeconds(datetime.utcnow() - start)
+
+        logger.info('TEST RESULT: insert of %d claims with %d properties each took %.3fsec (%.3fms per claim)',
+                    NUM_CLAIMS, NUM_PROPERTIES_PER_CLAIM, elapsed_insert, 1000.0*elapsed_insert/NUM_CLAIMS)
+
+        # all claims should be inserted, and the returned ids should be in the same order as the given claims
+        self.assertEqual(NUM_CLAIMS, len(claim_ids))
+        inserted_claims = {c['id']: c for c in self.radb.getResourceClaims(task_ids=task['id'])}
+        self.assertEqual(NUM_CLAIMS, len(inserted_claims))
+        for claim_id, claim in zip(claim_ids, claims):
+            self.assertEqual(claim['claim_size'], inserted_claims[claim_id]['claim_size'])
+            self.assertEqual(claim['resource_id'], inserted_claims[claim_id]['resource_id'])
+
+        # and so should their properties
+        properties = self.radb.getResourceClaimProperties(task_id=task['id'])
+        self.assertEqual(NUM_CLAIMS*NUM_PROPERTIES_PER_CLAIM, len(properties))
+
+        # enforce perfomance criterion
+        self.assertLess(elapsed_insert, ELAPSED_TRESHOLD, msg="insertResourceClaims of %d claims took longer than allowed. (%ssec > %ssec)" % (
+                                                                  NUM_CLAIMS, elapsed_insert, ELAPSED_TRESHOLD))
+
 os.environ['TZ'] = 'UTC'
 logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.DEBUG, stream=sys.stdout)
 
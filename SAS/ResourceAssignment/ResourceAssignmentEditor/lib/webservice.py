@@ -55,6 +55,7 @@ from lofar.common import isProductionEnvironment, isTestEnvironment
 from lofar.common.util import humanreadablesize
 from lofar.common.subprocess_utils import communicate_returning_strings
 from lofar.common import dbcredentials
+from lofar.common.postgres import query_profiler
 from lofar.sas.resourceassignment.database.radb import RADatabase
 
 logger = logging.getLogger(__name__)
@@ -806,6 +807,14 @@ def getLogEventsSince(fromTimestamp=None):
 def getLofarTime():
     return jsonify({'lofarTime': asIsoFormat(datetime.utcnow())})
 
+@app.route('/rest/query_profile')
+@gzipped
+def getQueryProfile():
+    '''the profile of the radb queries of this webservice when it queries the radb directly, or else of the RADBService'''
+    if _radb_dbcreds:
+        return jsonify(query_profiler.snapshot())
+    return jsonify(rarpc.get_query_profile())
+
 
 #ugly method to generate html tables for all tasks
 @app.route('/tasks.html')
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import unittest
+from unittest import mock
 import sys
 import time
 import urllib.request, urllib.error, urllib.parse
@@ -50,6 +51,21 @@ class TestResourceAssignmentEditor(FlaskTestCase):
         # also test a non-existent url, should give 404
         self.assertEqual(404, self.client.get(baseurl + '/hdaHJSK/fsfaAFdsaf.gwg').status_code)
 
+    def testQueryProfile(self):
+        '''test requesting the profile of the radb queries of the webservice itself, and of the RADBService'''
+        with mock.patch.object(webservice, '_radb_dbcreds', mock.MagicMock()), \
+             mock.patch.object(webservice.query_profiler, 'snapshot', return_value={'queries': [], 'own': True}):
+            response = self.client.get('/rest/query_profile')
+            self.assertEqual(200, response.status_code)
+            self.assertIn(b'own', response.data)
+
+        with mock.patch.object(webservice, '_radb_dbcreds', None), \
+             mock.patch.object(webservice, 'rarpc') as rarpc:
+            rarpc.get_query_profile.return_value = {'queries': [], 'radbservice': True}
+            response = self.client.get('/rest/query_profile')
+            self.assertEqual(200, response.status_code)
+            self.assertIn(b'radbservice', response.data)
+
 
 class TestLiveResourceAssignmentEditor(FlaskLiveTestCase):
     '''Test the live ResourceAssignmentEditor web service'''
@@ -303,6 +303,11 @@ class RADBRPC(RPCClientContextManagerMixin):
                                                            lower_bound=lower_bound,
                                                            upper_bound=upper_bound).get('resource_claimable_capacity')
 
+    def get_query_profile(self):
+        '''get the per query fingerprint count, latency, rows, retries and reconnects (and captured plans) of the radb queries of the service.
+        See lofar.common.postgres.QueryProfiler.snapshot'''
+        return self._rpc_client.execute('get_query_profile')
+
 
 def do_tests(exchange=DEFAULT_BUSNAME):
     from datetime import datetime, timedelta
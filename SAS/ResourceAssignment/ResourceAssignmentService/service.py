@@ -10,6 +10,7 @@ from lofar.common.util import waitForInterrupt
 from lofar.sas.resourceassignment.database import radb
 from lofar.sas.resourceassignment.resourceassignmentservice.config import DEFAULT_RADB_SERVICENAME
 from lofar.common import dbcredentials
+from lofar.common.postgres import query_profiler
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +72,9 @@ class RADBServiceMessageHandler(ServiceMessageHandler):
         self.register_service_method('get_max_resource_usage_between', self._get_max_resource_usage_between)
         self.register_service_method('get_resource_claimable_capacity', self._get_resource_claimable_capacity)
 
+        # the profile of the radb queries of this service, to find the slow/hot queries in production
+        self.register_service_method('get_query_profile', query_profiler.snapshot)
+
     def _getTaskStatuses(self):
         return self.radb.getTaskStatuses()
 